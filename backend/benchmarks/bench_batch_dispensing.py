@@ -0,0 +1,98 @@
+"""Compare sequential POST /api/dispensing calls with one /api/dispensing/batch.
+
+Usage: python benchmarks/bench_batch_dispensing.py [entries]
+"""
+import asyncio
+import os
+import pathlib
+import sys
+import tempfile
+import time
+
+ROOT = pathlib.Path(__file__).resolve().parents[1]
+sys.path.append(str(ROOT))
+
+DB_PATH = os.path.join(tempfile.mkdtemp(), "bench_batch_dispensing.db")
+os.environ["DATABASE_URL"] = f"sqlite:///{DB_PATH}"
+
+from database import (
+    create_tables,
+    SessionLocal,
+    Category,
+    Employee,
+    Medicine,
+    Patient,
+)
+from main import create_dispensing_batch, create_dispensing_record
+
+ITEMS = 50
+
+
+def seed(db) -> None:
+    db.add(Category(id="cat", name="cat", description="", type="medicine"))
+    db.add(Patient(id="p", first_name="P", last_name="L", illness="-", phone="1", address="a", branch_id="b1"))
+    db.add(Employee(id="e", first_name="E", last_name="L", phone="2", address="a", branch_id="b1"))
+    db.execute(
+        Medicine.__table__.insert(),
+        [
+            {
+                "id": f"m{i}",
+                "name": f"Medicine {i}",
+                "category_id": "cat",
+                "purchase_price": 0,
+                "sell_price": 0,
+                "quantity": 10_000_000,
+                "branch_id": "b1",
+            }
+            for i in range(ITEMS)
+        ],
+    )
+    db.commit()
+
+
+def entries(n: int) -> list[dict]:
+    return [
+        {
+            "patient_id": "p",
+            "employee_id": "e",
+            "branch_id": "b1",
+            "medicines": [
+                {"id": f"m{(k + j) % ITEMS}", "quantity": 1} for j in range(3)
+            ],
+        }
+        for k in range(n)
+    ]
+
+
+def sequential(payloads: list[dict]) -> float:
+    t0 = time.perf_counter()
+    for payload in payloads:
+        with SessionLocal() as db:
+            asyncio.run(create_dispensing_record(payload, db=db))
+    return time.perf_counter() - t0
+
+
+def batched(payloads: list[dict]) -> float:
+    t0 = time.perf_counter()
+    with SessionLocal() as db:
+        asyncio.run(create_dispensing_batch({"dispensings": payloads}, db=db))
+    return time.perf_counter() - t0
+
+
+def main() -> None:
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    create_tables()
+    with SessionLocal() as db:
+        seed(db)
+    payloads = entries(n)
+
+    slow = sequential(payloads)
+    fast = batched(payloads)
+    print(f"entries={n}")
+    print(f"sequential /api/dispensing: {slow * 1000:8.1f} ms")
+    print(f"one /api/dispensing/batch:  {fast * 1000:8.1f} ms")
+    print(f"speedup: {slow / fast:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+"""Cost of the duplicate-dispensing check on the dispensing path.
+
+Seeds a long dispensing history, then times the check's probe for a cart
+with and without its index, and POST /api/dispensing with the check off and
+on.
+
+Usage: python benchmarks/bench_duplicate_check.py [patients] [visits_per_patient]
+"""
+import asyncio
+import os
+import pathlib
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+ROOT = pathlib.Path(__file__).resolve().parents[1]
+sys.path.append(str(ROOT))
+
+DB_PATH = os.path.join(tempfile.mkdtemp(), "bench_duplicate_check.db")
+os.environ["DATABASE_URL"] = f"sqlite:///{DB_PATH}"
+
+from database import (
+    create_tables,
+    engine,
+    SessionLocal,
+    Category,
+    DispensingItem,
+    DispensingRecord,
+    Employee,
+    Medicine,
+    Patient,
+)
+from main import create_dispensing_record
+from services import duplicates
+from services.duplicates import DUPLICATE_INDEXES, find_duplicates
+
+ITEMS = 300
+CART = 5
+PROBES = 500
+REQUESTS = 200
+
+
+def seed(db, patients: int, visits: int) -> None:
+    rnd = random.Random(1)
+    db.add(Category(id="cat", name="cat", description="", type="medicine"))
+    db.add(Employee(id="e", first_name="E", last_name="L", phone="2", address="a", branch_id="b1"))
+    db.execute(
+        Patient.__table__.insert(),
+        [
+            {"id": f"p{i}", "first_name": "P", "last_name": f"L{i}", "illness": "-", "phone": "1",
+             "address": "a", "branch_id": "b1", "version": 1}
+            for i in range(patients)
+        ],
+    )
+    db.execute(
+        Medicine.__table__.insert(),
+        [
+            {"id": f"m{i}", "name": f"Medicine {i}", "category_id": "cat", "purchase_price": 0,
+             "sell_price": 0, "quantity": 10_000_000, "branch_id": "b1", "version": 1}
+            for i in range(ITEMS)
+        ],
+    )
+    start = datetime.utcnow() - timedelta(days=730)
+    for p in range(patients):
+        records, items = [], []
+        for v in range(visits):
+            rid = f"r{p}_{v}"
+            when = start + timedelta(minutes=rnd.randrange(730 * 24 * 60))
+            records.append(
+                {"id": rid, "patient_id": f"p{p}", "patient_name": "x", "employee_id": "e",
+                 "employee_name": "y", "branch_id": "b1", "date": when}
+            )
+            for j, m in enumerate(rnd.sample(range(ITEMS), 3)):
+                items.append(
+                    {"id": f"{rid}_{j}", "record_id": rid, "item_type": "medicine", "item_id": f"m{m}",
+                     "item_name": f"Medicine {m}", "quantity": 1, "patient_id": f"p{p}", "dispensed_at": when}
+                )
+        db.execute(DispensingRecord.__table__.insert(), records)
+        db.execute(DispensingItem.__table__.insert(), items)
+    db.commit()
+
+
+def carts(patients: int, n: int) -> list[tuple[str, list[tuple[str, str]]]]:
+    rnd = random.Random(2)
+    return [
+        (f"p{rnd.randrange(patients)}", [("medicine", f"m{m}") for m in rnd.sample(range(ITEMS), CART)])
+        for _ in range(n)
+    ]
+
+
+def time_probes(cases) -> list[float]:
+    now = datetime.utcnow()
+    timings = []
+    with SessionLocal() as db:
+        for patient_id, lines in cases:
+            t0 = time.perf_counter()
+            find_duplicates(db, patient_id, lines, now)
+            timings.append((time.perf_counter() - t0) * 1000)
+    return timings
+
+
+def time_requests(cases) -> list[float]:
+    timings = []
+    for patient_id, lines in cases:
+        payload = {
+            "patient_id": patient_id,
+            "employee_id": "e",
+            "branch_id": "b1",
+            "medicines": [{"id": item_id, "quantity": 1} for _, item_id in lines],
+        }
+        with SessionLocal() as db:
+            t0 = time.perf_counter()
+            asyncio.run(create_dispensing_record(payload, db=db))
+            timings.append((time.perf_counter() - t0) * 1000)
+    return timings
+
+
+def summary(label: str, timings: list[float]) -> None:
+    ordered = sorted(timings)
+    p99 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))]
+    print(
+        f"{label:<28} p50={statistics.median(ordered):7.3f} ms  "
+        f"p99={p99:7.3f} ms  max={ordered[-1]:7.3f} ms"
+    )
+
+
+def main() -> None:
+    patients = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    visits = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    create_tables()
+    with SessionLocal() as db:
+        seed(db, patients, visits)
+    print(f"patients={patients} visits={visits} items={patients * visits * 3} cart={CART}")
+
+    probes = carts(patients, PROBES)
+    summary("probe without index", time_probes(probes[:50]))
+    with engine.begin() as conn:
+        for ddl in DUPLICATE_INDEXES:
+            conn.exec_driver_sql(ddl)
+        conn.exec_driver_sql("ANALYZE")
+    summary("probe with index", time_probes(probes))
+
+    requests = carts(patients, REQUESTS)
+    duplicates.POLICY = "off"
+    off = time_requests(requests[: REQUESTS // 2])
+    duplicates.POLICY = "warn"
+    on = time_requests(requests[REQUESTS // 2 :])
+    summary("/api/dispensing check off", off)
+    summary("/api/dispensing check on", on)
+    print(f"added per dispensing (p50): {statistics.median(on) - statistics.median(off):.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""Compare the ORM + pydantic list path with the Core-row + orjson fast path.
+
+Usage: python benchmarks/bench_list_serialization.py [rows]
+"""
+import json
+import os
+import pathlib
+import sys
+import tempfile
+import time
+
+ROOT = pathlib.Path(__file__).resolve().parents[1]
+sys.path.append(str(ROOT))
+
+DB_PATH = os.path.join(tempfile.mkdtemp(), "bench_serialization.db")
+os.environ["DATABASE_URL"] = f"sqlite:///{DB_PATH}"
+
+from fastapi.encoders import jsonable_encoder
+
+from database import create_tables, SessionLocal, Medicine as DBMedicine
+from schemas import Medicine
+from services.serialization import dumps, select_rows
+
+
+def seed(db, n: int) -> None:
+    db.execute(
+        DBMedicine.__table__.insert(),
+        [
+            {
+                "id": f"m{i}",
+                "name": f"Medicine {i % 500}",
+                "category_id": "cat",
+                "purchase_price": 10.5,
+                "sell_price": 12.25,
+                "quantity": i % 100,
+                "branch_id": "b1",
+            }
+            for i in range(n)
+        ],
+    )
+    db.commit()
+
+
+def orm_path(db) -> bytes:
+    rows = db.query(DBMedicine).filter(DBMedicine.branch_id == "b1").all()
+    data = [Medicine.model_validate(m) for m in rows]
+    return json.dumps(jsonable_encoder(data)).encode("utf-8")
+
+
+def fast_path(db) -> bytes:
+    return dumps(select_rows(db, Medicine, DBMedicine, DBMedicine.branch_id == "b1"))
+
+
+def timed(fn, repeat: int = 3) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        with SessionLocal() as db:
+            t0 = time.perf_counter()
+            fn(db)
+            best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def main() -> None:
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 50_000
+    create_tables()
+    with SessionLocal() as db:
+        seed(db, n)
+        assert json.loads(orm_path(db)) == json.loads(fast_path(db))
+
+    slow = timed(orm_path)
+    fast = timed(fast_path)
+    print(f"rows={n}")
+    print(f"orm + model_validate + jsonable_encoder: {slow * 1000:8.1f} ms")
+    print(f"core rows + orjson:                      {fast * 1000:8.1f} ms")
+    print(f"speedup: {slow / fast:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
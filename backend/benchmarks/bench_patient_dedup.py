@@ -0,0 +1,117 @@
+"""Patient de-duplication scan over a synthetic register.
+
+Generates patients, re-registers a share of them with a typo, in the other
+script, with another phone format or with a new phone at the same address,
+then times the blocking scan.
+
+Usage: python benchmarks/bench_patient_dedup.py [patients] [duplicate_share]
+"""
+import os
+import pathlib
+import random
+import sys
+import tempfile
+import time
+
+ROOT = pathlib.Path(__file__).resolve().parents[1]
+sys.path.append(str(ROOT))
+
+DB_PATH = os.path.join(tempfile.mkdtemp(), "bench_patient_dedup.db")
+os.environ["DATABASE_URL"] = f"sqlite:///{DB_PATH}"
+
+from database import create_tables, SessionLocal, Patient
+from services.patient_dedup import run
+
+# a fifth of surnames come from a small common set (big blocks), the rest
+# from generated roots
+ROOTS = ["Иван", "Петр", "Сидор", "Смирн", "Кузнец", "Поп", "Васил", "Сокол", "Михайл", "Новик",
+         "Федор", "Мороз", "Волк", "Алекс", "Лебед", "Семен", "Егор", "Павл", "Козл", "Степан",
+         "Ахмет", "Нурлан", "Серик", "Жумабек", "Касым", "Омар", "Абдрахман", "Сулеймен", "Иса",
+         "Тулеген", "Бекмамбет", "Жаксыбек", "Ермек", "Галим", "Рахим", "Досым", "Калдыбек", "Марат",
+         "Орлов", "Белоус", "Гребен", "Дорож", "Жук", "Зайц", "Карп", "Лис", "Мельник", "Нестер",
+         "Осип", "Рыбак", "Сорок", "Тарас", "Ушак", "Филип", "Хомяк", "Чернов", "Шевчук", "Щерб"]
+SUFFIXES = ["ов", "ев", "ин", "енко", "ский", "баев", "улы", "ук", "ович", "ян"]
+FIRST = ["Иван", "Алексей", "Сергей", "Андрей", "Дмитрий", "Ерлан", "Нурлан", "Асель", "Айгерим",
+         "Мария", "Анна", "Елена", "Ольга", "Данияр", "Арман", "Жанна", "Гульнара", "Марат",
+         "Тимур", "Руслан", "Бауыржан", "Дина", "Камила", "Наталья", "Виктор", "Юлия", "Олжас",
+         "Сауле", "Мадина", "Ринат", "Павел", "Татьяна", "Ильяс", "Зарина", "Кирилл", "Светлана"]
+CONSONANTS = "бвгдзклмнпрстхчшжц"
+VOWELS = "аеиоуы"
+STREETS = [f"{name} {n}" for name in ("ул. Абая", "ул. Сатпаева", "пр. Достык", "мкр. Самал", "ул. Толе би") for n in range(60)]
+LATIN = {"и": "i", "в": "v", "а": "a", "н": "n", "о": "o", "п": "p", "е": "e", "т": "t", "р": "r",
+         "с": "s", "д": "d", "м": "m", "к": "k", "у": "u", "з": "z", "ц": "ts", "л": "l", "б": "b",
+         "ф": "f", "ь": "", "г": "g", "х": "kh", "ж": "zh", "ш": "sh", "я": "ya", "й": "i", "ы": "y"}
+
+
+def latin(name: str) -> str:
+    return "".join(LATIN.get(c, c) for c in name.lower()).capitalize()
+
+
+def surname(rnd: random.Random) -> str:
+    if rnd.random() < 0.2:
+        return rnd.choice(ROOTS) + rnd.choice(SUFFIXES)
+    root = "".join(rnd.choice(CONSONANTS) + rnd.choice(VOWELS) for _ in range(rnd.randint(2, 3)))
+    return (root + rnd.choice(CONSONANTS)).capitalize() + rnd.choice(SUFFIXES)
+
+
+def variant(rnd: random.Random, src: dict) -> dict:
+    row = dict(src)
+    kind = rnd.randrange(4)
+    if kind == 0:  # other script
+        row.update(last_name=latin(src["last_name"]), first_name=latin(src["first_name"]))
+    elif kind == 1:  # typo in the last name
+        last = src["last_name"]
+        i = rnd.randrange(1, len(last))
+        row["last_name"] = last[:i] + rnd.choice("аоеи") + last[i + 1 :]
+    elif kind == 2:  # phone written with the trunk prefix
+        row["phone"] = "8 " + src["phone"][3:]
+    else:  # new phone, same address
+        row["phone"] = f"+7 7{rnd.randrange(10**9):09d}"
+    return row
+
+
+def seed(db, n: int, share: float) -> int:
+    rnd = random.Random(3)
+    rows, planted = [], 0
+    for i in range(n):
+        if rows and rnd.random() < share:
+            row = variant(rnd, rows[rnd.randrange(len(rows))])
+            planted += 1
+        else:
+            row = {
+                "first_name": rnd.choice(FIRST),
+                "last_name": surname(rnd),
+                "illness": "-",
+                "phone": f"+7 7{rnd.randrange(10**9):09d}",
+                "address": f"{rnd.choice(STREETS)}, кв. {rnd.randint(1, 200)}",
+                "branch_id": None,
+                "version": 1,
+            }
+        rows.append({**row, "id": f"p{i}"})
+    for i in range(0, n, 20000):
+        db.execute(Patient.__table__.insert(), rows[i : i + 20000])
+    db.commit()
+    return planted
+
+
+def main() -> None:
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 500_000
+    share = float(sys.argv[2]) if len(sys.argv) > 2 else 0.05
+    create_tables()
+    with SessionLocal() as db:
+        planted = seed(db, n, share)
+    t0 = time.perf_counter()
+    with SessionLocal() as db:
+        stats = run(db)
+        db.commit()
+    elapsed = time.perf_counter() - t0
+    print(f"patients={stats['patients']} planted duplicates={planted}")
+    print(
+        f"blocks={stats['blocks']} skipped={stats['skipped_blocks']} compared={stats['compared']} "
+        f"(all pairs: {n * (n - 1) // 2})"
+    )
+    print(f"candidates={stats['candidates']} scan={stats['elapsed_ms'] / 1000:.1f} s total={elapsed:.1f} s")
+
+
+if __name__ == "__main__":
+    main()
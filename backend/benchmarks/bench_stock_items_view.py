@@ -0,0 +1,130 @@
+"""Current-stock report through the stock_items view vs. the inline UNION.
+
+Seeds medicines and medical devices over many branches, then prints the
+query plan of both forms of the report query and times them per branch.
+
+Usage: python benchmarks/bench_stock_items_view.py [branches] [items_per_branch]
+"""
+import os
+import pathlib
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = pathlib.Path(__file__).resolve().parents[1]
+sys.path.append(str(ROOT))
+
+DB_PATH = os.path.join(tempfile.mkdtemp(), "bench_stock_items_view.db")
+os.environ["DATABASE_URL"] = f"sqlite:///{DB_PATH}"
+
+from sqlalchemy import text
+
+from database import create_tables, engine, Category, MedicalDevice, Medicine
+from services.barcodes import SCAN_INDEXES
+
+RUNS = 5
+
+# the report as it was written before the view
+UNION_SQL = """
+    SELECT 'medicine' AS item_type, m.id AS item_id, m.name AS name,
+           COALESCE(c.name, '—') AS category, m.quantity AS quantity
+    FROM medicines m
+    LEFT JOIN categories c ON c.id = m.category_id
+    WHERE m.branch_id = :b AND m.quantity > 0
+    UNION ALL
+    SELECT 'medical_device' AS item_type, d.id AS item_id, d.name AS name,
+           COALESCE(c.name, '—') AS category, d.quantity AS quantity
+    FROM medical_devices d
+    LEFT JOIN categories c ON c.id = d.category_id
+    WHERE d.branch_id = :b AND d.quantity > 0
+    ORDER BY item_type, name
+"""
+
+# build_wh_stock_json's current-stock query
+VIEW_SQL = """
+    SELECT s.item_type, s.item_id, s.name,
+           COALESCE(c.name, '—') AS category, s.quantity
+    FROM stock_items s
+    LEFT JOIN categories c ON c.id = s.category_id
+    WHERE s.branch_id = :b AND s.quantity > 0
+    ORDER BY s.item_type, s.name
+"""
+
+
+def seed(conn, branches: int, items: int) -> None:
+    rnd = random.Random(1)
+    conn.execute(
+        Category.__table__.insert(),
+        [
+            {"id": "cm", "name": "medicines", "description": "", "type": "medicine"},
+            {"id": "cd", "name": "devices", "description": "", "type": "medical_device"},
+        ],
+    )
+    for model, category in ((Medicine, "cm"), (MedicalDevice, "cd")):
+        prefix = model.__tablename__[:3]
+        for b in range(branches):
+            conn.execute(
+                model.__table__.insert(),
+                [
+                    {"id": f"{prefix}{b}_{i}", "name": f"Item {i}", "category_id": category,
+                     "purchase_price": 0, "sell_price": 0, "quantity": rnd.randrange(-5, 100),
+                     "branch_id": f"b{b}", "version": 1}
+                    for i in range(items)
+                ],
+            )
+
+
+def plan(conn, sql: str) -> list[str]:
+    return [str(r[-1]) for r in conn.execute(text(f"EXPLAIN QUERY PLAN {sql}"), {"b": "b0"})]
+
+
+def time_query(conn, sql: str, branches: int) -> list[float]:
+    timings = []
+    for _ in range(RUNS):
+        for b in range(branches):
+            t0 = time.perf_counter()
+            conn.execute(text(sql), {"b": f"b{b}"}).all()
+            timings.append((time.perf_counter() - t0) * 1000)
+    return timings
+
+
+def summary(label: str, timings: list[float]) -> None:
+    ordered = sorted(timings)
+    p99 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))]
+    print(f"{label:<8} p50={statistics.median(ordered):7.3f} ms  p99={p99:7.3f} ms")
+
+
+def main() -> None:
+    branches = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    items = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    create_tables()
+    with engine.begin() as conn:
+        seed(conn, branches, items)
+        for ddl in SCAN_INDEXES:
+            conn.exec_driver_sql(ddl)
+        conn.exec_driver_sql("ANALYZE")
+    print(f"branches={branches} rows per branch={items * 2}")
+
+    with engine.connect() as conn:
+        union, view = plan(conn, UNION_SQL), plan(conn, VIEW_SQL)
+        for label, steps in (("union", union), ("view", view)):
+            print(f"{label} plan:")
+            for step in steps:
+                print(f"  {step}")
+        assert conn.execute(text(UNION_SQL), {"b": "b1"}).all() == conn.execute(
+            text(VIEW_SQL), {"b": "b1"}
+        ).all()
+        # warm both before timing
+        time_query(conn, UNION_SQL, 1)
+        time_query(conn, VIEW_SQL, 1)
+        union_ms = time_query(conn, UNION_SQL, branches)
+        view_ms = time_query(conn, VIEW_SQL, branches)
+    summary("union", union_ms)
+    summary("view", view_ms)
+    print(f"view / union (p50): {statistics.median(view_ms) / statistics.median(union_ms):.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,14 @@
 
-from sqlalchemy import create_engine, Column, Integer, String, Float, DateTime, ForeignKey, Text, Boolean
+from sqlalchemy import create_engine, BigInteger, Column, Integer, String, Float, Date, DateTime, ForeignKey, Text, Boolean, Enum, Index
+from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.types import TypeDecorator
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
 from datetime import datetime
+from typing import Optional
+import logging
+import threading
+import time
 import uuid
 import os
 from dotenv import load_dotenv
@@ -16,6 +22,52 @@ engine = create_engine(DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
+# Optional read replica for report routes; unset means everything reads the primary
+DATABASE_READ_URL = os.getenv("DATABASE_READ_URL")
+READ_MAX_LAG_SECONDS = float(os.getenv("DATABASE_READ_MAX_LAG", "30"))
+READ_LAG_CHECK_SECONDS = float(os.getenv("DATABASE_READ_LAG_CHECK", "5"))
+HEARTBEAT_SECONDS = float(os.getenv("DATABASE_HEARTBEAT_SECONDS", "1"))
+
+read_engine = create_engine(DATABASE_READ_URL) if DATABASE_READ_URL else None
+ReadSessionLocal = (
+    sessionmaker(autocommit=False, autoflush=False, bind=read_engine) if read_engine else None
+)
+
+logger = logging.getLogger(__name__)
+
+
+class GUID(TypeDecorator):
+    """UUID key: native 16-byte ``uuid`` on Postgres, text elsewhere.
+
+    Values are plain strings on both sides, so the API and raw SQL see the
+    same ids as before.
+    """
+
+    impl = String
+    cache_ok = True
+
+    def load_dialect_impl(self, dialect):
+        if dialect.name == "postgresql":
+            return dialect.type_descriptor(UUID(as_uuid=False))
+        return dialect.type_descriptor(String(36))
+
+    @property
+    def python_type(self):
+        return str
+
+    def process_bind_param(self, value, dialect):
+        return None if value is None else str(value)
+
+
+# Native enums on Postgres (4 bytes instead of the repeated text), plain
+# varchar elsewhere. Values are in alphabetical order so ORDER BY sorts as it
+# did on the text columns.
+ITEM_TYPE = Enum("medical_device", "medicine", name="item_type")
+SHIPMENT_STATUS = Enum(
+    "accepted", "cancelled", "draft", "pending", "rejected", name="shipment_status"
+)
+SEARCH_KEY = String().with_variant(String(collation="C"), "postgresql")
+
 # Database Models
 class User(Base):
     __tablename__ = "users"
@@ -29,7 +81,7 @@ class User(Base):
 class Branch(Base):
     __tablename__ = "branches"
     
-    id = Column(String, primary_key=True)
+    id = Column(GUID, primary_key=True)
     name = Column(String, nullable=False)
     login = Column(String, unique=True, nullable=False)
     password = Column(String, nullable=False)
@@ -38,55 +90,67 @@ class Branch(Base):
 class Medicine(Base):
     __tablename__ = "medicines"
 
-    id = Column(String, primary_key=True)
+    id = Column(GUID, primary_key=True)
     name = Column(String, nullable=False)
-    category_id = Column(String, ForeignKey("categories.id"), nullable=False)
+    category_id = Column(GUID, ForeignKey("categories.id"), nullable=False)
     purchase_price = Column(Float, nullable=False, default=0.0)
     sell_price = Column(Float, nullable=False, default=0.0)
     quantity = Column(Integer, nullable=False, default=0)
-    branch_id = Column(String, ForeignKey("branches.id"), nullable=True)
+    branch_id = Column(GUID, ForeignKey("branches.id"), nullable=True)
+    # row version for optimistic concurrency; raw UPDATEs must bump it too
+    version = Column(Integer, nullable=False, default=1, server_default="1")
+
+    __mapper_args__ = {"version_id_col": version}
 
 class Employee(Base):
     __tablename__ = "employees"
     
-    id = Column(String, primary_key=True)
+    id = Column(GUID, primary_key=True)
     first_name = Column(String, nullable=False)
     last_name = Column(String, nullable=False)
     phone = Column(String, nullable=False)
     address = Column(String, nullable=False)
-    branch_id = Column(String, ForeignKey("branches.id"), nullable=True)
+    branch_id = Column(GUID, ForeignKey("branches.id"), nullable=True)
 
 class Patient(Base):
     __tablename__ = "patients"
     
-    id = Column(String, primary_key=True)
+    id = Column(GUID, primary_key=True)
     first_name = Column(String, nullable=False)
     last_name = Column(String, nullable=False)
     illness = Column(String, nullable=False)
     phone = Column(String, nullable=False)
     address = Column(String, nullable=False)
-    branch_id = Column(String, ForeignKey("branches.id"), nullable=True)
+    branch_id = Column(GUID, ForeignKey("branches.id"), nullable=True)
+    version = Column(Integer, nullable=False, default=1, server_default="1")
+    # normalized copies for prefix search, kept by services.patients; byte
+    # order ("C") so a prefix is one contiguous range of the index
+    search_name = Column(SEARCH_KEY, nullable=True)
+    search_phone = Column(SEARCH_KEY, nullable=True)
+
+    __mapper_args__ = {"version_id_col": version}
 
 class Transfer(Base):
     __tablename__ = "transfers"
     
-    id = Column(String, primary_key=True)
-    medicine_id = Column(String, nullable=False)
+    id = Column(GUID, primary_key=True)
+    item_type = Column(ITEM_TYPE, nullable=False, default="medicine", server_default="medicine")
+    medicine_id = Column(GUID, nullable=False)  # item id, also for medical devices
     medicine_name = Column(String, nullable=False)
     quantity = Column(Integer, nullable=False)
     from_branch_id = Column(String, nullable=True)
-    to_branch_id = Column(String, nullable=False)
+    to_branch_id = Column(GUID, nullable=False)
     date = Column(DateTime, default=datetime.utcnow)
 
 class DispensingRecord(Base):
     __tablename__ = "dispensing_records"
 
-    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
-    patient_id = Column(String, ForeignKey("patients.id"), nullable=False)
+    id = Column(GUID, primary_key=True, default=lambda: str(uuid.uuid4()))
+    patient_id = Column(GUID, ForeignKey("patients.id"), nullable=False)
     patient_name = Column(String, nullable=False)
-    employee_id = Column(String, ForeignKey("employees.id"), nullable=False)
+    employee_id = Column(GUID, ForeignKey("employees.id"), nullable=False)
     employee_name = Column(String, nullable=False)
-    branch_id = Column(String, ForeignKey("branches.id"), nullable=False)
+    branch_id = Column(GUID, ForeignKey("branches.id"), nullable=False)
     date = Column(DateTime, default=datetime.utcnow)
 
     items = relationship(
@@ -96,75 +160,365 @@ class DispensingRecord(Base):
 class DispensingItem(Base):
     __tablename__ = "dispensing_items"
 
-    id = Column(String, primary_key=True)
+    id = Column(GUID, primary_key=True)
     record_id = Column(
-        String, ForeignKey("dispensing_records.id", ondelete="CASCADE"), nullable=False
+        GUID, ForeignKey("dispensing_records.id", ondelete="CASCADE"), nullable=False
     )
-    item_type = Column(String, nullable=False)  # 'medicine' or 'medical_device'
-    item_id = Column(String, nullable=False)
+    item_type = Column(ITEM_TYPE, nullable=False)  # 'medicine' or 'medical_device'
+    item_id = Column(GUID, nullable=False)
     item_name = Column(String, nullable=False)
     quantity = Column(Integer, nullable=False)
+    # copies of the record's, so repeat checks seek one index (services.duplicates)
+    patient_id = Column(GUID, nullable=True)
+    dispensed_at = Column(DateTime, nullable=True)
 
     record = relationship("DispensingRecord", back_populates="items")
 
 class Arrival(Base):
     __tablename__ = "arrivals"
 
-    id = Column(String, primary_key=True)
-    item_type = Column(String, nullable=False)  # 'medicine' or 'medical_device'
-    item_id = Column(String, nullable=False)
+    id = Column(GUID, primary_key=True)
+    item_type = Column(ITEM_TYPE, nullable=False)  # 'medicine' or 'medical_device'
+    item_id = Column(GUID, nullable=False)
     item_name = Column(String, nullable=False)
     quantity = Column(Integer, nullable=False)
     date = Column(DateTime, default=datetime.utcnow)
+    expiry_date = Column(Date, nullable=True)
+    lot_number = Column(String, nullable=True)
 
 class Category(Base):
     __tablename__ = "categories"
     
-    id = Column(String, primary_key=True)
+    id = Column(GUID, primary_key=True)
     name = Column(String, nullable=False)
     description = Column(String, nullable=True)
-    type = Column(String, nullable=False)  # 'medicine' or 'medical_device'
+    type = Column(ITEM_TYPE, nullable=False)  # 'medicine' or 'medical_device'
 
 class MedicalDevice(Base):
     __tablename__ = "medical_devices"
     
-    id = Column(String, primary_key=True)
+    id = Column(GUID, primary_key=True)
     name = Column(String, nullable=False)
-    category_id = Column(String, ForeignKey("categories.id"), nullable=False)
+    category_id = Column(GUID, ForeignKey("categories.id"), nullable=False)
     purchase_price = Column(Float, nullable=False, default=0.0)
     sell_price = Column(Float, nullable=False, default=0.0)
     quantity = Column(Integer, nullable=False, default=0)
-    branch_id = Column(String, ForeignKey("branches.id"), nullable=True)
+    branch_id = Column(GUID, ForeignKey("branches.id"), nullable=True)
+    version = Column(Integer, nullable=False, default=1, server_default="1")
+
+    __mapper_args__ = {"version_id_col": version}
+
+# item_type discriminator -> table holding that kind of stock. Both tables have
+# the same columns, so code that handles stock looks the model up here
+# instead of branching on the type.
+STOCK_MODELS = {"medicine": Medicine, "medical_device": MedicalDevice}
 
 class Shipment(Base):
     __tablename__ = "shipments"
     
-    id = Column(String, primary_key=True)
-    to_branch_id = Column(String, ForeignKey("branches.id"), nullable=False)
-    status = Column(String, default="pending")  # pending, accepted, rejected, cancelled
+    id = Column(GUID, primary_key=True)
+    to_branch_id = Column(GUID, ForeignKey("branches.id"), nullable=False)
+    status = Column(SHIPMENT_STATUS, default="pending")
     rejection_reason = Column(String, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
+    version = Column(Integer, nullable=False, default=1, server_default="1")
+
+    __mapper_args__ = {"version_id_col": version}
 
 class ShipmentItem(Base):
     __tablename__ = "shipment_items"
     
-    id = Column(String, primary_key=True)
-    shipment_id = Column(String, ForeignKey("shipments.id"), nullable=False)
-    item_type = Column(String, nullable=False)  # medicine or device
-    item_id = Column(String, nullable=False)
+    id = Column(GUID, primary_key=True)
+    shipment_id = Column(GUID, ForeignKey("shipments.id"), nullable=False)
+    item_type = Column(ITEM_TYPE, nullable=False)  # medicine or device
+    item_id = Column(GUID, nullable=False)
     item_name = Column(String, nullable=False)
     quantity = Column(Integer, nullable=False)
 
 class Notification(Base):
     __tablename__ = "notifications"
     
-    id = Column(String, primary_key=True)
-    branch_id = Column(String, ForeignKey("branches.id"), nullable=False)
+    id = Column(GUID, primary_key=True)
+    branch_id = Column(GUID, ForeignKey("branches.id"), nullable=False)
     title = Column(String, nullable=False)
     message = Column(String, nullable=False)
     is_read = Column(Integer, default=0)
     created_at = Column(DateTime, default=datetime.utcnow)
 
+class DataVersion(Base):
+    __tablename__ = "data_versions"
+
+    table_name = Column(String, primary_key=True)
+    scope = Column(String, primary_key=True, default="")  # branch id, '' = main/global
+    version = Column(Integer, nullable=False, default=0)
+
+class SyncChange(Base):
+    __tablename__ = "sync_changes"
+
+    # latest change of one row as seen by one scope (branch id, '' = main)
+    entity = Column(String, primary_key=True)
+    row_id = Column(String, primary_key=True)
+    scope = Column(String, primary_key=True, default="")
+    # writer's transaction id on Postgres (services.sync), past int4
+    version = Column(BigInteger, nullable=False, index=True)
+    deleted = Column(Boolean, nullable=False, default=False)
+
+class OutboxEvent(Base):
+    __tablename__ = "outbox_events"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)  # delivery order
+    aggregate_type = Column(String, nullable=False)
+    aggregate_id = Column(String, nullable=False)
+    event_type = Column(String, nullable=False)
+    payload = Column(Text, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    delivered_at = Column(DateTime, nullable=True, index=True)
+    attempts = Column(Integer, nullable=False, default=0)
+    last_error = Column(Text, nullable=True)
+
+class StockThreshold(Base):
+    __tablename__ = "stock_thresholds"
+
+    # one stock row (branch copy or main warehouse row) per threshold
+    item_type = Column(ITEM_TYPE, primary_key=True)  # 'medicine' or 'medical_device'
+    item_id = Column(GUID, primary_key=True)
+    min_qty = Column(Integer, nullable=False, default=0)
+    max_qty = Column(Integer, nullable=True)
+    alert_state = Column(String, nullable=False, default="ok")  # ok, low, out
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class StockAdjustment(Base):
+    __tablename__ = "stock_adjustments"
+
+    id = Column(GUID, primary_key=True, default=lambda: str(uuid.uuid4()))
+    item_type = Column(ITEM_TYPE, nullable=False)  # 'medicine' or 'medical_device'
+    item_id = Column(GUID, nullable=False, index=True)
+    branch_id = Column(GUID, nullable=True)  # NULL = main warehouse
+    quantity = Column(Integer, nullable=False)  # signed correction
+    reason = Column(String, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class PatientDuplicate(Base):
+    """A likely duplicate pair found by services.patient_dedup (ids ordered)."""
+    __tablename__ = "patient_duplicates"
+
+    patient_id = Column(GUID, primary_key=True)
+    duplicate_id = Column(GUID, primary_key=True, index=True)
+    score = Column(Float, nullable=False)
+    same_phone = Column(Boolean, nullable=False)
+    name_similarity = Column(Float, nullable=False)
+    found_at = Column(DateTime, default=datetime.utcnow)
+
+class StockLot(Base):
+    """Part of one stock row's quantity that expires on ``expiry_date``.
+
+    The row's quantity stays the total; stock received without an expiry
+    date is not split into lots.
+    """
+    __tablename__ = "stock_lots"
+
+    id = Column(GUID, primary_key=True, default=lambda: str(uuid.uuid4()))
+    item_type = Column(ITEM_TYPE, nullable=False)
+    item_id = Column(GUID, nullable=False)  # the medicines/medical_devices row
+    branch_id = Column(GUID, nullable=True)  # NULL = main warehouse
+    lot_number = Column(String, nullable=True)
+    expiry_date = Column(Date, nullable=False)
+    quantity = Column(Integer, nullable=False)
+    received_at = Column(DateTime, default=datetime.utcnow)
+
+    # both indexes only hold open lots: FEFO allocation walks the first in
+    # order, the expiring-soon report reads a range of the second
+    __table_args__ = (
+        Index(
+            "ix_stock_lots_fefo",
+            "branch_id",
+            "item_id",
+            "expiry_date",
+            "id",
+            postgresql_where=quantity > 0,
+            sqlite_where=quantity > 0,
+        ),
+        Index(
+            "ix_stock_lots_expiry",
+            "expiry_date",
+            postgresql_where=quantity > 0,
+            sqlite_where=quantity > 0,
+        ),
+    )
+
+class ItemBarcode(Base):
+    __tablename__ = "item_barcodes"
+
+    code = Column(String, primary_key=True)  # normalized, GTINs as 14 digits
+    item_type = Column(ITEM_TYPE, nullable=False)
+    item_id = Column(GUID, nullable=False, index=True)  # catalog (main warehouse) row
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class ExportJob(Base):
+    __tablename__ = "export_jobs"
+
+    id = Column(String, primary_key=True)
+    kind = Column(String, nullable=False)
+    params = Column(Text, nullable=False, default="{}")
+    params_hash = Column(String, nullable=False, index=True)
+    status = Column(String, nullable=False, default="queued")  # queued, running, done, failed, expired
+    progress = Column(Integer, nullable=False, default=0)
+    error = Column(Text, nullable=True)
+    file_path = Column(String, nullable=True)
+    file_name = Column(String, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+    # refreshed while a live worker owns the job (services.exports)
+    heartbeat_at = Column(DateTime, nullable=True)
+
+    # at most one queued or running job per request, across workers
+    __table_args__ = (
+        Index(
+            "uq_export_jobs_active",
+            "params_hash",
+            unique=True,
+            postgresql_where=status.in_(("queued", "running")),
+            sqlite_where=status.in_(("queued", "running")),
+        ),
+    )
+
+class IdempotencyKey(Base):
+    __tablename__ = "idempotency_keys"
+
+    scope = Column(String, primary_key=True)  # endpoint the key was sent to
+    key = Column(String, primary_key=True)
+    request_hash = Column(String, nullable=False)
+    status = Column(String, nullable=False, default="in_progress")  # in_progress, committed, done
+    status_code = Column(Integer, nullable=True)
+    response = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    locked_at = Column(DateTime, nullable=True)
+    expires_at = Column(DateTime, nullable=False, index=True)
+
+class ArchivedPeriod(Base):
+    __tablename__ = "archived_periods"
+
+    table_name = Column(String, primary_key=True)  # 'dispensing_records' or 'arrivals'
+    year = Column(Integer, primary_key=True)
+    path = Column(String, nullable=False)
+    rows = Column(Integer, nullable=False, default=0)
+    archived_at = Column(DateTime, default=datetime.utcnow)
+
+
+class ArchivedTotal(Base):
+    """Net quantity one stock row gained or lost in an archived year.
+
+    Written by services.archive with the period, so ledgers summed from the
+    live tables still balance once the year's rows are gone.
+    """
+    __tablename__ = "archived_totals"
+
+    table_name = Column(String, primary_key=True)  # as in archived_periods
+    year = Column(Integer, primary_key=True)
+    item_type = Column(ITEM_TYPE, primary_key=True)
+    item_id = Column(GUID, primary_key=True, index=True)
+    quantity = Column(Integer, nullable=False)  # arrivals add, dispensings subtract
+    date = Column(DateTime, nullable=False)  # the year's last second, where ledgers place it
+
+
+class ReplicaHeartbeat(Base):
+    __tablename__ = "replica_heartbeat"
+
+    id = Column(Integer, primary_key=True)
+    beat_at = Column(DateTime, nullable=False)
+
+
+class ReadRouter:
+    """Chooses the replica or the primary for read-only sessions.
+
+    The primary stamps ``replica_heartbeat`` every few seconds; the stamp
+    the replica has replayed tells how far behind it is. A replica that is
+    unreachable, has no stamp yet or lags more than ``max_lag`` seconds is
+    skipped until the next check.
+    """
+
+    def __init__(
+        self,
+        primary,
+        replica=None,
+        max_lag: float = READ_MAX_LAG_SECONDS,
+        check_interval: float = READ_LAG_CHECK_SECONDS,
+    ):
+        self.primary = primary
+        self.replica = replica
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.replica_reads = 0
+        self.primary_reads = 0
+        self.last_lag: Optional[float] = None
+        self._usable = False
+        self._checked_at: Optional[float] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def lag_seconds(self) -> Optional[float]:
+        with self.replica() as db:
+            beat = db.query(ReplicaHeartbeat.beat_at).filter(ReplicaHeartbeat.id == 1).scalar()
+        if beat is None:
+            return None
+        return max(0.0, (datetime.utcnow() - beat).total_seconds())
+
+    def replica_usable(self) -> bool:
+        if self.replica is None:
+            return False
+        now = time.monotonic()
+        if self._checked_at is None or now - self._checked_at >= self.check_interval:
+            try:
+                self.last_lag = self.lag_seconds()
+            except Exception:
+                logger.warning("read replica check failed", exc_info=True)
+                self.last_lag = None
+            self._usable = self.last_lag is not None and self.last_lag <= self.max_lag
+            self._checked_at = now
+        return self._usable
+
+    def session(self):
+        if self.replica_usable():
+            self.replica_reads += 1
+            return self.replica()
+        self.primary_reads += 1
+        return self.primary()
+
+    def beat(self) -> None:
+        with self.primary() as db:
+            db.merge(ReplicaHeartbeat(id=1, beat_at=datetime.utcnow()))
+            db.commit()
+
+    def _run_heartbeat(self) -> None:
+        while not self._stop.is_set():
+            try:
+                self.beat()
+            except Exception:
+                logger.warning("replica heartbeat failed", exc_info=True)
+            self._stop.wait(HEARTBEAT_SECONDS)
+
+    def start_heartbeat(self) -> None:
+        if self.replica is not None and self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run_heartbeat, name="replica-heartbeat", daemon=True
+            )
+            self._thread.start()
+
+    def stats(self) -> dict:
+        return {
+            "configured": self.replica is not None,
+            "using_replica": self._usable,
+            "lag_seconds": self.last_lag,
+            "max_lag_seconds": self.max_lag,
+            "replica_reads": self.replica_reads,
+            "primary_reads": self.primary_reads,
+        }
+
+
+read_router = ReadRouter(SessionLocal, ReadSessionLocal)
+
+
 # Database dependency
 def get_db():
     db = SessionLocal()
@@ -173,6 +527,42 @@ def get_db():
     finally:
         db.close()
 
+
+def read_session():
+    """Session for read-only work: the replica when fresh, else the primary."""
+    return read_router.session()
+
+
+# Dependency for routes that only read (reports, calendar)
+def get_read_db():
+    db = read_session()
+    try:
+        yield db
+    finally:
+        db.close()
+
+def create_stock_items_view(conn) -> None:
+    """(Re)create ``stock_items``: every stock row with its item_type.
+
+    Reads that list all kinds of items select from this view; a branch or
+    item filter is pushed down to the indexes of both tables. It is not a
+    merged items/stock table: the view plans as the UNION it replaced (two
+    index searches, see benchmarks/bench_stock_items_view.py) and writes go
+    to the table ``STOCK_MODELS`` picks.
+    """
+    columns = "id AS item_id, name, category_id, purchase_price, sell_price, quantity, branch_id"
+    conn.exec_driver_sql("DROP VIEW IF EXISTS stock_items")
+    conn.exec_driver_sql(
+        "CREATE VIEW stock_items AS "
+        + " UNION ALL ".join(
+            f"SELECT '{item_type}' AS item_type, {columns} FROM {model.__tablename__}"
+            for item_type, model in STOCK_MODELS.items()
+        )
+    )
+
+
 # Create tables
 def create_tables():
     Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        create_stock_items_view(conn)
@@ -1,6 +1,6 @@
 from fastapi import FastAPI, Depends, HTTPException, status, Query, Response, Request
 from starlette.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
 from sqlalchemy.orm import Session, joinedload
 from sqlalchemy import (
     text,
@@ -11,15 +11,23 @@ from sqlalchemy import (
     union_all,
     literal_column,
     case,
+    BigInteger,
     DateTime,
     Date,
+    tuple_,
 )
+from sqlalchemy.orm.exc import StaleDataError
 from sqlalchemy.sql.schema import Column
 from database import (
     get_db,
+    get_read_db,
+    read_router,
+    read_session,
     create_tables,
     engine,
     SessionLocal,
+    SHIPMENT_STATUS,
+    STOCK_MODELS,
     User as DBUser,
     Branch as DBBranch,
     Medicine as DBMedicine,
@@ -34,6 +42,9 @@ from database import (
     Shipment as DBShipment,
     ShipmentItem as DBShipmentItem,
     Notification as DBNotification,
+    StockThreshold as DBStockThreshold,
+    ExportJob as DBExportJob,
+    ItemBarcode as DBItemBarcode,
 )
 from schemas import *
 from typing import List, Optional, Iterable, Callable
@@ -43,6 +54,67 @@ import uuid
 import json
 from pydantic import ValidationError
 from services.stock import get_available_qty, decrement_stock, ItemType
+from services.alerts import note_stock_change
+from services.archive import archived_arrivals, archived_dispensings, backfill_totals
+from services.barcodes import SCAN_INDEXES, cache as scan_cache, normalize_code, scan as scan_code
+from services.compact_types import relation_sizes
+from services.compression import CompressionMiddleware, stats as compression_stats
+from services.dispensing import dispense_batch
+from services.duplicates import (
+    BACKFILL_SQL as DUPLICATE_BACKFILL_SQL,
+    DUPLICATE_INDEXES,
+    DuplicateDispensing,
+    check_cart,
+    stats as duplicate_stats,
+)
+from services.exports import (
+    EXPORT_INDEXES,
+    XLSX_MEDIA_TYPE,
+    ExportData,
+    job_to_dict,
+    manager as export_manager,
+    register_export,
+    resume_pending,
+)
+from services.forecast import branch_forecast, np as numpy_module
+from services.history import HISTORY_INDEXES, item_movements
+from services.idempotency import run_idempotent
+from services.lots import add_lot, expiring_lots, move_lots
+from services.outbox import emit_event, outbox_stats, start_relay
+from services.partitioning import PARTITION_ON_START, PartitionMaintainer, maintain
+from services.patient_dedup import (
+    candidates as duplicate_patients,
+    merge as merge_patients,
+    run as scan_duplicate_patients,
+)
+from services.patients import (
+    PATIENT_INDEXES,
+    backfill_search_keys,
+    patient_history,
+    search_patients,
+)
+from services.reconciliation import balances_as_of, parse_branch, reconcile
+from services.replenishment import create_draft_shipments, plan_replenishment
+from services.report_cache import (
+    cache as report_cache,
+    cached_report,
+    invalidate_reports,
+    note_report_write,
+)
+from services.serialization import FastJSONResponse, select_rows
+from services.sync import TRACKED as SYNC_ENTITIES, changes_since
+from services.transfers import transfer_batch
+from services.versions import (
+    bump_all_scopes,
+    bump_version,
+    check_row_version,
+    current_etag,
+    etag_matches,
+    expected_row_version,
+    not_modified,
+    set_cache_headers,
+    set_row_etag,
+)
 import traceback
 import logging
 import re
@@ -195,6 +267,10 @@ def ensure_arrivals_schema():
             conn.exec_driver_sql("ALTER TABLE arrivals ADD COLUMN item_id varchar")
         if "item_name" not in cols:
             conn.exec_driver_sql("ALTER TABLE arrivals ADD COLUMN item_name varchar")
+        if "expiry_date" not in cols:
+            conn.exec_driver_sql("ALTER TABLE arrivals ADD COLUMN expiry_date date")
+        if "lot_number" not in cols:
+            conn.exec_driver_sql("ALTER TABLE arrivals ADD COLUMN lot_number varchar")
 
         # prices are not part of arrivals anymore
         if "purchase_price" in cols:
@@ -209,6 +285,112 @@ def ensure_arrivals_schema():
             conn.exec_driver_sql("ALTER TABLE arrivals DROP COLUMN medicine_name")
 
 
+def ensure_transfers_schema():
+    with engine.begin() as conn:
+        cols = {c["name"] for c in inspect(conn).get_columns("transfers")}
+        # transfers carried medicines only before devices could be moved too
+        if "item_type" not in cols:
+            conn.exec_driver_sql(
+                "ALTER TABLE transfers ADD COLUMN item_type varchar NOT NULL DEFAULT 'medicine'"
+            )
+
+
+def ensure_row_versions():
+    with engine.begin() as conn:
+        for table in ("medicines", "medical_devices", "patients", "shipments"):
+            cols = {c["name"] for c in inspect(conn).get_columns(table)}
+            if "version" not in cols:
+                conn.exec_driver_sql(
+                    f"ALTER TABLE {table} ADD COLUMN version integer NOT NULL DEFAULT 1"
+                )
+
+
+def ensure_sync_schema():
+    # sync versions are transaction ids on Postgres (services.sync)
+    if engine.dialect.name != "postgresql":
+        return
+    with engine.begin() as conn:
+        cols = {c["name"]: c["type"] for c in inspect(conn).get_columns("sync_changes")}
+        if not isinstance(cols["version"], BigInteger):
+            conn.exec_driver_sql("ALTER TABLE sync_changes ALTER COLUMN version TYPE bigint")
+
+
+def ensure_history_indexes():
+    with engine.begin() as conn:
+        for ddl in HISTORY_INDEXES:
+            conn.exec_driver_sql(ddl)
+
+
+def ensure_archived_totals():
+    with SessionLocal() as db:
+        backfill_totals(db)
+        db.commit()
+
+
+def ensure_scan_indexes():
+    with engine.begin() as conn:
+        for ddl in SCAN_INDEXES:
+            conn.exec_driver_sql(ddl)
+
+
+def ensure_patient_search():
+    with engine.begin() as conn:
+        cols = {c["name"] for c in inspect(conn).get_columns("patients")}
+        collate = ' COLLATE "C"' if conn.dialect.name == "postgresql" else ""
+        for column in ("search_name", "search_phone"):
+            if column not in cols:
+                conn.exec_driver_sql(f"ALTER TABLE patients ADD COLUMN {column} varchar{collate}")
+        for ddl in PATIENT_INDEXES:
+            conn.exec_driver_sql(ddl)
+        backfill_search_keys(conn)
+
+
+def ensure_dispensing_items_schema():
+    with engine.begin() as conn:
+        insp = inspect(conn)
+        cols = {c["name"] for c in insp.get_columns("dispensing_items")}
+        if "patient_id" not in cols:
+            # same type as dispensing_records.patient_id (uuid once compacted)
+            ptype = next(
+                c["type"] for c in insp.get_columns("dispensing_records") if c["name"] == "patient_id"
+            )
+            conn.exec_driver_sql(
+                f"ALTER TABLE dispensing_items ADD COLUMN patient_id {ptype.compile(conn.dialect)}"
+            )
+        if "dispensed_at" not in cols:
+            conn.exec_driver_sql(
+                "ALTER TABLE dispensing_items ADD COLUMN dispensed_at "
+                + DateTime().compile(conn.dialect)
+            )
+        conn.exec_driver_sql(DUPLICATE_BACKFILL_SQL)
+        for ddl in DUPLICATE_INDEXES:
+            conn.exec_driver_sql(ddl)
+
+
+def ensure_export_jobs_schema():
+    with engine.begin() as conn:
+        cols = {c["name"] for c in inspect(conn).get_columns("export_jobs")}
+        if "heartbeat_at" not in cols:
+            conn.exec_driver_sql(
+                "ALTER TABLE export_jobs ADD COLUMN heartbeat_at " + DateTime().compile(conn.dialect)
+            )
+        for ddl in EXPORT_INDEXES:
+            conn.exec_driver_sql(ddl)
+
+
+def ensure_partitioning():
+    """Keep monthly partitions of the history tables ahead of the calendar.
+
+    Postgres only. Plain tables are converted when DB_PARTITIONING=1; tables
+    that are already partitioned get their upcoming months created here and
+    then periodically by ``partition_maintainer`` while the server runs.
+    """
+    maintain(engine, convert=PARTITION_ON_START)
+
+
+partition_maintainer = PartitionMaintainer(engine)
+
+
 # Create FastAPI app
 app = FastAPI(title="Warehouse Management System")
 
@@ -220,6 +402,15 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(CompressionMiddleware)
+
+
+@app.exception_handler(StaleDataError)
+async def stale_data_handler(request: Request, exc: StaleDataError):
+    # a concurrent request updated the row between our read and our write
+    return JSONResponse(
+        status_code=409, content={"detail": {"message": "Record was modified by another user"}}
+    )
 
 
 # Create tables on startup
@@ -260,11 +451,23 @@ async def startup_event():
         )
         db.add(device_category)
 
+    if db.new:
+        bump_version(db, "categories")
     db.commit()
 
     ensure_medicines_category_fk()
     ensure_schema_patches()
     ensure_arrivals_schema()
+    ensure_transfers_schema()
+    ensure_row_versions()
+    ensure_sync_schema()
+    ensure_partitioning()
+    ensure_history_indexes()
+    ensure_archived_totals()
+    ensure_scan_indexes()
+    ensure_patient_search()
+    ensure_dispensing_items_schema()
+    ensure_export_jobs_schema()
     # Ensure all existing medicines have a valid category and enforce NOT NULL constraint
     try:
         db.execute(
@@ -277,6 +480,104 @@ async def startup_event():
     except Exception:
         db.rollback()
 
+    # schema patches above may rewrite medicines.category_id in any branch
+    bump_all_scopes(db, "medicines")
+    db.commit()
+
+    resume_pending(SessionLocal)
+    partition_maintainer.start()
+    start_relay(SessionLocal)
+    read_router.start_heartbeat()
+
+
+_SYNC_SCHEMAS = {
+    "medicines": Medicine,
+    "medical_devices": MedicalDevice,
+    "patients": Patient,
+    "employees": Employee,
+}
+
+
+@app.get("/api/sync")
+async def get_sync_changes(
+    since: int = Query(0, ge=0),
+    branch_id: Optional[str] = Query(None),
+    entities: Optional[str] = Query(None),
+    limit: int = Query(1000, ge=1, le=5000),
+    cursor: Optional[str] = Query(None),
+    db: Session = Depends(get_db),
+):
+    """Rows of the offline lists changed after ``since``, with tombstones.
+
+    Keep requesting with ``cursor`` while ``has_more``; then store
+    ``version`` and send it as ``since`` next time.
+    """
+    names = entities.split(",") if entities else list(SYNC_ENTITIES)
+    unknown = [n for n in names if n not in SYNC_ENTITIES]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown entities: {', '.join(unknown)}")
+    try:
+        page = changes_since(db, since, branch_id, names, limit, cursor)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    data = {}
+    for name in names:
+        ids = page["upserted"][name]
+        model = SYNC_ENTITIES[name]
+        rows = select_rows(db, _SYNC_SCHEMAS[name], model, model.id.in_(ids)) if ids else []
+        found = {r["id"] for r in rows}
+        data[name] = {
+            "upserted": rows,
+            # logged as changed but gone since (e.g. removed by raw SQL)
+            "deleted": page["deleted"][name] + [i for i in ids if i not in found],
+        }
+    return FastJSONResponse(
+        {
+            "data": data,
+            "version": page["version"],
+            "has_more": page["has_more"],
+            "cursor": page["cursor"],
+        }
+    )
+
+
+@app.get("/api/metrics/compression")
+async def get_compression_metrics():
+    return {"data": compression_stats.snapshot()}
+
+
+@app.get("/api/metrics/duplicate_check")
+async def get_duplicate_check_metrics():
+    return {"data": duplicate_stats.snapshot()}
+
+
+@app.get("/api/metrics/outbox")
+async def get_outbox_metrics(db: Session = Depends(get_db)):
+    return {"data": outbox_stats(db)}
+
+
+@app.get("/api/metrics/scan_cache")
+async def get_scan_cache_metrics():
+    return {"data": scan_cache.stats()}
+
+
+@app.get("/api/metrics/storage")
+def get_storage_metrics():
+    # table/index bytes and cache hit ratios; empty unless on Postgres
+    with engine.connect() as conn:
+        return {"data": relation_sizes(conn)}
+
+
+@app.get("/api/metrics/read_replica")
+async def get_read_replica_metrics():
+    return {"data": read_router.stats()}
+
+
+@app.get("/api/metrics/report_cache")
+async def get_report_cache_metrics():
+    return {"data": report_cache.stats()}
+
 
 # Auth endpoints
 @app.post("/api/auth/login", response_model=LoginResponse)
@@ -296,8 +597,7 @@ async def login(login_data: UserLogin, db: Session = Depends(get_db)):
 # User endpoints
 @app.get("/api/users", response_model=List[User])
 async def get_users(db: Session = Depends(get_db)):
-    db_users = db.query(DBUser).all()
-    return [User.model_validate(user) for user in db_users]
+    return FastJSONResponse(select_rows(db, User, DBUser))
 
 
 @app.post("/api/users", response_model=User)
@@ -348,9 +648,14 @@ async def delete_user(user_id: str, db: Session = Depends(get_db)):
 
 # Branch endpoints
 @app.get("/api/branches", response_model=List[Branch])
-async def get_branches(db: Session = Depends(get_db)):
-    db_branches = db.query(DBBranch).all()
-    return [Branch.model_validate(branch) for branch in db_branches]
+async def get_branches(request: Request, db: Session = Depends(get_db)):
+    etag = current_etag(db, "branches")
+    if etag_matches(request, etag):
+        return not_modified(etag)
+
+    response = FastJSONResponse(select_rows(db, Branch, DBBranch))
+    set_cache_headers(response, etag)
+    return response
 
 
 @app.post("/api/branches", response_model=Branch)
@@ -373,6 +678,7 @@ async def create_branch(branch: BranchCreate, db: Session = Depends(get_db)):
         branch_name=branch.name
     )
     db.add(db_user)
+    bump_version(db, "branches")
 
     db.commit()
     db.refresh(db_branch)
@@ -397,6 +703,7 @@ async def update_branch(branch_id: str, branch: BranchUpdate, db: Session = Depe
             db_user.password = branch.password
         if branch.name:
             db_user.branch_name = branch.name
+    bump_version(db, "branches")
 
     db.commit()
     db.refresh(db_branch)
@@ -415,18 +722,29 @@ async def delete_branch(branch_id: str, db: Session = Depends(get_db)):
         db.delete(user)
 
     db.delete(branch)
+    bump_version(db, "branches")
     db.commit()
     return {"message": "Branch deleted"}
 
 
 # Medicine endpoints
 @app.get("/api/medicines", response_model=List[Medicine])
-async def get_medicines(branch_id: Optional[str] = None, db: Session = Depends(get_db)):
+async def get_medicines(
+    request: Request,
+    branch_id: Optional[str] = None,
+    db: Session = Depends(get_db),
+):
+    etag = current_etag(db, "medicines", branch_id)
+    if etag_matches(request, etag):
+        return not_modified(etag)
+
     if branch_id and branch_id != "null" and branch_id != "undefined":
-        db_medicines = db.query(DBMedicine).filter(DBMedicine.branch_id == branch_id).all()
+        rows = select_rows(db, Medicine, DBMedicine, DBMedicine.branch_id == branch_id)
     else:
-        db_medicines = db.query(DBMedicine).filter(DBMedicine.branch_id.is_(None)).all()
-    return [Medicine.model_validate(medicine) for medicine in db_medicines]
+        rows = select_rows(db, Medicine, DBMedicine, DBMedicine.branch_id.is_(None))
+    response = FastJSONResponse(rows)
+    set_cache_headers(response, etag)
+    return response
 
 
 @app.post("/api/medicines", response_model=Medicine)
@@ -448,16 +766,24 @@ async def create_medicine(medicine: MedicineCreate, db: Session = Depends(get_db
         branch_id=medicine.branch_id,
     )
     db.add(db_medicine)
+    bump_version(db, "medicines", db_medicine.branch_id)
     db.commit()
     db.refresh(db_medicine)
     return Medicine.model_validate(db_medicine)
 
 
 @app.put("/api/medicines/{medicine_id}", response_model=Medicine)
-async def update_medicine(medicine_id: str, medicine: MedicineUpdate, db: Session = Depends(get_db)):
+async def update_medicine(
+    medicine_id: str,
+    medicine: MedicineUpdate,
+    request: Request = None,
+    response: Response = None,
+    db: Session = Depends(get_db),
+):
     db_medicine = db.query(DBMedicine).filter(DBMedicine.id == medicine_id).first()
     if not db_medicine:
         raise HTTPException(status_code=404, detail="Medicine not found")
+    check_row_version(db_medicine, expected_row_version(request, medicine.version))
 
     category_id = medicine.category_id if medicine.category_id is not None else db_medicine.category_id
     cat = db.query(DBCategory).filter(DBCategory.id == medicine.category_id).first()
@@ -466,11 +792,19 @@ async def update_medicine(medicine_id: str, medicine: MedicineUpdate, db: Sessio
     if cat.type != "medicine":
         raise HTTPException(status_code=400, detail="Invalid category for medicine")
 
-    for field, value in medicine.model_dump(exclude_unset=True).items():
+    old_branch_id = db_medicine.branch_id
+    changes = medicine.model_dump(exclude_unset=True, exclude={"version"})
+    for field, value in changes.items():
         setattr(db_medicine, field, value)
 
+    if "name" in changes or "category_id" in changes:
+        invalidate_reports(db)
+    bump_version(db, "medicines", old_branch_id)
+    if db_medicine.branch_id != old_branch_id:
+        bump_version(db, "medicines", db_medicine.branch_id)
     db.commit()
     db.refresh(db_medicine)
+    set_row_etag(response, db_medicine)
     return Medicine.model_validate(db_medicine)
 
 
@@ -481,18 +815,31 @@ async def delete_medicine(medicine_id: str, db: Session = Depends(get_db)):
         raise HTTPException(status_code=404, detail="Medicine not found")
 
     db.delete(medicine)
+    bump_version(db, "medicines", medicine.branch_id)
+    drop_barcodes(db, medicine_id)
+    invalidate_reports(db)
     db.commit()
     return {"message": "Medicine deleted"}
 
 
 # Medical Device endpoints
 @app.get("/api/medical_devices", response_model=List[MedicalDevice])
-async def get_medical_devices(branch_id: Optional[str] = None, db: Session = Depends(get_db)):
+async def get_medical_devices(
+    request: Request,
+    branch_id: Optional[str] = None,
+    db: Session = Depends(get_db),
+):
+    etag = current_etag(db, "medical_devices", branch_id)
+    if etag_matches(request, etag):
+        return not_modified(etag)
+
     if branch_id and branch_id != "null" and branch_id != "undefined":
-        db_devices = db.query(DBMedicalDevice).filter(DBMedicalDevice.branch_id == branch_id).all()
+        rows = select_rows(db, MedicalDevice, DBMedicalDevice, DBMedicalDevice.branch_id == branch_id)
     else:
-        db_devices = db.query(DBMedicalDevice).filter(DBMedicalDevice.branch_id.is_(None)).all()
-    return [MedicalDevice.model_validate(device) for device in db_devices]
+        rows = select_rows(db, MedicalDevice, DBMedicalDevice, DBMedicalDevice.branch_id.is_(None))
+    response = FastJSONResponse(rows)
+    set_cache_headers(response, etag)
+    return response
 
 
 @app.post("/api/medical_devices", response_model=MedicalDevice)
@@ -514,16 +861,24 @@ async def create_medical_device(device: MedicalDeviceCreate, db: Session = Depen
         branch_id=device.branch_id,
     )
     db.add(db_device)
+    bump_version(db, "medical_devices", db_device.branch_id)
     db.commit()
     db.refresh(db_device)
     return MedicalDevice.model_validate(db_device)
 
 
 @app.put("/api/medical_devices/{device_id}", response_model=MedicalDevice)
-async def update_medical_device(device_id: str, device: MedicalDeviceUpdate, db: Session = Depends(get_db)):
+async def update_medical_device(
+    device_id: str,
+    device: MedicalDeviceUpdate,
+    request: Request = None,
+    response: Response = None,
+    db: Session = Depends(get_db),
+):
     db_device = db.query(DBMedicalDevice).filter(DBMedicalDevice.id == device_id).first()
     if not db_device:
         raise HTTPException(status_code=404, detail="Medical device not found")
+    check_row_version(db_device, expected_row_version(request, device.version))
 
     category_id = device.category_id if device.category_id is not None else db_device.category_id
     cat = db.query(DBCategory).filter(DBCategory.id == device.category_id).first()
@@ -532,11 +887,19 @@ async def update_medical_device(device_id: str, device: MedicalDeviceUpdate, db:
     if cat.type != "medical_device":
         raise HTTPException(status_code=400, detail="Invalid category for medical device")
 
-    for field, value in device.model_dump(exclude_unset=True).items():
+    old_branch_id = db_device.branch_id
+    changes = device.model_dump(exclude_unset=True, exclude={"version"})
+    for field, value in changes.items():
         setattr(db_device, field, value)
 
+    if "name" in changes or "category_id" in changes:
+        invalidate_reports(db)
+    bump_version(db, "medical_devices", old_branch_id)
+    if db_device.branch_id != old_branch_id:
+        bump_version(db, "medical_devices", db_device.branch_id)
     db.commit()
     db.refresh(db_device)
+    set_row_etag(response, db_device)
     return MedicalDevice.model_validate(db_device)
 
 
@@ -547,13 +910,26 @@ async def delete_medical_device(device_id: str, db: Session = Depends(get_db)):
         raise HTTPException(status_code=404, detail="Medical device not found")
 
     db.delete(device)
+    bump_version(db, "medical_devices", device.branch_id)
+    drop_barcodes(db, device_id)
+    invalidate_reports(db)
     db.commit()
     return {"message": "Medical device deleted"}
 
 
 # Category endpoints
 @app.get("/api/categories", response_model=List[dict])
-async def get_categories(type: Optional[str] = None, db: Session = Depends(get_db)):
+async def get_categories(
+    request: Request,
+    response: Response,
+    type: Optional[str] = None,
+    db: Session = Depends(get_db),
+):
+    etag = current_etag(db, "categories", variant=type or "")
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    set_cache_headers(response, etag)
+
     query = db.query(DBCategory)
     if type:
         query = query.filter(DBCategory.type == type)
@@ -571,6 +947,7 @@ async def create_category(category: dict, db: Session = Depends(get_db)):
         type=category["type"]
     )
     db.add(db_category)
+    bump_version(db, "categories")
     db.commit()
     db.refresh(db_category)
     return {"id": db_category.id, "name": db_category.name, "description": db_category.description,
@@ -587,6 +964,9 @@ async def update_category(category_id: str, category: dict, db: Session = Depend
         if hasattr(db_category, field):
             setattr(db_category, field, value)
 
+    bump_version(db, "categories")
+    if "name" in category:
+        invalidate_reports(db, ("stock",))
     db.commit()
     db.refresh(db_category)
     return {"id": db_category.id, "name": db_category.name, "description": db_category.description,
@@ -600,18 +980,30 @@ async def delete_category(category_id: str, db: Session = Depends(get_db)):
         raise HTTPException(status_code=404, detail="Category not found")
 
     db.delete(category)
+    bump_version(db, "categories")
+    invalidate_reports(db, ("stock",))
     db.commit()
     return {"message": "Category deleted"}
 
 
 # Employee endpoints
 @app.get("/api/employees", response_model=List[Employee])
-async def get_employees(branch_id: Optional[str] = None, db: Session = Depends(get_db)):
+async def get_employees(
+    request: Request,
+    branch_id: Optional[str] = None,
+    db: Session = Depends(get_db),
+):
+    etag = current_etag(db, "employees", branch_id)
+    if etag_matches(request, etag):
+        return not_modified(etag)
+
     if branch_id and branch_id != "null" and branch_id != "undefined":
-        db_employees = db.query(DBEmployee).filter(DBEmployee.branch_id == branch_id).all()
+        rows = select_rows(db, Employee, DBEmployee, DBEmployee.branch_id == branch_id)
     else:
-        db_employees = db.query(DBEmployee).filter(DBEmployee.branch_id.is_(None)).all()
-    return [Employee.model_validate(employee) for employee in db_employees]
+        rows = select_rows(db, Employee, DBEmployee, DBEmployee.branch_id.is_(None))
+    response = FastJSONResponse(rows)
+    set_cache_headers(response, etag)
+    return response
 
 
 @app.post("/api/employees", response_model=Employee)
@@ -626,6 +1018,7 @@ async def create_employee(employee: EmployeeCreate, db: Session = Depends(get_db
         branch_id=employee.branch_id
     )
     db.add(db_employee)
+    bump_version(db, "employees", db_employee.branch_id)
     db.commit()
     db.refresh(db_employee)
     return Employee.model_validate(db_employee)
@@ -637,9 +1030,16 @@ async def update_employee(employee_id: str, employee: EmployeeUpdate, db: Sessio
     if not db_employee:
         raise HTTPException(status_code=404, detail="Employee not found")
 
-    for field, value in employee.model_dump(exclude_unset=True).items():
+    old_branch_id = db_employee.branch_id
+    changes = employee.model_dump(exclude_unset=True)
+    for field, value in changes.items():
         setattr(db_employee, field, value)
 
+    if "first_name" in changes or "last_name" in changes:
+        invalidate_reports(db, ("dispensings",))
+    bump_version(db, "employees", old_branch_id)
+    if db_employee.branch_id != old_branch_id:
+        bump_version(db, "employees", db_employee.branch_id)
     db.commit()
     db.refresh(db_employee)
     return Employee.model_validate(db_employee)
@@ -652,6 +1052,8 @@ async def delete_employee(employee_id: str, db: Session = Depends(get_db)):
         raise HTTPException(status_code=404, detail="Employee not found")
 
     db.delete(employee)
+    bump_version(db, "employees", employee.branch_id)
+    invalidate_reports(db, ("dispensings",))
     db.commit()
     return {"message": "Employee deleted"}
 
@@ -660,10 +1062,10 @@ async def delete_employee(employee_id: str, db: Session = Depends(get_db)):
 @app.get("/api/patients", response_model=List[Patient])
 async def get_patients(branch_id: Optional[str] = None, db: Session = Depends(get_db)):
     if branch_id and branch_id != "null" and branch_id != "undefined":
-        db_patients = db.query(DBPatient).filter(DBPatient.branch_id == branch_id).all()
+        rows = select_rows(db, Patient, DBPatient, DBPatient.branch_id == branch_id)
     else:
-        db_patients = db.query(DBPatient).all()
-    return [Patient.model_validate(patient) for patient in db_patients]
+        rows = select_rows(db, Patient, DBPatient)
+    return FastJSONResponse(rows)
 
 
 @app.post("/api/patients", response_model=Patient)
@@ -685,16 +1087,27 @@ async def create_patient(patient: PatientCreate, db: Session = Depends(get_db)):
 
 
 @app.put("/api/patients/{patient_id}", response_model=Patient)
-async def update_patient(patient_id: str, patient: PatientUpdate, db: Session = Depends(get_db)):
+async def update_patient(
+    patient_id: str,
+    patient: PatientUpdate,
+    request: Request = None,
+    response: Response = None,
+    db: Session = Depends(get_db),
+):
     db_patient = db.query(DBPatient).filter(DBPatient.id == patient_id).first()
     if not db_patient:
         raise HTTPException(status_code=404, detail="Patient not found")
+    check_row_version(db_patient, expected_row_version(request, patient.version))
 
-    for field, value in patient.model_dump(exclude_unset=True).items():
+    changes = patient.model_dump(exclude_unset=True, exclude={"version"})
+    for field, value in changes.items():
         setattr(db_patient, field, value)
 
+    if "first_name" in changes or "last_name" in changes:
+        invalidate_reports(db, ("dispensings",))
     db.commit()
     db.refresh(db_patient)
+    set_row_etag(response, db_patient)
     return Patient.model_validate(db_patient)
 
 
@@ -705,68 +1118,97 @@ async def delete_patient(patient_id: str, db: Session = Depends(get_db)):
         raise HTTPException(status_code=404, detail="Patient not found")
 
     db.delete(patient)
+    invalidate_reports(db, ("dispensings",))
     db.commit()
     return {"message": "Patient deleted"}
 
 
+@app.get("/api/patients/search")
+async def search_patients_page(
+    q: Optional[str] = None,
+    branch_id: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[str] = None,
+    db: Session = Depends(get_db),
+):
+    """Patients whose "last first" name or phone digits start with ``q``."""
+    if branch_id in ("null", "undefined"):
+        branch_id = None
+    try:
+        return FastJSONResponse({"data": search_patients(db, q, branch_id, limit, cursor)})
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.post("/api/patients/duplicates/scan")
+def scan_patient_duplicates(payload: Optional[dict] = None, db: Session = Depends(get_db)):
+    """Rebuild the likely-duplicate pairs; ``threshold``/``max_block`` override the defaults."""
+    payload = payload or {}
+    try:
+        options = {k: payload[k] for k in ("threshold", "max_block") if payload.get(k) is not None}
+        stats = scan_duplicate_patients(db, **options)
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"data": stats}
+
+
+@app.get("/api/patients/duplicates")
+async def get_patient_duplicates(
+    min_score: float = Query(0, ge=0, le=1),
+    limit: int = Query(100, ge=1, le=1000),
+    db: Session = Depends(get_db),
+):
+    return {"data": duplicate_patients(db, min_score, limit)}
+
+
+@app.post("/api/patients/merge")
+async def merge_patient_records(body: PatientMerge, db: Session = Depends(get_db)):
+    """Move the dispensings of ``merge_ids`` to ``keep_id`` and delete those patients."""
+    try:
+        result = merge_patients(db, body.keep_id, body.merge_ids)
+        db.commit()
+    except LookupError as e:
+        db.rollback()
+        raise HTTPException(status_code=404, detail=str(e))
+    except ValueError as e:
+        db.rollback()
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"data": result}
+
+
+@app.get("/api/patients/{patient_id}/history")
+async def get_patient_history(
+    patient_id: str,
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[str] = None,
+    db: Session = Depends(get_read_db),
+):
+    """A patient's dispensings, newest first; the first page carries the summary."""
+    try:
+        page = patient_history(db, patient_id, limit, cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if page is None:
+        raise HTTPException(status_code=404, detail="Patient not found")
+    return {"data": page}
+
+
 # Transfer endpoints
 @app.get("/api/transfers", response_model=List[Transfer])
 async def get_transfers(branch_id: Optional[str] = None, db: Session = Depends(get_db)):
     if branch_id and branch_id != "null" and branch_id != "undefined":
-        db_transfers = db.query(DBTransfer).filter(DBTransfer.to_branch_id == branch_id).all()
+        rows = select_rows(db, Transfer, DBTransfer, DBTransfer.to_branch_id == branch_id)
     else:
-        db_transfers = db.query(DBTransfer).all()
-    return [Transfer.model_validate(transfer) for transfer in db_transfers]
+        rows = select_rows(db, Transfer, DBTransfer)
+    return FastJSONResponse(rows)
 
 
 @app.post("/api/transfers")
 async def create_transfers(batch: BatchTransferCreate, db: Session = Depends(get_db)):
     try:
-        for transfer_data in batch.transfers:
-            # Check main warehouse medicine
-            main_medicine = db.query(DBMedicine).filter(
-                DBMedicine.id == transfer_data.medicine_id,
-                DBMedicine.branch_id.is_(None)
-            ).first()
-
-            if not main_medicine or main_medicine.quantity < transfer_data.quantity:
-                raise HTTPException(status_code=400,
-                                    detail=f"Not enough {transfer_data.medicine_name} in main warehouse")
-
-            # Decrease quantity in main warehouse
-            main_medicine.quantity -= transfer_data.quantity
-
-            # Find or create medicine in branch
-            branch_medicine = db.query(DBMedicine).filter(
-                DBMedicine.name == transfer_data.medicine_name,
-                DBMedicine.branch_id == transfer_data.to_branch_id
-            ).first()
-
-            if branch_medicine:
-                branch_medicine.quantity += transfer_data.quantity
-            else:
-                new_branch_medicine = DBMedicine(
-                    id=str(uuid.uuid4()),
-                    name=transfer_data.medicine_name,
-                    category_id=main_medicine.category_id,
-                    purchase_price=main_medicine.purchase_price,
-                    sell_price=main_medicine.sell_price,
-                    quantity=transfer_data.quantity,
-                    branch_id=transfer_data.to_branch_id
-                )
-                db.add(new_branch_medicine)
-
-            # Create transfer record
-            db_transfer = DBTransfer(
-                id=str(uuid.uuid4()),
-                medicine_id=transfer_data.medicine_id,
-                medicine_name=transfer_data.medicine_name,
-                quantity=transfer_data.quantity,
-                from_branch_id=transfer_data.from_branch_id or "main",
-                to_branch_id=transfer_data.to_branch_id
-            )
-            db.add(db_transfer)
-
+        transfer_batch(db, batch.transfers)
         db.commit()
         return {"message": "Transfers completed"}
     except Exception as e:
@@ -778,7 +1220,10 @@ async def create_transfers(batch: BatchTransferCreate, db: Session = Depends(get
 @app.get("/api/shipments")
 async def get_shipments(branch_id: Optional[str] = None, db: Session = Depends(get_db)):
     if branch_id and branch_id != "null" and branch_id != "undefined":
-        shipments = db.query(DBShipment).filter(DBShipment.to_branch_id == branch_id).all()
+        # drafts stay with the admin until confirmed
+        shipments = db.query(DBShipment).filter(
+            DBShipment.to_branch_id == branch_id, DBShipment.status != "draft"
+        ).all()
     else:
         shipments = db.query(DBShipment).all()
 
@@ -852,7 +1297,15 @@ async def get_dispensing_record_detail(record_id: str, db: Session = Depends(get
 
 
 @app.post("/api/shipments")
-async def create_shipment(shipment_data: dict, db: Session = Depends(get_db)):
+async def create_shipment(
+    shipment_data: dict, request: Request = None, db: Session = Depends(get_db)
+):
+    return await run_idempotent(
+        db, request, "shipments", shipment_data, lambda: _create_shipment(shipment_data, db)
+    )
+
+
+async def _create_shipment(shipment_data: dict, db: Session):
     try:
         shipment_id = str(uuid.uuid4())
 
@@ -864,49 +1317,32 @@ async def create_shipment(shipment_data: dict, db: Session = Depends(get_db)):
         )
         db.add(db_shipment)
 
-        # Add medicines
-        if "medicines" in shipment_data:
-            for medicine_item in shipment_data["medicines"]:
-                medicine = db.query(DBMedicine).filter(
-                    DBMedicine.id == medicine_item["medicine_id"],
-                    DBMedicine.branch_id.is_(None)
-                ).first()
-
-                if not medicine or medicine.quantity < medicine_item["quantity"]:
-                    raise HTTPException(status_code=400, detail=f"Insufficient medicine quantity")
-
-                # Create shipment item
-                db_item = DBShipmentItem(
-                    id=str(uuid.uuid4()),
-                    shipment_id=shipment_id,
-                    item_type="medicine",
-                    item_id=medicine_item["medicine_id"],
-                    item_name=medicine.name,
-                    quantity=medicine_item["quantity"]
-                )
-                db.add(db_item)
-
-        # Add medical devices
-        if "medical_devices" in shipment_data:
-            for device_item in shipment_data["medical_devices"]:
-                device = db.query(DBMedicalDevice).filter(
-                    DBMedicalDevice.id == device_item["device_id"],
-                    DBMedicalDevice.branch_id.is_(None)
+        # Add medicines and medical devices
+        for item_type, key, id_key, label in (
+            ("medicine", "medicines", "medicine_id", "medicine"),
+            ("medical_device", "medical_devices", "device_id", "medical device"),
+        ):
+            model = STOCK_MODELS[item_type]
+            for line in shipment_data.get(key) or []:
+                stock = db.query(model).filter(
+                    model.id == line[id_key],
+                    model.branch_id.is_(None)
                 ).first()
 
-                if not device or device.quantity < device_item["quantity"]:
-                    raise HTTPException(status_code=400, detail=f"Insufficient medical device quantity")
+                if not stock or stock.quantity < line["quantity"]:
+                    raise HTTPException(status_code=400, detail=f"Insufficient {label} quantity")
 
                 # Create shipment item
-                db_item = DBShipmentItem(
-                    id=str(uuid.uuid4()),
-                    shipment_id=shipment_id,
-                    item_type="medical_device",
-                    item_id=device_item["device_id"],
-                    item_name=device.name,
-                    quantity=device_item["quantity"]
+                db.add(
+                    DBShipmentItem(
+                        id=str(uuid.uuid4()),
+                        shipment_id=shipment_id,
+                        item_type=item_type,
+                        item_id=line[id_key],
+                        item_name=stock.name,
+                        quantity=line["quantity"]
+                    )
                 )
-                db.add(db_item)
 
         # Create notification for branch
         notification = DBNotification(
@@ -918,6 +1354,8 @@ async def create_shipment(shipment_data: dict, db: Session = Depends(get_db)):
         )
         db.add(notification)
 
+        db.flush()
+        note_report_write(db, ("dispatches",), db_shipment.created_at)
         db.commit()
         return {"message": "Shipment created successfully"}
     except Exception as e:
@@ -926,77 +1364,87 @@ async def create_shipment(shipment_data: dict, db: Session = Depends(get_db)):
 
 
 @app.post("/api/shipments/{shipment_id}/accept")
-async def accept_shipment(shipment_id: str, db: Session = Depends(get_db)):
+async def accept_shipment(shipment_id: str, request: Request = None, db: Session = Depends(get_db)):
     try:
         shipment = db.query(DBShipment).filter(DBShipment.id == shipment_id).first()
         if not shipment:
             raise HTTPException(status_code=404, detail="Shipment not found")
+        check_row_version(shipment, expected_row_version(request))
+        # drafts go through confirm first; accepted or rejected ones are settled
+        if shipment.status != "pending":
+            raise HTTPException(status_code=409, detail=f"Shipment is {shipment.status}")
 
         # Get shipment items
         items = db.query(DBShipmentItem).filter(DBShipmentItem.shipment_id == shipment_id).all()
 
         for item in items:
-            if item.item_type == "medicine":
-                # Decrease main warehouse quantity
-                main_medicine = db.query(DBMedicine).filter(
-                    DBMedicine.id == item.item_id,
-                    DBMedicine.branch_id.is_(None)
-                ).first()
-                if main_medicine:
-                    main_medicine.quantity -= item.quantity
-
-                # Add to branch
-                branch_medicine = db.query(DBMedicine).filter(
-                    DBMedicine.name == item.item_name,
-                    DBMedicine.branch_id == shipment.to_branch_id
-                ).first()
-
-                if branch_medicine:
-                    branch_medicine.quantity += item.quantity
-                else:
-                    new_medicine = DBMedicine(
-                        id=str(uuid.uuid4()),
-                        name=item.item_name,
-                        category_id=main_medicine.category_id if main_medicine else None,
-                        purchase_price=main_medicine.purchase_price if main_medicine else 0,
-                        sell_price=main_medicine.sell_price if main_medicine else 0,
-                        quantity=item.quantity,
-                        branch_id=shipment.to_branch_id
-                    )
-                    db.add(new_medicine)
-
-            elif item.item_type == "medical_device":
-                # Decrease main warehouse quantity
-                main_device = db.query(DBMedicalDevice).filter(
-                    DBMedicalDevice.id == item.item_id,
-                    DBMedicalDevice.branch_id.is_(None)
-                ).first()
-                if main_device:
-                    main_device.quantity -= item.quantity
+            model = STOCK_MODELS[item.item_type]
+            # Decrease main warehouse quantity
+            main_row = db.query(model).filter(
+                model.id == item.item_id,
+                model.branch_id.is_(None)
+            ).first()
+            if main_row:
+                main_row.quantity -= item.quantity
+                note_stock_change(db, item.item_type, main_row.id)
+
+            # Add to branch
+            branch_row = db.query(model).filter(
+                model.name == item.item_name,
+                model.branch_id == shipment.to_branch_id
+            ).first()
 
-                # Add to branch
-                branch_device = db.query(DBMedicalDevice).filter(
-                    DBMedicalDevice.name == item.item_name,
-                    DBMedicalDevice.branch_id == shipment.to_branch_id
-                ).first()
+            if branch_row:
+                branch_row.quantity += item.quantity
+                note_stock_change(db, item.item_type, branch_row.id)
+            else:
+                branch_row = model(
+                    id=str(uuid.uuid4()),
+                    name=item.item_name,
+                    category_id=main_row.category_id if main_row else None,
+                    purchase_price=main_row.purchase_price if main_row else 0,
+                    sell_price=main_row.sell_price if main_row else 0,
+                    quantity=item.quantity,
+                    branch_id=shipment.to_branch_id
+                )
+                db.add(branch_row)
+            if main_row:
+                move_lots(
+                    db, item.item_type, main_row.id, None,
+                    branch_row.id, shipment.to_branch_id, item.quantity,
+                )
 
-                if branch_device:
-                    branch_device.quantity += item.quantity
-                else:
-                    new_device = DBMedicalDevice(
-                        id=str(uuid.uuid4()),
-                        name=item.item_name,
-                        category_id=main_device.category_id if main_device else None,
-                        purchase_price=main_device.purchase_price if main_device else 0,
-                        sell_price=main_device.sell_price if main_device else 0,
-                        quantity=item.quantity,
-                        branch_id=shipment.to_branch_id
-                    )
-                    db.add(new_device)
+        for item in items:
+            table = STOCK_MODELS[item.item_type].__tablename__
+            bump_version(db, table)
+            bump_version(db, table, shipment.to_branch_id)
 
         shipment.status = "accepted"
+        # closing balances count the shipment at its creation date
+        note_report_write(db, ("stock",), shipment.created_at)
+        emit_event(
+            db,
+            "shipment",
+            shipment.id,
+            "shipment.accepted",
+            {
+                "to_branch_id": shipment.to_branch_id,
+                "items": [
+                    {
+                        "type": item.item_type,
+                        "item_id": item.item_id,
+                        "name": item.item_name,
+                        "quantity": item.quantity,
+                    }
+                    for item in items
+                ],
+            },
+        )
         db.commit()
         return {"message": "Shipment accepted"}
+    except (HTTPException, StaleDataError):
+        db.rollback()
+        raise
     except Exception as e:
         db.rollback()
         raise HTTPException(status_code=400, detail=str(e))
@@ -1014,11 +1462,53 @@ async def reject_shipment(shipment_id: str, reason: dict, db: Session = Depends(
     return {"message": "Shipment rejected"}
 
 
+@app.post("/api/shipments/{shipment_id}/confirm")
+async def confirm_shipment(shipment_id: str, db: Session = Depends(get_db)):
+    shipment = db.query(DBShipment).filter(DBShipment.id == shipment_id).first()
+    if not shipment:
+        raise HTTPException(status_code=404, detail="Shipment not found")
+    if shipment.status != "draft":
+        raise HTTPException(status_code=400, detail="Only draft shipments can be confirmed")
+
+    shipment.status = "pending"
+    db.add(
+        DBNotification(
+            id=str(uuid.uuid4()),
+            branch_id=shipment.to_branch_id,
+            title="Новая отправка",
+            message="Поступление от главного склада",
+            is_read=0,
+        )
+    )
+    db.commit()
+    return {"message": "Shipment confirmed"}
+
+
+@app.post("/api/replenishment/plan")
+async def create_replenishment_plan(payload: dict, db: Session = Depends(get_db)):
+    """Propose top-ups for every branch; unless dry_run, stage them as drafts."""
+    try:
+        lines = plan_replenishment(db, payload.get("branch_ids"))
+        shipment_ids = []
+        if not payload.get("dry_run"):
+            shipment_ids = create_draft_shipments(db, lines)
+            db.commit()
+        return {"data": {"lines": lines, "shipment_ids": shipment_ids}}
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(status_code=400, detail=str(e))
+
+
 @app.put("/api/shipments/{shipment_id}/status")
-async def update_shipment_status(shipment_id: str, status_data: dict, db: Session = Depends(get_db)):
+async def update_shipment_status(
+    shipment_id: str, status_data: dict, request: Request = None, db: Session = Depends(get_db)
+):
     shipment = db.query(DBShipment).filter(DBShipment.id == shipment_id).first()
     if not shipment:
         raise HTTPException(status_code=404, detail="Shipment not found")
+    check_row_version(shipment, expected_row_version(request, status_data.get("version")))
+    if status_data.get("status") not in SHIPMENT_STATUS.enums:
+        raise HTTPException(status_code=400, detail="Invalid shipment status")
 
     shipment.status = status_data["status"]
     db.commit()
@@ -1102,7 +1592,20 @@ async def get_dispensing_records(branch_id: Optional[str] = None, db: Session =
 
 
 @app.post("/api/dispensing", status_code=status.HTTP_201_CREATED)
-async def create_dispensing_record(payload: dict, db: Session = Depends(get_db)):
+async def create_dispensing_record(
+    payload: dict, request: Request = None, db: Session = Depends(get_db)
+):
+    return await run_idempotent(
+        db,
+        request,
+        "dispensing",
+        payload,
+        lambda: _create_dispensing_record(payload, db),
+        status_code=status.HTTP_201_CREATED,
+    )
+
+
+async def _create_dispensing_record(payload: dict, db: Session):
     print("DISPENSING_RAW", payload)
     try:
         body = DispensePayload.model_validate(payload)
@@ -1169,6 +1672,19 @@ async def create_dispensing_record(payload: dict, db: Session = Depends(get_db))
                     )
                 itm["item_name"] = name
 
+            try:
+                warnings = check_cart(
+                    db,
+                    str(patient_id),
+                    [(itm["type"], itm["item_id"]) for itm in items],
+                    datetime.utcnow(),
+                    allow=body.allow_duplicates,
+                )
+            except DuplicateDispensing as e:
+                raise HTTPException(
+                    status_code=409, detail={"message": str(e), "duplicates": e.duplicates}
+                )
+
             db_record = DBDispensingRecord(
                 id=str(uuid.uuid4()),
                 branch_id=str(branch_id),
@@ -1181,6 +1697,7 @@ async def create_dispensing_record(payload: dict, db: Session = Depends(get_db))
             )
             db.add(db_record)
             db.flush()
+            note_report_write(db, ("dispensings", "stock"), db_record.date)
 
             for itm in items:
                 db.add(
@@ -1191,6 +1708,8 @@ async def create_dispensing_record(payload: dict, db: Session = Depends(get_db))
                         item_id=str(itm["item_id"]),
                         item_name=itm["item_name"],
                         quantity=itm["quantity"],
+                        patient_id=str(patient_id),
+                        dispensed_at=db_record.date,
                     )
                 )
                 decrement_stock(
@@ -1201,6 +1720,28 @@ async def create_dispensing_record(payload: dict, db: Session = Depends(get_db))
                     itm["quantity"],
                 )
 
+            emit_event(
+                db,
+                "dispensing",
+                db_record.id,
+                "dispensing.created",
+                {
+                    "branch_id": str(branch_id),
+                    "patient_id": str(patient_id),
+                    "employee_id": str(employee_id),
+                    "date": db_record.date.isoformat(),
+                    "items": [
+                        {
+                            "type": itm["type"].value,
+                            "item_id": str(itm["item_id"]),
+                            "name": itm["item_name"],
+                            "quantity": itm["quantity"],
+                        }
+                        for itm in items
+                    ],
+                },
+            )
+
             return {
                 "id": db_record.id,
                 "branch_id": str(branch_id),
@@ -1214,6 +1755,7 @@ async def create_dispensing_record(payload: dict, db: Session = Depends(get_db))
                     }
                     for itm in items
                 ],
+                "warnings": warnings,
             }
     except HTTPException:
         raise
@@ -1223,6 +1765,30 @@ async def create_dispensing_record(payload: dict, db: Session = Depends(get_db))
         raise HTTPException(status_code=500, detail="Failed to create dispensing")
 
 
+@app.post("/api/dispensing/batch")
+async def create_dispensing_batch(
+    payload: dict, request: Request = None, db: Session = Depends(get_db)
+):
+    """Dispense many records at once; each entry succeeds or fails on its own."""
+    return await run_idempotent(
+        db, request, "dispensing_batch", payload, lambda: _create_dispensing_batch(payload, db)
+    )
+
+
+async def _create_dispensing_batch(payload: dict, db: Session):
+    entries = payload.get("dispensings")
+    if not isinstance(entries, list) or not entries:
+        raise HTTPException(status_code=400, detail="No dispensings to create")
+    try:
+        results = dispense_batch(db, entries)
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        logger.exception("batch dispensing failed")
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"data": results}
+
+
 # Arrival endpoints
 @app.get("/api/arrivals")
 async def get_arrivals(item_type: Optional[str] = None, db: Session = Depends(get_db)):
@@ -1234,36 +1800,63 @@ async def get_arrivals(item_type: Optional[str] = None, db: Session = Depends(ge
 
 
 @app.post("/api/arrivals")
-async def create_arrivals(batch: BatchArrivalCreate, db: Session = Depends(get_db)):
+async def create_arrivals(
+    batch: BatchArrivalCreate, request: Request = None, db: Session = Depends(get_db)
+):
+    return await run_idempotent(
+        db, request, "arrivals", batch, lambda: _create_arrivals(batch, db)
+    )
+
+
+async def _create_arrivals(batch: BatchArrivalCreate, db: Session):
     try:
+        new_arrivals = []
         for it in batch.arrivals:
-            db.add(DBArrival(
+            arrival = DBArrival(
                 id=str(uuid.uuid4()),
                 item_type=it.item_type,
                 item_id=it.item_id,
                 item_name=it.item_name,
                 quantity=it.quantity,
-            ))
+                expiry_date=it.expiry_date,
+                lot_number=it.lot_number,
+            )
+            db.add(arrival)
+            new_arrivals.append(arrival)
 
             # increase stock on MAIN warehouse (branch_id IS NULL)
-            if it.item_type == "medicine":
-                stock = db.query(DBMedicine).filter(
-                    DBMedicine.id == it.item_id,
-                    DBMedicine.branch_id.is_(None),
-                ).first()
-            elif it.item_type == "medical_device":
-                stock = db.query(DBMedicalDevice).filter(
-                    DBMedicalDevice.id == it.item_id,
-                    DBMedicalDevice.branch_id.is_(None),
-                ).first()
-            else:
+            model = STOCK_MODELS.get(it.item_type)
+            if model is None:
                 raise HTTPException(status_code=400, detail="Invalid item_type")
+            stock = db.query(model).filter(
+                model.id == it.item_id,
+                model.branch_id.is_(None),
+            ).first()
 
             if not stock:
                 raise HTTPException(status_code=404, detail="Item not found")
 
             stock.quantity += it.quantity  # do not modify prices here
-
+            add_lot(db, it.item_type, stock.id, None, it.quantity, it.expiry_date, it.lot_number)
+            bump_version(db, stock.__tablename__)
+            note_stock_change(db, it.item_type, stock.id)
+
+        db.flush()
+        for arrival in new_arrivals:
+            note_report_write(db, ("arrivals", "stock"), arrival.date)
+            emit_event(
+                db,
+                "arrival",
+                arrival.id,
+                "arrival.created",
+                {
+                    "type": arrival.item_type,
+                    "item_id": arrival.item_id,
+                    "name": arrival.item_name,
+                    "quantity": arrival.quantity,
+                    "date": arrival.date.isoformat(),
+                },
+            )
         db.commit()
         return {"message": "Arrivals created successfully"}
     except Exception as e:
@@ -1271,6 +1864,127 @@ async def create_arrivals(batch: BatchArrivalCreate, db: Session = Depends(get_d
         raise HTTPException(status_code=400, detail=str(e))
 
 
+def drop_barcodes(db: Session, item_id: str) -> None:
+    if db.query(DBItemBarcode).filter(DBItemBarcode.item_id == item_id).delete(synchronize_session=False):
+        bump_version(db, "item_barcodes")
+
+
+@app.get("/api/barcodes")
+async def get_barcodes(item_id: str, db: Session = Depends(get_db)):
+    rows = db.query(DBItemBarcode).filter(DBItemBarcode.item_id == item_id).order_by(DBItemBarcode.code)
+    return {"data": [{"code": b.code, "item_type": b.item_type, "item_id": b.item_id} for b in rows]}
+
+
+@app.post("/api/barcodes")
+async def create_barcode(barcode: BarcodeCreate, db: Session = Depends(get_db)):
+    try:
+        code = normalize_code(barcode.code)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if db.get(STOCK_MODELS[barcode.item_type], barcode.item_id) is None:
+        raise HTTPException(status_code=404, detail="Item not found")
+    existing = db.get(DBItemBarcode, code)
+    if existing and existing.item_id != barcode.item_id:
+        raise HTTPException(status_code=409, detail=f"Barcode {code} belongs to another item")
+    if not existing:
+        db.add(DBItemBarcode(code=code, item_type=barcode.item_type, item_id=barcode.item_id))
+        bump_version(db, "item_barcodes")
+        db.commit()
+    return {"data": {"code": code, "item_type": barcode.item_type, "item_id": barcode.item_id}}
+
+
+@app.delete("/api/barcodes/{code}")
+async def delete_barcode(code: str, db: Session = Depends(get_db)):
+    try:
+        code = normalize_code(code)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not db.query(DBItemBarcode).filter(DBItemBarcode.code == code).delete(synchronize_session=False):
+        raise HTTPException(status_code=404, detail="Barcode not found")
+    bump_version(db, "item_barcodes")
+    db.commit()
+    return {"message": "Barcode deleted"}
+
+
+@app.get("/api/barcodes/scan/{code}")
+async def scan_barcode(code: str, branch_id: Optional[str] = None, db: Session = Depends(get_db)):
+    """Stock row and available quantity of a scanned item at ``branch_id`` (main if omitted)."""
+    try:
+        item = scan_code(db, code, branch_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if item is None:
+        raise HTTPException(status_code=404, detail="Unknown barcode")
+    return {"data": item}
+
+
+@app.get("/api/stock/thresholds")
+async def get_stock_thresholds(branch_id: Optional[str] = None, db: Session = Depends(get_db)):
+    result = []
+    for item_type, model in STOCK_MODELS.items():
+        q = (
+            db.query(DBStockThreshold, model.name, model.quantity, model.branch_id)
+            .join(model, model.id == DBStockThreshold.item_id)
+            .filter(DBStockThreshold.item_type == item_type)
+        )
+        if branch_id:
+            q = q.filter(model.branch_id == branch_id)
+        else:
+            q = q.filter(model.branch_id.is_(None))
+        for t, name, quantity, row_branch in q.order_by(model.name):
+            result.append(
+                {
+                    "item_type": item_type,
+                    "item_id": t.item_id,
+                    "name": name,
+                    "branch_id": row_branch,
+                    "quantity": quantity,
+                    "min_qty": t.min_qty,
+                    "max_qty": t.max_qty,
+                    "alert_state": t.alert_state,
+                }
+            )
+    return {"data": result}
+
+
+@app.put("/api/stock/thresholds")
+async def set_stock_thresholds(batch: BatchStockThresholdSet, db: Session = Depends(get_db)):
+    """Upsert min/max levels; each row is evaluated against its current stock."""
+    try:
+        keys = [(t.item_type, t.item_id) for t in batch.thresholds]
+        existing = {
+            (t.item_type, t.item_id): t
+            for t in db.query(DBStockThreshold).filter(
+                tuple_(DBStockThreshold.item_type, DBStockThreshold.item_id).in_(keys)
+            )
+        } if keys else {}
+        for t in batch.thresholds:
+            row = existing.get((t.item_type, t.item_id))
+            if row is None:
+                row = DBStockThreshold(item_type=t.item_type, item_id=t.item_id, alert_state="ok")
+                db.add(row)
+            row.min_qty = t.min_qty
+            row.max_qty = t.max_qty
+            note_stock_change(db, t.item_type, t.item_id)
+        db.commit()
+        return {"message": "Thresholds saved"}
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.post("/api/stock/reconcile")
+def reconcile_stock(payload: dict):
+    """Compare quantity columns with movement history; ``fix`` writes adjustments."""
+    try:
+        branch_ids = payload.get("branch_ids")
+        if branch_ids is not None:
+            branch_ids = [parse_branch(b) for b in branch_ids]
+        return {"data": reconcile(branch_ids, fix=bool(payload.get("fix")))}
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
 # Report endpoints
 @app.post("/api/reports/generate")
 async def generate_report(request: ReportRequest, db: Session = Depends(get_db)):
@@ -1278,32 +1992,15 @@ async def generate_report(request: ReportRequest, db: Session = Depends(get_db))
         report_data = []
 
         if request.type == "stock":
-            if request.branch_id:
-                medicines = db.query(DBMedicine).filter(DBMedicine.branch_id == request.branch_id).all()
-                devices = db.query(DBMedicalDevice).filter(DBMedicalDevice.branch_id == request.branch_id).all()
-            else:
-                medicines = db.query(DBMedicine).filter(DBMedicine.branch_id.is_(None)).all()
-                devices = db.query(DBMedicalDevice).filter(DBMedicalDevice.branch_id.is_(None)).all()
-
-            for med in medicines:
-                report_data.append({
-                    "id": med.id,
-                    "name": med.name,
-                    "type": "medicine",
-                    "quantity": med.quantity,
-                    "purchase_price": med.purchase_price,
-                    "sell_price": med.sell_price
-                })
-
-            for dev in devices:
-                report_data.append({
-                    "id": dev.id,
-                    "name": dev.name,
-                    "type": "medical_device",
-                    "quantity": dev.quantity,
-                    "purchase_price": dev.purchase_price,
-                    "sell_price": dev.sell_price
-                })
+            where = "branch_id = :b" if request.branch_id else "branch_id IS NULL"
+            rows = db.execute(
+                text(
+                    "SELECT item_id AS id, name, item_type AS type, quantity, purchase_price, sell_price "
+                    f"FROM stock_items WHERE {where} ORDER BY type DESC, name"
+                ),
+                {"b": request.branch_id},
+            ).mappings()
+            report_data.extend(dict(r) for r in rows)
 
         elif request.type == "dispensing":
             query = db.query(DBDispensingRecord)
@@ -1404,7 +2101,7 @@ async def get_dispensing_report(
     branch_id: str,
     date_from: str,
     date_to: str,
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
 ):
     try:
         start = datetime.fromisoformat(date_from).replace(
@@ -1455,7 +2152,7 @@ async def get_incoming_report(
     branch_id: str,
     date_from: str,
     date_to: str,
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
 ):
     try:
         start = datetime.fromisoformat(date_from).replace(
@@ -1505,7 +2202,7 @@ async def export_dispensing_report(
     branch_id: str,
     date_from: str,
     date_to: str,
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
 ):
     if Workbook is None:
         raise HTTPException(status_code=500, detail="openpyxl not installed")
@@ -1549,7 +2246,7 @@ async def export_incoming_report(
     branch_id: str,
     date_from: str,
     date_to: str,
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
 ):
     if Workbook is None:
         raise HTTPException(status_code=500, detail="openpyxl not installed")
@@ -1582,28 +2279,26 @@ async def export_incoming_report(
     )
 
 
-@app.get("/api/reports/dispensings")
-async def get_dispensings_report(
-    request: Request,
-    date_from: str,
-    date_to: str,
-    branch_id: str | None = Query(None),
-    export: str | None = Query(None),
-    format: str | None = Query(None),
-    db: Session = Depends(get_db),
-):
-    start = datetime.fromisoformat(date_from).replace(
-        hour=0, minute=0, second=0, microsecond=0
-    )
-    end = datetime.fromisoformat(date_to).replace(
-        hour=23, minute=59, second=59, microsecond=999999
-    )
+def refresh_item_names(db: Session, name_map: dict) -> None:
+    """Replace recorded names in ``{(item_type, item_id): name}`` with current ones."""
+    for item_type, model in STOCK_MODELS.items():
+        ids = [iid for (t, iid) in name_map if t == item_type]
+        if ids:
+            for row in db.query(model.id, model.name).filter(model.id.in_(ids)):
+                name_map[(item_type, row.id)] = row.name
 
+
+def build_dispensings_json(
+    db: Session, branch_id: str | None, start: datetime | None, end: datetime | None
+) -> dict:
     q = db.query(DBDispensingRecord).options(joinedload(DBDispensingRecord.items))
-    q = q.filter(DBDispensingRecord.date >= start, DBDispensingRecord.date <= end)
+    if start:
+        q = q.filter(DBDispensingRecord.date >= start)
+    if end:
+        q = q.filter(DBDispensingRecord.date <= end)
     if branch_id:
         q = q.filter(DBDispensingRecord.branch_id == branch_id)
-    records = q.all()
+    records = archived_dispensings(db, branch_id, start, end) + q.all()
 
     patient_ids = {r.patient_id for r in records}
     employee_ids = {r.employee_id for r in records}
@@ -1618,16 +2313,7 @@ async def get_dispensings_report(
         for e in db.query(DBEmployee).filter(DBEmployee.id.in_(employee_ids)).all()
     } if employee_ids else {}
 
-    med_ids = [iid for (t, iid) in name_map if t == "medicine"]
-    if med_ids:
-        for m in db.query(DBMedicine.id, DBMedicine.name).filter(DBMedicine.id.in_(med_ids)):
-            name_map[("medicine", m.id)] = m.name
-    dev_ids = [iid for (t, iid) in name_map if t == "medical_device"]
-    if dev_ids:
-        for d in db.query(DBMedicalDevice.id, DBMedicalDevice.name).filter(
-            DBMedicalDevice.id.in_(dev_ids)
-        ):
-            name_map[("medical_device", d.id)] = d.name
+    refresh_item_names(db, name_map)
 
     json_rows = []
     for r in records:
@@ -1652,7 +2338,27 @@ async def get_dispensings_report(
             }
         )
 
-    result = {"data": json_rows}
+    return {"data": json_rows}
+
+
+@app.get("/api/reports/dispensings")
+async def get_dispensings_report(
+    request: Request,
+    date_from: str,
+    date_to: str,
+    branch_id: str | None = Query(None),
+    export: str | None = Query(None),
+    format: str | None = Query(None),
+    db: Session = Depends(get_read_db),
+):
+    result = cached_report(
+        db,
+        "dispensings",
+        branch_id,
+        datetime.fromisoformat(date_from).date(),
+        datetime.fromisoformat(date_to).date(),
+        lambda s, e: build_dispensings_json(db, branch_id, *_day_range(s, e)),
+    )
 
     if _wants_excel(export, format):
         rows = []
@@ -1696,34 +2402,31 @@ async def get_dispensings_report(
 async def build_arrivals_json_payload(
     *, branch_id: str | None, date_from: str, date_to: str, db: Session
 ) -> dict:
-    start = datetime.fromisoformat(date_from).replace(
-        hour=0, minute=0, second=0, microsecond=0
-    )
-    end = datetime.fromisoformat(date_to).replace(
-        hour=23, minute=59, second=59, microsecond=999999
+    return cached_report(
+        db,
+        "arrivals",
+        branch_id,
+        datetime.fromisoformat(date_from).date(),
+        datetime.fromisoformat(date_to).date(),
+        lambda s, e: _build_arrivals_json(db, branch_id, *_day_range(s, e)),
     )
 
-    col = pick_arrival_branch_col(DBArrival)
+
+def _build_arrivals_json(
+    db: Session, branch_id: str | None, start: datetime | None, end: datetime | None
+) -> dict:
     q = db.query(DBArrival)
-    q = q.filter(DBArrival.date >= start, DBArrival.date <= end)
+    if start:
+        q = q.filter(DBArrival.date >= start)
+    if end:
+        q = q.filter(DBArrival.date <= end)
     if branch_id:
-        q = q.filter(col == branch_id)
-    rows = q.all()
+        q = q.filter(pick_arrival_branch_col(DBArrival) == branch_id)
+    rows = archived_arrivals(db, start, end) + q.all()
 
     name_map = {(r.item_type, r.item_id): r.item_name for r in rows}
 
-    med_ids = [iid for (t, iid) in name_map if t == "medicine"]
-    if med_ids:
-        for m in db.query(DBMedicine.id, DBMedicine.name).filter(
-            DBMedicine.id.in_(med_ids)
-        ):
-            name_map[("medicine", m.id)] = m.name
-    dev_ids = [iid for (t, iid) in name_map if t == "medical_device"]
-    if dev_ids:
-        for d in db.query(DBMedicalDevice.id, DBMedicalDevice.name).filter(
-            DBMedicalDevice.id.in_(dev_ids)
-        ):
-            name_map[("medical_device", d.id)] = d.name
+    refresh_item_names(db, name_map)
 
     json_rows: list[dict] = []
     for r in rows:
@@ -1743,7 +2446,7 @@ async def get_arrivals_report(
     branch_id: str | None = Query(None),
     export: str | None = Query(None),
     format: str | None = Query(None),
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
 ):
     result = await build_arrivals_json_payload(
         branch_id=branch_id, date_from=date_from, date_to=date_to, db=db
@@ -1860,6 +2563,16 @@ def _parse_ymd(s: str | None, end_of_day: bool = False) -> datetime | None:
     return datetime(d.year, d.month, d.day, tzinfo=timezone.utc)
 
 
+def _day_range(
+    start: date | None, end: date | None, tz: timezone | None = None
+) -> tuple[datetime | None, datetime | None]:
+    """Inclusive datetime bounds for an inclusive day range."""
+    return (
+        datetime.combine(start, time.min, tzinfo=tz) if start else None,
+        datetime.combine(end, time.max, tzinfo=tz) if end else None,
+    )
+
+
 def _wants_excel(export: str | None, format_: str | None) -> bool:
     e, f = (export or "").lower(), (format_ or "").lower()
     return e in {"excel", "xlsx"} or f in {"excel", "xlsx"}
@@ -1913,21 +2626,12 @@ def pick_arrival_branch_col(Arrival):
 def build_wh_stock_json(
     db, branch_id: str, date_from: str | None, date_to: str | None
 ) -> dict:
-    sql_current = """
-        SELECT 'medicine' AS item_type, m.id AS item_id, m.name AS name,
-               COALESCE(c.name, '—') AS category, m.quantity AS quantity
-        FROM medicines m
-        LEFT JOIN categories c ON c.id = m.category_id
-        WHERE m.branch_id = :b AND m.quantity > 0
-        UNION ALL
-        SELECT 'medical_device' AS item_type, d.id AS item_id, d.name AS name,
-               COALESCE(c.name, '—') AS category, d.quantity AS quantity
-        FROM medical_devices d
-        LEFT JOIN categories c ON c.id = d.category_id
-        WHERE d.branch_id = :b AND d.quantity > 0
-        ORDER BY item_type, name
-    """
+    """On-hand stock of a branch, or its closing balances at ``date_to``.
 
+    Closing balances come from the movement ledger (arrivals, accepted
+    shipments, transfers, dispensings and adjustments); they are not
+    additive per day, so only wholly closed ranges are cached.
+    """
     start = None
     end = None
     if date_from and date_to:
@@ -1935,69 +2639,31 @@ def build_wh_stock_json(
         end = datetime.fromisoformat(date_to)
 
     if not (start and end):
+        sql_current = """
+            SELECT s.item_type, s.item_id, s.name,
+                   COALESCE(c.name, '—') AS category, s.quantity
+            FROM stock_items s
+            LEFT JOIN categories c ON c.id = s.category_id
+            WHERE s.branch_id = :b AND s.quantity > 0
+            ORDER BY s.item_type, s.name
+        """
         rows = db.execute(text(sql_current), {"b": branch_id}).mappings().all()
         return {"data": rows}
 
-    arrival_branch_col = pick_col(DBArrival, "to_branch_id", "branch_id", "branch")
-    if not arrival_branch_col:
-        rows = db.execute(text(sql_current), {"b": branch_id}).mappings().all()
-        return {"data": rows}
-
-    sql_dated = f"""
-        WITH start_in AS (
-            SELECT item_type, item_id, COALESCE(SUM(quantity),0) AS qty
-            FROM arrivals
-            WHERE {arrival_branch_col} = :b AND date < :start
-            GROUP BY item_type, item_id
-        ),
-        start_out AS (
-            SELECT di.item_type, di.item_id, COALESCE(SUM(di.quantity),0) AS qty
-            FROM dispensing_items di
-            JOIN dispensing_records dr ON dr.id = di.record_id
-            WHERE dr.branch_id = :b AND dr.date < :start
-            GROUP BY di.item_type, di.item_id
-        ),
-        pin AS (
-            SELECT item_type, item_id, COALESCE(SUM(quantity),0) AS qty
-            FROM arrivals
-            WHERE {arrival_branch_col} = :b AND date >= :start AND date <= :end
-            GROUP BY item_type, item_id
-        ),
-        pout AS (
-            SELECT di.item_type, di.item_id, COALESCE(SUM(di.quantity),0) AS qty
-            FROM dispensing_items di
-            JOIN dispensing_records dr ON dr.id = di.record_id
-            WHERE dr.branch_id = :b AND dr.date >= :start AND dr.date <= :end
-            GROUP BY di.item_type, di.item_id
-        ),
-        base AS (
-            SELECT item_type, item_id, COALESCE(SUM(qty),0) AS quantity
-            FROM (
-                SELECT item_type, item_id, qty FROM start_in
-                UNION ALL
-                SELECT item_type, item_id, -qty FROM start_out
-                UNION ALL
-                SELECT item_type, item_id, qty FROM pin
-                UNION ALL
-                SELECT item_type, item_id, -qty FROM pout
-            ) s
-            GROUP BY item_type, item_id
-        )
-        SELECT b.item_type, b.item_id, b.quantity,
-               COALESCE(m.name, d.name) AS name,
-               COALESCE(mc.name, dc.name, '—') AS category
-        FROM base b
-        LEFT JOIN medicines m ON (b.item_type = 'medicine' AND m.id = b.item_id)
-        LEFT JOIN categories mc ON mc.id = m.category_id
-        LEFT JOIN medical_devices d ON (b.item_type = 'medical_device' AND d.id = b.item_id)
-        LEFT JOIN categories dc ON dc.id = d.category_id
-        WHERE b.quantity > 0
-        ORDER BY b.item_type, name
-    """
-    rows = db.execute(
-        text(sql_dated), {"b": branch_id, "start": start, "end": end}
-    ).mappings().all()
-    return {"data": rows}
+    def build_closing_balances(*_):
+        return {"data": balances_as_of(db, branch_id, end)}
+
+    if start.time() != time.min or end.time() != time.min:
+        return build_closing_balances()
+    return cached_report(
+        db,
+        "stock",
+        branch_id,
+        start.date(),
+        end.date(),
+        build_closing_balances,
+        mergeable=False,
+    )
 
 
 def build_wh_arrivals_json(
@@ -2018,7 +2684,7 @@ def build_wh_arrivals_json(
     if hasattr(DBArrival, "items"):
         q = q.options(joinedload(DBArrival.items))
 
-    rows = q.order_by(date_col.asc()).all()
+    rows = archived_arrivals(db, start, end) + q.order_by(date_col.asc()).all()
 
     json_rows: list[dict] = []
     for r in rows:
@@ -2048,6 +2714,26 @@ def build_wh_arrivals_json(
 
 def build_wh_dispatches_json(
     db, start: datetime | None, end: datetime | None
+) -> dict:
+    day_aligned = (start is None or start.timetz().replace(tzinfo=None) == time.min) and (
+        end is None or end.timetz().replace(tzinfo=None) == time.max
+    )
+    if not day_aligned:
+        return _build_wh_dispatches_json(db, start, end)
+
+    tz = (start or end).tzinfo if (start or end) else None
+    return cached_report(
+        db,
+        "dispatches",
+        None,
+        start.date() if start else None,
+        end.date() if end else None,
+        lambda s, e: _build_wh_dispatches_json(db, *_day_range(s, e, tz)),
+    )
+
+
+def _build_wh_dispatches_json(
+    db, start: datetime | None, end: datetime | None
 ) -> dict:
     q = db.query(DBShipment)
 
@@ -2085,7 +2771,7 @@ def admin_warehouse_stock(
     date_to: str | None = Query(None),
     export: str | None = Query(None),
     format: str | None = Query(None),
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
 ):
     """
     Warehouse stock report (no branches involved):
@@ -2123,22 +2809,14 @@ def admin_warehouse_stock(
             name = None
             category = None
 
-            if item_type == "medicine":
-                m = db.get(DBMedicine, item_id)
-                if m:
-                    name = getattr(m, "name", None)
-                    cat_id = getattr(m, "category_id", None)
-                    if cat_id:
-                        cat = db.get(DBCategory, cat_id)
-                        category = getattr(cat, "name", None)
-            elif item_type == "medical_device":
-                md = db.get(DBMedicalDevice, item_id)
-                if md:
-                    name = getattr(md, "name", None)
-                    cat_id = getattr(md, "category_id", None)
-                    if cat_id:
-                        cat = db.get(DBCategory, cat_id)
-                        category = getattr(cat, "name", None)
+            model = STOCK_MODELS.get(item_type)
+            row = db.get(model, item_id) if model else None
+            if row:
+                name = getattr(row, "name", None)
+                cat_id = getattr(row, "category_id", None)
+                if cat_id:
+                    cat = db.get(DBCategory, cat_id)
+                    category = getattr(cat, "name", None)
 
             result.append(
                 {
@@ -2185,7 +2863,7 @@ def admin_wh_arrivals(
     try:
         start = _parse_ymd(date_from)
         end = _parse_ymd(date_to, end_of_day=True)
-        with SessionLocal() as db:
+        with read_session() as db:
             payload = build_wh_arrivals_json(db, start, end)
             if _wants_excel(export, format):
                 rows: list[list[str]] = []
@@ -2221,7 +2899,7 @@ def admin_wh_dispatches(
     try:
         start = _parse_ymd(date_from)
         end = _parse_ymd(date_to, end_of_day=True)
-        with SessionLocal() as db:
+        with read_session() as db:
             payload = build_wh_dispatches_json(db, start, end)
             if _wants_excel(export, format):
                 rows: list[list[str]] = []
@@ -2255,110 +2933,8 @@ def get_stock_report(
     date_from: str | None = None,
     date_to: str | None = None,
 ):
-    # parse dates if provided
-    start = None
-    end = None
-    if date_from and date_to:
-        from datetime import datetime
-
-        start = datetime.fromisoformat(date_from)
-        end = datetime.fromisoformat(date_to)
-
-    with SessionLocal() as db:
-        # === PATH A: no date range => current on-hand ===
-        if not (start and end):
-            sql = """
-                SELECT 'medicine' AS item_type, m.id AS item_id, m.name AS name,
-                       COALESCE(c.name, '—') AS category, m.quantity AS quantity
-                FROM medicines m
-                LEFT JOIN categories c ON c.id = m.category_id
-                WHERE m.branch_id = :b AND m.quantity > 0
-                UNION ALL
-                SELECT 'medical_device' AS item_type, d.id AS item_id, d.name AS name,
-                       COALESCE(c.name, '—') AS category, d.quantity AS quantity
-                FROM medical_devices d
-                LEFT JOIN categories c ON c.id = d.category_id
-                WHERE d.branch_id = :b AND d.quantity > 0
-                ORDER BY item_type, name
-            """
-            rows = db.execute(text(sql), {"b": branch_id}).mappings().all()
-            return {"data": rows}
-
-        # === PATH B: date range present => closing balance as of `end` ===
-        arrival_branch_col = pick_col(DBArrival, "to_branch_id", "branch_id", "branch")
-        if not arrival_branch_col:
-            sql_fallback = """
-                SELECT 'medicine' AS item_type, m.id AS item_id, m.name AS name,
-                       COALESCE(c.name, '—') AS category, m.quantity AS quantity
-                FROM medicines m
-                LEFT JOIN categories c ON c.id = m.category_id
-                WHERE m.branch_id = :b AND m.quantity > 0
-                UNION ALL
-                SELECT 'medical_device' AS item_type, d.id AS item_id, d.name AS name,
-                       COALESCE(c.name, '—') AS category, d.quantity AS quantity
-                FROM medical_devices d
-                LEFT JOIN categories c ON c.id = d.category_id
-                WHERE d.branch_id = :b AND d.quantity > 0
-                ORDER BY item_type, name
-            """
-            rows = db.execute(text(sql_fallback), {"b": branch_id}).mappings().all()
-            return {"data": rows}
-
-        sql_dated = f"""
-            WITH start_in AS (
-                SELECT item_type, item_id, COALESCE(SUM(quantity),0) AS qty
-                FROM arrivals
-                WHERE {arrival_branch_col} = :b AND date < :start
-                GROUP BY item_type, item_id
-            ),
-            start_out AS (
-                SELECT di.item_type, di.item_id, COALESCE(SUM(di.quantity),0) AS qty
-                FROM dispensing_items di
-                JOIN dispensing_records dr ON dr.id = di.record_id
-                WHERE dr.branch_id = :b AND dr.date < :start
-                GROUP BY di.item_type, di.item_id
-            ),
-            pin AS (
-                SELECT item_type, item_id, COALESCE(SUM(quantity),0) AS qty
-                FROM arrivals
-                WHERE {arrival_branch_col} = :b AND date >= :start AND date <= :end
-                GROUP BY item_type, item_id
-            ),
-            pout AS (
-                SELECT di.item_type, di.item_id, COALESCE(SUM(di.quantity),0) AS qty
-                FROM dispensing_items di
-                JOIN dispensing_records dr ON dr.id = di.record_id
-                WHERE dr.branch_id = :b AND dr.date >= :start AND dr.date <= :end
-                GROUP BY di.item_type, di.item_id
-            ),
-            base AS (
-                SELECT item_type, item_id, COALESCE(SUM(qty),0) AS quantity
-                FROM (
-                    SELECT item_type, item_id, qty FROM start_in
-                    UNION ALL
-                    SELECT item_type, item_id, -qty FROM start_out
-                    UNION ALL
-                    SELECT item_type, item_id, qty FROM pin
-                    UNION ALL
-                    SELECT item_type, item_id, -qty FROM pout
-                ) s
-                GROUP BY item_type, item_id
-            )
-            SELECT b.item_type, b.item_id, b.quantity,
-                   COALESCE(m.name, d.name) AS name,
-                   COALESCE(mc.name, dc.name, '—') AS category
-            FROM base b
-            LEFT JOIN medicines m ON (b.item_type = 'medicine' AND m.id = b.item_id)
-            LEFT JOIN categories mc ON mc.id = m.category_id
-            LEFT JOIN medical_devices d ON (b.item_type = 'medical_device' AND d.id = b.item_id)
-            LEFT JOIN categories dc ON dc.id = d.category_id
-            WHERE b.quantity > 0
-            ORDER BY b.item_type, name
-        """
-        rows = db.execute(
-            text(sql_dated), {"b": branch_id, "start": start, "end": end}
-        ).mappings().all()
-        return {"data": rows}
+    with read_session() as db:
+        return build_wh_stock_json(db, branch_id, date_from, date_to)
 
 
 @app.get("/api/reports/stock/export")
@@ -2401,6 +2977,193 @@ def export_stock_xlsx(
     )
 
 
+@app.get("/api/reports/expiring")
+def get_expiring_report(
+    days: int = Query(30, ge=0, le=3650),
+    branch_id: str | None = Query(None),
+    limit: int = Query(500, ge=1, le=5000),
+    db: Session = Depends(get_read_db),
+):
+    """Open lots expiring within ``days``, soonest first (all locations by default)."""
+    until = datetime.utcnow().date() + timedelta(days=days)
+    return {"data": expiring_lots(db, until, branch_id, limit)}
+
+
+@app.get("/api/reports/forecast")
+def get_forecast_report(
+    branch_id: str,
+    history_days: int = Query(91, ge=7, le=730),
+    horizon_days: int = Query(90, ge=1, le=365),
+    export: str | None = Query(None),
+    format: str | None = Query(None),
+    db: Session = Depends(get_read_db),
+):
+    """Days of cover and expected stock-out date per item of a branch."""
+    if numpy_module is None:
+        raise HTTPException(status_code=500, detail="numpy not installed")
+    rows = branch_forecast(db, branch_id, history_days, horizon_days)
+
+    if _wants_excel(export, format):
+        content = _render_xlsx(
+            [
+                "Наименование",
+                "Остаток",
+                "Расход/день (7 дн.)",
+                "Расход/день (28 дн.)",
+                "Прогноз расхода/день",
+                "Дней запаса",
+                "Дата окончания",
+            ],
+            [
+                [
+                    r["name"],
+                    r["quantity"],
+                    r["avg_7d"],
+                    r["avg_28d"],
+                    r["daily_forecast"],
+                    r["days_of_cover"] if r["days_of_cover"] is not None else "—",
+                    r["stockout_date"] or "—",
+                ]
+                for r in rows
+            ],
+            "Прогноз",
+        )
+        return Response(
+            content,
+            media_type=XLSX_MEDIA_TYPE,
+            headers=_ascii_headers(f"forecast_{datetime.utcnow().date()}.xlsx"),
+        )
+
+    return {"data": rows}
+
+
+def _items_human(items) -> str:
+    return "; ".join(
+        f"{i.get('name', '')} — {i.get('quantity', '')}" for i in items or []
+    )
+
+
+@register_export("dispensings")
+def _export_dispensings(db: Session, params: dict) -> ExportData:
+    branch_id = params.get("branch_id")
+    date_from, date_to = params["date_from"], params["date_to"]
+    payload = cached_report(
+        db,
+        "dispensings",
+        branch_id,
+        datetime.fromisoformat(date_from).date(),
+        datetime.fromisoformat(date_to).date(),
+        lambda s, e: build_dispensings_json(db, branch_id, *_day_range(s, e)),
+    )
+    rows = [
+        [
+            r.get("patient_name", ""),
+            r.get("employee_name", ""),
+            _to_almaty_str(r.get("datetime", "")),
+            _items_human(r.get("items")),
+        ]
+        for r in payload.get("data", [])
+    ]
+    return ExportData(
+        ["Пациент", "Сотрудник", "Дата и время", "Выдано (наименование — кол-во)"],
+        rows,
+        "Выдачи",
+        f"dispensings_report_{date_to}.xlsx",
+    )
+
+
+@register_export("arrivals")
+def _export_wh_arrivals(db: Session, params: dict) -> ExportData:
+    date_to = params.get("date_to")
+    payload = build_wh_arrivals_json(
+        db, _parse_ymd(params.get("date_from")), _parse_ymd(date_to, end_of_day=True)
+    )
+    rows = [
+        [_to_almaty_str(r.get("datetime", "")), _items_human(r.get("items"))]
+        for r in payload.get("data", [])
+    ]
+    return ExportData(
+        ["Дата и время", "Поступило (наименование — кол-во)"],
+        rows,
+        "Поступления",
+        f"warehouse_arrivals_{date_to or 'all'}.xlsx",
+    )
+
+
+@register_export("dispatches")
+def _export_wh_dispatches(db: Session, params: dict) -> ExportData:
+    date_to = params.get("date_to")
+    payload = build_wh_dispatches_json(
+        db, _parse_ymd(params.get("date_from")), _parse_ymd(date_to, end_of_day=True)
+    )
+    rows = [
+        [_to_almaty_str(r.get("datetime", "")), _items_human(r.get("items"))]
+        for r in payload.get("data", [])
+    ]
+    return ExportData(
+        ["Дата и время", "Отправлено (наименование — кол-во)"],
+        rows,
+        "Отправки",
+        f"warehouse_dispatches_{date_to or 'all'}.xlsx",
+    )
+
+
+@register_export("stock")
+def _export_stock(db: Session, params: dict) -> ExportData:
+    payload = get_stock_report(
+        branch_id=params["branch_id"],
+        date_from=params.get("date_from"),
+        date_to=params.get("date_to"),
+    )
+    rows = [
+        [r["name"], r.get("category", ""), r["quantity"]]
+        for r in payload.get("data", [])
+    ]
+    return ExportData(
+        ["Название", "Категория", "Количество"],
+        rows,
+        "Остатки",
+        f"stock_{params.get('date_to') or 'current'}.xlsx",
+    )
+
+
+@app.post("/api/exports")
+async def create_export(payload: dict, db: Session = Depends(get_db)):
+    """Queue an XLSX export; identical in-flight requests share one job."""
+    kind = payload.get("kind")
+    params = payload.get("params") or {}
+    if not isinstance(params, dict):
+        raise HTTPException(status_code=400, detail="params must be an object")
+    try:
+        job = export_manager.submit(db, kind, params)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"data": job_to_dict(job)}
+
+
+@app.get("/api/exports/{job_id}")
+async def get_export(job_id: str, db: Session = Depends(get_db)):
+    export_manager.reap(db)
+    job = db.get(DBExportJob, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Export not found")
+    return {"data": job_to_dict(job)}
+
+
+@app.get("/api/exports/{job_id}/download")
+async def download_export(job_id: str, db: Session = Depends(get_db)):
+    job = db.get(DBExportJob, job_id)
+    if not job or job.status == "expired":
+        raise HTTPException(status_code=404, detail="Export not found")
+    if job.status != "done" or not job.file_path:
+        raise HTTPException(status_code=409, detail=f"Export is {job.status}")
+    return FileResponse(
+        job.file_path,
+        media_type=XLSX_MEDIA_TYPE,
+        headers=_ascii_headers(job.file_name or f"{job.id}.xlsx"),
+    )
+
+
 @app.get("/api/reports/stock/item_details")
 async def get_stock_item_details(
     branch_id: str,
@@ -2408,7 +3171,9 @@ async def get_stock_item_details(
     item_id: str,
     date_from: Optional[str] = None,
     date_to: Optional[str] = None,
-    db: Session = Depends(get_db),
+    limit: int = Query(200, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    db: Session = Depends(get_read_db),
 ):
     try:
         tz = ZoneInfo("Asia/Almaty")
@@ -2435,44 +3200,20 @@ async def get_stock_item_details(
             start_utc = None
         end_utc = dt_to.astimezone(timezone.utc).replace(tzinfo=None)
 
-        params = {"b": branch_id, "t": type, "i": item_id, "end": end_utc}
-        if start_utc:
-            params["start"] = start_utc
-
-        sql_in = (
-            "SELECT date, quantity FROM arrivals "
-            "WHERE branch_id = :b AND item_type = :t AND item_id = :i AND date <= :end"
-        )
-        if start_utc:
-            sql_in += " AND date >= :start"
-        sql_in += " ORDER BY date"
-        incoming_rows = db.execute(text(sql_in), params).fetchall()
-        incoming = [
-            {"date": r[0].isoformat(), "qty": int(r[1])} for r in incoming_rows
+        # movements follow the item row's own branch; branch_id is kept for old clients
+        page = item_movements(db, type, item_id, start_utc, end_utc, limit, cursor)
+        if page is None:
+            raise HTTPException(status_code=404, detail="Item not found")
+        # legacy two-list shape for the current page
+        page["incoming"] = [
+            {"date": m["date"], "qty": m["qty"]} for m in page["movements"] if m["qty"] > 0
         ]
-
-        sql_out = (
-            "SELECT dr.date, di.quantity FROM dispensing_records dr "
-            "JOIN dispensing_items di ON dr.id = di.record_id "
-            "WHERE dr.branch_id = :b AND di.item_type = :t AND di.item_id = :i AND dr.date <= :end"
-        )
-        if start_utc:
-            sql_out += " AND dr.date >= :start"
-        sql_out += " ORDER BY dr.date"
-        outgoing_rows = db.execute(text(sql_out), params).fetchall()
-        outgoing = [
-            {"date": r[0].isoformat(), "qty": int(r[1])} for r in outgoing_rows
+        page["outgoing"] = [
+            {"date": m["date"], "qty": -m["qty"]} for m in page["movements"] if m["qty"] < 0
         ]
-
-        total_in = sum(r["qty"] for r in incoming)
-        total_out = sum(r["qty"] for r in outgoing)
-
-        return {
-            "incoming": incoming,
-            "outgoing": outgoing,
-            "total_in": total_in,
-            "total_out": total_out,
-        }
+        return page
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
@@ -2488,7 +3229,7 @@ async def get_calendar_dispensing(
     # legacy params
     month: Optional[str] = None,
     patient_id: Optional[str] = None,
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
 ):
     """Calendar dispensing endpoint supporting summary and day listing."""
     try:
@@ -2610,7 +3351,7 @@ async def get_calendar_dispensing_day(
     branch_id: str,
     patient_id: str,
     date: str,
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
 ):
     """Return dispensing details for a specific patient on a given day."""
     try:
@@ -1,7 +1,7 @@
 
 from pydantic import BaseModel, ConfigDict, Field, model_validator, PrivateAttr
 from typing import Optional, List, Literal
-from datetime import datetime
+from datetime import date, datetime
 from uuid import UUID
 
 # User schemas
@@ -71,9 +71,11 @@ class MedicineUpdate(BaseModel):
     sell_price: Optional[float] = None
     quantity: Optional[int] = None
     branch_id: Optional[str] = None
+    version: Optional[int] = None  # alternative to If-Match
 
 class Medicine(MedicineBase):
     id: str
+    version: int = 1
     
     model_config = ConfigDict(from_attributes=True)
 
@@ -119,14 +121,21 @@ class PatientUpdate(BaseModel):
     phone: Optional[str] = None
     address: Optional[str] = None
     branch_id: Optional[str] = None
+    version: Optional[int] = None  # alternative to If-Match
 
 class Patient(PatientBase):
     id: str
+    version: int = 1
     
     model_config = ConfigDict(from_attributes=True)
 
+class PatientMerge(BaseModel):
+    keep_id: str
+    merge_ids: List[str] = Field(..., min_length=1)
+
 # Transfer schemas
 class TransferBase(BaseModel):
+    item_type: Literal["medicine", "medical_device"] = "medicine"
     medicine_id: str
     medicine_name: str
     quantity: int
@@ -168,6 +177,8 @@ class ArrivalBase(BaseModel):
     item_id: str
     item_name: str
     quantity: int
+    expiry_date: Optional[date] = None   # stock with an expiry date is tracked as a lot
+    lot_number: Optional[str] = None
 
 class ArrivalCreate(ArrivalBase):
     pass
@@ -188,6 +199,26 @@ class BatchDispensingCreate(BaseModel):
 class BatchArrivalCreate(BaseModel):
     arrivals: List[ArrivalCreate]
 
+class BarcodeCreate(BaseModel):
+    code: str = Field(..., min_length=1, max_length=64)
+    item_type: Literal["medicine", "medical_device"]
+    item_id: str
+
+class StockThresholdSet(BaseModel):
+    item_type: Literal["medicine", "medical_device"]
+    item_id: str
+    min_qty: int = Field(..., ge=0)
+    max_qty: Optional[int] = Field(None, ge=0)
+
+    @model_validator(mode="after")
+    def _check_range(self):
+        if self.max_qty is not None and self.max_qty < self.min_qty:
+            raise ValueError("max_qty must not be below min_qty")
+        return self
+
+class BatchStockThresholdSet(BaseModel):
+    thresholds: List[StockThresholdSet]
+
 
 # New dispensing payload models supporting legacy and new shapes
 class DispenseLine(BaseModel):
@@ -226,6 +257,9 @@ class DispensePayload(BaseModel):
     patient_name: Optional[str] = None
     employee_name: Optional[str] = None
 
+    # dispense even if the duplicate check blocks (DUPLICATE_DISPENSING_POLICY=block)
+    allow_duplicates: bool = False
+
 
     _normalized_items: List[DispenseLine] = PrivateAttr(default_factory=list)
 
@@ -286,9 +320,11 @@ class MedicalDeviceUpdate(BaseModel):
     sell_price: Optional[float] = None
     quantity: Optional[int] = None
     branch_id: Optional[str] = None
+    version: Optional[int] = None  # alternative to If-Match
 
 class MedicalDevice(MedicalDeviceBase):
     id: str
+    version: int = 1
     
     model_config = ConfigDict(from_attributes=True)
 
@@ -317,6 +353,7 @@ class Shipment(BaseModel):
     created_at: str
     medicines: Optional[List[dict]] = []
     medical_devices: Optional[List[dict]] = []
+    version: int = 1
     
     model_config = ConfigDict(from_attributes=True)
 
@@ -0,0 +1,80 @@
+import uuid
+from collections import defaultdict
+from typing import Optional
+
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+
+from database import STOCK_MODELS, Notification, StockThreshold
+
+_PENDING_KEY = "pending_stock_alerts"
+
+_TITLES = {"low": "Низкий остаток", "out": "Нет в наличии"}
+
+# severity order; only moves to a worse state notify
+_RANK = {"ok": 0, "low": 1, "out": 2}
+
+
+def note_stock_change(db: Session, item_type: str, item_id: str) -> None:
+    """Re-check the threshold of one stock row when ``db`` commits.
+
+    Only rows recorded here are evaluated, so alerting costs one indexed
+    lookup per written line regardless of catalog size.
+    """
+    item_type = getattr(item_type, "value", item_type)
+    if item_type in STOCK_MODELS:
+        db.info.setdefault(_PENDING_KEY, set()).add((item_type, str(item_id)))
+
+
+def next_state(current: str, qty: int, min_qty: int, max_qty: Optional[int]) -> str:
+    """Alert state for ``qty``; recovery needs to clear ``max_qty`` (hysteresis)."""
+    if qty <= 0:
+        return "out"
+    if qty <= min_qty:
+        return "low"
+    if current != "ok" and max_qty is not None and qty < max_qty:
+        # refilled above the minimum but not yet to the target level
+        return "low"
+    return "ok"
+
+
+@event.listens_for(Session, "before_commit")
+def _evaluate_pending_alerts(session: Session) -> None:
+    pending = session.info.pop(_PENDING_KEY, None)
+    if not pending:
+        return
+    session.flush()
+    by_type = defaultdict(list)
+    for item_type, item_id in pending:
+        by_type[item_type].append(item_id)
+
+    for item_type, ids in sorted(by_type.items()):
+        model = STOCK_MODELS[item_type]
+        rows = session.execute(
+            select(StockThreshold, model.name, model.quantity, model.branch_id)
+            .join(model, model.id == StockThreshold.item_id)
+            .where(StockThreshold.item_type == item_type, StockThreshold.item_id.in_(ids))
+        ).all()
+        for threshold, name, qty, branch_id in rows:
+            state = next_state(threshold.alert_state, qty, threshold.min_qty, threshold.max_qty)
+            if state == threshold.alert_state:
+                continue
+            worse = _RANK[state] > _RANK[threshold.alert_state]
+            threshold.alert_state = state
+            # main warehouse rows (branch_id IS NULL) have no notification feed
+            if worse and branch_id:
+                session.add(
+                    Notification(
+                        id=str(uuid.uuid4()),
+                        branch_id=branch_id,
+                        title=_TITLES[state],
+                        message=f"{name}: осталось {qty} (минимум {threshold.min_qty})",
+                        is_read=0,
+                    )
+                )
+    session.flush()
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_pending_alerts(session: Session) -> None:
+    session.info.pop(_PENDING_KEY, None)
@@ -0,0 +1,259 @@
+"""Move closed years of dispensings and arrivals out of the live tables.
+
+Usage: python -m services.archive YEAR [YEAR ...]
+"""
+import gzip
+import json
+import os
+import sys
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+from types import SimpleNamespace
+from typing import Optional
+
+from sqlalchemy import DateTime, delete, func, insert, literal, select
+from sqlalchemy.orm import Session
+
+from database import (
+    ArchivedPeriod,
+    ArchivedTotal,
+    Arrival,
+    DispensingItem,
+    DispensingRecord,
+    SessionLocal,
+)
+from services.partitioning import detach_month, is_partitioned, months_between
+from services.report_cache import invalidate_reports
+
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "archive")
+
+
+def _year_bounds(year: int) -> tuple[datetime, datetime]:
+    return datetime(year, 1, 1), datetime(year + 1, 1, 1)
+
+
+def _closing(year: int) -> datetime:
+    return _year_bounds(year)[1] - timedelta(seconds=1)
+
+
+def _write_gzip_lines(path: str, rows) -> int:
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = f"{path}.tmp"
+    count = 0
+    with gzip.open(tmp, "wt", encoding="utf-8") as fh:
+        for row in rows:
+            fh.write(json.dumps(row, ensure_ascii=False) + "\n")
+            count += 1
+    os.replace(tmp, path)
+    return count
+
+
+def _record_rows(db: Session, start: datetime, end: datetime):
+    records = db.execute(
+        select(DispensingRecord.__table__)
+        .where(DispensingRecord.date >= start, DispensingRecord.date < end)
+        .order_by(DispensingRecord.date, DispensingRecord.id)
+    ).mappings()
+    for chunk in records.partitions(1000):
+        items: dict[str, list] = {}
+        for item in db.execute(
+            select(DispensingItem.__table__).where(
+                DispensingItem.record_id.in_([r["id"] for r in chunk])
+            )
+        ).mappings():
+            items.setdefault(item["record_id"], []).append(
+                {k: item[k] for k in ("id", "item_type", "item_id", "item_name", "quantity")}
+            )
+        for r in chunk:
+            yield {**dict(r), "date": r["date"].isoformat(), "items": items.get(r["id"], [])}
+
+
+def _arrival_rows(db: Session, start: datetime, end: datetime):
+    rows = db.execute(
+        select(Arrival.__table__)
+        .where(Arrival.date >= start, Arrival.date < end)
+        .order_by(Arrival.date, Arrival.id)
+    ).mappings()
+    for r in rows:
+        expiry = r["expiry_date"]
+        yield {
+            **dict(r),
+            "date": r["date"].isoformat(),
+            "expiry_date": expiry.isoformat() if expiry else None,
+        }
+
+
+def _record_totals(db: Session, year: int, start: datetime, end: datetime) -> None:
+    """Per-row net quantities of the year, for ledgers (``ArchivedTotal``)."""
+    columns = ["table_name", "year", "item_type", "item_id", "quantity", "date"]
+    db.execute(
+        insert(ArchivedTotal).from_select(
+            columns,
+            select(
+                literal("dispensing_records"),
+                literal(year),
+                DispensingItem.item_type,
+                DispensingItem.item_id,
+                -func.sum(DispensingItem.quantity),
+                literal(_closing(year), DateTime),
+            )
+            .join(DispensingRecord, DispensingRecord.id == DispensingItem.record_id)
+            .where(DispensingRecord.date >= start, DispensingRecord.date < end)
+            .group_by(DispensingItem.item_type, DispensingItem.item_id),
+        )
+    )
+    db.execute(
+        insert(ArchivedTotal).from_select(
+            columns,
+            select(
+                literal("arrivals"),
+                literal(year),
+                Arrival.item_type,
+                Arrival.item_id,
+                func.sum(Arrival.quantity),
+                literal(_closing(year), DateTime),
+            )
+            .where(Arrival.date >= start, Arrival.date < end)
+            .group_by(Arrival.item_type, Arrival.item_id),
+        )
+    )
+
+
+def archive_year(db: Session, year: int, directory: str = ARCHIVE_DIR) -> dict:
+    """Export ``year`` to gzipped JSON lines and drop it from the live tables.
+
+    Files are written before the rows are removed and registered in
+    ``archived_periods`` in the same transaction as the removal, so a failed
+    run can simply be repeated. Each stock row's net quantity for the year
+    goes to ``archived_totals`` so ledgers keep balancing. On partitioned
+    Postgres tables the monthly partitions are detached and dropped instead
+    of deleting row by row. The caller commits.
+    """
+    if year >= datetime.utcnow().year:
+        raise ValueError(f"{year} is not closed yet")
+    if db.query(ArchivedPeriod).filter(ArchivedPeriod.year == year).first():
+        raise ValueError(f"{year} is already archived")
+    start, end = _year_bounds(year)
+    conn = db.connection()
+
+    counts = {}
+    for table, rows in (
+        ("dispensing_records", _record_rows(db, start, end)),
+        ("arrivals", _arrival_rows(db, start, end)),
+    ):
+        path = os.path.join(directory, f"{table}_{year}.jsonl.gz")
+        counts[table] = _write_gzip_lines(path, rows)
+        db.add(ArchivedPeriod(table_name=table, year=year, path=path, rows=counts[table]))
+    _record_totals(db, year, start, end)
+
+    in_year = select(DispensingRecord.id).where(
+        DispensingRecord.date >= start, DispensingRecord.date < end
+    )
+    db.execute(delete(DispensingItem).where(DispensingItem.record_id.in_(in_year)))
+    for model in (DispensingRecord, Arrival):
+        if is_partitioned(conn, model.__tablename__):
+            for month in months_between(start.date(), date(year, 12, 1)):
+                detach_month(conn, model.__tablename__, month)
+        # on partitioned tables only rows left in the default partition remain
+        db.execute(delete(model).where(model.date >= start, model.date < end))
+
+    invalidate_reports(db, ("dispensings", "arrivals"))
+    return counts
+
+
+@lru_cache(maxsize=8)
+def _load(path: str, mtime: float) -> tuple[dict, ...]:
+    with gzip.open(path, "rt", encoding="utf-8") as fh:
+        rows = [json.loads(line) for line in fh]
+    for row in rows:
+        row["date"] = datetime.fromisoformat(row["date"])
+    return tuple(rows)
+
+
+def _archived_rows(
+    db: Session, table: str, start: Optional[datetime], end: Optional[datetime]
+) -> list[dict]:
+    """Archived rows of ``table`` dated within ``[start, end]`` (inclusive)."""
+    q = db.query(ArchivedPeriod.path).filter(ArchivedPeriod.table_name == table)
+    if start:
+        q = q.filter(ArchivedPeriod.year >= start.year)
+    if end:
+        q = q.filter(ArchivedPeriod.year <= end.year)
+    result = []
+    for (path,) in q.order_by(ArchivedPeriod.year):
+        for row in _load(path, os.path.getmtime(path)):
+            if (start is None or row["date"] >= start) and (end is None or row["date"] <= end):
+                result.append(row)
+    return result
+
+
+def archived_dispensings(
+    db: Session, branch_id: Optional[str], start: Optional[datetime], end: Optional[datetime]
+) -> list[SimpleNamespace]:
+    """Archived records shaped like ``DispensingRecord`` rows with ``items``."""
+    return [
+        SimpleNamespace(**{**r, "items": [SimpleNamespace(**i) for i in r["items"]]})
+        for r in _archived_rows(db, "dispensing_records", start, end)
+        if not branch_id or r["branch_id"] == branch_id
+    ]
+
+
+def archived_arrivals(
+    db: Session, start: Optional[datetime], end: Optional[datetime]
+) -> list[SimpleNamespace]:
+    return [SimpleNamespace(**r) for r in _archived_rows(db, "arrivals", start, end)]
+
+
+def backfill_totals(db: Session) -> int:
+    """Record totals of periods archived before ``archived_totals`` existed.
+
+    Read from the period files; returns the number of periods filled. The
+    caller commits.
+    """
+    done = select(ArchivedTotal.table_name, ArchivedTotal.year).distinct().subquery()
+    periods = db.execute(
+        select(ArchivedPeriod.table_name, ArchivedPeriod.year, ArchivedPeriod.path)
+        .outerjoin(
+            done,
+            (done.c.table_name == ArchivedPeriod.table_name) & (done.c.year == ArchivedPeriod.year),
+        )
+        .where(ArchivedPeriod.rows > 0, done.c.year.is_(None))
+    ).all()
+    for table, year, path in periods:
+        totals: dict[tuple[str, str], int] = {}
+        for row in _load(path, os.path.getmtime(path)):
+            if table == "arrivals":
+                key = (row["item_type"], row["item_id"])
+                totals[key] = totals.get(key, 0) + row["quantity"]
+            else:
+                for item in row["items"]:
+                    key = (item["item_type"], item["item_id"])
+                    totals[key] = totals.get(key, 0) - item["quantity"]
+        if totals:
+            db.execute(
+                insert(ArchivedTotal),
+                [
+                    {
+                        "table_name": table,
+                        "year": year,
+                        "item_type": t,
+                        "item_id": i,
+                        "quantity": q,
+                        "date": _closing(year),
+                    }
+                    for (t, i), q in totals.items()
+                ],
+            )
+    return len(periods)
+
+
+def main(argv: list[str]) -> None:
+    with SessionLocal() as db:
+        for year in map(int, argv):
+            counts = archive_year(db, year)
+            db.commit()
+            print(f"{year}: " + ", ".join(f"{t}={n}" for t, n in counts.items()))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,148 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from services.versions import _scope
+
+CACHE_SIZE = int(os.getenv("SCAN_CACHE_SIZE", "20000"))
+
+# branch stock rows are found by name, as shipments and transfers match them
+SCAN_INDEXES = (
+    "CREATE INDEX IF NOT EXISTS idx_medicines_branch_name ON medicines (branch_id, name)",
+    "CREATE INDEX IF NOT EXISTS idx_medical_devices_branch_name ON medical_devices (branch_id, name)",
+)
+
+GTIN_LENGTHS = (8, 12, 13, 14)
+
+
+def _gtin_check_digit_ok(code: str) -> bool:
+    digits = [int(c) for c in code]
+    body, check = digits[:-1], digits[-1]
+    total = sum(d * (3 if i % 2 == 0 else 1) for i, d in enumerate(reversed(body)))
+    return (10 - total % 10) % 10 == check
+
+
+def normalize_code(raw: str) -> str:
+    """Canonical form of a scanned code; raises ValueError if it is not valid.
+
+    GTIN-8/12/13/14 are checked and zero-padded to 14 digits, so an item
+    scanned as UPC-A or EAN-13 resolves to the same row. Other codes (in-house
+    labels) are kept as scanned, without whitespace.
+    """
+    code = "".join(raw.split())
+    if not code:
+        raise ValueError("Empty barcode")
+    if code.isdigit() and len(code) in GTIN_LENGTHS:
+        if not _gtin_check_digit_ok(code):
+            raise ValueError(f"Invalid GTIN check digit: {code}")
+        return code.zfill(14)
+    return code
+
+
+class ScanCache:
+    """Resolved scans keyed by (code, branch, data versions).
+
+    Writes to barcodes or to a branch's stock rows bump their data versions
+    (``services.versions``), which are part of the key, so outdated entries
+    are never served and simply age out of the LRU.
+    """
+
+    def __init__(self, max_entries: int = CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[tuple, Optional[dict]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: tuple):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return True, self._entries[key]
+            self.misses += 1
+            return False, None
+
+    def put(self, key: tuple, value: Optional[dict]) -> None:
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+cache = ScanCache()
+
+
+def _generation(db: Session, branch_id: Optional[str]) -> tuple:
+    rows = db.execute(
+        text(
+            """
+            SELECT table_name, version FROM data_versions
+            WHERE (table_name = 'item_barcodes' AND scope = '')
+               OR (table_name IN ('medicines', 'medical_devices') AND scope = :s)
+        """
+        ),
+        {"s": _scope(branch_id)},
+    ).all()
+    versions = dict(rows)
+    return tuple(versions.get(t, 0) for t in ("item_barcodes", "medicines", "medical_devices"))
+
+
+def _resolve(db: Session, code: str, branch_id: Optional[str]) -> Optional[dict]:
+    branch = "s.branch_id = :b" if branch_id else "s.branch_id IS NULL"
+    row = db.execute(
+        text(
+            f"""
+            SELECT bc.code, c.item_type, c.name, s.item_id, s.quantity, s.sell_price
+            FROM item_barcodes bc
+            JOIN stock_items c ON c.item_id = bc.item_id
+            LEFT JOIN stock_items s ON s.item_type = c.item_type AND s.name = c.name AND {branch}
+            WHERE bc.code = :code
+            LIMIT 1
+        """
+        ),
+        {"code": code, "b": branch_id},
+    ).first()
+    if row is None:
+        return None
+    return {
+        "code": row.code,
+        "item_type": row.item_type,
+        "item_id": row.item_id,  # None if the branch does not stock it
+        "name": row.name,
+        "quantity": int(row.quantity or 0),
+        "sell_price": row.sell_price,
+    }
+
+
+def scan(db: Session, raw_code: str, branch_id: Optional[str]) -> Optional[dict]:
+    """Branch stock row and available quantity for a scanned code.
+
+    A hit costs one primary-key read of the version counters; a miss adds
+    one indexed join from the code to the branch's row.
+    """
+    code = normalize_code(raw_code)
+    key = (code, _scope(branch_id), _generation(db, branch_id))
+    found, value = cache.get(key)
+    if not found:
+        value = _resolve(db, code, branch_id)
+        cache.put(key, value)
+    return value
@@ -0,0 +1,217 @@
+"""Convert text keys and type columns to native uuid / enum types (Postgres).
+
+Usage: python -m services.compact_types [--measure]
+(--measure only prints table, index and cache-hit figures)
+"""
+import argparse
+import re
+
+from sqlalchemy import Enum, text
+from sqlalchemy.engine import Connection
+
+from database import GUID, Base, create_stock_items_view, engine
+
+_UUID_RE = "^[0-9a-fA-F]{8}-?([0-9a-fA-F]{4}-?){3}[0-9a-fA-F]{12}$"
+
+
+def compact_columns() -> list[tuple[str, str, object]]:
+    """(table, column, type) of every model column declared GUID or Enum."""
+    return [
+        (table.name, column.name, column.type)
+        for table in Base.metadata.sorted_tables
+        for column in table.columns
+        if isinstance(column.type, (GUID, Enum))
+    ]
+
+
+def _target(coltype) -> str:
+    return "uuid" if isinstance(coltype, GUID) else coltype.name
+
+
+def _current_types(conn: Connection) -> dict[tuple[str, str], str]:
+    rows = conn.execute(
+        text(
+            """
+            SELECT table_name, column_name, udt_name FROM information_schema.columns
+            WHERE table_schema = current_schema()
+        """
+        )
+    )
+    return {(r.table_name, r.column_name): r.udt_name for r in rows}
+
+
+def pending_columns(conn: Connection) -> list[tuple[str, str, object]]:
+    current = _current_types(conn)
+    return [
+        (table, column, coltype)
+        for table, column, coltype in compact_columns()
+        if (table, column) in current and current[(table, column)] != _target(coltype)
+    ]
+
+
+def _invalid_values(conn: Connection, pending) -> list[str]:
+    problems = []
+    for table, column, coltype in pending:
+        if isinstance(coltype, GUID):
+            bad = conn.execute(
+                text(f"SELECT count(*) FROM {table} WHERE {column} !~ :re"), {"re": _UUID_RE}
+            ).scalar()
+        else:
+            bad = conn.execute(
+                text(f"SELECT count(*) FROM {table} WHERE NOT ({column} = ANY(:values))"),
+                {"values": list(coltype.enums)},
+            ).scalar()
+        if bad:
+            problems.append(f"{table}.{column}: {bad} rows")
+    return problems
+
+
+def migrate(conn: Connection) -> list[str]:
+    """Alter every pending column in place; returns the converted ``table.column``.
+
+    Foreign keys between the affected tables are dropped for the rewrite and
+    recreated from their saved definitions, column defaults are recast. All
+    values are checked first so a failing run changes nothing. Each ALTER
+    rewrites its table and rebuilds its indexes, holding an exclusive lock.
+    """
+    if conn.dialect.name != "postgresql":
+        return []
+    pending = pending_columns(conn)
+    if not pending:
+        return []
+    problems = _invalid_values(conn, pending)
+    if problems:
+        raise ValueError("Values not convertible: " + "; ".join(problems))
+
+    for coltype in {c[2].name: c[2] for c in pending if isinstance(c[2], Enum)}.values():
+        coltype.create(conn, checkfirst=True)
+
+    tables = sorted({table for table, _, _ in pending})
+    foreign_keys = conn.execute(
+        text(
+            """
+            SELECT conrelid::regclass::text AS tbl, conname, pg_get_constraintdef(oid) AS ddl
+            FROM pg_constraint
+            WHERE contype = 'f'
+              AND (conrelid::regclass::text = ANY(:t) OR confrelid::regclass::text = ANY(:t))
+        """
+        ),
+        {"t": tables},
+    ).all()
+    for fk in foreign_keys:
+        conn.exec_driver_sql(f'ALTER TABLE {fk.tbl} DROP CONSTRAINT "{fk.conname}"')
+    # views pin their columns' types
+    had_view = conn.execute(text("SELECT to_regclass('stock_items')")).scalar()
+    conn.exec_driver_sql("DROP VIEW IF EXISTS stock_items")
+
+    converted = []
+    for table in tables:
+        columns = [(c, t) for tbl, c, t in pending if tbl == table]
+        defaults = {
+            r.column_name: r.column_default
+            for r in conn.execute(
+                text(
+                    "SELECT column_name, column_default FROM information_schema.columns "
+                    "WHERE table_schema = current_schema() AND table_name = :t"
+                ),
+                {"t": table},
+            )
+        }
+        clauses = []
+        for column, coltype in columns:
+            if defaults.get(column):
+                clauses.append(f"ALTER COLUMN {column} DROP DEFAULT")
+            target = _target(coltype)
+            clauses.append(f"ALTER COLUMN {column} TYPE {target} USING {column}::{target}")
+            default = defaults.get(column)
+            if default:
+                literal = re.match(r"^('(?:[^']|'')*')", default)
+                if literal:
+                    clauses.append(f"ALTER COLUMN {column} SET DEFAULT {literal.group(1)}::{target}")
+            converted.append(f"{table}.{column}")
+        # one statement per table so it is rewritten once
+        conn.exec_driver_sql(f"ALTER TABLE {table} " + ", ".join(clauses))
+
+    for fk in foreign_keys:
+        conn.exec_driver_sql(f'ALTER TABLE {fk.tbl} ADD CONSTRAINT "{fk.conname}" {fk.ddl}')
+    if had_view:
+        create_stock_items_view(conn)
+    for table in tables:
+        conn.exec_driver_sql(f"ANALYZE {table}")
+    return converted
+
+
+def relation_sizes(conn: Connection, tables=None) -> dict[str, dict]:
+    """Heap, index and total bytes plus buffer cache hit ratios per table.
+
+    Partitioned tables are summed over their partitions. Hit ratios come
+    from pg_statio counters since the last statistics reset.
+    """
+    if conn.dialect.name != "postgresql":
+        return {}
+    tables = list(tables) if tables else sorted({t for t, _, _ in compact_columns()})
+    result = {}
+    for table in tables:
+        row = conn.execute(
+            text(
+                """
+                SELECT COALESCE(SUM(pg_relation_size(pt.relid)), 0) AS heap,
+                       COALESCE(SUM(pg_indexes_size(pt.relid)), 0) AS indexes,
+                       COALESCE(SUM(pg_total_relation_size(pt.relid)), 0) AS total,
+                       COALESCE(SUM(st.heap_blks_hit), 0) AS heap_hit,
+                       COALESCE(SUM(st.heap_blks_read), 0) AS heap_read,
+                       COALESCE(SUM(st.idx_blks_hit), 0) AS idx_hit,
+                       COALESCE(SUM(st.idx_blks_read), 0) AS idx_read
+                FROM pg_partition_tree(CAST(:t AS regclass)) pt
+                LEFT JOIN pg_statio_user_tables st ON st.relid = pt.relid
+            """
+            ),
+            {"t": table},
+        ).one()
+        result[table] = {
+            "heap_bytes": int(row.heap),
+            "index_bytes": int(row.indexes),
+            "total_bytes": int(row.total),
+            "heap_hit_ratio": _ratio(row.heap_hit, row.heap_read),
+            "index_hit_ratio": _ratio(row.idx_hit, row.idx_read),
+        }
+    return result
+
+
+def _ratio(hit, read):
+    hit, read = int(hit or 0), int(read or 0)
+    return round(hit / (hit + read), 4) if hit + read else None
+
+
+def _print_sizes(title: str, sizes: dict) -> None:
+    print(title)
+    for table, s in sizes.items():
+        print(
+            f"  {table:<20} heap={s['heap_bytes']:>12} idx={s['index_bytes']:>12} "
+            f"total={s['total_bytes']:>12} hit={s['heap_hit_ratio']}/{s['index_hit_ratio']}"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--measure", action="store_true", help="print sizes only")
+    args = parser.parse_args()
+    if engine.dialect.name != "postgresql":
+        print("nothing to do: native uuid/enum columns are Postgres only")
+        return
+    with engine.begin() as conn:
+        before = relation_sizes(conn)
+        _print_sizes("before" if not args.measure else "sizes", before)
+        if args.measure:
+            return
+        converted = migrate(conn)
+    print("converted: " + (", ".join(converted) or "none"))
+    with engine.connect() as conn:
+        after = relation_sizes(conn)
+    _print_sizes("after", after)
+    saved = sum(before[t]["total_bytes"] - after[t]["total_bytes"] for t in after)
+    print(f"saved {saved} bytes")
+
+
+if __name__ == "__main__":
+    main()
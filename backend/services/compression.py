@@ -0,0 +1,287 @@
+import os
+import threading
+import time
+import zlib
+from typing import Callable, Optional
+
+import anyio
+from starlette.datastructures import Headers, MutableHeaders
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+
+MINIMUM_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+GZIP_LEVEL = int(os.getenv("COMPRESSION_GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.getenv("COMPRESSION_BROTLI_QUALITY", "5"))
+ZSTD_LEVEL = int(os.getenv("COMPRESSION_ZSTD_LEVEL", "3"))
+# whole bodies above this size are compressed off the event loop
+THREAD_THRESHOLD = 1024 * 1024
+
+COMPRESSIBLE_TYPES = {
+    "application/json",
+    "application/javascript",
+    "application/xml",
+    "image/svg+xml",
+}
+
+
+def _available_encodings() -> list[str]:
+    """Server preference order, best ratio/speed trade-off first."""
+    names = []
+    if zstandard is not None:
+        names.append("zstd")
+    if brotli is not None:
+        names.append("br")
+    names.append("gzip")
+    return names
+
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    """Pick a content coding from an Accept-Encoding header value."""
+    if not accept_encoding:
+        return None
+    weights: dict[str, float] = {}
+    for part in accept_encoding.split(","):
+        token, _, params = part.strip().partition(";")
+        token = token.strip().lower()
+        if not token:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        weights[token] = q
+    wildcard = weights.get("*", 0.0)
+    best, best_q = None, 0.0
+    for name in _available_encodings():
+        q = weights.get(name, wildcard)
+        if q > best_q:
+            best, best_q = name, q
+    return best
+
+
+def is_compressible(content_type: str) -> bool:
+    media_type = content_type.split(";", 1)[0].strip().lower()
+    return (
+        media_type.startswith("text/")
+        or media_type in COMPRESSIBLE_TYPES
+        or media_type.endswith("+json")
+    )
+
+
+class _Compressor:
+    """Uniform streaming interface over gzip, brotli and zstd."""
+
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == "gzip":
+            obj = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+            self._chunk = lambda data: obj.compress(data) + obj.flush(zlib.Z_SYNC_FLUSH)
+            self._finish = obj.flush
+        elif encoding == "br":
+            obj = brotli.Compressor(quality=BROTLI_QUALITY)
+            self._chunk = lambda data: obj.process(data) + obj.flush()
+            self._finish = obj.finish
+        elif encoding == "zstd":
+            obj = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+            self._chunk = lambda data: obj.compress(data) + obj.flush(
+                zstandard.COMPRESSOBJ_FLUSH_BLOCK
+            )
+            self._finish = obj.flush
+        else:
+            raise ValueError(f"Unsupported encoding: {encoding}")
+
+    def chunk(self, data: bytes) -> bytes:
+        return self._chunk(data)
+
+    def finish(self) -> bytes:
+        return self._finish()
+
+    def whole(self, data: bytes) -> bytes:
+        return self._chunk(data) + self._finish()
+
+
+class CompressionStats:
+    """Process-wide counters used to tune the thresholds and levels."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.responses = 0
+            self.bytes_in = 0
+            self.bytes_out = 0
+            self.cpu_seconds = 0.0
+            self.by_encoding: dict[str, int] = {}
+            self.skipped_small = 0
+            self.skipped_type = 0
+
+    def record(self, encoding: str, bytes_in: int, bytes_out: int, cpu: float) -> None:
+        with self._lock:
+            self.responses += 1
+            self.bytes_in += bytes_in
+            self.bytes_out += bytes_out
+            self.cpu_seconds += cpu
+            self.by_encoding[encoding] = self.by_encoding.get(encoding, 0) + 1
+
+    def skip(self, reason: str) -> None:
+        with self._lock:
+            if reason == "small":
+                self.skipped_small += 1
+            else:
+                self.skipped_type += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "responses": self.responses,
+                "bytes_in": self.bytes_in,
+                "bytes_out": self.bytes_out,
+                "bytes_saved": self.bytes_in - self.bytes_out,
+                "ratio": round(self.bytes_out / self.bytes_in, 4) if self.bytes_in else None,
+                "cpu_seconds": round(self.cpu_seconds, 6),
+                "by_encoding": dict(self.by_encoding),
+                "skipped_small": self.skipped_small,
+                "skipped_type": self.skipped_type,
+                "encodings_available": _available_encodings(),
+            }
+
+
+stats = CompressionStats()
+
+
+def _timed(fn: Callable[..., bytes], *args) -> tuple[bytes, float]:
+    t0 = time.thread_time()
+    out = fn(*args)
+    return out, time.thread_time() - t0
+
+
+class CompressionMiddleware:
+    """Negotiated gzip/br/zstd compression for buffered and streamed responses.
+
+    Responses that are already encoded, not textual (e.g. XLSX downloads),
+    bodiless (204/304) or below ``minimum_size`` are passed through untouched.
+    """
+
+    def __init__(self, app, minimum_size: int = MINIMUM_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = choose_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+        responder = _CompressingResponder(send, encoding, self.minimum_size)
+        await self.app(scope, receive, responder.send)
+
+
+class _CompressingResponder:
+    def __init__(self, send, encoding: str, minimum_size: int):
+        self._send = send
+        self.encoding = encoding
+        self.minimum_size = minimum_size
+        self.start_message = None
+        self.active = False
+        self.started = False
+        self.buffer = b""
+        self.compressor: Optional[_Compressor] = None
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.cpu = 0.0
+
+    def _should_compress(self, message) -> bool:
+        if message["status"] < 200 or message["status"] in (204, 304):
+            return False
+        headers = Headers(raw=message["headers"])
+        if "content-encoding" in headers:
+            return False
+        if not is_compressible(headers.get("content-type", "")):
+            stats.skip("type")
+            return False
+        return True
+
+    async def send(self, message) -> None:
+        if message["type"] == "http.response.start":
+            self.start_message = message
+            self.active = self._should_compress(message)
+            if not self.active:
+                await self._send(message)
+            return
+
+        if message["type"] != "http.response.body" or not self.active:
+            await self._send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+
+        if self.started:
+            await self._stream(body, more_body)
+            return
+
+        self.buffer += body
+        if len(self.buffer) < self.minimum_size:
+            if more_body:
+                return
+            stats.skip("small")
+            self.active = False
+            await self._send(self.start_message)
+            await self._send({"type": "http.response.body", "body": self.buffer})
+            return
+
+        self.started = True
+        self.compressor = _Compressor(self.encoding)
+        headers = MutableHeaders(raw=self.start_message["headers"])
+        headers["Content-Encoding"] = self.encoding
+        headers.add_vary_header("Accept-Encoding")
+        etag = headers.get("etag")
+        if etag and not etag.startswith("W/"):
+            # the encoded body is a different representation than the identity one
+            headers["ETag"] = f"W/{etag}"
+        data, self.buffer = self.buffer, b""
+
+        if not more_body:
+            if len(data) >= THREAD_THRESHOLD:
+                out, cpu = await anyio.to_thread.run_sync(_timed, self.compressor.whole, data)
+            else:
+                out, cpu = _timed(self.compressor.whole, data)
+            headers["Content-Length"] = str(len(out))
+            stats.record(self.encoding, len(data), len(out), cpu)
+            await self._send(self.start_message)
+            await self._send({"type": "http.response.body", "body": out})
+            return
+
+        if "content-length" in headers:
+            del headers["Content-Length"]
+        await self._send(self.start_message)
+        await self._stream(data, True)
+
+    async def _stream(self, data: bytes, more_body: bool) -> None:
+        out, cpu = _timed(self.compressor.chunk, data) if data else (b"", 0.0)
+        if not more_body:
+            tail, tail_cpu = _timed(self.compressor.finish)
+            out += tail
+            cpu += tail_cpu
+        self.bytes_in += len(data)
+        self.bytes_out += len(out)
+        self.cpu += cpu
+        if not more_body:
+            stats.record(self.encoding, self.bytes_in, self.bytes_out, self.cpu)
+        await self._send({"type": "http.response.body", "body": out, "more_body": more_body})
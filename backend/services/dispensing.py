@@ -0,0 +1,233 @@
+import uuid
+from collections import defaultdict
+from datetime import datetime
+from typing import Any
+
+from pydantic import ValidationError
+from sqlalchemy import case, insert, select, update
+from sqlalchemy.orm import Session
+
+from database import (
+    DispensingItem,
+    DispensingRecord,
+    Employee,
+    Patient,
+    STOCK_MODELS,
+)
+from schemas import DispensePayload, DispensingCreate
+from services.alerts import note_stock_change
+from services.duplicates import DuplicateDispensing, check_cart
+from services.lots import allocate_fefo
+from services.outbox import emit_event
+from services.report_cache import note_report_write
+from services.sync import record_change
+from services.versions import bump_version
+
+
+def parse_entry(raw: Any) -> DispensePayload:
+    """Accept the legacy one-medicine ``DispensingCreate`` shape or ``DispensePayload``."""
+    if isinstance(raw, dict) and "medicine_id" in raw:
+        legacy = DispensingCreate.model_validate(raw)
+        return DispensePayload(
+            patient_id=legacy.patient_id,
+            employee_id=legacy.employee_id,
+            branch_id=legacy.branch_id,
+            patient_name=legacy.patient_name,
+            employee_name=legacy.employee_name,
+            medicines=[{"id": legacy.medicine_id, "quantity": legacy.quantity}],
+        )
+    return DispensePayload.model_validate(raw)
+
+
+def _error(index: int, detail: Any) -> dict:
+    return {"index": index, "status": "error", "detail": detail}
+
+
+def dispense_batch(db: Session, entries: list) -> list[dict]:
+    """Dispense many records in one transaction with partial-failure results.
+
+    Stock rows of the whole batch are read (and locked) with one query per
+    item table and checked in memory in submission order, so an entry that
+    does not fit fails alone. Each entry's cart goes through the duplicate
+    check with one probe, counting entries accepted before it for the same
+    patient. Accepted records and items are bulk-inserted
+    and each item table is decremented by a single UPDATE. The caller
+    commits.
+    """
+    results: list = [None] * len(entries)
+    parsed: list[tuple[int, DispensePayload]] = []
+    for index, raw in enumerate(entries):
+        try:
+            body = parse_entry(raw)
+        except ValidationError as e:
+            results[index] = _error(index, e.errors(include_url=False))
+            continue
+        if not body._normalized_items:
+            results[index] = _error(index, "No items to dispense")
+            continue
+        parsed.append((index, body))
+
+    patients = {
+        p.id: p
+        for p in db.query(Patient).filter(Patient.id.in_({b.patient_id for _, b in parsed}))
+    }
+    employees = {
+        e.id: e
+        for e in db.query(Employee).filter(Employee.id.in_({b.employee_id for _, b in parsed}))
+    }
+
+    stock: dict[tuple[str, str], dict] = {}
+    wanted = defaultdict(set)
+    for _, body in parsed:
+        for line in body._normalized_items:
+            wanted[line.item_type].add(line.item_id)
+    for item_type, ids in wanted.items():
+        model = STOCK_MODELS[item_type]
+        rows = db.execute(
+            select(model.id, model.branch_id, model.name, model.quantity)
+            .where(model.id.in_(ids))
+            .with_for_update()
+        )
+        for row in rows:
+            stock[(item_type, row.id)] = {
+                "branch_id": row.branch_id,
+                "name": row.name,
+                "remaining": int(row.quantity or 0),
+            }
+
+    now = datetime.utcnow()
+    records, items = [], []
+    taken = defaultdict(lambda: defaultdict(int))  # item_type -> id -> qty
+    dispensed = defaultdict(dict)  # patient -> (item_type, id) -> duplicate row
+    for index, body in parsed:
+        patient = patients.get(body.patient_id)
+        employee = employees.get(body.employee_id)
+        if not patient or not employee:
+            results[index] = _error(index, "Patient or employee not found")
+            continue
+
+        demand = defaultdict(int)
+        for line in body._normalized_items:
+            demand[(line.item_type, line.item_id)] += int(line.quantity)
+        shortage = None
+        for (item_type, item_id), qty in demand.items():
+            row = stock.get((item_type, item_id))
+            available = row["remaining"] if row and row["branch_id"] == body.branch_id else 0
+            if qty > available:
+                shortage = (
+                    f"Not enough stock for {item_type}:{item_id} "
+                    f"(available {available}, requested {qty})"
+                )
+                break
+        if shortage:
+            results[index] = _error(index, shortage)
+            continue
+        try:
+            warnings = check_cart(
+                db,
+                body.patient_id,
+                demand,
+                now,
+                allow=body.allow_duplicates,
+                pending=dispensed[body.patient_id],
+            )
+        except DuplicateDispensing as e:
+            results[index] = _error(index, {"message": str(e), "duplicates": e.duplicates})
+            continue
+
+        record_id = str(uuid.uuid4())
+        records.append(
+            {
+                "id": record_id,
+                "branch_id": body.branch_id,
+                "patient_id": body.patient_id,
+                "patient_name": body.patient_name
+                or f"{patient.first_name} {patient.last_name}",
+                "employee_id": body.employee_id,
+                "employee_name": body.employee_name
+                or f"{employee.first_name} {employee.last_name}",
+                "date": now,
+            }
+        )
+        first_item = len(items)
+        for line in body._normalized_items:
+            row = stock[(line.item_type, line.item_id)]
+            items.append(
+                {
+                    "id": str(uuid.uuid4()),
+                    "record_id": record_id,
+                    "item_type": line.item_type,
+                    "item_id": line.item_id,
+                    "item_name": row["name"],
+                    "quantity": int(line.quantity),
+                    "patient_id": body.patient_id,
+                    "dispensed_at": now,
+                }
+            )
+        for (item_type, item_id), qty in demand.items():
+            stock[(item_type, item_id)]["remaining"] -= qty
+            taken[item_type][item_id] += qty
+            earlier = dispensed[body.patient_id].get((item_type, item_id))
+            dispensed[body.patient_id][(item_type, item_id)] = {
+                "type": item_type,
+                "item_id": item_id,
+                "name": stock[(item_type, item_id)]["name"],
+                "last_dispensed_at": now.isoformat(),
+                "days_ago": 0,
+                "last_quantity": qty,
+                "employee_name": records[-1]["employee_name"],
+                "branch_id": body.branch_id,
+                "times": earlier["times"] + 1 if earlier else 1,
+            }
+        results[index] = {
+            "index": index,
+            "status": "created",
+            "id": record_id,
+            "warnings": warnings,
+        }
+        emit_event(
+            db,
+            "dispensing",
+            record_id,
+            "dispensing.created",
+            {
+                "branch_id": body.branch_id,
+                "patient_id": body.patient_id,
+                "employee_id": body.employee_id,
+                "date": now.isoformat(),
+                "items": [
+                    {
+                        "type": i["item_type"],
+                        "item_id": i["item_id"],
+                        "name": i["item_name"],
+                        "quantity": i["quantity"],
+                    }
+                    for i in items[first_item:]
+                ],
+            },
+        )
+
+    if records:
+        db.execute(insert(DispensingRecord), records)
+        db.execute(insert(DispensingItem), items)
+    for item_type, per_id in taken.items():
+        model = STOCK_MODELS[item_type]
+        db.execute(
+            update(model)
+            .where(model.id.in_(list(per_id)))
+            .values(
+                quantity=model.quantity - case(per_id, value=model.id, else_=0),
+                version=model.version + 1,
+            )
+            .execution_options(synchronize_session=False)
+        )
+        for item_id, qty in per_id.items():
+            allocate_fefo(db, item_id, stock[(item_type, item_id)]["branch_id"], qty)
+            bump_version(db, model.__tablename__, stock[(item_type, item_id)]["branch_id"])
+            note_stock_change(db, item_type, item_id)
+            record_change(
+                db, model.__tablename__, item_id, stock[(item_type, item_id)]["branch_id"]
+            )
+    if records:
+        note_report_write(db, ("dispensings", "stock"), now)
+    return results
@@ -0,0 +1,157 @@
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Iterable, Optional
+
+from sqlalchemy import select, tuple_
+from sqlalchemy.orm import Session
+
+from database import DispensingItem, DispensingRecord
+
+# off: no check; warn: dispense and return warnings; block: refuse with 409
+# unless the request sets allow_duplicates
+POLICY = os.getenv("DUPLICATE_DISPENSING_POLICY", "warn")
+WINDOW_DAYS = int(os.getenv("DUPLICATE_DISPENSING_DAYS", "7"))
+
+DUPLICATE_INDEXES = (
+    "CREATE INDEX IF NOT EXISTS idx_dispensing_items_patient_item_date "
+    "ON dispensing_items (patient_id, item_type, item_id, dispensed_at)",
+)
+
+# items written before patient_id/dispensed_at existed take their record's
+BACKFILL_SQL = """
+    UPDATE dispensing_items SET
+      patient_id = (SELECT dr.patient_id FROM dispensing_records dr
+                    WHERE dr.id = dispensing_items.record_id),
+      dispensed_at = (SELECT dr.date FROM dispensing_records dr
+                      WHERE dr.id = dispensing_items.record_id)
+    WHERE patient_id IS NULL
+"""
+
+
+class CheckStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checks = 0
+        self.flagged = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def record(self, elapsed_ms: float, flagged: bool) -> None:
+        with self._lock:
+            self.checks += 1
+            self.flagged += int(flagged)
+            self.total_ms += elapsed_ms
+            self.max_ms = max(self.max_ms, elapsed_ms)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "policy": POLICY,
+                "window_days": WINDOW_DAYS,
+                "checks": self.checks,
+                "flagged": self.flagged,
+                "avg_ms": round(self.total_ms / self.checks, 3) if self.checks else None,
+                "max_ms": round(self.max_ms, 3),
+            }
+
+
+stats = CheckStats()
+
+
+def find_duplicates(
+    db: Session,
+    patient_id: str,
+    lines: Iterable[tuple[str, str]],
+    now: datetime,
+    days: int = WINDOW_DAYS,
+) -> list[dict]:
+    """Cart lines the patient already received within ``days`` before ``now``.
+
+    ``lines`` are (item_type, item_id). All of them are probed by one query,
+    each as a range of ``idx_dispensing_items_patient_item_date``, so the
+    cost follows the matches in the window, not the patient's history.
+    Returns the latest earlier dispensing per repeated item.
+    """
+    keys = list(dict.fromkeys((getattr(t, "value", t), str(i)) for t, i in lines))
+    if not keys or days <= 0:
+        return []
+    started = time.perf_counter()
+    rows = db.execute(
+        select(
+            DispensingItem.item_type,
+            DispensingItem.item_id,
+            DispensingItem.item_name,
+            DispensingItem.quantity,
+            DispensingItem.dispensed_at,
+            DispensingRecord.employee_name,
+            DispensingRecord.branch_id,
+        )
+        .join(DispensingRecord, DispensingRecord.id == DispensingItem.record_id)
+        .where(
+            DispensingItem.patient_id == patient_id,
+            tuple_(DispensingItem.item_type, DispensingItem.item_id).in_(keys),
+            DispensingItem.dispensed_at >= now - timedelta(days=days),
+        )
+        .order_by(DispensingItem.dispensed_at.desc())
+    ).all()
+
+    found: dict[tuple[str, str], dict] = {}
+    for r in rows:
+        key = (r.item_type, r.item_id)
+        if key in found:
+            found[key]["times"] += 1
+            continue
+        found[key] = {
+            "type": r.item_type,
+            "item_id": r.item_id,
+            "name": r.item_name,
+            "last_dispensed_at": r.dispensed_at.isoformat(),
+            "days_ago": (now - r.dispensed_at).days,
+            "last_quantity": r.quantity,
+            "employee_name": r.employee_name,
+            "branch_id": r.branch_id,
+            "times": 1,
+        }
+    stats.record((time.perf_counter() - started) * 1000, bool(found))
+    return [found[k] for k in keys if k in found]
+
+
+class DuplicateDispensing(ValueError):
+    def __init__(self, duplicates: list[dict]):
+        super().__init__("Already dispensed to this patient recently")
+        self.duplicates = duplicates
+
+
+def check_cart(
+    db: Session,
+    patient_id: str,
+    lines: Iterable[tuple[str, str]],
+    now: datetime,
+    allow: bool = False,
+    pending: Optional[dict] = None,
+) -> list[dict]:
+    """Apply ``POLICY`` to a cart: the warnings to return, or raise
+    ``DuplicateDispensing`` when blocking and not ``allow``.
+
+    ``pending`` maps (item_type, item_id) to the patient's dispensings
+    accepted earlier in the same request but not written yet, shaped like
+    ``find_duplicates`` rows; they count as the latest ones.
+    """
+    if POLICY == "off":
+        return []
+    lines = list(lines)
+    duplicates = find_duplicates(db, patient_id, lines, now)
+    if pending:
+        stored = {(d["type"], d["item_id"]): d for d in duplicates}
+        duplicates = []
+        for key in dict.fromkeys((getattr(t, "value", t), str(i)) for t, i in lines):
+            if key in pending:
+                times = pending[key]["times"] + stored.get(key, {}).get("times", 0)
+                duplicates.append({**pending[key], "times": times})
+            elif key in stored:
+                duplicates.append(stored[key])
+    if duplicates and POLICY == "block" and not allow:
+        raise DuplicateDispensing(duplicates)
+    return duplicates
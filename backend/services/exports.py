@@ -0,0 +1,343 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime, timedelta
+from multiprocessing import get_context
+from typing import Callable, NamedTuple, Optional
+
+from sqlalchemy import select, text, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, sessionmaker
+
+from database import ExportJob
+
+try:
+    from openpyxl import Workbook
+except ImportError:  # pragma: no cover
+    Workbook = None
+
+logger = logging.getLogger(__name__)
+
+EXPORT_DIR = os.getenv("EXPORT_DIR") or os.path.join(tempfile.gettempdir(), "warehouse_exports")
+MAX_CONCURRENT = int(os.getenv("EXPORT_MAX_CONCURRENT", "2"))
+RENDER_PROCESSES = int(os.getenv("EXPORT_RENDER_PROCESSES", "2"))
+FILE_TTL_SECONDS = int(os.getenv("EXPORT_FILE_TTL", "3600"))
+# a worker stamps the jobs it owns this often; a job not stamped for
+# STALE_SECONDS has lost its worker
+HEARTBEAT_SECONDS = float(os.getenv("EXPORT_HEARTBEAT_SECONDS", "10"))
+STALE_SECONDS = float(os.getenv("EXPORT_STALE_SECONDS", "30"))
+
+XLSX_MEDIA_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+ACTIVE_STATUSES = ("queued", "running")
+
+# the partial unique index of ExportJob, for tables created before it; older
+# duplicate active jobs are failed first so it can be built
+EXPORT_INDEXES = (
+    """
+    UPDATE export_jobs SET status = 'failed', error = 'duplicate'
+    WHERE status IN ('queued', 'running') AND id NOT IN (
+        SELECT MIN(id) FROM export_jobs WHERE status IN ('queued', 'running') GROUP BY params_hash
+    )
+    """,
+    "CREATE UNIQUE INDEX IF NOT EXISTS uq_export_jobs_active ON export_jobs (params_hash) "
+    "WHERE status IN ('queued', 'running')",
+)
+
+
+class ExportData(NamedTuple):
+    headers: list
+    rows: list
+    sheet_name: str
+    filename: str
+
+
+# kind -> builder(db, params) returning the rows to render
+_builders: dict[str, Callable[[Session, dict], ExportData]] = {}
+
+
+def register_export(kind: str):
+    def decorator(fn: Callable[[Session, dict], ExportData]):
+        _builders[kind] = fn
+        return fn
+
+    return decorator
+
+
+def export_kinds() -> list[str]:
+    return sorted(_builders)
+
+
+def render_xlsx_file(path: str, headers: list, rows: list, sheet_name: str) -> int:
+    """Write an XLSX file; runs in a worker process. Returns the file size."""
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(title=sheet_name)
+    ws.append(headers)
+    for r in rows:
+        ws.append(r)
+    tmp = f"{path}.tmp"
+    wb.save(tmp)
+    os.replace(tmp, path)
+    return os.path.getsize(path)
+
+
+def params_hash(kind: str, params: dict) -> str:
+    return hashlib.sha1(
+        json.dumps([kind, params], sort_keys=True, ensure_ascii=False).encode("utf-8")
+    ).hexdigest()
+
+
+def job_to_dict(job: ExportJob) -> dict:
+    return {
+        "id": job.id,
+        "kind": job.kind,
+        "params": json.loads(job.params or "{}"),
+        "status": job.status,
+        "progress": job.progress,
+        "error": job.error,
+        "file_name": job.file_name,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+    }
+
+
+class ExportManager:
+    """Runs export jobs on a capped thread pool, rendering in worker processes.
+
+    Job state lives in ``export_jobs`` so status polling works from any
+    worker; a conditional UPDATE claims a job so it runs exactly once, and a
+    partial unique index keeps one active job per request. While this
+    process holds a job it refreshes the job's ``heartbeat_at``, so other
+    workers can tell a live job from one orphaned by a restart.
+    """
+
+    def __init__(self, max_concurrent: int = MAX_CONCURRENT, processes: int = RENDER_PROCESSES):
+        self._threads = ThreadPoolExecutor(
+            max_workers=max_concurrent, thread_name_prefix="export"
+        )
+        self._processes_count = processes
+        self._processes: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        # job id -> session factory, for every job dispatched here and not finished
+        self._owned: dict[str, Callable] = {}
+        self._stop = threading.Event()
+        self._heartbeat: Optional[threading.Thread] = None
+
+    def _pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._processes is None:
+                self._processes = ProcessPoolExecutor(
+                    max_workers=self._processes_count, mp_context=get_context("spawn")
+                )
+            return self._processes
+
+    def submit(self, db: Session, kind: str, params: dict) -> ExportJob:
+        if kind not in _builders:
+            raise ValueError(f"Unknown export kind: {kind}")
+        digest = params_hash(kind, params)
+        self.reap(db)
+        existing = _active_job(db, digest)
+        if existing:
+            return existing
+        now = datetime.utcnow()
+        job = ExportJob(
+            id=str(uuid.uuid4()),
+            kind=kind,
+            params=json.dumps(params, ensure_ascii=False),
+            params_hash=digest,
+            status="queued",
+            progress=0,
+            created_at=now,
+            heartbeat_at=now,
+        )
+        db.add(job)
+        try:
+            db.commit()
+        except IntegrityError:
+            # another worker queued the same request first
+            db.rollback()
+            existing = _active_job(db, digest)
+            if existing:
+                return existing
+            raise
+        self.dispatch(sessionmaker(bind=db.get_bind()), job.id)
+        cleanup_expired(db)
+        return job
+
+    def reap(self, db: Session) -> None:
+        """Settle jobs orphaned by a dead worker, taking over stale queued ones."""
+        requeued = reap_stale(db)
+        if requeued:
+            session_factory = sessionmaker(bind=db.get_bind())
+            for job_id in requeued:
+                self.dispatch(session_factory, job_id)
+
+    def dispatch(self, session_factory, job_id: str):
+        with self._lock:
+            self._owned[job_id] = session_factory
+            if self._heartbeat is None:
+                self._heartbeat = threading.Thread(
+                    target=self._run_heartbeat, name="export-heartbeat", daemon=True
+                )
+                self._heartbeat.start()
+        return self._threads.submit(self._run, session_factory, job_id)
+
+    def beat(self) -> None:
+        """Stamp ``heartbeat_at`` of every job this process owns."""
+        with self._lock:
+            owned = dict(self._owned)
+        by_factory: dict = {}
+        for job_id, factory in owned.items():
+            by_factory.setdefault(factory, []).append(job_id)
+        now = datetime.utcnow()
+        for factory, ids in by_factory.items():
+            with factory() as db:
+                db.execute(
+                    update(ExportJob)
+                    .where(ExportJob.id.in_(ids), ExportJob.status.in_(ACTIVE_STATUSES))
+                    .values(heartbeat_at=now)
+                )
+                db.commit()
+
+    def _run_heartbeat(self) -> None:
+        while not self._stop.wait(HEARTBEAT_SECONDS):
+            try:
+                self.beat()
+            except Exception:
+                logger.warning("export heartbeat failed", exc_info=True)
+
+    def _run(self, session_factory, job_id: str) -> None:
+        try:
+            self._execute(session_factory, job_id)
+        finally:
+            with self._lock:
+                self._owned.pop(job_id, None)
+
+    def _execute(self, session_factory, job_id: str) -> None:
+        with session_factory() as db:
+            now = datetime.utcnow()
+            claimed = db.execute(
+                text(
+                    "UPDATE export_jobs SET status = 'running', progress = 5, started_at = :now, "
+                    "heartbeat_at = :now WHERE id = :id AND status = 'queued'"
+                ),
+                {"id": job_id, "now": now},
+            ).rowcount
+            db.commit()
+            if not claimed:
+                return
+            job = db.get(ExportJob, job_id)
+            try:
+                data = _builders[job.kind](db, json.loads(job.params or "{}"))
+                job.progress = 40
+                db.commit()
+
+                os.makedirs(EXPORT_DIR, exist_ok=True)
+                path = os.path.join(EXPORT_DIR, f"{job.id}.xlsx")
+                self._pool().submit(
+                    render_xlsx_file, path, data.headers, data.rows, data.sheet_name
+                ).result()
+
+                job.file_path = path
+                job.file_name = data.filename
+                job.status = "done"
+                job.progress = 100
+            except Exception as e:
+                logger.exception("export job %s failed", job_id)
+                db.rollback()
+                job = db.get(ExportJob, job_id)
+                job.status = "failed"
+                job.error = str(e)
+            job.finished_at = datetime.utcnow()
+            db.commit()
+
+    def shutdown(self) -> None:
+        self._stop.set()
+        self._threads.shutdown(wait=True)
+        if self._processes is not None:
+            self._processes.shutdown(wait=True)
+
+
+manager = ExportManager()
+
+
+def cleanup_expired(db: Session, ttl_seconds: int = FILE_TTL_SECONDS) -> int:
+    """Delete files of jobs finished more than ``ttl_seconds`` ago."""
+    cutoff = datetime.utcnow() - timedelta(seconds=ttl_seconds)
+    jobs = (
+        db.query(ExportJob)
+        .filter(ExportJob.status.in_(("done", "failed")), ExportJob.finished_at < cutoff)
+        .all()
+    )
+    for job in jobs:
+        if job.file_path:
+            try:
+                os.remove(job.file_path)
+            except FileNotFoundError:
+                pass
+        job.status = "expired"
+        job.file_path = None
+    if jobs:
+        db.commit()
+    return len(jobs)
+
+
+def _active_job(db: Session, digest: str) -> Optional[ExportJob]:
+    return (
+        db.query(ExportJob)
+        .filter(ExportJob.params_hash == digest, ExportJob.status.in_(ACTIVE_STATUSES))
+        .first()
+    )
+
+
+def reap_stale(db: Session, stale_seconds: float = STALE_SECONDS) -> list[str]:
+    """Settle active jobs whose worker stopped stamping them.
+
+    A stale running job is failed, since its partial output is gone; a
+    stale queued one is stamped afresh and its id returned for the caller to
+    dispatch (the claim in ``_execute`` stops two workers running it).
+    """
+    now = datetime.utcnow()
+    cutoff = now - timedelta(seconds=stale_seconds)
+    stale = db.execute(
+        select(ExportJob.id, ExportJob.status).where(
+            ExportJob.status.in_(ACTIVE_STATUSES),
+            ExportJob.heartbeat_at.is_(None) | (ExportJob.heartbeat_at < cutoff),
+        )
+    ).all()
+    if not stale:
+        return []
+    orphaned = [r.id for r in stale if r.status == "running"]
+    requeued = [r.id for r in stale if r.status == "queued"]
+    if orphaned:
+        db.execute(
+            update(ExportJob)
+            .where(ExportJob.id.in_(orphaned), ExportJob.status == "running")
+            .values(status="failed", error="interrupted", finished_at=now)
+        )
+    if requeued:
+        db.execute(
+            update(ExportJob)
+            .where(ExportJob.id.in_(requeued), ExportJob.status == "queued")
+            .values(heartbeat_at=now)
+        )
+    db.commit()
+    return requeued
+
+
+def resume_pending(session_factory) -> None:
+    """On startup: fail jobs orphaned mid-run, re-dispatch queued ones.
+
+    Running jobs still stamped by a live worker are left alone; every queued
+    job is dispatched, the claim decides who runs it.
+    """
+    with session_factory() as db:
+        reap_stale(db)
+        queued = [j.id for j in db.query(ExportJob.id).filter(ExportJob.status == "queued")]
+        cleanup_expired(db)
+    for job_id in queued:
+        manager.dispatch(session_factory, job_id)
@@ -0,0 +1,184 @@
+import os
+from datetime import date, datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from services.report_cache import cache
+from services.versions import get_version
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+HISTORY_DAYS = int(os.getenv("FORECAST_HISTORY_DAYS", "91"))
+HORIZON_DAYS = int(os.getenv("FORECAST_HORIZON_DAYS", "90"))
+SMOOTHING_ALPHA = float(os.getenv("FORECAST_ALPHA", "0.3"))
+# weekday factors need a few full weeks to be more signal than noise
+MIN_SEASON_WEEKS = 3
+
+
+def daily_consumption(
+    db: Session, branch_id: str, start: date, end: date
+) -> tuple[list[tuple[str, str]], "np.ndarray"]:
+    """Dispensed quantity per item and day as an (items x days) matrix.
+
+    One grouped query for the whole branch; ``end`` is inclusive.
+    """
+    rows = db.execute(
+        text(
+            """
+            SELECT di.item_type, di.item_id, DATE(dr.date) AS day, SUM(di.quantity) AS qty
+            FROM dispensing_items di
+            JOIN dispensing_records dr ON dr.id = di.record_id
+            WHERE dr.branch_id = :b AND dr.date >= :start AND dr.date < :stop
+            GROUP BY di.item_type, di.item_id, DATE(dr.date)
+        """
+        ),
+        {
+            "b": branch_id,
+            "start": datetime.combine(start, datetime.min.time()),
+            "stop": datetime.combine(end + timedelta(days=1), datetime.min.time()),
+        },
+    ).all()
+
+    keys = sorted({(r[0], str(r[1])) for r in rows})
+    index = {k: i for i, k in enumerate(keys)}
+    matrix = np.zeros((len(keys), (end - start).days + 1))
+    if rows:
+        item_idx = np.fromiter((index[(r[0], str(r[1]))] for r in rows), dtype=np.int64)
+        day_idx = np.fromiter(
+            ((date.fromisoformat(str(r[2])[:10]) - start).days for r in rows), dtype=np.int64
+        )
+        qty = np.fromiter((r[3] or 0 for r in rows), dtype=np.float64)
+        np.add.at(matrix, (item_idx, day_idx), qty)
+    return keys, matrix
+
+
+def fit(matrix: "np.ndarray", start: date, alpha: float = SMOOTHING_ALPHA) -> dict:
+    """Per-item moving averages, smoothed level and weekday factors."""
+    n_items, n_days = matrix.shape
+    ma7 = matrix[:, -7:].mean(axis=1) if n_days else np.zeros(n_items)
+    ma28 = matrix[:, -28:].mean(axis=1) if n_days else np.zeros(n_items)
+
+    # simple exponential smoothing written as one weighted sum over days
+    weights = alpha * (1 - alpha) ** np.arange(n_days - 1, -1, -1)
+    if n_days:
+        weights[0] = (1 - alpha) ** (n_days - 1)
+    level = matrix @ weights
+
+    factors = np.ones((n_items, 7))
+    if n_days >= 7 * MIN_SEASON_WEEKS:
+        dow = (np.arange(n_days) + start.weekday()) % 7
+        by_dow = np.stack([matrix[:, dow == k].mean(axis=1) for k in range(7)], axis=1)
+        mean = matrix.mean(axis=1, keepdims=True)
+        np.divide(by_dow, mean, out=factors, where=mean > 0)
+
+    return {"ma7": ma7, "ma28": ma28, "level": level, "factors": factors}
+
+
+def days_of_cover(
+    on_hand: "np.ndarray",
+    level: "np.ndarray",
+    factors: "np.ndarray",
+    first_weekday: int,
+    horizon: int = HORIZON_DAYS,
+) -> "np.ndarray":
+    """Whole days the stock lasts at the forecast rate; -1 beyond ``horizon``."""
+    dows = (np.arange(horizon) + first_weekday) % 7
+    demand = np.cumsum(level[:, None] * factors[:, dows], axis=1)
+    # tolerance keeps e.g. 10 units at 2/day at exactly five days
+    runs_out = demand > np.maximum(on_hand, 0)[:, None] + 1e-9
+    cover = runs_out.argmax(axis=1)
+    cover[~runs_out.any(axis=1) | (level <= 0)] = -1
+    cover[on_hand <= 0] = 0
+    return cover
+
+
+def _fitted(db: Session, branch_id: str, today: date, history_days: int) -> dict:
+    """Fit on closed days only, so the result is cached for the whole day."""
+    end = today - timedelta(days=1)
+    start = end - timedelta(days=history_days - 1)
+    key = (
+        "forecast",
+        branch_id,
+        start.isoformat(),
+        end.isoformat(),
+        SMOOTHING_ALPHA,
+        get_version(db, "report:dispensings"),
+    )
+    payload = cache.get(key)
+    if payload is None:
+        keys, matrix = daily_consumption(db, branch_id, start, end)
+        model = fit(matrix, start)
+        payload = {"keys": keys}
+        payload.update({name: arr.tolist() for name, arr in model.items()})
+        cache.put(key, payload)
+    return payload
+
+
+def branch_forecast(
+    db: Session,
+    branch_id: str,
+    history_days: int = HISTORY_DAYS,
+    horizon_days: int = HORIZON_DAYS,
+    today: Optional[date] = None,
+) -> list[dict]:
+    """Days of cover and expected stock-out date for every item of a branch."""
+    today = today or datetime.utcnow().date()
+    model = _fitted(db, branch_id, today, history_days)
+
+    stock = db.execute(
+        text(
+            """
+            SELECT 'medicine' AS item_type, id, name, quantity
+            FROM medicines WHERE branch_id = :b
+            UNION ALL
+            SELECT 'medical_device' AS item_type, id, name, quantity
+            FROM medical_devices WHERE branch_id = :b
+        """
+        ),
+        {"b": branch_id},
+    ).all()
+    if not stock:
+        return []
+
+    fitted_index = {tuple(k): i for i, k in enumerate(model["keys"])}
+    n = len(stock)
+    rows_idx = np.array([fitted_index.get((s[0], str(s[1])), -1) for s in stock])
+    known = rows_idx >= 0
+    take = np.where(known, rows_idx, 0)
+
+    def column(name: str, width: Optional[int] = None) -> "np.ndarray":
+        values = np.asarray(model[name], dtype=np.float64)
+        shape = (n,) if width is None else (n, width)
+        out = np.zeros(shape) if width is None else np.ones(shape)
+        if values.size:
+            out[known] = values[take[known]]
+        return out
+
+    level, ma7, ma28 = column("level"), column("ma7"), column("ma28")
+    factors = column("factors", 7)
+    on_hand = np.array([s[3] or 0 for s in stock], dtype=np.float64)
+    cover = days_of_cover(on_hand, level, factors, today.weekday(), horizon_days)
+
+    result = []
+    for i, (item_type, item_id, name, quantity) in enumerate(stock):
+        c = int(cover[i])
+        result.append(
+            {
+                "item_type": item_type,
+                "item_id": str(item_id),
+                "name": name,
+                "quantity": int(quantity or 0),
+                "avg_7d": round(float(ma7[i]), 3),
+                "avg_28d": round(float(ma28[i]), 3),
+                "daily_forecast": round(float(level[i]), 3),
+                "days_of_cover": c if c >= 0 else None,
+                "stockout_date": (today + timedelta(days=c)).isoformat() if c >= 0 else None,
+            }
+        )
+    result.sort(key=lambda r: (r["days_of_cover"] is None, r["days_of_cover"] or 0, r["name"]))
+    return result
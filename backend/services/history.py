@@ -0,0 +1,183 @@
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import DateTime, bindparam, text
+from sqlalchemy.orm import Session
+
+from database import STOCK_MODELS
+
+# Every stock movement of one item row as (date, key, kind, delta, note).
+# Arrivals only reach main-warehouse rows; shipments and transfers leave the
+# main row by id and reach the branch row by name, as accept_shipment and
+# create_transfers apply them. Years moved out by services.archive come back
+# as one row per table, dated at the year's end. Branch ids are cast so the
+# note column has one type when they are native uuids.
+MOVEMENTS_SQL = """
+    SELECT a.date AS date, 'arrival:' || a.id AS key, 'arrival' AS kind,
+           a.quantity AS delta, NULL AS note
+    FROM arrivals a
+    WHERE a.item_type = :t AND a.item_id = :i
+    UNION ALL
+    SELECT s.created_at, 'shipment_in:' || si.id, 'shipment_in', si.quantity, NULL
+    FROM shipment_items si JOIN shipments s ON s.id = si.shipment_id
+    WHERE s.status = 'accepted' AND s.to_branch_id = :b
+      AND si.item_type = :t AND si.item_name = :name
+    UNION ALL
+    SELECT s.created_at, 'shipment_out:' || si.id, 'shipment_out', -si.quantity,
+           CAST(s.to_branch_id AS VARCHAR)
+    FROM shipment_items si JOIN shipments s ON s.id = si.shipment_id
+    WHERE s.status = 'accepted' AND si.item_type = :t AND si.item_id = :i
+    UNION ALL
+    SELECT tr.date, 'transfer_in:' || tr.id, 'transfer_in', tr.quantity, tr.from_branch_id
+    FROM transfers tr
+    WHERE tr.item_type = :t AND tr.to_branch_id = :b AND tr.medicine_name = :name
+    UNION ALL
+    SELECT tr.date, 'transfer_out:' || tr.id, 'transfer_out', -tr.quantity,
+           CAST(tr.to_branch_id AS VARCHAR)
+    FROM transfers tr
+    WHERE tr.item_type = :t AND tr.medicine_id = :i
+    UNION ALL
+    SELECT dr.date, 'dispensing:' || di.id, 'dispensing', -di.quantity, dr.patient_name
+    FROM dispensing_items di JOIN dispensing_records dr ON dr.id = di.record_id
+    WHERE di.item_type = :t AND di.item_id = :i
+    UNION ALL
+    SELECT ad.created_at, 'adjustment:' || ad.id, 'adjustment', ad.quantity, ad.reason
+    FROM stock_adjustments ad
+    WHERE ad.item_type = :t AND ad.item_id = :i
+    UNION ALL
+    SELECT at.date, 'archived:' || at.table_name || ':' || CAST(at.year AS VARCHAR), 'archived',
+           at.quantity, at.table_name
+    FROM archived_totals at
+    WHERE at.item_type = :t AND at.item_id = :i
+"""
+
+# indexes the per-source lookups above seek on
+HISTORY_INDEXES = (
+    "CREATE INDEX IF NOT EXISTS idx_arrivals_item_date ON arrivals (item_id, date)",
+    "CREATE INDEX IF NOT EXISTS idx_shipment_items_item ON shipment_items (item_id)",
+    "CREATE INDEX IF NOT EXISTS idx_shipment_items_name ON shipment_items (item_name)",
+    "CREATE INDEX IF NOT EXISTS idx_transfers_medicine_date ON transfers (medicine_id, date)",
+    "CREATE INDEX IF NOT EXISTS idx_transfers_to_name ON transfers (to_branch_id, medicine_name)",
+    "CREATE INDEX IF NOT EXISTS idx_dispensing_items_item ON dispensing_items (item_id, record_id)",
+)
+
+
+def encode_cursor(date: datetime, key: str, balance: int) -> str:
+    return f"{date.isoformat()}|{key}|{balance}"
+
+
+def parse_cursor(cursor: str) -> tuple[datetime, str, int]:
+    date, key, balance = cursor.rsplit("|", 2)
+    return datetime.fromisoformat(date), key, int(balance)
+
+
+def _query(sql: str, params: dict, returns_dates: bool = False):
+    """``text(sql)`` with datetimes bound and read back as ``DateTime``.
+
+    SQLite compares dates as strings, so the bound values must be rendered
+    exactly as the ORM stored them.
+    """
+    stmt = text(sql).bindparams(
+        *(bindparam(k, type_=DateTime) for k, v in params.items() if isinstance(v, datetime))
+    )
+    return stmt.columns(date=DateTime) if returns_dates else stmt
+
+
+def item_movements(
+    db: Session,
+    item_type: str,
+    item_id: str,
+    start: Optional[datetime],
+    end: datetime,
+    limit: int,
+    cursor: Optional[str] = None,
+) -> Optional[dict]:
+    """One page of an item's movements in time order with a running balance.
+
+    The first page also carries the balance before ``start`` and the period
+    totals. Pages are keyed on (date, key); the cursor carries the balance
+    reached so far, so each page computes its window over its own rows only.
+    """
+    model = STOCK_MODELS.get(item_type)
+    if model is None:
+        raise ValueError(f"Unknown item type: {item_type}")
+    item = db.execute(
+        text(f"SELECT name, branch_id FROM {model.__tablename__} WHERE id = :i"), {"i": item_id}
+    ).first()
+    if item is None:
+        return None
+    params = {"t": item_type, "i": item_id, "b": item.branch_id, "name": item.name, "end": end}
+    in_range = "m.date <= :end"
+    if start:
+        params["start"] = start
+        in_range += " AND m.date >= :start"
+
+    result: dict = {"opening_balance": None, "total_in": None, "total_out": None}
+    if cursor:
+        after_date, after_key, carry = parse_cursor(cursor)
+        params.update(after_date=after_date, after_key=after_key)
+        after = " AND (m.date > :after_date OR (m.date = :after_date AND m.key > :after_key))"
+    else:
+        totals = db.execute(
+            _query(
+                f"""
+                SELECT
+                  COALESCE(SUM(CASE WHEN {'m.date < :start' if start else '1 = 0'}
+                                    THEN m.delta END), 0) AS opening,
+                  COALESCE(SUM(CASE WHEN {in_range} AND m.delta > 0 THEN m.delta END), 0) AS total_in,
+                  COALESCE(SUM(CASE WHEN {in_range} AND m.delta < 0 THEN -m.delta END), 0) AS total_out
+                FROM ({MOVEMENTS_SQL}) m
+                WHERE m.date <= :end
+            """,
+                params,
+            ),
+            params,
+        ).one()
+        carry = int(totals.opening)
+        result.update(
+            opening_balance=carry, total_in=int(totals.total_in), total_out=int(totals.total_out)
+        )
+        after = ""
+
+    params.update(carry=carry, limit=limit + 1)
+    rows = db.execute(
+        _query(
+            f"""
+            SELECT page.date, page.key, page.kind, page.delta, page.note,
+                   :carry + SUM(page.delta) OVER (
+                       ORDER BY page.date, page.key ROWS UNBOUNDED PRECEDING
+                   ) AS balance
+            FROM (
+                SELECT m.* FROM ({MOVEMENTS_SQL}) m
+                WHERE {in_range}{after}
+                ORDER BY m.date, m.key
+                LIMIT :limit
+            ) page
+            ORDER BY page.date, page.key
+        """,
+            params,
+            returns_dates=True,
+        ),
+        params,
+    ).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    movements = [
+        {
+            "date": r.date.isoformat(),
+            "kind": r.kind,
+            "qty": int(r.delta),
+            "balance": int(r.balance),
+            "note": r.note,
+        }
+        for r in rows
+    ]
+    last = rows[-1] if rows else None
+    result.update(
+        movements=movements,
+        has_more=has_more,
+        cursor=encode_cursor(last.date, last.key, int(last.balance))
+        if has_more
+        else None,
+    )
+    return result
@@ -0,0 +1,192 @@
+import asyncio
+import hashlib
+import json
+import os
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Optional
+
+from fastapi import HTTPException, Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from sqlalchemy import event, text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, sessionmaker
+
+TTL_SECONDS = int(os.getenv("IDEMPOTENCY_TTL", str(24 * 3600)))
+# how long a duplicate waits for the first attempt before giving up
+WAIT_SECONDS = float(os.getenv("IDEMPOTENCY_WAIT", "30"))
+# an attempt holding a key longer than this is assumed dead
+LOCK_SECONDS = int(os.getenv("IDEMPOTENCY_LOCK", "120"))
+POLL_SECONDS = 0.05
+
+HEADER = "Idempotency-Key"
+_ACTIVE_KEY = "idempotency_key"
+
+
+def request_hash(payload: Any) -> str:
+    body = json.dumps(jsonable_encoder(payload), sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(body.encode("utf-8")).hexdigest()
+
+
+@event.listens_for(Session, "before_commit")
+def _mark_committed(session: Session) -> None:
+    """Flag the key inside the handler's own transaction.
+
+    If the process dies after this commit but before the response is
+    stored, retries see 'committed' and are not executed a second time.
+    """
+    active = session.info.pop(_ACTIVE_KEY, None)
+    if active is None:
+        return
+    session.execute(
+        text(
+            "UPDATE idempotency_keys SET status = 'committed' "
+            "WHERE scope = :s AND key = :k AND status = 'in_progress'"
+        ),
+        {"s": active[0], "k": active[1]},
+    )
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_active(session: Session) -> None:
+    session.info.pop(_ACTIVE_KEY, None)
+
+
+def _claim(factory, scope: str, key: str, digest: str) -> Optional[dict]:
+    """Try to own ``key``; return the existing row if someone else has it."""
+    now = datetime.utcnow()
+    with factory() as s:
+        s.execute(text("DELETE FROM idempotency_keys WHERE expires_at < :now"), {"now": now})
+        s.commit()
+        try:
+            s.execute(
+                text(
+                    """
+                    INSERT INTO idempotency_keys
+                        (scope, key, request_hash, status, created_at, locked_at, expires_at)
+                    VALUES (:s, :k, :h, 'in_progress', :now, :now, :exp)
+                """
+                ),
+                {"s": scope, "k": key, "h": digest, "now": now,
+                 "exp": now + timedelta(seconds=TTL_SECONDS)},
+            )
+            s.commit()
+            return None
+        except IntegrityError:
+            s.rollback()
+        row = s.execute(
+            text(
+                "SELECT request_hash, status, status_code, response, locked_at "
+                "FROM idempotency_keys WHERE scope = :s AND key = :k"
+            ),
+            {"s": scope, "k": key},
+        ).mappings().first()
+        if row is None:
+            # released between our insert and select: try again
+            return {"status": "released"}
+        row = dict(row)
+        if row["status"] == "in_progress" and row["locked_at"] is not None:
+            locked_at = row["locked_at"]
+            if isinstance(locked_at, str):
+                locked_at = datetime.fromisoformat(locked_at)
+            if locked_at < now - timedelta(seconds=LOCK_SECONDS):
+                taken = s.execute(
+                    text(
+                        "UPDATE idempotency_keys SET locked_at = :now, request_hash = :h "
+                        "WHERE scope = :s AND key = :k AND status = 'in_progress' "
+                        "AND locked_at = :old"
+                    ),
+                    {"s": scope, "k": key, "h": digest, "now": now, "old": row["locked_at"]},
+                ).rowcount
+                s.commit()
+                if taken:
+                    return None
+        return row
+
+
+def _release(factory, scope: str, key: str) -> None:
+    with factory() as s:
+        s.execute(
+            text(
+                "DELETE FROM idempotency_keys "
+                "WHERE scope = :s AND key = :k AND status = 'in_progress'"
+            ),
+            {"s": scope, "k": key},
+        )
+        s.commit()
+
+
+def _store(factory, scope: str, key: str, status_code: int, body: Any) -> None:
+    with factory() as s:
+        s.execute(
+            text(
+                "UPDATE idempotency_keys SET status = 'done', status_code = :c, response = :r "
+                "WHERE scope = :s AND key = :k"
+            ),
+            {"s": scope, "k": key, "c": status_code, "r": json.dumps(body, ensure_ascii=False)},
+        )
+        s.commit()
+
+
+def _replay(row: dict) -> JSONResponse:
+    return JSONResponse(
+        json.loads(row["response"]),
+        status_code=row["status_code"],
+        headers={"Idempotent-Replayed": "true"},
+    )
+
+
+async def run_idempotent(
+    db: Session,
+    request: Optional[Request],
+    scope: str,
+    payload: Any,
+    handler: Callable[[], Awaitable[Any]],
+    status_code: int = 200,
+):
+    """Run ``handler`` at most once per ``Idempotency-Key`` within ``scope``.
+
+    Without the header the handler simply runs. A replay with the same key
+    and body returns the stored response; a concurrent duplicate waits for
+    the first attempt. Failed attempts release the key, since their
+    transaction was rolled back and retrying is safe.
+    """
+    key = request.headers.get(HEADER) if request is not None else None
+    if not key:
+        return await handler()
+
+    factory = sessionmaker(bind=db.get_bind())
+    digest = request_hash(payload)
+    deadline = asyncio.get_running_loop().time() + WAIT_SECONDS
+    while True:
+        row = await asyncio.to_thread(_claim, factory, scope, key, digest)
+        if row is None:
+            break
+        if row["status"] != "released" and row["request_hash"] != digest:
+            raise HTTPException(
+                status_code=422,
+                detail=f"{HEADER} was already used with a different request",
+            )
+        if row["status"] == "done":
+            return _replay(row)
+        if row["status"] == "committed":
+            raise HTTPException(
+                status_code=409,
+                detail="Request was already processed; its response is unavailable",
+            )
+        if asyncio.get_running_loop().time() > deadline:
+            raise HTTPException(
+                status_code=409, detail="A request with this key is still in progress"
+            )
+        await asyncio.sleep(POLL_SECONDS)
+
+    db.info[_ACTIVE_KEY] = (scope, key)
+    try:
+        result = await handler()
+    except BaseException:
+        db.info.pop(_ACTIVE_KEY, None)
+        await asyncio.to_thread(_release, factory, scope, key)
+        raise
+    db.info.pop(_ACTIVE_KEY, None)
+    await asyncio.to_thread(_store, factory, scope, key, status_code, jsonable_encoder(result))
+    return result
@@ -0,0 +1,166 @@
+from collections import defaultdict
+from datetime import date, datetime
+from typing import Optional
+
+from sqlalchemy import case, insert, select, tuple_, update
+from sqlalchemy.orm import Session
+
+from database import STOCK_MODELS, StockLot
+
+# open lots read per round trip while allocating; one page covers almost
+# every dispensing, items with hundreds of lots just read further pages
+PAGE = 50
+
+
+def _same_row(item_id: str, branch_id: Optional[str]):
+    branch = StockLot.branch_id.is_(None) if branch_id is None else StockLot.branch_id == branch_id
+    return (branch, StockLot.item_id == item_id)
+
+
+def add_lot(
+    db: Session,
+    item_type: str,
+    item_id: str,
+    branch_id: Optional[str],
+    quantity: int,
+    expiry_date: Optional[date],
+    lot_number: Optional[str] = None,
+) -> None:
+    """Put ``quantity`` into the lot of one stock row, merging equal lots.
+
+    Stock without an expiry date stays untracked.
+    """
+    if quantity <= 0 or expiry_date is None:
+        return
+    same_lot = (
+        StockLot.lot_number.is_(None) if lot_number is None else StockLot.lot_number == lot_number
+    )
+    existing = db.execute(
+        select(StockLot.id)
+        .where(*_same_row(item_id, branch_id), StockLot.expiry_date == expiry_date, same_lot)
+        .with_for_update()
+    ).scalar()
+    if existing:
+        db.execute(
+            update(StockLot)
+            .where(StockLot.id == existing)
+            .values(quantity=StockLot.quantity + quantity)
+            .execution_options(synchronize_session=False)
+        )
+    else:
+        db.execute(
+            insert(StockLot),
+            [
+                {
+                    "item_type": getattr(item_type, "value", item_type),
+                    "item_id": item_id,
+                    "branch_id": branch_id,
+                    "lot_number": lot_number,
+                    "expiry_date": expiry_date,
+                    "quantity": quantity,
+                    "received_at": datetime.utcnow(),
+                }
+            ],
+        )
+
+
+def allocate_fefo(
+    db: Session, item_id: str, branch_id: Optional[str], qty: int
+) -> list[dict]:
+    """Take ``qty`` from the open lots of one stock row, earliest expiry first.
+
+    Lots are read in ``ix_stock_lots_fefo`` order a page at a time and only
+    until ``qty`` is covered; the lots taken from are decremented by one
+    statement. Returns what was taken per lot; whatever is left over comes
+    from the untracked part of the row.
+    """
+    taken, need, after = [], qty, None
+    while need > 0:
+        q = select(StockLot.id, StockLot.lot_number, StockLot.expiry_date, StockLot.quantity).where(
+            *_same_row(item_id, branch_id), StockLot.quantity > 0
+        )
+        if after:
+            q = q.where(tuple_(StockLot.expiry_date, StockLot.id) > after)
+        rows = db.execute(
+            q.order_by(StockLot.expiry_date, StockLot.id).limit(PAGE).with_for_update()
+        ).all()
+        for row in rows:
+            take = min(need, row.quantity)
+            taken.append(
+                {
+                    "id": row.id,
+                    "lot_number": row.lot_number,
+                    "expiry_date": row.expiry_date,
+                    "quantity": take,
+                }
+            )
+            need -= take
+            if not need:
+                break
+        if len(rows) < PAGE:
+            break
+        after = (rows[-1].expiry_date, rows[-1].id)
+    if taken:
+        db.execute(
+            update(StockLot)
+            .where(StockLot.id.in_([t["id"] for t in taken]))
+            .values(
+                quantity=StockLot.quantity
+                - case({t["id"]: t["quantity"] for t in taken}, value=StockLot.id, else_=0)
+            )
+            .execution_options(synchronize_session=False)
+        )
+    return taken
+
+
+def move_lots(
+    db: Session,
+    item_type: str,
+    from_item_id: str,
+    from_branch_id: Optional[str],
+    to_item_id: str,
+    to_branch_id: Optional[str],
+    qty: int,
+) -> None:
+    """Carry the FEFO share of ``qty`` from one stock row's lots to another's."""
+    for lot in allocate_fefo(db, from_item_id, from_branch_id, qty):
+        add_lot(
+            db, item_type, to_item_id, to_branch_id, lot["quantity"], lot["expiry_date"], lot["lot_number"]
+        )
+
+
+def expiring_lots(
+    db: Session, until: date, branch_id: Optional[str] = None, limit: int = 500
+) -> list[dict]:
+    """Open lots expiring on or before ``until``, soonest first.
+
+    Reads a range of ``ix_stock_lots_expiry``; names come from one lookup
+    per item type.
+    """
+    q = select(StockLot).where(StockLot.quantity > 0, StockLot.expiry_date <= until)
+    if branch_id:
+        q = q.where(StockLot.branch_id == branch_id)
+    lots = db.execute(q.order_by(StockLot.expiry_date, StockLot.id).limit(limit)).scalars().all()
+
+    ids = defaultdict(set)
+    for lot in lots:
+        ids[lot.item_type].add(lot.item_id)
+    names = {}
+    for item_type, item_ids in ids.items():
+        model = STOCK_MODELS[item_type]
+        for row in db.query(model.id, model.name).filter(model.id.in_(item_ids)):
+            names[row.id] = row.name
+    today = datetime.utcnow().date()
+    return [
+        {
+            "item_type": lot.item_type,
+            "item_id": lot.item_id,
+            "name": names.get(lot.item_id),
+            "branch_id": lot.branch_id,
+            "lot_number": lot.lot_number,
+            "expiry_date": lot.expiry_date.isoformat(),
+            "days_left": (lot.expiry_date - today).days,
+            "quantity": lot.quantity,
+        }
+        for lot in lots
+    ]
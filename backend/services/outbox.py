@@ -0,0 +1,209 @@
+import json
+import logging
+import os
+import threading
+import urllib.request
+from datetime import datetime
+from typing import Optional, Protocol
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from database import OutboxEvent
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "500"))
+POLL_SECONDS = float(os.getenv("OUTBOX_POLL_SECONDS", "1.0"))
+MAX_BACKOFF_SECONDS = 60.0
+WEBHOOK_TIMEOUT = float(os.getenv("OUTBOX_WEBHOOK_TIMEOUT", "10"))
+
+
+def emit_event(
+    db: Session, aggregate_type: str, aggregate_id: str, event_type: str, payload: dict
+) -> None:
+    """Stage an event in ``db``'s transaction; it exists only if that commits."""
+    db.add(
+        OutboxEvent(
+            aggregate_type=aggregate_type,
+            aggregate_id=str(aggregate_id),
+            event_type=event_type,
+            payload=json.dumps(payload, ensure_ascii=False, default=str),
+            created_at=datetime.utcnow(),
+        )
+    )
+
+
+def event_to_dict(event: OutboxEvent) -> dict:
+    return {
+        "id": event.id,
+        "aggregate_type": event.aggregate_type,
+        "aggregate_id": event.aggregate_id,
+        "type": event.event_type,
+        "payload": json.loads(event.payload),
+        "created_at": event.created_at.isoformat() if event.created_at else None,
+    }
+
+
+class Sink(Protocol):
+    def send(self, events: list[dict]) -> None:
+        """Deliver a batch or raise; a raised batch is retried as a whole."""
+
+
+class NDJSONFileSink:
+    """Appends one JSON line per event; consumers tail the file."""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def send(self, events: list[dict]) -> None:
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.path, "a", encoding="utf-8") as fh:
+            for event in events:
+                fh.write(json.dumps(event, ensure_ascii=False) + "\n")
+            fh.flush()
+            os.fsync(fh.fileno())
+
+
+class WebhookSink:
+    """POSTs each batch as a JSON array; any non-2xx answer is a failure."""
+
+    def __init__(self, url: str, timeout: float = WEBHOOK_TIMEOUT):
+        self.url = url
+        self.timeout = timeout
+
+    def send(self, events: list[dict]) -> None:
+        req = urllib.request.Request(
+            self.url,
+            data=json.dumps(events, ensure_ascii=False).encode("utf-8"),
+            headers={"Content-Type": "application/json"},
+            method="POST",
+        )
+        with urllib.request.urlopen(req, timeout=self.timeout) as resp:
+            if not 200 <= resp.status < 300:
+                raise RuntimeError(f"webhook answered {resp.status}")
+
+
+def sink_from_url(url: Optional[str]) -> Optional[Sink]:
+    """``file:/path/events.ndjson`` or an ``http(s)://`` webhook URL."""
+    if not url:
+        return None
+    if url.startswith("file:"):
+        return NDJSONFileSink(url[len("file:"):])
+    if url.startswith(("http://", "https://")):
+        return WebhookSink(url)
+    raise ValueError(f"Unsupported OUTBOX_SINK: {url}")
+
+
+class OutboxRelay:
+    """Delivers undelivered events in id order, at least once.
+
+    A batch is marked delivered only after the sink accepted it, so a crash
+    in between re-sends it; consumers dedupe on ``id``. Delivery stops at
+    the first failing batch, which keeps events of each aggregate in order.
+    """
+
+    def __init__(self, session_factory, sink: Sink, batch_size: int = BATCH_SIZE):
+        self.session_factory = session_factory
+        self.sink = sink
+        self.batch_size = batch_size
+        self.delivered = 0
+        self.failures = 0
+        self.last_error: Optional[str] = None
+        self.last_delivery: Optional[datetime] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def deliver_batch(self) -> int:
+        with self.session_factory() as db:
+            events = (
+                db.query(OutboxEvent)
+                .filter(OutboxEvent.delivered_at.is_(None))
+                .order_by(OutboxEvent.id)
+                .limit(self.batch_size)
+                .with_for_update()
+                .all()
+            )
+            if not events:
+                return 0
+            try:
+                self.sink.send([event_to_dict(e) for e in events])
+            except Exception as e:
+                db.rollback()
+                self.failures += 1
+                self.last_error = str(e)
+                db.query(OutboxEvent).filter(OutboxEvent.id == events[0].id).update(
+                    {"attempts": OutboxEvent.attempts + 1, "last_error": str(e)[:500]}
+                )
+                db.commit()
+                raise
+            now = datetime.utcnow()
+            for event in events:
+                event.delivered_at = now
+            db.commit()
+            self.delivered += len(events)
+            self.last_delivery = now
+            return len(events)
+
+    def run(self) -> None:
+        backoff = POLL_SECONDS
+        while not self._stop.is_set():
+            try:
+                sent = self.deliver_batch()
+                backoff = POLL_SECONDS
+                if sent == self.batch_size:
+                    continue
+            except Exception:
+                logger.exception("outbox delivery failed")
+                backoff = min(backoff * 2, MAX_BACKOFF_SECONDS)
+            self._stop.wait(backoff)
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self.run, name="outbox-relay", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+
+relay: Optional[OutboxRelay] = None
+
+
+def outbox_stats(db: Session) -> dict:
+    """Backlog and lag from the table, plus this process's relay counters."""
+    pending, oldest = db.query(
+        func.count(OutboxEvent.id), func.min(OutboxEvent.created_at)
+    ).filter(OutboxEvent.delivered_at.is_(None)).one()
+    if isinstance(oldest, str):
+        oldest = datetime.fromisoformat(oldest)
+    result = {
+        "pending": pending,
+        "lag_seconds": round((datetime.utcnow() - oldest).total_seconds(), 3) if oldest else 0.0,
+        "relay": None,
+    }
+    if relay is not None:
+        result["relay"] = {
+            "delivered": relay.delivered,
+            "failures": relay.failures,
+            "last_error": relay.last_error,
+            "last_delivery": relay.last_delivery.isoformat() if relay.last_delivery else None,
+        }
+    return result
+
+
+def start_relay(session_factory) -> Optional[OutboxRelay]:
+    """Start the background relay if ``OUTBOX_SINK`` is configured."""
+    global relay
+    sink = sink_from_url(os.getenv("OUTBOX_SINK"))
+    if sink is None:
+        return None
+    if relay is None:
+        relay = OutboxRelay(session_factory, sink)
+        relay.start()
+    return relay
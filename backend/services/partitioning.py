@@ -0,0 +1,266 @@
+import json
+import logging
+import os
+import threading
+from datetime import date, datetime
+from typing import Iterator, Optional
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+
+logger = logging.getLogger(__name__)
+
+# tables range-partitioned by month on their ``date`` column (Postgres only)
+PARTITIONED_TABLES = ("dispensing_records", "arrivals")
+MONTHS_AHEAD = int(os.getenv("PARTITION_MONTHS_AHEAD", "3"))
+# convert plain tables at startup; already partitioned ones are always extended
+PARTITION_ON_START = os.getenv("DB_PARTITIONING") == "1"
+# how often a running server creates the coming months
+MAINTENANCE_SECONDS = float(os.getenv("PARTITION_MAINTENANCE_SECONDS", str(6 * 3600)))
+
+
+def _add_months(day: date, months: int) -> date:
+    index = day.year * 12 + day.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def months_between(first: date, last: date) -> Iterator[date]:
+    """First days of every month from ``first``'s month to ``last``'s."""
+    month = date(first.year, first.month, 1)
+    while month <= last:
+        yield month
+        month = _add_months(month, 1)
+
+
+def partition_name(table: str, month: date) -> str:
+    return f"{table}_y{month.year}m{month.month:02d}"
+
+
+def default_partition_name(table: str) -> str:
+    return f"{table}_default"
+
+
+def _exists(conn: Connection, name: str) -> bool:
+    return conn.execute(text("SELECT to_regclass(:n)"), {"n": name}).scalar() is not None
+
+
+def is_partitioned(conn: Connection, table: str) -> bool:
+    if conn.dialect.name != "postgresql":
+        return False
+    return bool(
+        conn.execute(
+            text(
+                """
+                SELECT 1 FROM pg_partitioned_table pt
+                JOIN pg_class c ON c.oid = pt.partrelid
+                WHERE c.relname = :t
+            """
+            ),
+            {"t": table},
+        ).first()
+    )
+
+
+def create_partition(conn: Connection, table: str, month: date) -> None:
+    """Create ``month``'s partition, moving its rows out of the default one.
+
+    Postgres refuses a new partition while the default partition holds rows
+    in its range, so the default is detached for the move and re-attached.
+    """
+    name = partition_name(table, month)
+    if _exists(conn, name):
+        return
+    lower, upper = month.isoformat(), _add_months(month, 1).isoformat()
+    bounds = f"FOR VALUES FROM ('{lower}') TO ('{upper}')"
+    default = default_partition_name(table)
+    stray = _exists(conn, default) and conn.execute(
+        text(f"SELECT 1 FROM {default} WHERE date >= :lo AND date < :hi LIMIT 1"),
+        {"lo": lower, "hi": upper},
+    ).first()
+    if not stray:
+        conn.exec_driver_sql(f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {table} {bounds}")
+        return
+    conn.exec_driver_sql(f"ALTER TABLE {table} DETACH PARTITION {default}")
+    conn.exec_driver_sql(f"CREATE TABLE {name} PARTITION OF {table} {bounds}")
+    conn.exec_driver_sql(
+        f"WITH moved AS (DELETE FROM {default} WHERE date >= '{lower}' AND date < '{upper}' "
+        f"RETURNING *) INSERT INTO {table} SELECT * FROM moved"
+    )
+    conn.exec_driver_sql(f"ALTER TABLE {table} ATTACH PARTITION {default} DEFAULT")
+    logger.info("moved %s rows of %s out of the default partition", table, lower)
+
+
+def create_default_partition(conn: Connection, table: str) -> None:
+    """Catch-all partition, so writes past the last month never fail."""
+    conn.exec_driver_sql(
+        f"CREATE TABLE IF NOT EXISTS {default_partition_name(table)} PARTITION OF {table} DEFAULT"
+    )
+
+
+def ensure_partitions(conn: Connection, table: str, today: date, months_ahead: int = MONTHS_AHEAD) -> None:
+    """Create the partitions of the current and the next ``months_ahead`` months.
+
+    Months that have already spilled into the default partition get their
+    own partition as well.
+    """
+    create_default_partition(conn, table)
+    spilled = [
+        r[0].date()
+        for r in conn.execute(
+            text(
+                f"SELECT DISTINCT date_trunc('month', date) FROM {default_partition_name(table)} "
+                "ORDER BY 1"
+            )
+        )
+    ]
+    for month in [*spilled, *months_between(today, _add_months(today, months_ahead))]:
+        create_partition(conn, table, month)
+
+
+def maintain(engine, convert: bool = False) -> None:
+    """Keep every partitioned history table's months ahead of the calendar.
+
+    Postgres only; plain tables are converted when ``convert`` is set. An
+    advisory lock keeps workers from running the DDL at the same time.
+    """
+    if engine.dialect.name != "postgresql":
+        return
+    today = datetime.utcnow().date()
+    with engine.begin() as conn:
+        conn.execute(text("SELECT pg_advisory_xact_lock(hashtext('partition_maintenance'))"))
+        for table in PARTITIONED_TABLES:
+            if is_partitioned(conn, table):
+                ensure_partitions(conn, table, today)
+            elif convert:
+                convert_to_partitioned(conn, table, today)
+
+
+class PartitionMaintainer:
+    """Runs ``maintain`` every ``interval`` seconds in a daemon thread."""
+
+    def __init__(self, engine, interval: float = MAINTENANCE_SECONDS):
+        self.engine = engine
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                maintain(self.engine)
+            except Exception:
+                logger.warning("partition maintenance failed", exc_info=True)
+
+    def start(self) -> None:
+        if self.engine.dialect.name == "postgresql" and self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="partition-maintenance", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+
+def _table_dependents(conn: Connection, table: str) -> tuple[list, list, list]:
+    """Secondary indexes, outgoing and incoming foreign keys of ``table``.
+
+    Definitions are read while the table still has its name, so they can be
+    replayed on the table that replaces it.
+    """
+    params = {"t": table}
+    indexes = conn.execute(
+        text(
+            """
+            SELECT i.relname, pg_get_indexdef(x.indexrelid)
+            FROM pg_index x JOIN pg_class i ON i.oid = x.indexrelid
+            WHERE x.indrelid = CAST(:t AS regclass) AND NOT x.indisprimary
+            ORDER BY i.relname
+        """
+        ),
+        params,
+    ).all()
+    outgoing = conn.execute(
+        text(
+            "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+            "WHERE conrelid = CAST(:t AS regclass) AND contype = 'f' ORDER BY conname"
+        ),
+        params,
+    ).all()
+    incoming = conn.execute(
+        text(
+            "SELECT CAST(CAST(conrelid AS regclass) AS text), conname FROM pg_constraint "
+            "WHERE confrelid = CAST(:t AS regclass) AND contype = 'f' ORDER BY conname"
+        ),
+        params,
+    ).all()
+    return indexes, outgoing, incoming
+
+
+def convert_to_partitioned(conn: Connection, table: str, today: date) -> None:
+    """Rebuild a plain table as a monthly range-partitioned one.
+
+    The primary key becomes ``(id, date)`` because Postgres requires the
+    partition key in every unique constraint. Secondary indexes and the
+    table's own foreign keys are recreated on the new table. Foreign keys
+    pointing at it (``dispensing_items.record_id``) cannot reference a key
+    without ``date`` and are dropped by name; items are deleted through the
+    ORM cascade and by the archiver. The old table is then dropped without
+    CASCADE, so anything else still depending on it stops the conversion.
+    """
+    old = f"{table}_unpartitioned"
+    indexes, outgoing, incoming = _table_dependents(conn, table)
+    for referencing, name in incoming:
+        logger.warning("dropping foreign key %s of %s on %s", name, referencing, table)
+        conn.exec_driver_sql(f'ALTER TABLE {referencing} DROP CONSTRAINT "{name}"')
+    conn.exec_driver_sql(f"ALTER TABLE {table} RENAME TO {old}")
+    # free the names for the new table
+    for name, _ in outgoing:
+        conn.exec_driver_sql(f'ALTER TABLE {old} DROP CONSTRAINT "{name}"')
+    for name, _ in indexes:
+        conn.exec_driver_sql(f'DROP INDEX "{name}"')
+    conn.exec_driver_sql(f"UPDATE {old} SET date = now() AT TIME ZONE 'utc' WHERE date IS NULL")
+    conn.exec_driver_sql(
+        f"CREATE TABLE {table} (LIKE {old} INCLUDING DEFAULTS) PARTITION BY RANGE (date)"
+    )
+    conn.exec_driver_sql(f"ALTER TABLE {table} ALTER COLUMN date SET NOT NULL")
+    conn.exec_driver_sql(f"ALTER TABLE {table} ADD PRIMARY KEY (id, date)")
+    first = conn.execute(text(f"SELECT min(date) FROM {old}")).scalar()
+    for month in months_between(first.date() if first else today, _add_months(today, MONTHS_AHEAD)):
+        create_partition(conn, table, month)
+    create_default_partition(conn, table)
+    conn.exec_driver_sql(f"INSERT INTO {table} SELECT * FROM {old}")
+    conn.exec_driver_sql(f"DROP TABLE {old}")
+    for _, ddl in indexes:
+        conn.exec_driver_sql(ddl)
+    for name, definition in outgoing:
+        conn.exec_driver_sql(f'ALTER TABLE {table} ADD CONSTRAINT "{name}" {definition}')
+    if table == "dispensing_records":
+        conn.exec_driver_sql(
+            "CREATE INDEX IF NOT EXISTS idx_dispensing_records_branch_date "
+            "ON dispensing_records (branch_id, date)"
+        )
+    logger.info("partitioned %s by month", table)
+
+
+def detach_month(conn: Connection, table: str, month: date) -> None:
+    name = partition_name(table, month)
+    if not _exists(conn, name):
+        return
+    conn.exec_driver_sql(f"ALTER TABLE {table} DETACH PARTITION {name}")
+    conn.exec_driver_sql(f"DROP TABLE {name}")
+
+
+def scanned_relations(conn: Connection, sql: str, params: dict) -> set[str]:
+    """Tables and partitions the plan of ``sql`` scans, to verify pruning."""
+    plan = conn.execute(text(f"EXPLAIN (FORMAT JSON) {sql}"), params).scalar()
+    found: set[str] = set()
+
+    def walk(node: dict) -> None:
+        if "Relation Name" in node:
+            found.add(node["Relation Name"])
+        for child in node.get("Plans", ()):
+            walk(child)
+
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    walk(plan[0]["Plan"])
+    return found
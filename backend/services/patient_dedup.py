@@ -0,0 +1,289 @@
+"""Find patients registered more than once and merge them.
+
+Usage: python -m services.patient_dedup [--threshold T] [--max-block N]
+(replaces the stored candidate pairs; merging is done through the API)
+"""
+import argparse
+import os
+import time
+from collections import defaultdict
+from datetime import datetime
+from functools import lru_cache
+
+from sqlalchemy import delete, insert, or_, select, update
+from sqlalchemy.orm import Session, aliased
+
+from database import DispensingItem, DispensingRecord, Patient, PatientDuplicate, SessionLocal
+from services.outbox import emit_event
+from services.patients import name_key, phone_key
+from services.report_cache import invalidate_reports
+from services.sync import record_change
+
+THRESHOLD = float(os.getenv("PATIENT_DEDUP_THRESHOLD", "0.75"))
+# blocks larger than this (placeholder phones, very common names) are
+# skipped rather than compared pairwise
+MAX_BLOCK = int(os.getenv("PATIENT_DEDUP_MAX_BLOCK", "500"))
+# a matching name alone never reaches the default threshold (namesakes);
+# it also needs the same phone or a similar address, and relatives sharing
+# a phone stay below it
+NAME_WEIGHT, CONTACT_WEIGHT = 0.6, 0.4
+# the national number: +7 and 8 trunk prefixes differ, the last ten digits don't
+PHONE_DIGITS = 10
+# shorter addresses are placeholders ("-", "нет") and never match
+MIN_ADDRESS = 5
+INSERT_CHUNK = 5000
+
+_TRANSLIT = {
+    "а": "a", "б": "b", "в": "v", "г": "g", "д": "d", "е": "e", "ё": "e", "ж": "zh",
+    "з": "z", "и": "i", "й": "i", "к": "k", "л": "l", "м": "m", "н": "n", "о": "o",
+    "п": "p", "р": "r", "с": "s", "т": "t", "у": "u", "ф": "f", "х": "kh", "ц": "ts",
+    "ч": "ch", "ш": "sh", "щ": "shch", "ъ": "", "ы": "y", "ь": "", "э": "e", "ю": "yu",
+    "я": "ya", "ә": "a", "ғ": "g", "қ": "k", "ң": "n", "ө": "o", "ұ": "u", "ү": "u",
+    "һ": "h", "і": "i",
+}
+_TRANSLIT_TABLE = str.maketrans(_TRANSLIT)
+_SOUNDEX = {
+    c: digit
+    for digit, letters in {"1": "bfpv", "2": "cgjkqsxz", "3": "dt", "4": "l", "5": "mn", "6": "r"}.items()
+    for c in letters
+}
+
+
+def translit(text_: str) -> str:
+    """Latin spelling of a casefolded name, so both scripts compare alike."""
+    return text_.translate(_TRANSLIT_TABLE)
+
+
+@lru_cache(maxsize=100_000)  # names repeat a lot
+def soundex(word: str) -> str:
+    word = "".join(c for c in word if "a" <= c <= "z")
+    if not word:
+        return ""
+    code, last = word[0], _SOUNDEX.get(word[0], "")
+    for c in word[1:]:
+        digit = _SOUNDEX.get(c, "")
+        if digit and digit != last:
+            code += digit
+        if c not in "hw":
+            last = digit
+    return (code + "000")[:4]
+
+
+def trigrams(text_: str) -> frozenset:
+    """Character trigrams of each word, padded as pg_trgm does."""
+    grams = set()
+    for word in text_.split():
+        padded = f"  {word} "
+        grams.update(padded[i : i + 3] for i in range(len(padded) - 2))
+    return frozenset(grams)
+
+
+def _similarity(a: int, b: int, texts: list[str], cache: dict[int, frozenset]) -> float:
+    """Trigram Jaccard similarity of ``texts[a]`` and ``texts[b]``."""
+    for i in (a, b):
+        if i not in cache:
+            cache[i] = trigrams(texts[i])
+    union = len(cache[a] | cache[b])
+    return len(cache[a] & cache[b]) / union if union else 0.0
+
+
+def blocking_keys(last_name: str, first_name: str, phone: str) -> list[str]:
+    """Keys under which a patient is compared with others.
+
+    Two patients are scored only if they share a key: the national phone
+    number, or the soundex codes of last and first name.
+    """
+    return _keys(
+        translit(name_key(last_name, None)), translit(name_key(first_name, None)), phone_key(phone)
+    )
+
+
+def _keys(last: str, first: str, digits: str) -> list[str]:
+    keys = []
+    if len(digits) >= 7:
+        keys.append("p:" + digits[-PHONE_DIGITS:])
+    code = soundex(last)
+    if code:
+        keys.append(f"n:{code}:{soundex(first)}")
+    return keys
+
+
+def scan(db: Session, threshold: float = THRESHOLD, max_block: int = MAX_BLOCK) -> tuple[list[dict], dict]:
+    """Likely duplicate pairs of all patients, best first, and scan stats.
+
+    Patients are streamed once and grouped by ``blocking_keys``; only pairs
+    inside a block are scored, each once, so the work follows the block
+    sizes instead of n². Blocks over ``max_block`` are skipped. The score
+    weighs trigram similarity of the transliterated "last first" names
+    against the contact: 1 for the same national phone number, else the
+    addresses' trigram similarity. Pairs whose names alone rule them out
+    skip the contact comparison.
+    """
+    started = time.perf_counter()
+    ids, names, phones, addresses = [], [], [], []
+    blocks = defaultdict(list)
+    rows = db.execute(
+        select(
+            Patient.id, Patient.last_name, Patient.first_name, Patient.phone, Patient.address
+        ).execution_options(yield_per=10000)
+    )
+    for index, r in enumerate(rows):
+        ids.append(r.id)
+        last = translit(name_key(r.last_name, None))
+        first = translit(name_key(r.first_name, None))
+        digits = phone_key(r.phone)
+        names.append(f"{last} {first}".strip())
+        phones.append(digits[-PHONE_DIGITS:])
+        address = translit(name_key(r.address, None))
+        addresses.append(address if len(address) >= MIN_ADDRESS else "")
+        for key in _keys(last, first, digits):
+            blocks[key].append(index)
+
+    # a pair sharing a phone is scored in that phone's block, unless the
+    # block is too big, so no pair is scored twice
+    oversized = {key for key, members in blocks.items() if len(members) > max_block}
+    name_grams: dict[int, frozenset] = {}
+    address_grams: dict[int, frozenset] = {}
+    found, compared = [], 0
+    for key, members in blocks.items():
+        if len(members) < 2 or key in oversized:
+            continue
+        by_name = key.startswith("n:")
+        for x, a in enumerate(members):
+            for b in members[x + 1 :]:
+                same_phone = len(phones[a]) >= 7 and phones[a] == phones[b]
+                if by_name and same_phone and "p:" + phones[a] not in oversized:
+                    continue
+                compared += 1
+                name_sim = _similarity(a, b, names, name_grams)
+                if NAME_WEIGHT * name_sim + CONTACT_WEIGHT < threshold:
+                    continue
+                contact = 1.0 if same_phone else _similarity(a, b, addresses, address_grams)
+                score = NAME_WEIGHT * name_sim + CONTACT_WEIGHT * contact
+                if score >= threshold:
+                    first, second = sorted((ids[a], ids[b]))
+                    found.append(
+                        {
+                            "patient_id": first,
+                            "duplicate_id": second,
+                            "score": round(score, 4),
+                            "same_phone": same_phone,
+                            "name_similarity": round(name_sim, 4),
+                        }
+                    )
+    found.sort(key=lambda p: (-p["score"], p["patient_id"], p["duplicate_id"]))
+    return found, {
+        "patients": len(ids),
+        "blocks": sum(1 for m in blocks.values() if len(m) > 1),
+        "skipped_blocks": len(oversized),
+        "compared": compared,
+        "candidates": len(found),
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+    }
+
+
+def run(db: Session, threshold: float = THRESHOLD, max_block: int = MAX_BLOCK) -> dict:
+    """Scan and replace the stored candidate pairs; the caller commits."""
+    found, stats = scan(db, threshold, max_block)
+    db.execute(delete(PatientDuplicate))
+    now = datetime.utcnow()
+    for i in range(0, len(found), INSERT_CHUNK):
+        db.execute(
+            insert(PatientDuplicate), [{**p, "found_at": now} for p in found[i : i + INSERT_CHUNK]]
+        )
+    return stats
+
+
+def candidates(db: Session, min_score: float = 0.0, limit: int = 100) -> list[dict]:
+    """Stored pairs, best first, with both patients' details."""
+    a, b = aliased(Patient), aliased(Patient)
+    fields = ("id", "first_name", "last_name", "phone", "branch_id")
+    rows = db.execute(
+        select(PatientDuplicate, a, b)
+        .join(a, a.id == PatientDuplicate.patient_id)
+        .join(b, b.id == PatientDuplicate.duplicate_id)
+        .where(PatientDuplicate.score >= min_score)
+        .order_by(
+            PatientDuplicate.score.desc(), PatientDuplicate.patient_id, PatientDuplicate.duplicate_id
+        )
+        .limit(limit)
+    ).all()
+    return [
+        {
+            "score": pair.score,
+            "same_phone": pair.same_phone,
+            "name_similarity": pair.name_similarity,
+            "patient": {f: getattr(first, f) for f in fields},
+            "duplicate": {f: getattr(second, f) for f in fields},
+        }
+        for pair, first, second in rows
+    ]
+
+
+def merge(db: Session, keep_id: str, merge_ids: list[str]) -> dict:
+    """Fold ``merge_ids`` into ``keep_id`` and delete them; the caller commits.
+
+    Dispensings (and their items' patient copies) are re-pointed by one
+    UPDATE each, seeking the patient_id indexes. Raises LookupError if a
+    patient does not exist.
+    """
+    merge_ids = [m for m in dict.fromkeys(merge_ids) if m != keep_id]
+    if not merge_ids:
+        raise ValueError("No other patients to merge")
+    found = {
+        r.id: r.branch_id
+        for r in db.execute(
+            select(Patient.id, Patient.branch_id)
+            .where(Patient.id.in_([keep_id, *merge_ids]))
+            .with_for_update()
+        )
+    }
+    missing = [p for p in (keep_id, *merge_ids) if p not in found]
+    if missing:
+        raise LookupError("Patient not found: " + ", ".join(missing))
+
+    moved = db.execute(
+        update(DispensingRecord)
+        .where(DispensingRecord.patient_id.in_(merge_ids))
+        .values(patient_id=keep_id)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    db.execute(
+        update(DispensingItem)
+        .where(DispensingItem.patient_id.in_(merge_ids))
+        .values(patient_id=keep_id)
+        .execution_options(synchronize_session=False)
+    )
+    db.execute(
+        delete(PatientDuplicate).where(
+            or_(PatientDuplicate.patient_id.in_(merge_ids), PatientDuplicate.duplicate_id.in_(merge_ids))
+        )
+    )
+    db.execute(
+        delete(Patient).where(Patient.id.in_(merge_ids)).execution_options(synchronize_session=False)
+    )
+    for patient_id in merge_ids:
+        record_change(db, "patients", patient_id, found[patient_id], deleted=True)
+    invalidate_reports(db, ("dispensings",))
+    emit_event(
+        db, "patient", keep_id, "patient.merged", {"merged_ids": merge_ids, "dispensings": moved}
+    )
+    return {"kept": keep_id, "merged": merge_ids, "dispensings_moved": moved}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--threshold", type=float, default=THRESHOLD)
+    parser.add_argument("--max-block", type=int, default=MAX_BLOCK)
+    args = parser.parse_args()
+    with SessionLocal() as db:
+        stats = run(db, args.threshold, args.max_block)
+        db.commit()
+    print(
+        f"patients={stats['patients']} blocks={stats['blocks']} skipped={stats['skipped_blocks']} "
+        f"compared={stats['compared']} candidates={stats['candidates']} in {stats['elapsed_ms']} ms"
+    )
+
+
+if __name__ == "__main__":
+    main()
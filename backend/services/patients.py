@@ -0,0 +1,245 @@
+from collections import defaultdict
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import bindparam, desc, distinct, event, func, select, true, tuple_, update
+from sqlalchemy.orm import Session
+
+from database import DispensingItem, DispensingRecord, Patient
+
+# prefix search walks (key, id) in order, per branch or across all of them;
+# a patient's history is read newest first, its items by record id
+PATIENT_INDEXES = (
+    "CREATE INDEX IF NOT EXISTS idx_patients_search_name ON patients (search_name, id)",
+    "CREATE INDEX IF NOT EXISTS idx_patients_branch_search_name ON patients (branch_id, search_name, id)",
+    "CREATE INDEX IF NOT EXISTS idx_patients_search_phone ON patients (search_phone, id)",
+    "CREATE INDEX IF NOT EXISTS idx_dispensing_records_patient_date ON dispensing_records (patient_id, date)",
+    "CREATE INDEX IF NOT EXISTS idx_dispensing_items_record ON dispensing_items (record_id)",
+)
+
+TOP_ITEMS = 5
+# the columns of the Patient schema, in its order
+PATIENT_FIELDS = (
+    "first_name", "last_name", "illness", "phone", "address", "branch_id", "id", "version",
+)
+
+
+def name_key(last_name: Optional[str], first_name: Optional[str]) -> str:
+    """``"last first"`` casefolded with runs of whitespace collapsed."""
+    text_ = f"{last_name or ''} {first_name or ''}".casefold().replace("ё", "е")
+    return " ".join(text_.split())
+
+
+def phone_key(phone: Optional[str]) -> str:
+    return "".join(filter(str.isdigit, phone or ""))
+
+
+@event.listens_for(Session, "before_flush")
+def _set_search_keys(session: Session, flush_context, instances) -> None:
+    # matched by table so reloaded model modules are covered too
+    for obj in (*session.new, *session.dirty):
+        if getattr(obj, "__tablename__", None) == Patient.__tablename__:
+            obj.search_name = name_key(obj.last_name, obj.first_name)
+            obj.search_phone = phone_key(obj.phone)
+
+
+def backfill_search_keys(conn, batch: int = 1000) -> int:
+    """Fill the search keys of rows written before they existed."""
+    filled = 0
+    while True:
+        rows = conn.execute(
+            select(Patient.id, Patient.first_name, Patient.last_name, Patient.phone)
+            .where(Patient.search_name.is_(None))
+            .limit(batch)
+        ).all()
+        if not rows:
+            return filled
+        conn.execute(
+            update(Patient.__table__)
+            .where(Patient.__table__.c.id == bindparam("pid"))
+            .values(search_name=bindparam("sn"), search_phone=bindparam("sp")),
+            [
+                {"pid": r.id, "sn": name_key(r.last_name, r.first_name), "sp": phone_key(r.phone)}
+                for r in rows
+            ],
+        )
+        filled += len(rows)
+
+
+def _prefix_range(column, prefix: str):
+    # everything starting with ``prefix`` sorts in [prefix, prefix with its
+    # last character incremented) under byte order
+    upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+    return (column >= prefix, column < upper)
+
+
+def search_patients(
+    db: Session,
+    q: Optional[str],
+    branch_id: Optional[str],
+    limit: int,
+    cursor: Optional[str] = None,
+) -> dict:
+    """One page of patients whose name or phone starts with ``q``.
+
+    Letters in ``q`` search ``"last first"``, digits alone search the phone
+    number's digits. Both are ranges of an index in (key, id) order, which is
+    also the page order; the cursor is the last row's (key, id).
+    """
+    names = PATIENT_FIELDS
+    prefix = name_key(q, None) if q else ""
+    if prefix and not any(c.isalpha() for c in prefix) and phone_key(prefix):
+        key, prefix = Patient.search_phone, phone_key(prefix)
+    else:
+        key = Patient.search_name
+    stmt = select(*(getattr(Patient, n) for n in names), key.label("key"))
+    if branch_id:
+        stmt = stmt.where(Patient.branch_id == branch_id)
+    if prefix:
+        stmt = stmt.where(*_prefix_range(key, prefix))
+    if cursor:
+        after_key, after_id = cursor.rsplit("|", 1)
+        stmt = stmt.where(tuple_(key, Patient.id) > (after_key, after_id))
+    rows = db.execute(stmt.order_by(key, Patient.id).limit(limit + 1)).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    return {
+        "patients": [dict(zip(names, row)) for row in rows],
+        "has_more": has_more,
+        "cursor": f"{rows[-1].key}|{rows[-1].id}" if has_more else None,
+    }
+
+
+def _summary(db: Session, patient_id: str) -> dict:
+    """Visit totals and most dispensed items in one statement.
+
+    The totals row is joined with the top items, so both come back from the
+    same snapshot and each seeks the (patient_id, date) index once.
+    """
+    totals = (
+        select(
+            func.count(DispensingRecord.id).label("visits"),
+            func.min(DispensingRecord.date).label("first_visit"),
+            func.max(DispensingRecord.date).label("last_visit"),
+        )
+        .where(DispensingRecord.patient_id == patient_id)
+        .subquery()
+    )
+    quantity = func.sum(DispensingItem.quantity).label("quantity")
+    top = (
+        select(
+            DispensingItem.item_type,
+            DispensingItem.item_id,
+            func.max(DispensingItem.item_name).label("name"),
+            quantity,
+            func.count(distinct(DispensingItem.record_id)).label("times"),
+        )
+        .join(DispensingRecord, DispensingRecord.id == DispensingItem.record_id)
+        .where(DispensingRecord.patient_id == patient_id)
+        .group_by(DispensingItem.item_type, DispensingItem.item_id)
+        .order_by(desc("quantity"), DispensingItem.item_id)
+        .limit(TOP_ITEMS)
+        .subquery()
+    )
+    rows = db.execute(
+        select(totals, top)
+        .select_from(totals.outerjoin(top, true()))
+        .order_by(desc(top.c.quantity), top.c.item_id)
+    ).all()
+    first = rows[0]
+    return {
+        "visits": int(first.visits),
+        "first_visit": first.first_visit.isoformat() if first.first_visit else None,
+        "last_visit": first.last_visit.isoformat() if first.last_visit else None,
+        "top_items": [
+            {
+                "type": r.item_type,
+                "item_id": r.item_id,
+                "name": r.name,
+                "quantity": int(r.quantity),
+                "times": int(r.times),
+            }
+            for r in rows
+            if r.item_id is not None
+        ],
+    }
+
+
+def patient_history(
+    db: Session, patient_id: str, limit: int, cursor: Optional[str] = None
+) -> Optional[dict]:
+    """One page of a patient's dispensings, newest first, with their items.
+
+    The first page also carries the summary. Pages are keyed on (date, id);
+    the items of a page are read with one query.
+    """
+    patient = db.execute(
+        select(Patient.id, Patient.first_name, Patient.last_name, Patient.phone, Patient.branch_id)
+        .where(Patient.id == patient_id)
+    ).first()
+    if patient is None:
+        return None
+
+    stmt = select(
+        DispensingRecord.id,
+        DispensingRecord.date,
+        DispensingRecord.branch_id,
+        DispensingRecord.employee_name,
+    ).where(DispensingRecord.patient_id == patient_id)
+    if cursor:
+        after_date, after_id = cursor.rsplit("|", 1)
+        stmt = stmt.where(
+            tuple_(DispensingRecord.date, DispensingRecord.id)
+            < (datetime.fromisoformat(after_date), after_id)
+        )
+    rows = db.execute(
+        stmt.order_by(DispensingRecord.date.desc(), DispensingRecord.id.desc()).limit(limit + 1)
+    ).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    items = defaultdict(list)
+    if rows:
+        for item in db.execute(
+            select(
+                DispensingItem.record_id,
+                DispensingItem.item_type,
+                DispensingItem.item_id,
+                DispensingItem.item_name,
+                DispensingItem.quantity,
+            )
+            .where(DispensingItem.record_id.in_([r.id for r in rows]))
+            .order_by(DispensingItem.record_id, DispensingItem.item_name)
+        ):
+            items[item.record_id].append(
+                {
+                    "type": item.item_type,
+                    "item_id": item.item_id,
+                    "name": item.item_name,
+                    "quantity": item.quantity,
+                }
+            )
+
+    last = rows[-1] if rows else None
+    return {
+        "patient": {
+            "id": patient.id,
+            "first_name": patient.first_name,
+            "last_name": patient.last_name,
+            "phone": patient.phone,
+            "branch_id": patient.branch_id,
+        },
+        "summary": None if cursor else _summary(db, patient_id),
+        "dispensings": [
+            {
+                "id": r.id,
+                "date": r.date.isoformat(),
+                "branch_id": r.branch_id,
+                "employee_name": r.employee_name,
+                "items": items[r.id],
+            }
+            for r in rows
+        ],
+        "has_more": has_more,
+        "cursor": f"{last.date.isoformat()}|{last.id}" if has_more else None,
+    }
@@ -0,0 +1,225 @@
+"""Compare stock quantity columns with the movement history.
+
+Usage: python -m services.reconciliation [--fix] [BRANCH_ID|main ...]
+(no branch ids: the main warehouse and every branch)
+"""
+import argparse
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Iterable, Optional
+
+from sqlalchemy import DateTime, bindparam, insert, text
+from sqlalchemy.orm import Session
+
+from database import STOCK_MODELS, SessionLocal, StockAdjustment
+
+WORKERS = int(os.getenv("RECONCILE_WORKERS", "4"))
+REASON = "reconciliation"
+
+
+def ledger_sql(table: str, main: bool, as_of: bool = False) -> str:
+    """Quantity column and ledger balance of every row of one branch.
+
+    Rows are matched to movements as in ``services.history``: by id for what
+    leaves or enters the row itself, by name for shipments and transfers
+    arriving at a branch. By-id sums are restricted to the branch's own ids
+    so each worker reads only its slice of the movement tables. Years moved
+    out by ``services.archive`` are added from ``archived_totals``. With
+    ``as_of`` only movements dated up to ``:end`` are summed.
+    """
+    own = "x2.branch_id IS NULL" if main else "x2.branch_id = :b"
+    ids = f"SELECT x2.id FROM {table} x2 WHERE {own}"
+
+    def until(column: str) -> str:
+        return f" AND {column} <= :end" if as_of else ""
+
+    dispensed = (
+        "dispensing_items di JOIN dispensing_records dr ON dr.id = di.record_id"
+        if as_of
+        else "dispensing_items di"
+    )
+    return f"""
+        SELECT x.id AS item_id, x.name AS name, x.category_id AS category_id,
+               COALESCE(x.quantity, 0) AS actual,
+               COALESCE(arr.q, 0) + COALESCE(sin.q, 0) + COALESCE(tin.q, 0)
+               + COALESCE(adj.q, 0) + COALESCE(arch.q, 0) - COALESCE(sout.q, 0)
+               - COALESCE(tout.q, 0) - COALESCE(disp.q, 0) AS expected
+        FROM {table} x
+        LEFT JOIN (
+            SELECT item_id, SUM(quantity) AS q FROM arrivals
+            WHERE item_type = :t AND item_id IN ({ids}){until("date")} GROUP BY item_id
+        ) arr ON arr.item_id = x.id
+        LEFT JOIN (
+            SELECT si.item_name, SUM(si.quantity) AS q
+            FROM shipment_items si JOIN shipments s ON s.id = si.shipment_id
+            WHERE s.status = 'accepted' AND s.to_branch_id = :b AND si.item_type = :t{until("s.created_at")}
+            GROUP BY si.item_name
+        ) sin ON sin.item_name = x.name
+        LEFT JOIN (
+            SELECT si.item_id, SUM(si.quantity) AS q
+            FROM shipment_items si JOIN shipments s ON s.id = si.shipment_id
+            WHERE s.status = 'accepted' AND si.item_type = :t AND si.item_id IN ({ids}){until("s.created_at")}
+            GROUP BY si.item_id
+        ) sout ON sout.item_id = x.id
+        LEFT JOIN (
+            SELECT medicine_name, SUM(quantity) AS q FROM transfers
+            WHERE item_type = :t AND to_branch_id = :b{until("date")} GROUP BY medicine_name
+        ) tin ON tin.medicine_name = x.name
+        LEFT JOIN (
+            SELECT medicine_id, SUM(quantity) AS q FROM transfers
+            WHERE item_type = :t AND medicine_id IN ({ids}){until("date")} GROUP BY medicine_id
+        ) tout ON tout.medicine_id = x.id
+        LEFT JOIN (
+            SELECT di.item_id, SUM(di.quantity) AS q FROM {dispensed}
+            WHERE di.item_type = :t AND di.item_id IN ({ids}){until("dr.date")} GROUP BY di.item_id
+        ) disp ON disp.item_id = x.id
+        LEFT JOIN (
+            SELECT item_id, SUM(quantity) AS q FROM stock_adjustments
+            WHERE item_type = :t AND item_id IN ({ids}){until("created_at")} GROUP BY item_id
+        ) adj ON adj.item_id = x.id
+        LEFT JOIN (
+            SELECT item_id, SUM(quantity) AS q FROM archived_totals
+            WHERE item_type = :t AND item_id IN ({ids}){until("date")} GROUP BY item_id
+        ) arch ON arch.item_id = x.id
+        WHERE {own.replace('x2.', 'x.')}
+    """
+
+
+def balances_as_of(db: Session, branch_id: Optional[str], end: datetime) -> list[dict]:
+    """Ledger balance at ``end`` of every stock row of one branch that holds any.
+
+    Rows come in the shape of the current-stock report, ordered by type and
+    name.
+    """
+    rows = []
+    for item_type, model in STOCK_MODELS.items():
+        stmt = text(
+            f"""
+            SELECT l.item_id, l.name, COALESCE(c.name, '—') AS category, l.expected AS quantity
+            FROM ({ledger_sql(model.__tablename__, branch_id is None, as_of=True)}) l
+            LEFT JOIN categories c ON c.id = l.category_id
+            WHERE l.expected > 0
+        """
+        ).bindparams(bindparam("end", type_=DateTime))
+        rows += [
+            {"item_type": item_type, **r}
+            for r in db.execute(
+                stmt, {"t": item_type, "b": branch_id, "end": end}
+            ).mappings()
+        ]
+    rows.sort(key=lambda r: (r["item_type"], r["name"]))
+    return rows
+
+
+def reconcile_branch(branch_id: Optional[str], fix: bool = False, session_factory=SessionLocal) -> dict:
+    """Drift of one branch (``None`` = main warehouse), fixed if asked.
+
+    Each item table is checked by one statement, so quantities and sums come
+    from the same snapshot; corrections are written in that transaction.
+    Adjustments align the ledger with the quantity column, which is what
+    staff edit after a physical count.
+    """
+    drift, checked = [], 0
+    with session_factory() as db:
+        for item_type, model in STOCK_MODELS.items():
+            rows = db.execute(
+                text(ledger_sql(model.__tablename__, branch_id is None)),
+                {"t": item_type, "b": branch_id},
+            ).all()
+            checked += len(rows)
+            for r in rows:
+                actual, expected = int(r.actual), int(r.expected)
+                if actual != expected or actual < 0:
+                    drift.append(
+                        {
+                            "branch_id": branch_id,
+                            "item_type": item_type,
+                            "item_id": r.item_id,
+                            "name": r.name,
+                            "actual": actual,
+                            "expected": expected,
+                            "drift": actual - expected,
+                            "negative": actual < 0,
+                        }
+                    )
+        corrections = [d for d in drift if d["drift"]]
+        if fix and corrections:
+            now = datetime.utcnow()
+            db.execute(
+                insert(StockAdjustment),
+                [
+                    {
+                        "id": str(uuid.uuid4()),
+                        "item_type": d["item_type"],
+                        "item_id": d["item_id"],
+                        "branch_id": branch_id,
+                        "quantity": d["drift"],
+                        "reason": REASON,
+                        "created_at": now,
+                    }
+                    for d in corrections
+                ],
+            )
+            db.commit()
+    return {
+        "checked": checked,
+        "drift": drift,
+        "adjusted": len(corrections) if fix else 0,
+    }
+
+
+def parse_branch(branch_id: Optional[str]) -> Optional[str]:
+    """``None``, ``""`` and ``"main"`` name the main warehouse."""
+    return None if branch_id in (None, "", "main") else branch_id
+
+
+def all_branch_ids(session_factory=SessionLocal) -> list[Optional[str]]:
+    with session_factory() as db:
+        return [None] + [r[0] for r in db.execute(text("SELECT id FROM branches ORDER BY id"))]
+
+
+def reconcile(
+    branch_ids: Optional[Iterable[Optional[str]]] = None,
+    fix: bool = False,
+    workers: int = WORKERS,
+    session_factory=SessionLocal,
+) -> dict:
+    """Reconcile ``branch_ids`` (default: all) with one branch per worker."""
+    started = time.perf_counter()
+    branches = list(branch_ids) if branch_ids is not None else all_branch_ids(session_factory)
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="reconcile") as pool:
+        results = list(pool.map(lambda b: reconcile_branch(b, fix, session_factory), branches))
+    return {
+        "branches": len(branches),
+        "checked": sum(r["checked"] for r in results),
+        "adjusted": sum(r["adjusted"] for r in results),
+        "drift": [d for r in results for d in r["drift"]],
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("branch_ids", nargs="*")
+    parser.add_argument("--fix", action="store_true", help="write correcting adjustments")
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    args = parser.parse_args()
+    branches = [parse_branch(b) for b in args.branch_ids] or None
+    report = reconcile(branches, fix=args.fix, workers=args.workers)
+    for d in report["drift"]:
+        print(
+            f"{d['branch_id'] or 'main'}\t{d['item_type']}\t{d['name']}\t"
+            f"actual={d['actual']}\texpected={d['expected']}\tdrift={d['drift']:+d}"
+        )
+    print(
+        f"branches={report['branches']} checked={report['checked']} "
+        f"drifting={len(report['drift'])} adjusted={report['adjusted']} "
+        f"in {report['elapsed_ms']} ms"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+import uuid
+from collections import defaultdict
+from typing import Iterable, Optional
+
+from sqlalchemy import bindparam, text
+from sqlalchemy.orm import Session
+
+from database import Shipment, ShipmentItem
+
+_TABLES = {"medicine": "medicines", "medical_device": "medical_devices"}
+
+# shipments whose items are already promised out of the main warehouse
+_OPEN_STATUSES = ("draft", "pending")
+
+
+def allocate_fairly(available: int, needs: list[int]) -> list[int]:
+    """Split ``available`` units proportionally to ``needs`` (largest remainder).
+
+    Nobody gets more than they need; leftovers from rounding go to the
+    largest fractional shares, ties to the larger need.
+    """
+    total = sum(needs)
+    if available <= 0 or total <= 0:
+        return [0] * len(needs)
+    if available >= total:
+        return list(needs)
+    shares = [available * n / total for n in needs]
+    alloc = [int(s) for s in shares]
+    order = sorted(
+        range(len(needs)), key=lambda i: (alloc[i] - shares[i], -needs[i], i)
+    )
+    for i in order[: available - sum(alloc)]:
+        alloc[i] += 1
+    return alloc
+
+
+def _shortages(db: Session, item_type: str, branch_ids: Optional[list[str]]) -> list:
+    table = _TABLES[item_type]
+    branch_filter = "AND b.branch_id IN :branches" if branch_ids else ""
+    sql = text(
+        f"""
+        SELECT b.branch_id, b.name, b.quantity,
+               COALESCE(th.max_qty, th.min_qty) AS target,
+               m.id AS main_id, m.quantity AS main_qty
+        FROM stock_thresholds th
+        JOIN {table} b ON b.id = th.item_id
+        JOIN {table} m ON m.name = b.name AND m.branch_id IS NULL
+        WHERE th.item_type = :t
+          AND b.branch_id IS NOT NULL
+          AND b.quantity <= th.min_qty
+          AND COALESCE(th.max_qty, th.min_qty) > b.quantity
+          {branch_filter}
+        ORDER BY m.id, b.branch_id
+    """
+    )
+    params = {"t": item_type}
+    if branch_ids:
+        sql = sql.bindparams(bindparam("branches", expanding=True))
+        params["branches"] = list(branch_ids)
+    return db.execute(sql, params).all()
+
+
+def _open_shipments(db: Session) -> tuple[dict, dict]:
+    """Units already promised per main item, and per (branch, item) in transit."""
+    rows = db.execute(
+        text(
+            """
+            SELECT s.to_branch_id, si.item_type, si.item_id, SUM(si.quantity) AS qty
+            FROM shipment_items si
+            JOIN shipments s ON s.id = si.shipment_id
+            WHERE s.status IN :statuses
+            GROUP BY s.to_branch_id, si.item_type, si.item_id
+        """
+        ).bindparams(bindparam("statuses", expanding=True)),
+        {"statuses": list(_OPEN_STATUSES)},
+    ).all()
+    reserved: dict = defaultdict(int)
+    inbound: dict = defaultdict(int)
+    for branch_id, item_type, item_id, qty in rows:
+        reserved[(item_type, item_id)] += int(qty or 0)
+        inbound[(branch_id, item_type, item_id)] += int(qty or 0)
+    return reserved, inbound
+
+
+def plan_replenishment(db: Session, branch_ids: Optional[Iterable[str]] = None) -> list[dict]:
+    """Proposed shipment lines bringing branches back to their max levels.
+
+    Branch rows at or below ``min_qty`` are topped up to ``max_qty`` from the
+    main warehouse row with the same name, net of open shipments. When main
+    stock is short it is shared in proportion to each branch's need.
+    """
+    branch_ids = list(branch_ids) if branch_ids else None
+    reserved, inbound = _open_shipments(db)
+    lines: list[dict] = []
+    for item_type in _TABLES:
+        by_item: dict = defaultdict(list)
+        for branch_id, name, qty, target, main_id, main_qty in _shortages(db, item_type, branch_ids):
+            need = int(target) - int(qty) - inbound.get((branch_id, item_type, main_id), 0)
+            if need > 0:
+                by_item[(main_id, name, int(main_qty or 0))].append((branch_id, int(qty), need))
+
+        for (main_id, name, main_qty), wants in by_item.items():
+            available = main_qty - reserved.get((item_type, main_id), 0)
+            alloc = allocate_fairly(available, [w[2] for w in wants])
+            for (branch_id, qty, need), units in zip(wants, alloc):
+                lines.append(
+                    {
+                        "branch_id": branch_id,
+                        "item_type": item_type,
+                        "item_id": main_id,
+                        "name": name,
+                        "on_hand": qty,
+                        "need": need,
+                        "quantity": units,
+                    }
+                )
+    return lines
+
+
+def create_draft_shipments(db: Session, lines: list[dict]) -> list[str]:
+    """Stage one draft shipment per branch; the caller commits."""
+    per_branch: dict = defaultdict(list)
+    for line in lines:
+        if line["quantity"] > 0:
+            per_branch[line["branch_id"]].append(line)
+
+    shipments, items = [], []
+    for branch_id, branch_lines in sorted(per_branch.items()):
+        shipment_id = str(uuid.uuid4())
+        shipments.append({"id": shipment_id, "to_branch_id": branch_id, "status": "draft"})
+        items.extend(
+            {
+                "id": str(uuid.uuid4()),
+                "shipment_id": shipment_id,
+                "item_type": line["item_type"],
+                "item_id": line["item_id"],
+                "item_name": line["name"],
+                "quantity": line["quantity"],
+            }
+            for line in branch_lines
+        )
+    if shipments:
+        db.bulk_insert_mappings(Shipment, shipments)
+        db.bulk_insert_mappings(ShipmentItem, items)
+    return [s["id"] for s in shipments]
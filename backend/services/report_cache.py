@@ -0,0 +1,191 @@
+import gzip
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+from typing import Callable, Iterable, Optional
+
+from sqlalchemy.orm import Session
+
+from services.serialization import dumps
+from services.versions import bump_version, get_version
+
+MAX_BYTES = int(os.getenv("REPORT_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+CACHE_DIR = os.getenv("REPORT_CACHE_DIR") or None
+DISK_MAX_FILES = int(os.getenv("REPORT_CACHE_DISK_MAX_FILES", "2000"))
+
+REPORT_KINDS = ("dispensings", "arrivals", "dispatches", "stock")
+
+
+class ReportCache:
+    """Finished report payloads keyed by (kind, branch, range, generation).
+
+    The memory tier is an LRU bounded by the serialized size of the entries;
+    the optional disk tier keeps gzipped JSON under ``directory`` so closed
+    periods survive restarts and are shared between workers.
+    """
+
+    def __init__(self, max_bytes: int = MAX_BYTES, directory: Optional[str] = CACHE_DIR):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self._entries: "OrderedDict[tuple, bytes]" = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, key: tuple) -> str:
+        digest = hashlib.sha1(repr(key).encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, f"{key[0]}-{digest}.json.gz")
+
+    def get(self, key: tuple) -> Optional[dict]:
+        with self._lock:
+            blob = self._entries.get(key)
+            if blob is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return json.loads(blob)
+        if self.directory:
+            try:
+                with gzip.open(self._path(key), "rb") as fh:
+                    blob = fh.read()
+            except FileNotFoundError:
+                blob = None
+            if blob is not None:
+                self._remember(key, blob)
+                with self._lock:
+                    self.hits += 1
+                return json.loads(blob)
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key: tuple, payload: dict) -> None:
+        blob = dumps(payload)
+        self._remember(key, blob)
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+            path = self._path(key)
+            tmp = f"{path}.{os.getpid()}.tmp"
+            with gzip.open(tmp, "wb") as fh:
+                fh.write(blob)
+            os.replace(tmp, path)
+            self._prune_disk()
+
+    def _remember(self, key: tuple, blob: bytes) -> None:
+        if len(blob) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= len(old)
+            self._entries[key] = blob
+            self._size += len(blob)
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+    def _prune_disk(self) -> None:
+        files = [
+            os.path.join(self.directory, f)
+            for f in os.listdir(self.directory)
+            if f.endswith(".json.gz")
+        ]
+        if len(files) <= DISK_MAX_FILES:
+            return
+        files.sort(key=lambda p: os.path.getmtime(p))
+        for path in files[: len(files) - DISK_MAX_FILES]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+        if self.directory and os.path.isdir(self.directory):
+            for f in os.listdir(self.directory):
+                if f.endswith(".json.gz"):
+                    os.remove(os.path.join(self.directory, f))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._size,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "disk": self.directory,
+            }
+
+
+cache = ReportCache()
+
+
+def _today() -> date:
+    # report ranges are compared against naive UTC timestamps in the tables
+    return datetime.utcnow().date()
+
+
+def cached_report(
+    db: Session,
+    kind: str,
+    branch_id: Optional[str],
+    start: Optional[date],
+    end: Optional[date],
+    build: Callable[[Optional[date], Optional[date]], dict],
+    mergeable: bool = True,
+) -> dict:
+    """Serve the closed part of ``[start, end]`` from cache, build the rest.
+
+    ``build(start, end)`` must return ``{"data": [...]}`` for an inclusive day
+    range (``None`` = unbounded). Row reports are ``mergeable``: the closed
+    days and the open current day are built separately and concatenated.
+    Reports that are not (e.g. closing balances) are cached only when the
+    whole range is closed.
+    """
+    today = _today()
+    if end is not None and end < today:
+        closed, open_ = (start, end), None
+    elif not mergeable or (start is not None and start >= today):
+        return build(start, end)
+    else:
+        closed, open_ = (start, today - timedelta(days=1)), (today, end)
+
+    generation = get_version(db, f"report:{kind}")
+    key = (
+        kind,
+        branch_id or "",
+        closed[0].isoformat() if closed[0] else "",
+        closed[1].isoformat(),
+        generation,
+    )
+    payload = cache.get(key)
+    if payload is None:
+        payload = build(*closed)
+        cache.put(key, payload)
+
+    if open_ is None:
+        return payload
+    fresh = build(*open_)
+    return {"data": payload.get("data", []) + fresh.get("data", [])}
+
+
+def invalidate_reports(db: Session, kinds: Iterable[str] = REPORT_KINDS) -> None:
+    """Drop cached payloads of ``kinds`` in every worker once ``db`` commits."""
+    for kind in kinds:
+        bump_version(db, f"report:{kind}")
+
+
+def note_report_write(
+    db: Session, kinds: Iterable[str], when: Optional[datetime] = None
+) -> None:
+    """Invalidate ``kinds`` if a write dated ``when`` lands in a closed day."""
+    if when is None:
+        return
+    if when.date() < _today():
+        invalidate_reports(db, kinds)
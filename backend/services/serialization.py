@@ -0,0 +1,54 @@
+import json
+from datetime import date, datetime
+from typing import Any, Type
+
+from fastapi import Response
+from pydantic import BaseModel
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+
+def _json_default(value: Any):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(content: Any) -> bytes:
+    """Serialize plain Python data straight to JSON bytes."""
+    if orjson is not None:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(
+        content, ensure_ascii=False, separators=(",", ":"), default=_json_default
+    ).encode("utf-8")
+
+
+class FastJSONResponse(Response):
+    """JSON response rendered with orjson, bypassing jsonable_encoder."""
+
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+def select_rows(
+    db: Session, schema: Type[BaseModel], model, *criteria, order_by=None
+) -> list[dict]:
+    """Load only the columns ``schema`` exposes, as plain dicts.
+
+    Skips ORM entity construction and per-row pydantic validation; keys come
+    out in the schema's field order so the payload matches ``response_model``.
+    """
+    names = list(schema.model_fields)
+    stmt = select(*(getattr(model, n) for n in names))
+    if criteria:
+        stmt = stmt.where(*criteria)
+    if order_by is not None:
+        stmt = stmt.order_by(order_by)
+    return [dict(zip(names, row)) for row in db.execute(stmt)]
@@ -4,6 +4,12 @@ from typing import Optional, Tuple
 from sqlalchemy import text
 from sqlalchemy.orm import Session
 
+from database import STOCK_MODELS
+from services.alerts import note_stock_change
+from services.lots import allocate_fefo
+from services.sync import record_change
+from services.versions import bump_version
+
 
 class ItemType(str, Enum):
     medicine = "medicine"
@@ -14,7 +20,7 @@ def get_available_qty(
     db: Session, branch_id: str, item_type: ItemType, item_id: str
 ) -> Tuple[int, Optional[str]]:
     """Return available quantity and item name for given branch and item."""
-    table = "medicines" if item_type == ItemType.medicine else "medical_devices"
+    table = STOCK_MODELS[item_type].__tablename__
     row = db.execute(
         text(
             f"SELECT quantity, name FROM {table} WHERE id = :i AND branch_id = :b"
@@ -29,15 +35,15 @@ def get_available_qty(
 def decrement_stock(
     db: Session, branch_id: str, item_type: ItemType, item_id: str, qty: int
 ) -> None:
-    """Decrement stock atomically; raise ValueError if insufficient."""
+    """Decrement stock atomically, FEFO across lots; raise ValueError if insufficient."""
     if qty <= 0:
         return
-    table = "medicines" if item_type == ItemType.medicine else "medical_devices"
+    table = STOCK_MODELS[item_type].__tablename__
     res = db.execute(
         text(
             f"""
             UPDATE {table}
-               SET quantity = quantity - :q
+               SET quantity = quantity - :q, version = version + 1
              WHERE id = :i AND branch_id = :b AND quantity >= :q
             RETURNING quantity
         """
@@ -48,3 +54,7 @@ def decrement_stock(
         raise ValueError(
             f"Not enough stock for {item_type}:{item_id}"
         )
+    allocate_fefo(db, item_id, branch_id, qty)
+    bump_version(db, table, branch_id)
+    note_stock_change(db, item_type, item_id)
+    record_change(db, table, item_id, branch_id)
@@ -0,0 +1,174 @@
+from typing import Optional
+
+from sqlalchemy import event, inspect, text, tuple_
+from sqlalchemy.orm import Session
+
+from database import Employee, MedicalDevice, Medicine, Patient, SyncChange
+from services.versions import _scope
+
+# entity name (table) -> model; the lists branch clients keep offline
+TRACKED = {
+    "medicines": Medicine,
+    "medical_devices": MedicalDevice,
+    "patients": Patient,
+    "employees": Employee,
+}
+
+_PENDING_KEY = "pending_sync_changes"
+# SQLite (one writer at a time): data_versions row holding the last version
+_COUNTER = "sync"
+
+
+def record_change(
+    db: Session, entity: str, row_id: str, scope: Optional[str], deleted: bool = False
+) -> None:
+    """Log a row change made outside the ORM (e.g. a raw UPDATE)."""
+    pending = db.info.setdefault(_PENDING_KEY, {})
+    pending[(entity, str(row_id), _scope(scope))] = deleted
+
+
+def _tracked(obj) -> Optional[str]:
+    name = getattr(obj, "__tablename__", None)
+    return name if name in TRACKED else None
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_orm_changes(session: Session, flush_context) -> None:
+    for obj in session.new:
+        entity = _tracked(obj)
+        if entity:
+            record_change(session, entity, obj.id, obj.branch_id)
+    for obj in session.dirty:
+        entity = _tracked(obj)
+        if not entity or not session.is_modified(obj):
+            continue
+        history = inspect(obj).attrs.branch_id.history
+        for old in history.deleted or ():
+            if _scope(old) != _scope(obj.branch_id):
+                # moved away: the old branch must drop its copy
+                record_change(session, entity, obj.id, old, deleted=True)
+        record_change(session, entity, obj.id, obj.branch_id)
+    for obj in session.deleted:
+        entity = _tracked(obj)
+        if entity:
+            record_change(session, entity, obj.id, obj.branch_id, deleted=True)
+
+
+@event.listens_for(Session, "before_commit")
+def _write_changes(session: Session) -> None:
+    session.flush()
+    pending = session.info.pop(_PENDING_KEY, None)
+    if not pending:
+        return
+    version = _transaction_version(session)
+    session.execute(
+        text(
+            """
+            INSERT INTO sync_changes (entity, row_id, scope, version, deleted)
+            VALUES (:e, :r, :s, :v, :d)
+            ON CONFLICT (entity, row_id, scope)
+            DO UPDATE SET version = excluded.version, deleted = excluded.deleted
+        """
+        ),
+        [
+            {"e": e, "r": r, "s": s, "v": version, "d": deleted}
+            for (e, r, s), deleted in sorted(pending.items())
+        ],
+    )
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_changes(session: Session) -> None:
+    session.info.pop(_PENDING_KEY, None)
+
+
+def _transaction_version(session: Session) -> int:
+    """Version of the changes written by the current transaction.
+
+    On Postgres this is the transaction id, so concurrent writers share no
+    row; readers stop at ``current_version`` until every lower id is done.
+    Elsewhere writers are serialized anyway and a counter row is bumped.
+    """
+    if session.get_bind().dialect.name == "postgresql":
+        return session.execute(text("SELECT txid_current()")).scalar_one()
+    return session.execute(
+        text(
+            """
+            INSERT INTO data_versions (table_name, scope, version)
+            VALUES (:t, '', 1)
+            ON CONFLICT (table_name, scope)
+            DO UPDATE SET version = data_versions.version + 1
+            RETURNING version
+        """
+        ),
+        {"t": _COUNTER},
+    ).scalar_one()
+
+
+def current_version(db: Session) -> int:
+    """Highest version below which every change is committed and visible.
+
+    On Postgres transaction ids are taken in start order, not commit order,
+    so this is one below the oldest transaction still running: nothing can
+    later commit a change at or under it. A long writer holds syncing back
+    until it ends, it never makes a client skip a change.
+    """
+    if db.get_bind().dialect.name == "postgresql":
+        return db.execute(text("SELECT txid_snapshot_xmin(txid_current_snapshot()) - 1")).scalar_one()
+    row = db.execute(
+        text("SELECT version FROM data_versions WHERE table_name = :t AND scope = ''"),
+        {"t": _COUNTER},
+    ).first()
+    return int(row[0]) if row else 0
+
+
+def parse_cursor(cursor: Optional[str]) -> tuple[int, tuple[int, str, str]]:
+    upto, version, entity, row_id = cursor.split(":", 3)
+    return int(upto), (int(version), entity, row_id)
+
+
+def changes_since(
+    db: Session,
+    since: int,
+    scope: Optional[str],
+    entities: list[str],
+    limit: int,
+    cursor: Optional[str] = None,
+) -> dict:
+    """One page of changes after ``since``, newest row state per entity.
+
+    Pages are keyed on (version, entity, row_id) and capped at the
+    ``current_version`` seen on the first page, which the cursor carries
+    along, so a client paging through a backlog ends at a consistent
+    ``version``.
+    """
+    after = None
+    if cursor:
+        upto, after = parse_cursor(cursor)
+    else:
+        upto = current_version(db)
+    q = db.query(SyncChange.version, SyncChange.entity, SyncChange.row_id, SyncChange.deleted).filter(
+        SyncChange.scope == _scope(scope),
+        SyncChange.entity.in_(entities),
+        SyncChange.version > since,
+        SyncChange.version <= upto,
+    )
+    if after:
+        q = q.filter(tuple_(SyncChange.version, SyncChange.entity, SyncChange.row_id) > after)
+    rows = q.order_by(SyncChange.version, SyncChange.entity, SyncChange.row_id).limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    upserted = {e: [] for e in entities}
+    deleted = {e: [] for e in entities}
+    for _, entity, row_id, is_deleted in rows:
+        (deleted if is_deleted else upserted)[entity].append(row_id)
+
+    last = rows[-1] if rows else None
+    return {
+        "upserted": upserted,
+        "deleted": deleted,
+        "version": upto,
+        "has_more": has_more,
+        "cursor": f"{upto}:{last[0]}:{last[1]}:{last[2]}" if has_more else None,
+    }
@@ -0,0 +1,170 @@
+import uuid
+from collections import defaultdict
+from datetime import datetime
+
+from sqlalchemy import case, insert, select, tuple_, update
+from sqlalchemy.orm import Session
+
+from database import STOCK_MODELS, Transfer
+from schemas import TransferCreate
+from services.alerts import note_stock_change
+from services.lots import move_lots
+from services.outbox import emit_event
+from services.sync import record_change
+from services.versions import bump_version
+
+
+def transfer_batch(db: Session, lines: list[TransferCreate]) -> list[str]:
+    """Move stock from the main warehouse to branches in one set of statements.
+
+    Main-warehouse rows are locked with one query per item table and every
+    line is validated before anything is written; a batch with any
+    shortage fails as a whole with all shortages listed. Each table then
+    gets one decrement, one increment of the existing branch copies, one
+    bulk insert of missing copies, and the transfer rows are bulk-inserted.
+    The caller commits. Returns the new transfer ids.
+    """
+    by_type = defaultdict(list)
+    for line in lines:
+        if line.quantity <= 0:
+            raise ValueError(f"Quantity must be positive for {line.medicine_name}")
+        by_type[line.item_type].append(line)
+
+    locked, demand = {}, {}
+    shortages = []
+    for item_type, type_lines in by_type.items():
+        model = STOCK_MODELS[item_type]
+        main_rows = locked[item_type] = {
+            r.id: r
+            for r in db.execute(
+                select(
+                    model.id,
+                    model.name,
+                    model.category_id,
+                    model.purchase_price,
+                    model.sell_price,
+                    model.quantity,
+                )
+                .where(model.id.in_({l.medicine_id for l in type_lines}), model.branch_id.is_(None))
+                .with_for_update()
+            )
+        }
+        wanted = demand[item_type] = defaultdict(int)
+        for line in type_lines:
+            wanted[line.medicine_id] += line.quantity
+        shortages += [
+            f"Not enough {main_rows[i].name if i in main_rows else i} in main warehouse"
+            for i, qty in wanted.items()
+            if i not in main_rows or (main_rows[i].quantity or 0) < qty
+        ]
+    if shortages:
+        raise ValueError("; ".join(shortages))
+
+    now = datetime.utcnow()
+    transfer_rows = []
+    for item_type, type_lines in by_type.items():
+        model = STOCK_MODELS[item_type]
+        main_rows = locked[item_type]
+        incoming = defaultdict(int)  # (branch, name) -> qty
+        source = {}  # (branch, name) -> main row, for new branch copies
+        for line in type_lines:
+            main = main_rows[line.medicine_id]
+            key = (line.to_branch_id, main.name)
+            incoming[key] += line.quantity
+            source.setdefault(key, main)
+            transfer_rows.append(
+                {
+                    "id": str(uuid.uuid4()),
+                    "item_type": item_type,
+                    "medicine_id": main.id,
+                    "medicine_name": main.name,
+                    "quantity": line.quantity,
+                    "from_branch_id": line.from_branch_id or "main",
+                    "to_branch_id": line.to_branch_id,
+                    "date": now,
+                }
+            )
+
+        db.execute(
+            update(model)
+            .where(model.id.in_(list(demand[item_type])))
+            .values(
+                quantity=model.quantity - case(dict(demand[item_type]), value=model.id, else_=0),
+                version=model.version + 1,
+            )
+            .execution_options(synchronize_session=False)
+        )
+
+        existing = {
+            (r.branch_id, r.name): r.id
+            for r in db.execute(
+                select(model.id, model.branch_id, model.name)
+                .where(tuple_(model.branch_id, model.name).in_(list(incoming)))
+                .with_for_update()
+            )
+        }
+        if existing:
+            db.execute(
+                update(model)
+                .where(model.id.in_(list(existing.values())))
+                .values(
+                    quantity=model.quantity
+                    + case(
+                        {existing[k]: qty for k, qty in incoming.items() if k in existing},
+                        value=model.id,
+                        else_=0,
+                    ),
+                    version=model.version + 1,
+                )
+                .execution_options(synchronize_session=False)
+            )
+        created = {}
+        for key, qty in incoming.items():
+            if key in existing:
+                continue
+            main = source[key]
+            created[key] = {
+                "id": str(uuid.uuid4()),
+                "name": main.name,
+                "category_id": main.category_id,
+                "purchase_price": main.purchase_price,
+                "sell_price": main.sell_price,
+                "quantity": qty,
+                "branch_id": key[0],
+            }
+        if created:
+            db.execute(insert(model), list(created.values()))
+        for line in type_lines:
+            key = (line.to_branch_id, main_rows[line.medicine_id].name)
+            branch_item = existing.get(key) or created[key]["id"]
+            move_lots(db, item_type, line.medicine_id, None, branch_item, key[0], line.quantity)
+
+        table = model.__tablename__
+        bump_version(db, table)
+        for item_id in demand[item_type]:
+            note_stock_change(db, item_type, item_id)
+            record_change(db, table, item_id, None)
+        for key in incoming:
+            branch_item = existing.get(key) or created[key]["id"]
+            bump_version(db, table, key[0])
+            note_stock_change(db, item_type, branch_item)
+            record_change(db, table, branch_item, key[0])
+
+    if transfer_rows:
+        db.execute(insert(Transfer), transfer_rows)
+    for row in transfer_rows:
+        emit_event(
+            db,
+            "transfer",
+            row["id"],
+            "transfer.created",
+            {
+                "type": row["item_type"],
+                "item_id": row["medicine_id"],
+                "name": row["medicine_name"],
+                "quantity": row["quantity"],
+                "from_branch_id": row["from_branch_id"],
+                "to_branch_id": row["to_branch_id"],
+            },
+        )
+    return [row["id"] for row in transfer_rows]
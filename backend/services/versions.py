@@ -0,0 +1,162 @@
+import hashlib
+from typing import Optional
+
+from fastapi import HTTPException, Request, Response
+from sqlalchemy import event, text
+from sqlalchemy.orm import Session
+
+# Reference lists are revalidated on every use; the browser may keep a copy
+# but must send If-None-Match before reusing it.
+CACHE_CONTROL = "private, no-cache"
+
+
+def _scope(scope: Optional[str]) -> str:
+    """Map a branch id to a version scope; '' is the main warehouse/global."""
+    if not scope or scope in ("null", "undefined"):
+        return ""
+    return str(scope)
+
+
+_PENDING_KEY = "pending_data_versions"
+
+
+def bump_version(db: Session, table: str, scope: Optional[str] = None) -> None:
+    """Mark ``table`` within ``scope`` as changed by the current transaction.
+
+    The counter itself is incremented once per (table, scope) just before
+    commit, so a write touching many lines holds the version row only for
+    the tail of the transaction.
+    """
+    db.info.setdefault(_PENDING_KEY, set()).add((table, _scope(scope)))
+
+
+def bump_all_scopes(db: Session, table: str) -> None:
+    """Invalidate every scope of ``table``, e.g. after a schema-level backfill."""
+    db.execute(
+        text("UPDATE data_versions SET version = version + 1 WHERE table_name = :t"),
+        {"t": table},
+    )
+    bump_version(db, table)
+
+
+@event.listens_for(Session, "before_commit")
+def _apply_pending_versions(session: Session) -> None:
+    pending = session.info.pop(_PENDING_KEY, None)
+    if not pending:
+        return
+    # sorted so concurrent transactions lock version rows in the same order
+    for table, scope in sorted(pending):
+        session.execute(
+            text(
+                """
+                INSERT INTO data_versions (table_name, scope, version)
+                VALUES (:t, :s, 1)
+                ON CONFLICT (table_name, scope)
+                DO UPDATE SET version = data_versions.version + 1
+            """
+            ),
+            {"t": table, "s": scope},
+        )
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_pending_versions(session: Session) -> None:
+    session.info.pop(_PENDING_KEY, None)
+
+
+def get_version(db: Session, table: str, scope: Optional[str] = None) -> int:
+    """Return the current data version of ``table`` within ``scope``."""
+    row = db.execute(
+        text("SELECT version FROM data_versions WHERE table_name = :t AND scope = :s"),
+        {"t": table, "s": _scope(scope)},
+    ).first()
+    return int(row[0]) if row else 0
+
+
+def make_etag(table: str, scope: Optional[str], version: int, variant: str = "") -> str:
+    """Build a strong ETag for one representation of a versioned list.
+
+    Scope and variant come from query parameters, so they are hashed to keep
+    the tag ASCII and free of quotes and commas.
+    """
+    key = hashlib.sha1(
+        f"{_scope(scope)}\0{variant}".encode("utf-8")
+    ).hexdigest()[:12]
+    return f'"{table}-{key}-{version}"'
+
+
+def current_etag(
+    db: Session, table: str, scope: Optional[str] = None, variant: str = ""
+) -> str:
+    return make_etag(table, scope, get_version(db, table, scope), variant)
+
+
+def etag_matches(request: Optional[Request], etag: str) -> bool:
+    """Evaluate If-None-Match against ``etag`` (weak comparison, RFC 9110)."""
+    if request is None:
+        return False
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
+def set_cache_headers(response: Optional[Response], etag: str) -> None:
+    if response is None:
+        return
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = CACHE_CONTROL
+    response.headers["Vary"] = "Accept-Encoding"
+
+
+def not_modified(etag: str) -> Response:
+    return Response(
+        status_code=304,
+        headers={
+            "ETag": etag,
+            "Cache-Control": CACHE_CONTROL,
+            "Vary": "Accept-Encoding",
+        },
+    )
+
+
+def expected_row_version(request: Optional[Request], body_version: Optional[int] = None) -> Optional[int]:
+    """Row version the client last saw: If-Match (``"3"``, ``W/"3"``) or the body.
+
+    ``None`` (no header, or ``*``) means the update is unconditional.
+    """
+    header = request.headers.get("if-match") if request is not None else None
+    if header and header.strip() != "*":
+        tag = header.strip()
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        try:
+            return int(tag.strip('"'))
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"Invalid If-Match: {header}")
+    return body_version
+
+
+def check_row_version(row, expected: Optional[int]) -> None:
+    """Refuse to update ``row`` if it changed since the client read it."""
+    if expected is not None and row.version != expected:
+        raise HTTPException(
+            status_code=409,
+            detail={
+                "message": "Record was modified by another user",
+                "current_version": row.version,
+            },
+        )
+
+
+def set_row_etag(response: Optional[Response], row) -> None:
+    if response is not None:
+        response.headers["ETag"] = f'"{row.version}"'
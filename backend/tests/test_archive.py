@@ -0,0 +1,160 @@
+import os
+import tempfile
+import sys
+import pathlib
+from datetime import datetime
+
+import pytest
+
+ROOT = pathlib.Path(__file__).resolve().parents[1]
+sys.path.append(str(ROOT))
+
+DB_PATH = os.path.join(tempfile.gettempdir(), "test_archive.db")
+if os.path.exists(DB_PATH):
+    os.remove(DB_PATH)
+os.environ["DATABASE_URL"] = f"sqlite:///{DB_PATH}"
+
+from database import (
+    create_tables,
+    SessionLocal,
+    ArchivedPeriod,
+    ArchivedTotal,
+    Arrival,
+    Branch,
+    DispensingItem,
+    DispensingRecord,
+    Employee,
+    Patient,
+)
+from main import _build_arrivals_json, build_dispensings_json
+from services.archive import archive_year
+
+create_tables()
+session = SessionLocal()
+
+YEAR = 2001
+
+
+@pytest.fixture
+def history():
+    session.add(Branch(id="ar_b", name="Архив", login="ar_b", password="x"))
+    session.add(Patient(id="ar_p", first_name="П", last_name="Л", illness="-", phone="1", address="a", branch_id="ar_b"))
+    session.add(Employee(id="ar_e", first_name="С", last_name="Л", phone="2", address="a", branch_id="ar_b"))
+    for rid, when in (("ar_old", datetime(YEAR, 6, 1, 10)), ("ar_new", datetime(YEAR + 1, 1, 2, 10))):
+        session.add(DispensingRecord(id=rid, patient_id="ar_p", patient_name="П Л", employee_id="ar_e", employee_name="С Л", branch_id="ar_b", date=when))
+        session.add(DispensingItem(id=f"{rid}_i", record_id=rid, item_type="medicine", item_id="ar_m", item_name="Аспирин", quantity=3))
+        session.add(Arrival(id=f"{rid}_a", item_type="medicine", item_id="ar_m", item_name="Аспирин", quantity=10, date=when))
+    session.commit()
+    yield
+    session.rollback()
+    for model in (DispensingItem, DispensingRecord, Arrival):
+        session.query(model).filter(model.id.like("ar_%")).delete(synchronize_session=False)
+    session.query(ArchivedPeriod).filter(ArchivedPeriod.year == YEAR).delete()
+    session.query(ArchivedTotal).filter(ArchivedTotal.year == YEAR).delete()
+    for model in (Patient, Employee, Branch):
+        session.query(model).filter(model.id.like("ar_%")).delete(synchronize_session=False)
+    session.commit()
+
+
+def test_archived_year_leaves_live_tables_but_stays_in_reports(history, tmp_path):
+    start, end = datetime(YEAR, 1, 1), datetime(YEAR + 1, 12, 31, 23, 59)
+    before = build_dispensings_json(session, "ar_b", start, end)
+
+    counts = archive_year(session, YEAR, directory=str(tmp_path))
+    session.commit()
+
+    assert counts == {"dispensing_records": 1, "arrivals": 1}
+    assert (tmp_path / f"dispensing_records_{YEAR}.jsonl.gz").exists()
+    assert session.get(DispensingRecord, "ar_old") is None
+    assert session.query(DispensingItem).filter_by(record_id="ar_old").count() == 0
+    assert session.get(DispensingRecord, "ar_new") is not None
+
+    after = build_dispensings_json(session, "ar_b", start, end)
+    assert after == before
+    assert [r["id"] for r in after["data"]] == ["ar_old", "ar_new"]
+    # ranges outside the archived year do not touch the archive
+    assert [r["id"] for r in build_dispensings_json(session, "ar_b", datetime(YEAR + 1, 1, 1), end)["data"]] == ["ar_new"]
+
+    arrivals = _build_arrivals_json(session, None, start, end)["data"]
+    assert [r["id"] for r in arrivals if r["id"].startswith("ar_")] == ["ar_old_a", "ar_new_a"]
+
+
+def test_only_closed_unarchived_years(history, tmp_path):
+    with pytest.raises(ValueError):
+        archive_year(session, datetime.utcnow().year, directory=str(tmp_path))
+    archive_year(session, YEAR, directory=str(tmp_path))
+    session.commit()
+    with pytest.raises(ValueError):
+        archive_year(session, YEAR, directory=str(tmp_path))
+
+
+@pytest.mark.skipif(not os.getenv("TEST_POSTGRES_URL"), reason="needs an empty Postgres database")
+def test_report_queries_prune_month_partitions():
+    from sqlalchemy import create_engine
+    from database import Base
+    from services.partitioning import convert_to_partitioned, scanned_relations
+
+    pg = create_engine(os.environ["TEST_POSTGRES_URL"])
+    Base.metadata.create_all(bind=pg)
+    with pg.connect() as conn:
+        # empty table: partitions span January .. January + PARTITION_MONTHS_AHEAD
+        convert_to_partitioned(conn, "dispensing_records", datetime(2024, 1, 15).date())
+        sql = (
+            "SELECT * FROM dispensing_records "
+            "WHERE branch_id = :b AND date >= :start AND date <= :end"
+        )
+        scanned = scanned_relations(
+            conn, sql, {"b": "b1", "start": datetime(2024, 2, 1), "end": datetime(2024, 2, 29, 23, 59)}
+        )
+        assert scanned == {"dispensing_records_y2024m02"}
+        conn.rollback()
+
+
+@pytest.mark.skipif(not os.getenv("TEST_POSTGRES_URL"), reason="needs an empty Postgres database")
+def test_rows_past_the_last_partition_land_in_default_and_move_out():
+    from sqlalchemy import create_engine, text
+    from database import Base
+    from services.partitioning import convert_to_partitioned, ensure_partitions
+
+    pg = create_engine(os.environ["TEST_POSTGRES_URL"])
+    Base.metadata.create_all(bind=pg)
+    with pg.connect() as conn:
+        convert_to_partitioned(conn, "arrivals", datetime(2024, 1, 15).date())
+        conn.execute(
+            text(
+                "INSERT INTO arrivals (id, item_type, item_id, item_name, quantity, date) "
+                "VALUES ('00000000-0000-0000-0000-000000000001', 'medicine', "
+                "'00000000-0000-0000-0000-000000000002', 'x', 1, '2024-09-10')"
+            )
+        )
+        assert conn.execute(text("SELECT count(*) FROM arrivals_default")).scalar() == 1
+        ensure_partitions(conn, "arrivals", datetime(2024, 1, 15).date())
+        assert conn.execute(text("SELECT count(*) FROM arrivals_default")).scalar() == 0
+        assert conn.execute(text("SELECT count(*) FROM arrivals_y2024m09")).scalar() == 1
+        conn.rollback()
+
+
+@pytest.mark.skipif(not os.getenv("TEST_POSTGRES_URL"), reason="needs an empty Postgres database")
+def test_conversion_keeps_indexes_and_foreign_keys():
+    from sqlalchemy import create_engine, text
+    from database import Base
+    from services.partitioning import convert_to_partitioned
+
+    pg = create_engine(os.environ["TEST_POSTGRES_URL"])
+    Base.metadata.create_all(bind=pg)
+    with pg.connect() as conn:
+        conn.exec_driver_sql("CREATE INDEX idx_dispensing_records_patient ON dispensing_records (patient_id)")
+        convert_to_partitioned(conn, "dispensing_records", datetime(2024, 1, 15).date())
+        indexes = {r[0] for r in conn.execute(text("SELECT indexname FROM pg_indexes WHERE tablename = 'dispensing_records'"))}
+        assert "idx_dispensing_records_patient" in indexes
+        referenced = {
+            r[0]
+            for r in conn.execute(
+                text(
+                    "SELECT CAST(CAST(confrelid AS regclass) AS text) FROM pg_constraint "
+                    "WHERE conrelid = CAST('dispensing_records' AS regclass) AND contype = 'f'"
+                )
+            )
+        }
+        assert referenced == {"patients", "employees", "branches"}
+        conn.rollback()
@@ -0,0 +1,72 @@
+import os
+import tempfile
+import sys
+import asyncio
+import pathlib
+
+ROOT = pathlib.Path(__file__).resolve().parents[1]
+sys.path.append(str(ROOT))
+
+DB_PATH = os.path.join(tempfile.gettempdir(), "test_barcodes.db")
+if os.path.exists(DB_PATH):
+    os.remove(DB_PATH)
+os.environ["DATABASE_URL"] = f"sqlite:///{DB_PATH}"
+
+import pytest
+from fastapi import HTTPException
+
+from database import create_tables, SessionLocal, Branch, Category, Medicine
+from main import create_barcode, scan_barcode
+from schemas import BarcodeCreate
+from services.barcodes import cache, normalize_code
+from services.stock import ItemType, decrement_stock
+
+create_tables()
+session = SessionLocal()
+
+EAN = "4006381333931"
+
+
+@pytest.fixture(scope="module", autouse=True)
+def seed():
+    session.add(Category(id="bc_c", name="cat", description="", type="medicine"))
+    session.add(Branch(id="bc_b", name="bc_b", login="bc_b", password="x"))
+    session.add(Medicine(id="bc_m", name="Лоратадин", category_id="bc_c", purchase_price=1, sell_price=2, quantity=50, branch_id=None))
+    session.add(Medicine(id="bc_m_b", name="Лоратадин", category_id="bc_c", purchase_price=1, sell_price=2, quantity=9, branch_id="bc_b"))
+    session.add(Medicine(id="bc_other", name="Другое", category_id="bc_c", purchase_price=1, sell_price=2, quantity=1, branch_id=None))
+    session.commit()
+
+
+def scan(code, branch_id=None):
+    return asyncio.run(scan_barcode(code, branch_id, db=session))["data"]
+
+
+def test_normalize_code():
+    assert normalize_code("036000291452") == "00036000291452"  # UPC-A
+    assert normalize_code(f" {EAN} ") == "0" + EAN
+    assert normalize_code("INT-77") == "INT-77"
+    with pytest.raises(ValueError):
+        normalize_code("4006381333932")
+
+
+def test_scan_resolves_branch_row_and_follows_stock_writes():
+    asyncio.run(create_barcode(BarcodeCreate(code=EAN, item_type="medicine", item_id="bc_m"), db=session))
+    with pytest.raises(HTTPException) as exc:
+        asyncio.run(create_barcode(BarcodeCreate(code=EAN, item_type="medicine", item_id="bc_other"), db=session))
+    assert exc.value.status_code == 409
+
+    item = scan("0" + EAN, "bc_b")
+    assert (item["item_id"], item["name"], item["quantity"]) == ("bc_m_b", "Лоратадин", 9)
+    assert scan(EAN)["item_id"] == "bc_m"
+
+    hits = cache.stats()["hits"]
+    assert scan(EAN, "bc_b")["quantity"] == 9
+    assert cache.stats()["hits"] == hits + 1
+
+    decrement_stock(session, "bc_b", ItemType.medicine, "bc_m_b", 4)
+    session.commit()
+    assert scan(EAN, "bc_b")["quantity"] == 5
+
+    with pytest.raises(HTTPException) as exc:
+        scan("96385074")  # valid GTIN-8, not registered
+    assert exc.value.status_code == 404
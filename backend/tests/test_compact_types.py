@@ -0,0 +1,78 @@
+import os
+import tempfile
+import sys
+import asyncio
+import pathlib
+import uuid
+
+ROOT = pathlib.Path(__file__).resolve().parents[1]
+sys.path.append(str(ROOT))
+
+DB_PATH = os.path.join(tempfile.gettempdir(), "test_compact_types.db")
+if os.path.exists(DB_PATH):
+    os.remove(DB_PATH)
+os.environ["DATABASE_URL"] = f"sqlite:///{DB_PATH}"
+
+import pytest
+from fastapi import HTTPException
+
+from database import create_tables, SessionLocal, Branch, Shipment
+from main import update_shipment_status
+from services.compact_types import compact_columns
+
+create_tables()
+session = SessionLocal()
+
+
+def test_compact_columns_cover_keys_and_types_only():
+    columns = {(t, c) for t, c, _ in compact_columns()}
+    assert {("dispensing_items", "item_id"), ("dispensing_items", "item_type"), ("shipments", "status")} <= columns
+    # "admin" and "main" are not uuids
+    assert ("users", "id") not in columns
+    assert ("transfers", "from_branch_id") not in columns
+
+
+def test_ids_and_statuses_stay_strings():
+    branch_id, shipment_id = str(uuid.uuid4()), str(uuid.uuid4())
+    session.add(Branch(id=branch_id, name="ct", login="ct_b", password="x"))
+    session.add(Shipment(id=shipment_id, to_branch_id=branch_id, status="pending"))
+    session.commit()
+    session.expire_all()
+    shipment = session.get(Shipment, shipment_id)
+    assert (shipment.id, shipment.to_branch_id, shipment.status) == (shipment_id, branch_id, "pending")
+
+    with pytest.raises(HTTPException) as exc:
+        asyncio.run(update_shipment_status(shipment_id, {"status": "lost"}, db=session))
+    assert exc.value.status_code == 400
+    asyncio.run(update_shipment_status(shipment_id, {"status": "cancelled"}, db=session))
+    session.expire_all()
+    assert session.get(Shipment, shipment_id).status == "cancelled"
+
+
+@pytest.mark.skipif(not os.getenv("TEST_POSTGRES_URL"), reason="needs an empty Postgres database")
+def test_migration_shrinks_tables():
+    from sqlalchemy import create_engine, text
+    from services.compact_types import migrate, pending_columns, relation_sizes
+
+    pg = create_engine(os.environ["TEST_POSTGRES_URL"])
+    with pg.connect() as conn:
+        # the pre-migration schema: keys and types as varchar
+        conn.exec_driver_sql(
+            "CREATE TABLE arrivals (id varchar PRIMARY KEY, item_type varchar NOT NULL, "
+            "item_id varchar NOT NULL, item_name varchar NOT NULL, quantity integer NOT NULL, "
+            "date timestamp)"
+        )
+        conn.exec_driver_sql("CREATE INDEX ix_arrivals_item ON arrivals (item_id)")
+        conn.execute(
+            text(
+                "INSERT INTO arrivals SELECT gen_random_uuid()::text, 'medicine', "
+                "gen_random_uuid()::text, 'x', 1, now() FROM generate_series(1, 20000)"
+            )
+        )
+        before = relation_sizes(conn, ["arrivals"])["arrivals"]
+        assert migrate(conn) == ["arrivals.id", "arrivals.item_type", "arrivals.item_id"]
+        after = relation_sizes(conn, ["arrivals"])["arrivals"]
+        assert pending_columns(conn) == []
+        assert after["index_bytes"] < before["index_bytes"]
+        assert after["heap_bytes"] < before["heap_bytes"]
+        conn.rollback()
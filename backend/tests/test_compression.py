@@ -0,0 +1,117 @@
+import sys
+import asyncio
+import gzip
+import json
+import pathlib
+
+import pytest
+
+ROOT = pathlib.Path(__file__).resolve().parents[1]
+sys.path.append(str(ROOT))
+
+from fastapi.responses import Response, StreamingResponse
+from services.compression import CompressionMiddleware, choose_encoding, stats
+
+XLSX = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+PAYLOAD = json.dumps(
+    {"data": [{"patient_name": "Иванов Иван", "items": [{"name": "Тримол", "quantity": 2}]}] * 500}
+).encode("utf-8")
+
+
+def run(app, accept="gzip"):
+    scope = {
+        "type": "http",
+        "method": "GET",
+        "path": "/",
+        "headers": [(b"accept-encoding", accept.encode())],
+        "query_string": b"",
+    }
+    messages = []
+    received = []
+
+    async def receive():
+        if received:
+            await asyncio.sleep(3600)  # keep the client connected
+        received.append(True)
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    asyncio.run(CompressionMiddleware(app, minimum_size=500)(scope, receive, send))
+    headers = {k.decode(): v.decode() for k, v in messages[0]["headers"]}
+    body = b"".join(m.get("body", b"") for m in messages[1:])
+    return headers, body
+
+
+def test_choose_encoding():
+    assert choose_encoding("gzip, deflate") == "gzip"
+    assert choose_encoding("gzip;q=0, deflate") is None
+    assert choose_encoding("identity") is None
+    assert choose_encoding("*") is not None
+
+
+def test_compresses_large_json():
+    stats.reset()
+    headers, body = run(Response(PAYLOAD, media_type="application/json"))
+    assert headers["content-encoding"] == "gzip"
+    assert headers["vary"] == "Accept-Encoding"
+    assert int(headers["content-length"]) == len(body)
+    assert gzip.decompress(body) == PAYLOAD
+    snap = stats.snapshot()
+    assert snap["responses"] == 1 and snap["bytes_saved"] > 0
+
+
+def test_streamed_response():
+    chunks = [PAYLOAD[i:i + 300] for i in range(0, len(PAYLOAD), 300)]
+    app = StreamingResponse(iter(chunks), media_type="application/json")
+    headers, body = run(app)
+    assert headers["content-encoding"] == "gzip"
+    assert "content-length" not in headers
+    assert gzip.decompress(body) == PAYLOAD
+
+
+def test_skips_small_and_xlsx():
+    headers, body = run(Response(b'{"data": []}', media_type="application/json"))
+    assert "content-encoding" not in headers and body == b'{"data": []}'
+    headers, body = run(Response(PAYLOAD, media_type=XLSX))
+    assert "content-encoding" not in headers and body == PAYLOAD
+
+
+def test_compressed_representation_gets_weak_etag():
+    headers, _ = run(Response(PAYLOAD, media_type="application/json", headers={"ETag": '"medicines-abc-3"'}))
+    assert headers["content-encoding"] == "gzip"
+    assert headers["etag"] == 'W/"medicines-abc-3"'
+    headers, _ = run(Response(b"{}", media_type="application/json", headers={"ETag": '"medicines-abc-3"'}))
+    assert headers["etag"] == '"medicines-abc-3"'
+
+
+def _decoders():
+    import brotli
+    import zstandard
+
+    return {
+        "br": brotli.decompress,
+        "zstd": lambda data: zstandard.ZstdDecompressor().decompressobj().decompress(data),
+    }
+
+
+@pytest.mark.parametrize("encoding", ["br", "zstd"])
+def test_brotli_and_zstd_round_trip(encoding):
+    decode = _decoders()[encoding]
+    headers, body = run(Response(PAYLOAD, media_type="application/json"), accept=encoding)
+    assert headers["content-encoding"] == encoding
+    assert len(body) < len(PAYLOAD)
+    assert decode(body) == PAYLOAD
+
+    chunks = [PAYLOAD[i:i + 300] for i in range(0, len(PAYLOAD), 300)]
+    app = StreamingResponse(iter(chunks), media_type="application/json")
+    headers, body = run(app, accept=encoding)
+    assert headers["content-encoding"] == encoding
+    assert decode(body) == PAYLOAD
+
+
+def test_prefers_zstd_then_br():
+    assert choose_encoding("gzip, br, zstd") == "zstd"
+    assert choose_encoding("gzip, br") == "br"
+    assert choose_encoding("gzip;q=1, br;q=0.5") == "gzip"
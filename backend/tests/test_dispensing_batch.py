@@ -0,0 +1,73 @@
+import os
+import tempfile
+import sys
+import asyncio
+import pathlib
+
+ROOT = pathlib.Path(__file__).resolve().parents[1]
+sys.path.append(str(ROOT))
+
+DB_PATH = os.path.join(tempfile.gettempdir(), "test_dispensing_batch.db")
+if os.path.exists(DB_PATH):
+    os.remove(DB_PATH)
+os.environ["DATABASE_URL"] = f"sqlite:///{DB_PATH}"
+
+from database import (
+    create_tables,
+    SessionLocal,
+    Category,
+    Patient,
+    Employee,
+    Medicine,
+    MedicalDevice,
+    DispensingRecord,
+    DispensingItem,
+)
+from main import create_dispensing_batch
+
+create_tables()
+session = SessionLocal()
+session.add(Category(id="db_c", name="cat", description="", type="medicine"))
+session.add(Patient(id="db_p", first_name="П", last_name="Б", illness="-", phone="1", address="a", branch_id="db_b"))
+session.add(Employee(id="db_e", first_name="С", last_name="Б", phone="2", address="a", branch_id="db_b"))
+session.add(Medicine(id="db_m", name="Анальгин ДБ", category_id="db_c", purchase_price=0, sell_price=0, quantity=5, branch_id="db_b"))
+session.add(Medicine(id="db_other", name="Чужой", category_id="db_c", purchase_price=0, sell_price=0, quantity=50, branch_id="db_x"))
+session.add(MedicalDevice(id="db_d", name="Шприц ДБ", category_id="db_c", purchase_price=0, sell_price=0, quantity=2, branch_id="db_b"))
+session.commit()
+
+
+def entry(**lines):
+    return {"patient_id": "db_p", "employee_id": "db_e", "branch_id": "db_b", **lines}
+
+
+def test_batch_partial_failure():
+    payload = {
+        "dispensings": [
+            entry(medicines=[{"id": "db_m", "quantity": 2}], medical_devices=[{"id": "db_d", "quantity": 1}]),
+            # legacy DispensingCreate shape
+            {"medicine_id": "db_m", "medicine_name": "x", "quantity": 2, "patient_id": "db_p",
+             "patient_name": "П Б", "employee_id": "db_e", "employee_name": "С Б", "branch_id": "db_b"},
+            # only 1 left after the first two entries
+            entry(medicines=[{"id": "db_m", "quantity": 2}]),
+            # stock row belongs to another branch
+            entry(medicines=[{"id": "db_other", "quantity": 1}]),
+            entry(patient_id="missing", medicines=[{"id": "db_m", "quantity": 1}]),
+            {"patient_id": "db_p"},
+            entry(medicines=[{"id": "db_m", "quantity": 1}], medical_devices=[{"id": "db_d", "quantity": 1}]),
+        ]
+    }
+    results = asyncio.run(create_dispensing_batch(payload, db=session))["data"]
+    assert [r["status"] for r in results] == [
+        "created", "created", "error", "error", "error", "error", "created",
+    ]
+    assert "available 1, requested 2" in results[2]["detail"]
+
+    session.expire_all()
+    assert session.get(Medicine, "db_m").quantity == 0
+    assert session.get(MedicalDevice, "db_d").quantity == 0
+    assert session.get(Medicine, "db_other").quantity == 50
+
+    created = [r["id"] for r in results if r["status"] == "created"]
+    assert session.query(DispensingRecord).filter(DispensingRecord.id.in_(created)).count() == 3
+    names = {i.item_name for i in session.query(DispensingItem).filter(DispensingItem.record_id.in_(created))}
+    assert names == {"Анальгин ДБ", "Шприц ДБ"}
@@ -0,0 +1,156 @@
+import os
+import tempfile
+import sys
+import asyncio
+import pathlib
+from datetime import datetime, timedelta
+
+ROOT = pathlib.Path(__file__).resolve().parents[1]
+sys.path.append(str(ROOT))
+
+DB_PATH = os.path.join(tempfile.gettempdir(), "test_duplicates.db")
+if os.path.exists(DB_PATH):
+    os.remove(DB_PATH)
+os.environ["DATABASE_URL"] = f"sqlite:///{DB_PATH}"
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import text
+
+from database import (
+    create_tables,
+    SessionLocal,
+    engine,
+    Branch,
+    Category,
+    DispensingItem,
+    DispensingRecord,
+    Employee,
+    Medicine,
+    Patient,
+)
+from main import create_dispensing_batch, create_dispensing_record
+from services import duplicates
+from services.duplicates import BACKFILL_SQL, DUPLICATE_INDEXES, find_duplicates
+
+create_tables()
+session = SessionLocal()
+
+
+@pytest.fixture(scope="module", autouse=True)
+def seed():
+    session.add(Category(id="dd_c", name="cat", description="", type="medicine"))
+    session.add(Branch(id="dd_b", name="dd_b", login="dd_b", password="x"))
+    for i in (1, 2, 3):
+        session.add(Patient(id=f"dd_p{i}", first_name="П", last_name=f"Пациент{i}", illness="", phone="1", address="", branch_id="dd_b"))
+    session.add(Employee(id="dd_e1", first_name="Анна", last_name="А", phone="2", address="a", branch_id="dd_b"))
+    session.add(Employee(id="dd_e2", first_name="Борис", last_name="Б", phone="3", address="a", branch_id="dd_b"))
+    for i in (1, 2):
+        session.add(Medicine(id=f"dd_m{i}", name=f"Препарат {i}", category_id="dd_c", purchase_price=1, sell_price=2, quantity=100, branch_id="dd_b"))
+    session.commit()
+    with engine.begin() as conn:
+        for ddl in DUPLICATE_INDEXES:
+            conn.exec_driver_sql(ddl)
+
+
+def dispense(patient, employee, *medicines, **extra):
+    payload = {
+        "patient_id": patient,
+        "employee_id": employee,
+        "branch_id": "dd_b",
+        "medicines": [{"id": m, "quantity": 1} for m in medicines],
+        **extra,
+    }
+    with SessionLocal() as db:
+        return asyncio.run(create_dispensing_record(payload, db=db))
+
+
+def test_repeat_within_window_is_warned():
+    assert dispense("dd_p1", "dd_e1", "dd_m1")["warnings"] == []
+    warnings = dispense("dd_p1", "dd_e2", "dd_m1", "dd_m2")["warnings"]
+    assert [(w["item_id"], w["employee_name"], w["times"], w["days_ago"]) for w in warnings] == [
+        ("dd_m1", "Анна А", 1, 0)
+    ]
+    assert dispense("dd_p1", "dd_e1", "dd_m1")["warnings"][0]["times"] == 2
+    assert dispense("dd_p2", "dd_e1", "dd_m1")["warnings"] == []  # another patient
+
+
+def test_block_policy_refuses_unless_allowed(monkeypatch):
+    monkeypatch.setattr(duplicates, "POLICY", "block")
+    dispense("dd_p3", "dd_e1", "dd_m2")
+    with pytest.raises(HTTPException) as exc:
+        dispense("dd_p3", "dd_e2", "dd_m2")
+    assert exc.value.status_code == 409
+    assert exc.value.detail["duplicates"][0]["item_id"] == "dd_m2"
+    with SessionLocal() as db:
+        assert db.query(DispensingItem).filter_by(patient_id="dd_p3").count() == 1
+
+    resp = dispense("dd_p3", "dd_e2", "dd_m2", allow_duplicates=True)
+    assert resp["warnings"][0]["item_id"] == "dd_m2"
+
+    monkeypatch.setattr(duplicates, "POLICY", "off")
+    assert dispense("dd_p3", "dd_e2", "dd_m2")["warnings"] == []
+
+
+def test_block_policy_applies_to_batches(monkeypatch):
+    monkeypatch.setattr(duplicates, "POLICY", "block")
+    session.add(Patient(id="dd_p4", first_name="П", last_name="Пациент4", illness="", phone="1", address="", branch_id="dd_b"))
+    session.commit()
+    dispense("dd_p4", "dd_e1", "dd_m1")
+
+    def entry(*medicines, **extra):
+        return {"patient_id": "dd_p4", "employee_id": "dd_e2", "branch_id": "dd_b", "medicines": [{"id": m, "quantity": 1} for m in medicines], **extra}
+
+    with SessionLocal() as db:
+        results = asyncio.run(
+            create_dispensing_batch(
+                {"dispensings": [entry("dd_m1"), entry("dd_m2"), entry("dd_m2"), entry("dd_m1", allow_duplicates=True)]},
+                db=db,
+            )
+        )["data"]
+    assert [r["status"] for r in results] == ["error", "created", "error", "created"]
+    assert results[0]["detail"]["duplicates"][0]["item_id"] == "dd_m1"
+    # the earlier entry of the same batch counts too
+    assert results[2]["detail"]["duplicates"][0]["times"] == 1
+    assert [(w["item_id"], w["times"]) for w in results[3]["warnings"]] == [("dd_m1", 1)]
+    with SessionLocal() as db:
+        assert db.query(DispensingItem).filter_by(patient_id="dd_p4").count() == 3
+
+
+def test_window_and_backfilled_items():
+    old = datetime.utcnow() - timedelta(days=duplicates.WINDOW_DAYS + 3)
+    recent = datetime.utcnow() - timedelta(days=2)
+    for rid, when in (("dd_r_old", old), ("dd_r_recent", recent)):
+        session.add(DispensingRecord(id=rid, patient_id="dd_p2", patient_name="x", employee_id="dd_e2", employee_name="Борис Б", branch_id="dd_b", date=when))
+        # written before the columns existed
+        session.add(DispensingItem(id=f"{rid}_i", record_id=rid, item_type="medicine", item_id="dd_m2", item_name="Препарат 2", quantity=1))
+    session.commit()
+    with engine.begin() as conn:
+        conn.exec_driver_sql(BACKFILL_SQL)
+
+    found = find_duplicates(session, "dd_p2", [("medicine", "dd_m2")], datetime.utcnow())
+    assert [(d["days_ago"], d["times"]) for d in found] == [(2, 1)]
+    assert find_duplicates(session, "dd_p2", [("medicine", "dd_m2")], datetime.utcnow(), days=30)[0]["times"] == 2
+
+
+def test_batch_items_carry_patient_and_date_and_probe_uses_index():
+    with SessionLocal() as db:
+        asyncio.run(
+            create_dispensing_batch(
+                {"dispensings": [{"patient_id": "dd_p3", "employee_id": "dd_e1", "branch_id": "dd_b", "medicines": [{"id": "dd_m1", "quantity": 1}]}]},
+                db=db,
+            )
+        )
+    assert find_duplicates(session, "dd_p3", [("medicine", "dd_m1")], datetime.utcnow())[0]["times"] == 1
+
+    with engine.connect() as conn:
+        plan = " ".join(
+            str(r[-1])
+            for r in conn.execute(
+                text(
+                    "EXPLAIN QUERY PLAN SELECT id FROM dispensing_items WHERE patient_id = 'dd_p1' "
+                    "AND item_type = 'medicine' AND item_id = 'dd_m1' AND dispensed_at >= '2024-01-01'"
+                )
+            )
+        )
+    assert "idx_dispensing_items_patient_item_date" in plan
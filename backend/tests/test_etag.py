@@ -0,0 +1,110 @@
+import os
+import tempfile
+import sys
+import asyncio
+import pathlib
+
+from fastapi import Request, Response
+
+ROOT = pathlib.Path(__file__).resolve().parents[1]
+sys.path.append(str(ROOT))
+
+DB_PATH = os.path.join(tempfile.gettempdir(), "test_etag.db")
+if os.path.exists(DB_PATH):
+    os.remove(DB_PATH)
+os.environ["DATABASE_URL"] = f"sqlite:///{DB_PATH}"
+
+from database import create_tables, SessionLocal, Category, Medicine
+from main import get_medicines, create_medicine, get_categories
+from schemas import MedicineCreate
+from services.stock import decrement_stock, ItemType
+
+create_tables()
+session = SessionLocal()
+session.add(Category(id="etag_cat", name="cat", description="", type="medicine"))
+session.add(Medicine(id="etag_m1", name="Med", category_id="etag_cat", purchase_price=0, sell_price=0, quantity=10, branch_id="etag_b"))
+session.commit()
+
+
+def make_request(etag=None):
+    headers = [(b"if-none-match", etag.encode())] if etag else []
+    return Request({"type": "http", "method": "GET", "path": "/", "headers": headers, "query_string": b""})
+
+
+def fetch_medicines(branch_id, etag=None):
+    return asyncio.run(get_medicines(make_request(etag), branch_id=branch_id, db=session))
+
+
+def test_not_modified_until_write():
+    first = fetch_medicines("etag_b")
+    etag = first.headers["ETag"]
+    assert first.headers["Cache-Control"] == "private, no-cache"
+
+    result = fetch_medicines("etag_b", etag)
+    assert result.status_code == 304
+    assert result.headers["ETag"] == etag
+    assert result.headers["Vary"] == "Accept-Encoding"
+    assert fetch_medicines("etag_b", f"W/{etag}").status_code == 304
+
+    decrement_stock(session, "etag_b", ItemType.medicine, "etag_m1", 1)
+    session.commit()
+
+    result = fetch_medicines("etag_b", etag)
+    assert result.status_code == 200
+    assert result.headers["ETag"] != etag
+
+
+def test_branch_scopes_are_independent():
+    main_etag = fetch_medicines(None).headers["ETag"]
+    branch_etag = fetch_medicines("etag_b").headers["ETag"]
+
+    payload = MedicineCreate(name="New", category_id="etag_cat", purchase_price=1, sell_price=2, quantity=1)
+    asyncio.run(create_medicine(payload, db=session))
+
+    assert fetch_medicines("etag_b", branch_etag).status_code == 304
+    assert fetch_medicines(None, main_etag).status_code == 200
+
+
+def test_category_variants_have_distinct_etags():
+    all_resp, med_resp = Response(), Response()
+    asyncio.run(get_categories(make_request(), all_resp, type=None, db=session))
+    asyncio.run(get_categories(make_request(), med_resp, type="medicine", db=session))
+    assert all_resp.headers["ETag"] != med_resp.headers["ETag"]
+
+
+def test_non_ascii_parameters_produce_valid_etag():
+    resp = fetch_medicines('филиал "1", 2')
+    etag = resp.headers["ETag"]
+    assert etag.isascii() and etag.count('"') == 2 and "," not in etag
+    assert fetch_medicines('филиал "1", 2', etag).status_code == 304
+
+    cat_resp = Response()
+    asyncio.run(get_categories(make_request(), cat_resp, type="лекарство", db=session))
+    assert cat_resp.headers["ETag"].isascii()
+
+
+def test_bump_is_applied_once_at_commit():
+    from services.versions import bump_version, get_version
+
+    before = get_version(session, "medicines", "etag_b")
+    for _ in range(3):
+        bump_version(session, "medicines", "etag_b")
+    assert get_version(session, "medicines", "etag_b") == before
+    session.commit()
+    assert get_version(session, "medicines", "etag_b") == before + 1
+
+    bump_version(session, "medicines", "etag_b")
+    session.rollback()
+    session.commit()
+    assert get_version(session, "medicines", "etag_b") == before + 1
+
+
+def test_bump_all_scopes():
+    from services.versions import bump_all_scopes, get_version
+
+    branch_before = get_version(session, "medicines", "etag_b")
+    main_before = get_version(session, "medicines")
+    bump_all_scopes(session, "medicines")
+    session.commit()
+    assert get_version(session, "medicines", "etag_b") > branch_before
+    assert get_version(session, "medicines") > main_before
@@ -0,0 +1,113 @@
+import os
+import tempfile
+import sys
+import asyncio
+import pathlib
+import threading
+import time
+from datetime import datetime, timedelta
+
+ROOT = pathlib.Path(__file__).resolve().parents[1]
+sys.path.append(str(ROOT))
+
+DB_PATH = os.path.join(tempfile.gettempdir(), "test_exports.db")
+if os.path.exists(DB_PATH):
+    os.remove(DB_PATH)
+os.environ["DATABASE_URL"] = f"sqlite:///{DB_PATH}"
+
+from database import create_tables, SessionLocal, ExportJob
+from main import create_export, download_export, get_export
+from services.exports import ExportData, cleanup_expired, params_hash, register_export
+from fastapi import HTTPException
+import pytest
+from sqlalchemy.exc import IntegrityError
+
+create_tables()
+session = SessionLocal()
+
+release = threading.Event()
+
+
+@register_export("test_rows")
+def _build(db, params):
+    release.wait(10)
+    rows = [[f"Товар {i}", i] for i in range(params["n"])]
+    return ExportData(["Название", "Количество"], rows, "Лист", "rows.xlsx")
+
+
+def wait_for(job_id, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        session.expire_all()
+        job = session.get(ExportJob, job_id)
+        if job.status in ("done", "failed"):
+            return job
+        time.sleep(0.05)
+    raise AssertionError("export did not finish")
+
+
+def test_export_job_lifecycle():
+    first = asyncio.run(create_export({"kind": "test_rows", "params": {"n": 500}}, db=session))["data"]
+    second = asyncio.run(create_export({"kind": "test_rows", "params": {"n": 500}}, db=session))["data"]
+    assert first["id"] == second["id"]
+
+    try:
+        asyncio.run(download_export(first["id"], db=session))
+        assert False, "download of an unfinished export must fail"
+    except HTTPException as e:
+        assert e.status_code == 409
+
+    release.set()
+    job = wait_for(first["id"])
+    assert job.status == "done", job.error
+    assert os.path.getsize(job.file_path) > 0
+
+    status = asyncio.run(get_export(first["id"], db=session))["data"]
+    assert status["progress"] == 100
+    response = asyncio.run(download_export(first["id"], db=session))
+    assert response.path == job.file_path
+    assert "rows.xlsx" in response.headers["content-disposition"]
+
+    path = job.file_path
+    assert cleanup_expired(session, ttl_seconds=-1) >= 1
+    assert not os.path.exists(path)
+    session.expire_all()
+    assert session.get(ExportJob, first["id"]).status == "expired"
+
+
+def test_unknown_kind_is_rejected():
+    try:
+        asyncio.run(create_export({"kind": "nope", "params": {}}, db=session))
+        assert False, "unknown kind must be rejected"
+    except HTTPException as e:
+        assert e.status_code == 400
+
+
+def test_job_orphaned_by_a_restart_is_failed_not_joined():
+    release.set()
+    orphan = ExportJob(
+        id="ex_orphan", kind="test_rows", params='{"n": 3}', params_hash=params_hash("test_rows", {"n": 3}),
+        status="running", progress=40, started_at=datetime.utcnow() - timedelta(seconds=90),
+        heartbeat_at=datetime.utcnow() - timedelta(seconds=90),
+    )
+    session.add(orphan)
+    session.commit()
+
+    job = asyncio.run(create_export({"kind": "test_rows", "params": {"n": 3}}, db=session))["data"]
+    assert job["id"] != "ex_orphan"
+    session.expire_all()
+    assert (orphan.status, orphan.error) == ("failed", "interrupted")
+    assert wait_for(job["id"]).status == "done"
+
+
+def test_one_active_job_per_request_across_workers():
+    digest = params_hash("test_rows", {"n": 4})
+    session.add(ExportJob(id="ex_a", kind="test_rows", params='{"n": 4}', params_hash=digest, status="queued", heartbeat_at=datetime.utcnow()))
+    session.commit()
+    # what a second worker's insert would run into
+    session.add(ExportJob(id="ex_b", kind="test_rows", params='{"n": 4}', params_hash=digest, status="queued", heartbeat_at=datetime.utcnow()))
+    with pytest.raises(IntegrityError):
+        session.commit()
+    session.rollback()
+    job = asyncio.run(create_export({"kind": "test_rows", "params": {"n": 4}}, db=session))["data"]
+    assert job["id"] == "ex_a"
@@ -0,0 +1,73 @@
+import os
+import tempfile
+import sys
+import pathlib
+from datetime import date, datetime, timedelta
+
+import numpy as np
+import pytest
+
+ROOT = pathlib.Path(__file__).resolve().parents[1]
+sys.path.append(str(ROOT))
+
+DB_PATH = os.path.join(tempfile.gettempdir(), "test_forecast.db")
+if os.path.exists(DB_PATH):
+    os.remove(DB_PATH)
+os.environ["DATABASE_URL"] = f"sqlite:///{DB_PATH}"
+
+from database import (
+    create_tables,
+    SessionLocal,
+    Category,
+    Medicine,
+    MedicalDevice,
+    DispensingRecord,
+    DispensingItem,
+)
+from services.forecast import branch_forecast, days_of_cover, fit
+
+create_tables()
+session = SessionLocal()
+
+TODAY = date(2026, 3, 2)  # a Monday
+
+
+@pytest.fixture(scope="module", autouse=True)
+def seed():
+    # seeded lazily: other modules clear dispensing tables between their tests
+    session.add(Category(id="fc_c", name="cat", description="", type="medicine"))
+    session.add(Medicine(id="fc_m", name="Ибупрофен", category_id="fc_c", purchase_price=0, sell_price=0, quantity=40, branch_id="fc_b"))
+    session.add(MedicalDevice(id="fc_d", name="Бинт", category_id="fc_c", purchase_price=0, sell_price=0, quantity=3, branch_id="fc_b"))
+    for day in range(1, 29):
+        when = datetime.combine(TODAY - timedelta(days=day), datetime.min.time()) + timedelta(hours=10)
+        session.add(DispensingRecord(id=f"fc_r{day}", patient_id="p", patient_name="p", employee_id="e", employee_name="e", branch_id="fc_b", date=when))
+        session.add(DispensingItem(id=f"fc_i{day}", record_id=f"fc_r{day}", item_type="medicine", item_id="fc_m", item_name="x", quantity=2))
+    session.commit()
+
+
+def test_fit_and_cover_are_vectorized():
+    matrix = np.array([[2.0] * 28, [0.0] * 28])
+    model = fit(matrix, TODAY - timedelta(days=28))
+    assert np.allclose(model["ma7"], [2.0, 0.0])
+    assert np.allclose(model["level"], [2.0, 0.0])
+    assert np.allclose(model["factors"][0], 1.0)
+
+    cover = days_of_cover(np.array([10.0, 5.0]), model["level"], model["factors"], 0, 30)
+    assert cover.tolist() == [5, -1]
+
+
+def test_branch_forecast():
+    rows = {r["item_id"]: r for r in branch_forecast(session, "fc_b", history_days=28, today=TODAY)}
+    med = rows["fc_m"]
+    assert med["avg_7d"] == 2.0 and med["avg_28d"] == 2.0
+    assert med["days_of_cover"] == 20
+    assert med["stockout_date"] == (TODAY + timedelta(days=20)).isoformat()
+    # no consumption history: stock never runs out within the horizon
+    assert rows["fc_d"]["days_of_cover"] is None
+
+    # the fitted model is cached for the day
+    session.add(DispensingItem(id="fc_extra", record_id="fc_r1", item_type="medicine", item_id="fc_m", item_name="x", quantity=100))
+    session.flush()
+    again = {r["item_id"]: r for r in branch_forecast(session, "fc_b", history_days=28, today=TODAY)}
+    assert again["fc_m"]["avg_7d"] == 2.0
+    session.rollback()
@@ -0,0 +1,97 @@
+import os
+import tempfile
+import sys
+import asyncio
+import pathlib
+
+import pytest
+from fastapi import HTTPException
+from starlette.requests import Request
+
+ROOT = pathlib.Path(__file__).resolve().parents[1]
+sys.path.append(str(ROOT))
+
+DB_PATH = os.path.join(tempfile.gettempdir(), "test_idempotency.db")
+if os.path.exists(DB_PATH):
+    os.remove(DB_PATH)
+os.environ["DATABASE_URL"] = f"sqlite:///{DB_PATH}"
+
+from database import create_tables, SessionLocal, Category, Medicine, Arrival
+from main import create_arrivals
+from schemas import BatchArrivalCreate
+from services.idempotency import run_idempotent
+
+create_tables()
+session = SessionLocal()
+session.add(Category(id="ik_c", name="cat", description="", type="medicine"))
+session.add(Medicine(id="ik_m", name="Аспирин ИК", category_id="ik_c", purchase_price=0, sell_price=0, quantity=0, branch_id=None))
+session.commit()
+
+
+def keyed_request(key):
+    return Request({"type": "http", "method": "POST", "headers": [(b"idempotency-key", key.encode())]})
+
+
+def batch(qty):
+    return BatchArrivalCreate(arrivals=[{"item_type": "medicine", "item_id": "ik_m", "item_name": "Аспирин ИК", "quantity": qty}])
+
+
+def stock():
+    session.expire_all()
+    return session.get(Medicine, "ik_m").quantity
+
+
+def test_replay_does_not_rerun_the_transaction():
+    first = asyncio.run(create_arrivals(batch(5), request=keyed_request("ik-1"), db=session))
+    again = asyncio.run(create_arrivals(batch(5), request=keyed_request("ik-1"), db=session))
+    assert first == {"message": "Arrivals created successfully"}
+    assert again.status_code == 200 and again.headers["idempotent-replayed"] == "true"
+    assert stock() == 5
+    assert session.query(Arrival).filter(Arrival.item_id == "ik_m").count() == 1
+
+    with pytest.raises(HTTPException) as e:
+        asyncio.run(create_arrivals(batch(6), request=keyed_request("ik-1"), db=session))
+    assert e.value.status_code == 422
+
+    # no header: plain behaviour
+    asyncio.run(create_arrivals(batch(1), db=session))
+    assert stock() == 6
+
+
+def test_concurrent_duplicate_waits_for_first_attempt():
+    calls = []
+
+    async def slow_handler():
+        calls.append(1)
+        await asyncio.sleep(0.3)
+        return {"n": len(calls)}
+
+    async def both():
+        other = SessionLocal()
+        try:
+            return await asyncio.gather(
+                run_idempotent(session, keyed_request("ik-2"), "test", {"a": 1}, slow_handler),
+                run_idempotent(other, keyed_request("ik-2"), "test", {"a": 1}, slow_handler),
+            )
+        finally:
+            other.close()
+
+    results = asyncio.run(both())
+    assert calls == [1]
+    # whichever claimed the key ran the handler; the other got the replay
+    assert {"n": 1} in results
+    replay = next(r for r in results if r != {"n": 1})
+    assert replay.status_code == 200 and replay.body == b'{"n":1}'
+
+
+def test_failed_attempt_releases_the_key():
+    async def failing():
+        raise HTTPException(status_code=400, detail="boom")
+
+    with pytest.raises(HTTPException):
+        asyncio.run(run_idempotent(session, keyed_request("ik-3"), "test", {}, failing))
+
+    async def ok():
+        return {"ok": True}
+
+    assert asyncio.run(run_idempotent(session, keyed_request("ik-3"), "test", {}, ok)) == {"ok": True}
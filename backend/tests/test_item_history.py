@@ -0,0 +1,126 @@
+import os
+import tempfile
+import sys
+import asyncio
+import pathlib
+from datetime import datetime
+
+ROOT = pathlib.Path(__file__).resolve().parents[1]
+sys.path.append(str(ROOT))
+
+DB_PATH = os.path.join(tempfile.gettempdir(), "test_item_history.db")
+if os.path.exists(DB_PATH):
+    os.remove(DB_PATH)
+os.environ["DATABASE_URL"] = f"sqlite:///{DB_PATH}"
+
+import pytest
+
+from database import (
+    create_tables,
+    SessionLocal,
+    Arrival,
+    Branch,
+    Category,
+    DispensingItem,
+    DispensingRecord,
+    Employee,
+    Medicine,
+    Patient,
+    Shipment,
+    ShipmentItem,
+    Transfer,
+)
+from main import get_stock_item_details
+from services.archive import archive_year
+
+create_tables()
+session = SessionLocal()
+
+
+@pytest.fixture(scope="module", autouse=True)
+def seed():
+    session.add(Category(id="ih_c", name="cat", description="", type="medicine"))
+    session.add(Branch(id="ih_b", name="Филиал", login="ih_b", password="x"))
+    session.add(Patient(id="ih_p", first_name="П", last_name="Л", illness="-", phone="1", address="a", branch_id="ih_b"))
+    session.add(Employee(id="ih_e", first_name="С", last_name="Л", phone="2", address="a", branch_id="ih_b"))
+    session.add(Medicine(id="ih_main", name="Ибупрофен", category_id="ih_c", purchase_price=0, sell_price=0, quantity=100, branch_id=None))
+    session.add(Medicine(id="ih_br", name="Ибупрофен", category_id="ih_c", purchase_price=0, sell_price=0, quantity=100, branch_id="ih_b"))
+    session.add(Arrival(id="ih_a1", item_type="medicine", item_id="ih_main", item_name="Ибупрофен", quantity=200, date=datetime(2024, 1, 1)))
+    session.add(Shipment(id="ih_s1", to_branch_id="ih_b", status="accepted", created_at=datetime(2024, 1, 2)))
+    session.add(ShipmentItem(id="ih_si1", shipment_id="ih_s1", item_type="medicine", item_id="ih_main", item_name="Ибупрофен", quantity=50))
+    session.add(Shipment(id="ih_s2", to_branch_id="ih_b", status="pending", created_at=datetime(2024, 1, 3)))
+    session.add(ShipmentItem(id="ih_si2", shipment_id="ih_s2", item_type="medicine", item_id="ih_main", item_name="Ибупрофен", quantity=999))
+    session.add(Transfer(id="ih_t1", medicine_id="ih_main", medicine_name="Ибупрофен", quantity=80, from_branch_id="main", to_branch_id="ih_b", date=datetime(2024, 1, 4)))
+    for n in range(3):
+        rid = f"ih_r{n}"
+        session.add(DispensingRecord(id=rid, patient_id="ih_p", patient_name="П Л", employee_id="ih_e", employee_name="С Л", branch_id="ih_b", date=datetime(2024, 1, 5 + n, 6)))
+        session.add(DispensingItem(id=f"ih_i{n}", record_id=rid, item_type="medicine", item_id="ih_br", item_name="Ибупрофен", quantity=10))
+    session.commit()
+
+
+def details(item_id, **kw):
+    params = dict(branch_id="ih_b", type="medicine", item_id=item_id, date_from=None, date_to="2024-12-31", limit=200, cursor=None)
+    params.update(kw)
+    return asyncio.run(get_stock_item_details(**params, db=session))
+
+
+def test_branch_item_feed_pages_with_running_balance():
+    seen, cursor, pages = [], None, 0
+    while True:
+        page = details("ih_br", limit=2, cursor=cursor)
+        seen += page["movements"]
+        pages += 1
+        if not page["has_more"]:
+            break
+        cursor = page["cursor"]
+    assert pages == 3
+    assert [(m["kind"], m["qty"], m["balance"]) for m in seen] == [
+        ("shipment_in", 50, 50),
+        ("transfer_in", 80, 130),
+        ("dispensing", -10, 120),
+        ("dispensing", -10, 110),
+        ("dispensing", -10, 100),
+    ]
+
+
+def test_opening_balance_and_totals_for_a_range():
+    page = details("ih_br", date_from="2024-01-05")
+    assert page["opening_balance"] == 130
+    assert (page["total_in"], page["total_out"]) == (0, 30)
+    assert [m["balance"] for m in page["movements"]] == [120, 110, 100]
+    assert page["outgoing"][0] == {"date": "2024-01-05T06:00:00", "qty": 10}
+
+
+def test_main_item_feed_shows_outgoing_shipments_and_transfers():
+    page = details("ih_main")
+    assert [(m["kind"], m["balance"]) for m in page["movements"]] == [
+        ("arrival", 200),
+        ("shipment_out", 150),
+        ("transfer_out", 70),
+    ]
+    assert (page["total_in"], page["total_out"]) == (200, 130)
+
+
+def test_archived_years_count_in_balances(tmp_path):
+    year = 2002
+    session.add(Medicine(id="ih_arch", name="Аспирин", category_id="ih_c", purchase_price=0, sell_price=0, quantity=0, branch_id=None))
+    session.add(Arrival(id="ih_a2", item_type="medicine", item_id="ih_arch", item_name="Аспирин", quantity=40, date=datetime(year, 5, 1)))
+    session.add(Arrival(id="ih_a3", item_type="medicine", item_id="ih_arch", item_name="Аспирин", quantity=5, date=datetime(2024, 2, 1)))
+    session.add(DispensingRecord(id="ih_r9", patient_id="ih_p", patient_name="П Л", employee_id="ih_e", employee_name="С Л", branch_id="ih_b", date=datetime(year, 6, 1)))
+    session.add(DispensingItem(id="ih_i9", record_id="ih_r9", item_type="medicine", item_id="ih_arch", item_name="Аспирин", quantity=15))
+    session.commit()
+    before = details("ih_arch", date_from="2024-01-01")
+    archive_year(session, year, directory=str(tmp_path))
+    session.commit()
+
+    page = details("ih_arch", date_from="2024-01-01")
+    assert page == before
+    assert (page["opening_balance"], page["movements"][-1]["balance"]) == (25, 30)
+
+    page = details("ih_arch")
+    assert [(m["kind"], m["qty"], m["balance"]) for m in page["movements"]] == [
+        ("archived", 40, 40),
+        ("archived", -15, 25),
+        ("arrival", 5, 30),
+    ]
+    assert (page["total_in"], page["total_out"]) == (45, 15)
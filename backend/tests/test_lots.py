@@ -0,0 +1,102 @@
+import os
+import tempfile
+import sys
+import asyncio
+import pathlib
+from datetime import date, timedelta
+
+ROOT = pathlib.Path(__file__).resolve().parents[1]
+sys.path.append(str(ROOT))
+
+DB_PATH = os.path.join(tempfile.gettempdir(), "test_lots.db")
+if os.path.exists(DB_PATH):
+    os.remove(DB_PATH)
+os.environ["DATABASE_URL"] = f"sqlite:///{DB_PATH}"
+
+import pytest
+from sqlalchemy import text
+
+from database import create_tables, SessionLocal, Branch, Category, Medicine, StockLot
+from main import _create_arrivals
+from schemas import BatchArrivalCreate, TransferCreate
+from services.lots import add_lot, allocate_fefo, expiring_lots
+from services.stock import ItemType, decrement_stock
+from services.transfers import transfer_batch
+
+create_tables()
+session = SessionLocal()
+
+SOON, LATER = date(2030, 1, 31), date(2030, 3, 31)
+
+
+@pytest.fixture(scope="module", autouse=True)
+def seed():
+    session.add(Category(id="lt_c", name="cat", description="", type="medicine"))
+    session.add(Branch(id="lt_b", name="lt_b", login="lt_b", password="x"))
+    session.add(Medicine(id="lt_m", name="Амоксициллин", category_id="lt_c", purchase_price=1, sell_price=2, quantity=0, branch_id=None))
+    session.add(Medicine(id="lt_many", name="Ибупрофен", category_id="lt_c", purchase_price=1, sell_price=2, quantity=0, branch_id=None))
+    session.commit()
+
+
+def lots(item_id):
+    session.expire_all()
+    return [
+        (l.expiry_date, l.quantity)
+        for l in session.query(StockLot).filter_by(item_id=item_id).order_by(StockLot.expiry_date)
+        if l.quantity
+    ]
+
+
+def test_lots_follow_stock_first_expiring_first_out():
+    arrivals = [
+        {"item_type": "medicine", "item_id": "lt_m", "item_name": "Амоксициллин", "quantity": 5, "expiry_date": LATER, "lot_number": "A"},
+        {"item_type": "medicine", "item_id": "lt_m", "item_name": "Амоксициллин", "quantity": 5, "expiry_date": SOON, "lot_number": "B"},
+        {"item_type": "medicine", "item_id": "lt_m", "item_name": "Амоксициллин", "quantity": 5},
+    ]
+    asyncio.run(_create_arrivals(BatchArrivalCreate(arrivals=arrivals), session))
+    assert lots("lt_m") == [(SOON, 5), (LATER, 5)]
+
+    transfer_batch(session, [TransferCreate(medicine_id="lt_m", medicine_name="-", quantity=7, to_branch_id="lt_b")])
+    session.commit()
+    branch_row = session.query(Medicine).filter_by(branch_id="lt_b", name="Амоксициллин").one()
+    assert lots("lt_m") == [(LATER, 3)]
+    assert lots(branch_row.id) == [(SOON, 5), (LATER, 2)]
+
+    decrement_stock(session, "lt_b", ItemType.medicine, branch_row.id, 6)
+    session.commit()
+    assert lots(branch_row.id) == [(LATER, 1)]
+
+    soon = expiring_lots(session, date(2030, 12, 31))
+    assert {(r["branch_id"], r["lot_number"], r["quantity"]) for r in soon if r["name"] == "Амоксициллин"} == {
+        (None, "A", 3),
+        ("lt_b", "A", 1),
+    }
+    assert expiring_lots(session, date(2030, 12, 31), branch_id="lt_b")[0]["item_id"] == branch_row.id
+
+
+def test_allocation_pages_through_many_open_lots():
+    start = date(2031, 1, 1)
+    for day in range(120):
+        add_lot(session, "medicine", "lt_many", None, 1, start + timedelta(days=day))
+    session.commit()
+    taken = allocate_fefo(session, "lt_many", None, 110)
+    session.commit()
+    assert [t["expiry_date"] for t in taken] == [start + timedelta(days=d) for d in range(110)]
+    assert [d for d, _ in lots("lt_many")] == [start + timedelta(days=d) for d in range(110, 120)]
+
+
+def test_fefo_and_expiry_reads_use_the_lot_indexes():
+    plan = session.execute(
+        text(
+            "EXPLAIN QUERY PLAN SELECT id FROM stock_lots "
+            "WHERE branch_id = 'x' AND item_id = 'y' AND quantity > 0 ORDER BY expiry_date, id LIMIT 50"
+        )
+    ).all()
+    assert any("ix_stock_lots_fefo" in row[-1] for row in plan)
+    plan = session.execute(
+        text(
+            "EXPLAIN QUERY PLAN SELECT id FROM stock_lots "
+            "WHERE quantity > 0 AND expiry_date <= '2030-06-01' ORDER BY expiry_date"
+        )
+    ).all()
+    assert any("ix_stock_lots_expiry" in row[-1] for row in plan)
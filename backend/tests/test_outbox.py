@@ -0,0 +1,88 @@
+import os
+import tempfile
+import sys
+import asyncio
+import json
+import pathlib
+
+import pytest
+from fastapi import HTTPException
+
+ROOT = pathlib.Path(__file__).resolve().parents[1]
+sys.path.append(str(ROOT))
+
+DB_PATH = os.path.join(tempfile.gettempdir(), "test_outbox.db")
+if os.path.exists(DB_PATH):
+    os.remove(DB_PATH)
+os.environ["DATABASE_URL"] = f"sqlite:///{DB_PATH}"
+
+from database import create_tables, SessionLocal, Category, Employee, Medicine, OutboxEvent, Patient
+from main import create_dispensing_record
+from services.outbox import NDJSONFileSink, OutboxRelay, emit_event, outbox_stats
+
+create_tables()
+session = SessionLocal()
+
+
+def pending_ids():
+    session.expire_all()
+    rows = session.query(OutboxEvent.id).filter(OutboxEvent.delivered_at.is_(None))
+    return [r.id for r in rows.order_by(OutboxEvent.id)]
+
+
+@pytest.fixture(scope="module", autouse=True)
+def seed():
+    session.add(Category(id="ob_c", name="cat", description="", type="medicine"))
+    session.add(Patient(id="ob_p", first_name="П", last_name="Л", illness="-", phone="1", address="a", branch_id="ob_b"))
+    session.add(Employee(id="ob_e", first_name="С", last_name="Л", phone="2", address="a", branch_id="ob_b"))
+    session.add(Medicine(id="ob_m", name="Аспирин", category_id="ob_c", purchase_price=0, sell_price=0, quantity=5, branch_id="ob_b"))
+    session.commit()
+    # start each run from a drained outbox
+    session.query(OutboxEvent).delete()
+    session.commit()
+
+
+def dispense(quantity):
+    payload = {"patient_id": "ob_p", "employee_id": "ob_e", "branch_id": "ob_b", "medicines": [{"id": "ob_m", "quantity": quantity}]}
+    with SessionLocal() as db:
+        return asyncio.run(create_dispensing_record(payload, db=db))
+
+
+def test_events_commit_and_roll_back_with_the_write():
+    before = pending_ids()
+    record = dispense(2)
+    with pytest.raises(HTTPException):
+        dispense(100)
+    new = session.query(OutboxEvent).filter(OutboxEvent.id.notin_(before)).all()
+    assert [(e.event_type, e.aggregate_id) for e in new] == [("dispensing.created", record["id"])]
+    assert json.loads(new[0].payload)["items"][0]["quantity"] == 2
+
+
+def test_relay_delivers_in_order_and_retries_failures(tmp_path):
+    emit_event(session, "shipment", "s1", "shipment.accepted", {"n": 1})
+    emit_event(session, "shipment", "s1", "shipment.accepted", {"n": 2})
+    session.commit()
+    queued = pending_ids()
+    assert outbox_stats(session)["pending"] == len(queued)
+
+    class Broken:
+        def send(self, events):
+            raise ConnectionError("down")
+
+    failing = OutboxRelay(SessionLocal, Broken(), batch_size=2)
+    with pytest.raises(ConnectionError):
+        failing.deliver_batch()
+    assert pending_ids() == queued
+    assert session.get(OutboxEvent, queued[0]).attempts == 1
+    assert failing.failures == 1
+
+    path = tmp_path / "events.ndjson"
+    relay = OutboxRelay(SessionLocal, NDJSONFileSink(str(path)), batch_size=2)
+    while relay.deliver_batch():
+        pass
+    lines = [json.loads(line) for line in path.read_text(encoding="utf-8").splitlines()]
+    assert [e["id"] for e in lines] == queued
+    assert [e["payload"] for e in lines[-2:]] == [{"n": 1}, {"n": 2}]
+    assert pending_ids() == []
+    stats = outbox_stats(session)
+    assert stats["pending"] == 0 and stats["lag_seconds"] == 0.0
@@ -0,0 +1,90 @@
+import os
+import tempfile
+import sys
+import asyncio
+import pathlib
+from datetime import datetime
+
+ROOT = pathlib.Path(__file__).resolve().parents[1]
+sys.path.append(str(ROOT))
+
+DB_PATH = os.path.join(tempfile.gettempdir(), "test_patient_dedup.db")
+if os.path.exists(DB_PATH):
+    os.remove(DB_PATH)
+os.environ["DATABASE_URL"] = f"sqlite:///{DB_PATH}"
+
+import pytest
+from fastapi import HTTPException
+
+from database import create_tables, SessionLocal, Branch, DispensingItem, DispensingRecord, Patient, PatientDuplicate
+from main import get_patient_duplicates, merge_patient_records, scan_patient_duplicates
+from schemas import PatientMerge
+from services.patient_dedup import blocking_keys, scan, soundex, translit
+
+create_tables()
+session = SessionLocal()
+
+PATIENTS = {
+    "pd_a": ("Иванов", "Иван", "+7 701 555 1234", "ул. Абая 10, кв. 5"),
+    "pd_b": ("Ivanov", "Ivan", "8 (701) 555-12-34", "-"),  # re-registered in Latin script
+    "pd_c": ("Иваноф", "Иван", "87015551234", "-"),  # typo, same phone
+    "pd_d": ("Иванова", "Мария", "+7 701 555 1234", "ул. Абая 10, кв. 5"),  # relative sharing the phone
+    "pd_e": ("Иванов", "Иван", "+7 777 000 9999", "Абая 10 кв 5"),  # new phone, same address
+    "pd_f": ("Иванов", "Иван", "+7 777 000 1111", "-"),  # namesake
+}
+
+
+@pytest.fixture(scope="module", autouse=True)
+def seed():
+    session.add(Branch(id="pd_br", name="pd_br", login="pd_br", password="x"))
+    for pid, (last, first, phone, address) in PATIENTS.items():
+        session.add(Patient(id=pid, first_name=first, last_name=last, illness="", phone=phone, address=address, branch_id="pd_br"))
+    for i, pid in enumerate(("pd_a", "pd_b", "pd_b", "pd_c")):
+        session.add(DispensingRecord(id=f"pd_r{i}", patient_id=pid, patient_name="x", employee_id="pd_e", employee_name="y", branch_id="pd_br", date=datetime(2024, 3, 1 + i)))
+        session.add(DispensingItem(id=f"pd_i{i}", record_id=f"pd_r{i}", item_type="medicine", item_id="pd_m", item_name="m", quantity=1, patient_id=pid, dispensed_at=datetime(2024, 3, 1 + i)))
+    session.commit()
+
+
+def ours(pairs):
+    return {(p["patient_id"], p["duplicate_id"]) for p in pairs if p["patient_id"].startswith("pd_")}
+
+
+def test_keys_match_across_scripts():
+    assert soundex("robert") == soundex("rupert") == "r163"
+    assert translit("иваноф") == "ivanof"
+    assert blocking_keys("Иванов", "Иван", "+7 701 555 1234") == blocking_keys("IVANOV", "Ivan", "87015551234")
+
+
+def test_scan_scores_pairs_inside_blocks_only():
+    found, stats = scan(session)
+    assert ours(found) == {("pd_a", "pd_b"), ("pd_a", "pd_c"), ("pd_b", "pd_c"), ("pd_a", "pd_e")}
+    assert stats["compared"] < stats["patients"] * (stats["patients"] - 1) // 2
+
+    _, stats = scan(session, max_block=1)
+    assert stats["compared"] == 0 and stats["skipped_blocks"] > 0
+
+
+def test_merge_repoints_history_and_removes_duplicates():
+    stats = scan_patient_duplicates({"threshold": 0.75}, db=session)["data"]
+    assert stats["candidates"] >= 4
+    listed = asyncio.run(get_patient_duplicates(min_score=0.75, limit=1000, db=session))["data"]
+    pair = next(p for p in listed if {p["patient"]["id"], p["duplicate"]["id"]} == {"pd_a", "pd_b"})
+    assert pair["same_phone"] and pair["score"] == 1.0
+
+    result = asyncio.run(merge_patient_records(PatientMerge(keep_id="pd_a", merge_ids=["pd_b", "pd_c", "pd_a"]), db=session))["data"]
+    assert result == {"kept": "pd_a", "merged": ["pd_b", "pd_c"], "dispensings_moved": 3}
+
+    session.expire_all()
+    assert session.query(DispensingRecord).filter(DispensingRecord.id.like("pd_r%"), DispensingRecord.patient_id != "pd_a").count() == 0
+    assert session.query(DispensingItem).filter(DispensingItem.id.like("pd_i%"), DispensingItem.patient_id != "pd_a").count() == 0
+    assert session.get(Patient, "pd_b") is None and session.get(Patient, "pd_c") is None
+    assert session.query(PatientDuplicate).filter(PatientDuplicate.duplicate_id.in_(["pd_b", "pd_c"])).count() == 0
+
+
+def test_merge_errors():
+    with pytest.raises(HTTPException) as exc:
+        asyncio.run(merge_patient_records(PatientMerge(keep_id="pd_a", merge_ids=["pd_missing"]), db=session))
+    assert exc.value.status_code == 404
+    with pytest.raises(HTTPException) as exc:
+        asyncio.run(merge_patient_records(PatientMerge(keep_id="pd_a", merge_ids=["pd_a"]), db=session))
+    assert exc.value.status_code == 400
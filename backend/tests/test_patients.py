@@ -0,0 +1,141 @@
+import os
+import tempfile
+import sys
+import asyncio
+import json
+import pathlib
+from datetime import datetime, timedelta
+
+ROOT = pathlib.Path(__file__).resolve().parents[1]
+sys.path.append(str(ROOT))
+
+DB_PATH = os.path.join(tempfile.gettempdir(), "test_patients.db")
+if os.path.exists(DB_PATH):
+    os.remove(DB_PATH)
+os.environ["DATABASE_URL"] = f"sqlite:///{DB_PATH}"
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import text
+
+from database import create_tables, SessionLocal, engine, Branch, DispensingItem, DispensingRecord, Patient
+from main import get_patient_history, search_patients_page
+from services.patients import PATIENT_INDEXES, backfill_search_keys
+
+create_tables()
+session = SessionLocal()
+
+NAMES = [
+    ("Иванов", "Иван", "+7 (701) 111-22-33"),
+    ("Иванова", "Мария", "+7 701 111 4455"),
+    ("Ёлкин", "Пётр", "8 777 000 1122"),
+    ("Ivanov", "Ivan", "+7 702 000 0000"),
+    ("Петров", "Семён", "+7 701 999 0000"),
+]
+
+
+@pytest.fixture(scope="module", autouse=True)
+def seed():
+    session.add(Branch(id="pt_b", name="pt_b", login="pt_b", password="x"))
+    for i, (last, first, phone) in enumerate(NAMES):
+        session.add(
+            Patient(id=f"pt_p{i}", first_name=first, last_name=last, illness="", phone=phone, address="", branch_id="pt_b")
+        )
+    start = datetime(2024, 1, 1, 10)
+    for day in range(7):
+        session.add(
+            DispensingRecord(
+                id=f"pt_r{day}", patient_id="pt_p0", patient_name="Иванов Иван", employee_id="pt_e",
+                employee_name="Анна", branch_id="pt_b", date=start + timedelta(days=day),
+            )
+        )
+        session.add(DispensingItem(id=f"pt_i{day}a", record_id=f"pt_r{day}", item_type="medicine", item_id="pt_m1", item_name="Парацетамол", quantity=2))
+        if day % 2:
+            session.add(DispensingItem(id=f"pt_i{day}b", record_id=f"pt_r{day}", item_type="medical_device", item_id="pt_d1", item_name="Шприц", quantity=10))
+    session.commit()
+
+
+def search(q=None, limit=50, cursor=None, branch_id="pt_b"):
+    response = asyncio.run(search_patients_page(q, branch_id, limit, cursor, db=session))
+    return json.loads(response.body)["data"]
+
+
+def test_prefix_search_by_name_and_phone():
+    found = search("иванов")
+    assert [p["id"] for p in found["patients"]] == ["pt_p0", "pt_p1"]
+    assert found["patients"][0]["first_name"] == "Иван" and found["patients"][0]["version"] == 1
+    assert [p["id"] for p in search("ИВАНОВ  ив")["patients"]] == ["pt_p0"]
+    assert [p["id"] for p in search("елк")["patients"]] == ["pt_p2"]
+    assert [p["id"] for p in search("7701")["patients"]] == ["pt_p0", "pt_p1", "pt_p4"]
+    assert [p["id"] for p in search("+7 701 111")["patients"]] == ["pt_p0", "pt_p1"]
+    assert search("zzz")["patients"] == []
+
+
+def test_search_pages_follow_the_cursor():
+    seen, cursor = [], None
+    while True:
+        page = search(limit=2, cursor=cursor, branch_id="pt_b")
+        seen += [p["id"] for p in page["patients"]]
+        if not page["has_more"]:
+            break
+        cursor = page["cursor"]
+    assert sorted(seen) == sorted(f"pt_p{i}" for i in range(len(NAMES)))
+    assert len(seen) == len(set(seen))
+
+
+def test_renamed_patient_is_found_under_the_new_name():
+    patient = session.get(Patient, "pt_p3")
+    patient.last_name = "Sidorov"
+    session.commit()
+    assert [p["id"] for p in search("sid")["patients"]] == ["pt_p3"]
+    assert search("ivanov")["patients"] == []
+
+
+def test_backfill_and_indexes_on_start():
+    session.execute(text("UPDATE patients SET search_name = NULL, search_phone = NULL WHERE id = 'pt_p4'"))
+    session.commit()
+    with engine.begin() as conn:  # what ensure_patient_search runs
+        for ddl in PATIENT_INDEXES:
+            conn.exec_driver_sql(ddl)
+        assert backfill_search_keys(conn) == 1
+    assert [p["id"] for p in search("петр")["patients"]] == ["pt_p4"]
+    with engine.connect() as conn:
+        plan = " ".join(
+            str(r[-1])
+            for r in conn.exec_driver_sql(
+                "EXPLAIN QUERY PLAN SELECT id, date FROM dispensing_records "
+                "WHERE patient_id = 'pt_p0' ORDER BY date DESC"
+            )
+        )
+    assert "idx_dispensing_records_patient_date" in plan
+
+
+def test_history_pages_and_summary():
+    first = asyncio.run(get_patient_history("pt_p0", limit=3, cursor=None, db=session))["data"]
+    summary = first["summary"]
+    assert summary["visits"] == 7
+    assert summary["first_visit"].startswith("2024-01-01")
+    assert summary["last_visit"].startswith("2024-01-07")
+    assert [(t["item_id"], t["quantity"], t["times"]) for t in summary["top_items"]] == [
+        ("pt_d1", 30, 3),
+        ("pt_m1", 14, 7),
+    ]
+    assert [d["id"] for d in first["dispensings"]] == ["pt_r6", "pt_r5", "pt_r4"]
+    assert [i["name"] for i in first["dispensings"][1]["items"]] == ["Парацетамол", "Шприц"]
+
+    ids, cursor = [d["id"] for d in first["dispensings"]], first["cursor"]
+    while cursor:
+        page = asyncio.run(get_patient_history("pt_p0", limit=3, cursor=cursor, db=session))["data"]
+        assert page["summary"] is None
+        ids += [d["id"] for d in page["dispensings"]]
+        cursor = page["cursor"]
+    assert ids == [f"pt_r{d}" for d in range(6, -1, -1)]
+
+
+def test_history_of_patient_without_visits_and_unknown_patient():
+    page = asyncio.run(get_patient_history("pt_p2", limit=10, cursor=None, db=session))["data"]
+    assert page["summary"] == {"visits": 0, "first_visit": None, "last_visit": None, "top_items": []}
+    assert page["dispensings"] == [] and page["cursor"] is None
+    with pytest.raises(HTTPException) as exc:
+        asyncio.run(get_patient_history("pt_missing", limit=10, cursor=None, db=session))
+    assert exc.value.status_code == 404
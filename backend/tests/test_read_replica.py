@@ -0,0 +1,76 @@
+import os
+import tempfile
+import sys
+import pathlib
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+ROOT = pathlib.Path(__file__).resolve().parents[1]
+sys.path.append(str(ROOT))
+
+DB_PATH = os.path.join(tempfile.gettempdir(), "test_read_replica.db")
+REPLICA_PATH = os.path.join(tempfile.gettempdir(), "test_read_replica_ro.db")
+for path in (DB_PATH, REPLICA_PATH):
+    if os.path.exists(path):
+        os.remove(path)
+os.environ["DATABASE_URL"] = f"sqlite:///{DB_PATH}"
+
+import database
+from database import Base, Branch, ReadRouter, ReplicaHeartbeat
+
+replica_engine = create_engine(f"sqlite:///{REPLICA_PATH}")
+Base.metadata.create_all(bind=replica_engine)
+Replica = sessionmaker(bind=replica_engine)
+
+
+def stamp(age_seconds):
+    with Replica() as db:
+        db.merge(ReplicaHeartbeat(id=1, beat_at=datetime.utcnow() - timedelta(seconds=age_seconds)))
+        db.commit()
+
+
+def engine_of(db):
+    return db.get_bind().url.database
+
+
+def test_router_prefers_a_fresh_replica_and_falls_back():
+    database.create_tables()
+    router = ReadRouter(database.SessionLocal, Replica, max_lag=30, check_interval=0)
+
+    # no heartbeat replicated yet
+    with router.session() as db:
+        assert engine_of(db) != REPLICA_PATH
+    stamp(5)
+    with router.session() as db:
+        assert engine_of(db) == REPLICA_PATH
+    stamp(120)
+    with router.session() as db:
+        assert engine_of(db) != REPLICA_PATH
+    assert router.stats()["lag_seconds"] >= 120
+    assert (router.replica_reads, router.primary_reads) == (1, 2)
+
+
+def test_marked_routes_read_from_the_replica():
+    stamp(0)
+    with Replica() as db:
+        db.add(Branch(id="rr_b", name="Только на реплике", login="rr_b", password="x"))
+        db.commit()
+    saved = database.read_router
+    database.read_router = ReadRouter(database.SessionLocal, Replica, check_interval=0)
+    try:
+        gen = database.get_read_db()
+        db = next(gen)
+        assert db.get(Branch, "rr_b").name == "Только на реплике"
+        gen.close()
+    finally:
+        database.read_router = saved
+
+
+def test_unreachable_replica_falls_back_to_primary():
+    broken = sessionmaker(bind=create_engine("sqlite:////nonexistent/dir/replica.db"))
+    router = ReadRouter(database.SessionLocal, broken, check_interval=0)
+    with router.session() as db:
+        assert engine_of(db) == database.engine.url.database
+    assert router.stats()["using_replica"] is False
@@ -0,0 +1,120 @@
+import os
+import tempfile
+import sys
+import asyncio
+import pathlib
+from datetime import datetime
+
+ROOT = pathlib.Path(__file__).resolve().parents[1]
+sys.path.append(str(ROOT))
+
+DB_PATH = os.path.join(tempfile.gettempdir(), "test_reconciliation.db")
+if os.path.exists(DB_PATH):
+    os.remove(DB_PATH)
+os.environ["DATABASE_URL"] = f"sqlite:///{DB_PATH}"
+
+import pytest
+
+from database import (
+    create_tables,
+    SessionLocal,
+    ArchivedTotal,
+    Arrival,
+    Branch,
+    Category,
+    DispensingItem,
+    DispensingRecord,
+    Employee,
+    MedicalDevice,
+    Medicine,
+    Patient,
+    Shipment,
+    ShipmentItem,
+)
+from main import get_stock_item_details
+from services.archive import archive_year, backfill_totals
+from services.reconciliation import reconcile
+
+create_tables()
+session = SessionLocal()
+
+
+@pytest.fixture(scope="module", autouse=True)
+def seed():
+    session.add(Category(id="rq_c", name="cat", description="", type="medicine"))
+    session.add(Category(id="rq_cd", name="dev", description="", type="medical_device"))
+    for b in ("rq_b1", "rq_b2"):
+        session.add(Branch(id=b, name=b, login=b, password="x"))
+    session.add(Patient(id="rq_p", first_name="П", last_name="Л", illness="-", phone="1", address="a", branch_id="rq_b1"))
+    session.add(Employee(id="rq_e", first_name="С", last_name="Л", phone="2", address="a", branch_id="rq_b1"))
+    # branch 1: 40 shipped in, 5 dispensed -> 35 expected, but edited to 30
+    session.add(Medicine(id="rq_m1", name="Парацетамол", category_id="rq_c", purchase_price=0, sell_price=0, quantity=30, branch_id="rq_b1"))
+    session.add(Shipment(id="rq_s", to_branch_id="rq_b1", status="accepted", created_at=datetime(2024, 1, 1)))
+    session.add(ShipmentItem(id="rq_si", shipment_id="rq_s", item_type="medicine", item_id="rq_main", item_name="Парацетамол", quantity=40))
+    session.add(ShipmentItem(id="rq_sd", shipment_id="rq_s", item_type="medical_device", item_id="rq_dmain", item_name="Шприц", quantity=10))
+    session.add(DispensingRecord(id="rq_r", patient_id="rq_p", patient_name="П Л", employee_id="rq_e", employee_name="С Л", branch_id="rq_b1", date=datetime(2024, 1, 2)))
+    session.add(DispensingItem(id="rq_i", record_id="rq_r", item_type="medicine", item_id="rq_m1", item_name="Парацетамол", quantity=5))
+    # branch 1 device in agreement with its history
+    session.add(MedicalDevice(id="rq_d1", name="Шприц", category_id="rq_cd", purchase_price=0, sell_price=0, quantity=10, branch_id="rq_b1"))
+    # branch 2: driven negative without history
+    session.add(Medicine(id="rq_m2", name="Анальгин", category_id="rq_c", purchase_price=0, sell_price=0, quantity=-3, branch_id="rq_b2"))
+    session.commit()
+
+
+def test_reports_drift_per_branch_and_fixes_it():
+    report = reconcile(["rq_b1", "rq_b2"], workers=2, session_factory=SessionLocal)
+    assert report["branches"] == 2 and report["checked"] == 3
+    drift = {d["item_id"]: d for d in report["drift"]}
+    assert set(drift) == {"rq_m1", "rq_m2"}
+    assert (drift["rq_m1"]["expected"], drift["rq_m1"]["actual"], drift["rq_m1"]["drift"]) == (35, 30, -5)
+    assert drift["rq_m2"]["negative"] is True
+
+    fixed = reconcile(["rq_b1", "rq_b2"], fix=True, workers=2, session_factory=SessionLocal)
+    assert fixed["adjusted"] == 2
+
+    again = reconcile(["rq_b1", "rq_b2"], workers=2, session_factory=SessionLocal)
+    # the ledger now agrees; a negative quantity is still flagged
+    assert [(d["item_id"], d["drift"], d["negative"]) for d in again["drift"]] == [("rq_m2", 0, True)]
+
+
+def test_adjustments_show_in_item_history():
+    session.expire_all()
+    page = asyncio.run(
+        get_stock_item_details(branch_id="rq_b1", type="medicine", item_id="rq_m1", date_from=None, date_to=None, limit=200, cursor=None, db=session)
+    )
+    assert [m["kind"] for m in page["movements"]] == ["shipment_in", "dispensing", "adjustment"]
+    assert page["movements"][-1]["balance"] == 30
+
+
+def test_archived_year_does_not_show_as_drift(tmp_path):
+    year = 2003
+    # branch 3 received 10 and dispensed 3 in a year that gets archived
+    session.add(Branch(id="rq_b3", name="rq_b3", login="rq_b3", password="x"))
+    session.add(Medicine(id="rq_main3", name="Ибупрофен", category_id="rq_c", purchase_price=0, sell_price=0, quantity=15, branch_id=None))
+    session.add(Arrival(id="rq_a3", item_type="medicine", item_id="rq_main3", item_name="Ибупрофен", quantity=25, date=datetime(year, 2, 1)))
+    session.add(Shipment(id="rq_s3", to_branch_id="rq_b3", status="accepted", created_at=datetime(year, 3, 1)))
+    session.add(ShipmentItem(id="rq_si3", shipment_id="rq_s3", item_type="medicine", item_id="rq_main3", item_name="Ибупрофен", quantity=10))
+    session.add(Medicine(id="rq_m3", name="Ибупрофен", category_id="rq_c", purchase_price=0, sell_price=0, quantity=7, branch_id="rq_b3"))
+    session.add(DispensingRecord(id="rq_r3", patient_id="rq_p", patient_name="П Л", employee_id="rq_e", employee_name="С Л", branch_id="rq_b3", date=datetime(year, 4, 1)))
+    session.add(DispensingItem(id="rq_i3", record_id="rq_r3", item_type="medicine", item_id="rq_m3", item_name="Ибупрофен", quantity=3))
+    session.commit()
+
+    def ours():
+        report = reconcile([None, "rq_b3"], workers=2, session_factory=SessionLocal)
+        return [d for d in report["drift"] if d["item_id"] in ("rq_main3", "rq_m3")]
+
+    assert ours() == []
+    archive_year(session, year, directory=str(tmp_path))
+    session.commit()
+    assert session.get(DispensingRecord, "rq_r3") is None and session.get(Arrival, "rq_a3") is None
+    assert ours() == []
+    assert reconcile(["rq_b3"], fix=True, session_factory=SessionLocal)["adjusted"] == 0
+
+    # periods archived before totals were recorded are filled from the files
+    session.query(ArchivedTotal).filter(ArchivedTotal.year == year).delete()
+    session.commit()
+    assert [d["drift"] for d in ours()] == [25, -3]
+    assert backfill_totals(session) >= 2
+    session.commit()
+    assert ours() == []
+    assert backfill_totals(session) == 0
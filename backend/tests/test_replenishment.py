@@ -0,0 +1,88 @@
+import os
+import tempfile
+import sys
+import asyncio
+import pathlib
+
+import pytest
+from fastapi import HTTPException
+
+ROOT = pathlib.Path(__file__).resolve().parents[1]
+sys.path.append(str(ROOT))
+
+DB_PATH = os.path.join(tempfile.gettempdir(), "test_replenishment.db")
+if os.path.exists(DB_PATH):
+    os.remove(DB_PATH)
+os.environ["DATABASE_URL"] = f"sqlite:///{DB_PATH}"
+
+from database import (
+    create_tables,
+    SessionLocal,
+    Category,
+    Medicine,
+    Shipment,
+    ShipmentItem,
+    StockThreshold,
+)
+from main import accept_shipment, create_replenishment_plan, confirm_shipment, get_shipments
+from services.replenishment import allocate_fairly
+
+create_tables()
+session = SessionLocal()
+session.add(Category(id="rp_c", name="cat", description="", type="medicine"))
+session.add(Medicine(id="rp_main", name="Цитрамон РП", category_id="rp_c", purchase_price=0, sell_price=0, quantity=12, branch_id=None))
+for branch, qty in (("rp_b1", 2), ("rp_b2", 0), ("rp_b3", 9)):
+    session.add(Medicine(id=f"rp_{branch}", name="Цитрамон РП", category_id="rp_c", purchase_price=0, sell_price=0, quantity=qty, branch_id=branch))
+    session.add(StockThreshold(item_type="medicine", item_id=f"rp_{branch}", min_qty=3, max_qty=10))
+session.commit()
+
+
+def test_allocate_fairly():
+    assert allocate_fairly(100, [5, 7]) == [5, 7]
+    assert allocate_fairly(0, [5, 7]) == [0, 0]
+    assert allocate_fairly(12, [8, 10]) == [5, 7]
+    assert sum(allocate_fairly(7, [3, 3, 3])) == 7
+
+
+def test_plan_creates_drafts_fairly():
+    dry = asyncio.run(create_replenishment_plan({"dry_run": True}, db=session))["data"]
+    assert dry["shipment_ids"] == []
+    lines = {l["branch_id"]: l for l in dry["lines"]}
+    # rp_b3 is above its minimum; 12 units are split over needs of 8 and 10
+    assert set(lines) == {"rp_b1", "rp_b2"}
+    assert lines["rp_b1"]["quantity"] + lines["rp_b2"]["quantity"] == 12
+    assert lines["rp_b2"]["quantity"] > lines["rp_b1"]["quantity"]
+
+    result = asyncio.run(create_replenishment_plan({}, db=session))["data"]
+    assert len(result["shipment_ids"]) == 2
+    items = session.query(ShipmentItem).filter(ShipmentItem.shipment_id.in_(result["shipment_ids"])).all()
+    assert sum(i.quantity for i in items) == 12 and {i.item_id for i in items} == {"rp_main"}
+
+    # drafts reserve main stock and count as in transit: the rest stays unmet
+    again = asyncio.run(create_replenishment_plan({"dry_run": True}, db=session))["data"]
+    assert {l["quantity"] for l in again["lines"]} == {0}
+    assert sum(l["need"] for l in again["lines"]) == 18 - 12
+
+    # branches only see a draft once it is confirmed
+    shipment = session.query(Shipment).filter(Shipment.to_branch_id == "rp_b2").one()
+    assert asyncio.run(get_shipments(branch_id="rp_b2", db=session))["data"] == []
+    asyncio.run(confirm_shipment(shipment.id, db=session))
+    assert asyncio.run(get_shipments(branch_id="rp_b2", db=session))["data"][0]["status"] == "pending"
+
+
+def test_only_pending_shipments_can_be_accepted():
+    draft = session.query(Shipment).filter(Shipment.to_branch_id == "rp_b1").one()
+    with pytest.raises(HTTPException) as exc:
+        asyncio.run(accept_shipment(draft.id, db=session))
+    assert exc.value.status_code == 409
+    session.expire_all()
+    assert session.get(Medicine, "rp_rp_b1").quantity == 2
+
+    pending = session.query(Shipment).filter(Shipment.to_branch_id == "rp_b2").one()
+    asyncio.run(accept_shipment(pending.id, db=session))
+    received = session.get(Medicine, "rp_rp_b2").quantity
+    with pytest.raises(HTTPException) as exc:
+        asyncio.run(accept_shipment(pending.id, db=session))
+    assert exc.value.status_code == 409
+    session.expire_all()
+    assert session.get(Medicine, "rp_rp_b2").quantity == received > 0
@@ -0,0 +1,125 @@
+import os
+import tempfile
+import sys
+import asyncio
+import pathlib
+from datetime import datetime, timedelta
+
+ROOT = pathlib.Path(__file__).resolve().parents[1]
+sys.path.append(str(ROOT))
+
+DB_PATH = os.path.join(tempfile.gettempdir(), "test_report_cache.db")
+if os.path.exists(DB_PATH):
+    os.remove(DB_PATH)
+os.environ["DATABASE_URL"] = f"sqlite:///{DB_PATH}"
+
+from database import (
+    create_tables,
+    SessionLocal,
+    Patient,
+    Employee,
+    Category,
+    Medicine,
+    DispensingRecord,
+    DispensingItem,
+    Shipment,
+    ShipmentItem,
+)
+from main import get_dispensings_report, get_stock_report, update_patient, build_wh_dispatches_json
+from schemas import PatientUpdate
+from services.report_cache import cache, note_report_write
+
+create_tables()
+session = SessionLocal()
+session.add(Patient(id="rc_p", first_name="Анна", last_name="К", illness="-", phone="1", address="a", branch_id="rc_b"))
+session.add(Employee(id="rc_e", first_name="Е", last_name="Л", phone="2", address="a", branch_id="rc_b"))
+session.commit()
+
+
+def add_record(rec_id, when):
+    session.add(DispensingRecord(id=rec_id, patient_id="rc_p", patient_name="x", employee_id="rc_e", employee_name="y", branch_id="rc_b", date=when))
+    session.add(DispensingItem(id=f"{rec_id}_i", record_id=rec_id, item_type="medicine", item_id="m", item_name="Тримол", quantity=1))
+    session.commit()
+
+
+add_record("rc_old", datetime(2024, 1, 15, 10, 0))
+
+
+def report(date_from, date_to):
+    return asyncio.run(
+        get_dispensings_report(
+            None, date_from, date_to, branch_id="rc_b", export=None, format=None, db=session
+        )
+    )
+
+
+def test_closed_range_is_served_from_cache():
+    cache.clear()
+    first = report("2024-01-01", "2024-01-31")
+    hits = cache.stats()["hits"]
+    second = report("2024-01-01", "2024-01-31")
+    assert second == first
+    assert cache.stats()["hits"] == hits + 1
+    assert [r["id"] for r in first["data"]] == ["rc_old"]
+
+
+def test_open_day_is_recomputed():
+    cache.clear()
+    today = datetime.utcnow()
+    range_to = today.date().isoformat()
+    before = report("2024-01-01", range_to)
+    add_record(f"rc_today_{len(before['data'])}", today)
+    after = report("2024-01-01", range_to)
+    assert len(after["data"]) == len(before["data"]) + 1
+    assert cache.stats()["hits"] >= 1
+
+
+def test_rename_invalidates_closed_period():
+    cache.clear()
+    assert report("2024-01-01", "2024-01-31")["data"][0]["patient_name"] == "Анна К"
+    asyncio.run(update_patient("rc_p", PatientUpdate(first_name="Мария"), db=session))
+    assert report("2024-01-01", "2024-01-31")["data"][0]["patient_name"] == "Мария К"
+
+
+def test_backdated_write_invalidates():
+    cache.clear()
+    report("2024-01-01", "2024-01-31")
+    when = datetime(2024, 1, 20, 9, 0)
+    add_record("rc_backdated", when)
+    note_report_write(session, ("dispensings",), when)
+    session.commit()
+    ids = {r["id"] for r in report("2024-01-01", "2024-01-31")["data"]}
+    assert "rc_backdated" in ids
+
+
+def test_dispatches_split_at_today():
+    cache.clear()
+    session.add(Shipment(id="rc_s_old", to_branch_id="rc_b", status="accepted", created_at=datetime(2024, 1, 5)))
+    session.commit()
+    start = datetime(2024, 1, 1)
+    end = datetime.combine(datetime.utcnow().date() + timedelta(days=1), datetime.max.time())
+    first = build_wh_dispatches_json(session, start, end)
+    session.add(Shipment(id="rc_s_new", to_branch_id="rc_b", status="pending", created_at=datetime.utcnow()))
+    session.commit()
+    second = build_wh_dispatches_json(session, start, end)
+    ids = [r["id"] for r in second["data"]]
+    assert "rc_s_old" in ids and "rc_s_new" in ids
+    assert len(second["data"]) == len(first["data"]) + 1
+
+
+def test_stock_closing_balance_is_cached():
+    cache.clear()
+    session.add(Category(id="rc_c", name="Обезболивающие", description="", type="medicine"))
+    session.add(Medicine(id="rc_m", name="Тримол", category_id="rc_c", purchase_price=0, sell_price=0, quantity=7, branch_id="rc_b"))
+    session.add(Shipment(id="rc_s_stock", to_branch_id="rc_b", status="accepted", created_at=datetime(2024, 1, 3)))
+    session.add(ShipmentItem(id="rc_si", shipment_id="rc_s_stock", item_type="medicine", item_id="rc_main", item_name="Тримол", quantity=10))
+    session.add(DispensingRecord(id="rc_stock_r", patient_id="rc_p", patient_name="x", employee_id="rc_e", employee_name="y", branch_id="rc_b", date=datetime(2024, 1, 10)))
+    session.add(DispensingItem(id="rc_stock_i", record_id="rc_stock_r", item_type="medicine", item_id="rc_m", item_name="Тримол", quantity=3))
+    session.commit()
+
+    first = get_stock_report("rc_b", "2024-01-01", "2024-01-31")
+    assert [(r["item_id"], r["quantity"], r["category"]) for r in first["data"]] == [("rc_m", 7, "Обезболивающие")]
+    hits = cache.stats()["hits"]
+    assert get_stock_report("rc_b", "2024-01-01", "2024-01-31") == first
+    assert cache.stats()["hits"] == hits + 1
+    assert get_stock_report("rc_b", "2024-01-01", "2024-01-05")["data"][0]["quantity"] == 10
@@ -0,0 +1,96 @@
+import os
+import tempfile
+import sys
+import asyncio
+import pathlib
+
+ROOT = pathlib.Path(__file__).resolve().parents[1]
+sys.path.append(str(ROOT))
+
+DB_PATH = os.path.join(tempfile.gettempdir(), "test_row_versions.db")
+if os.path.exists(DB_PATH):
+    os.remove(DB_PATH)
+os.environ["DATABASE_URL"] = f"sqlite:///{DB_PATH}"
+
+import pytest
+from fastapi import HTTPException, Request, Response
+from sqlalchemy.orm.exc import StaleDataError
+
+from database import create_tables, SessionLocal, Branch, Category, Medicine, Patient
+from main import update_medicine, update_patient
+from schemas import MedicineUpdate, PatientUpdate
+from services.stock import ItemType, decrement_stock
+
+create_tables()
+session = SessionLocal()
+
+
+@pytest.fixture(scope="module", autouse=True)
+def seed():
+    session.add(Category(id="ov_c", name="cat", description="", type="medicine"))
+    session.add(Branch(id="ov_b", name="ov_b", login="ov_b", password="x"))
+    session.add(Medicine(id="ov_m", name="Цитрамон", category_id="ov_c", purchase_price=1, sell_price=2, quantity=10, branch_id="ov_b"))
+    session.add(Patient(id="ov_p", first_name="А", last_name="Б", illness="-", phone="1", address="a", branch_id="ov_b"))
+    session.commit()
+
+
+def make_request(if_match=None):
+    headers = [(b"if-match", if_match.encode())] if if_match else []
+    return Request({"type": "http", "method": "PUT", "path": "/", "headers": headers, "query_string": b""})
+
+
+def put_medicine(if_match=None, **fields):
+    response = Response()
+    body = MedicineUpdate(category_id="ov_c", **fields)
+    result = asyncio.run(
+        update_medicine("ov_m", body, request=make_request(if_match), response=response, db=session)
+    )
+    return result, response
+
+
+def test_matching_version_updates_and_bumps():
+    session.expire_all()
+    version = session.get(Medicine, "ov_m").version
+    result, response = put_medicine(f'"{version}"', sell_price=3)
+    assert result.version == version + 1
+    assert response.headers["ETag"] == f'"{version + 1}"'
+
+
+def test_stale_if_match_is_rejected():
+    session.expire_all()
+    version = session.get(Medicine, "ov_m").version
+    with pytest.raises(HTTPException) as exc:
+        put_medicine(f'W/"{version - 1}"', sell_price=4)
+    assert exc.value.status_code == 409
+    assert exc.value.detail["current_version"] == version
+    session.rollback()
+    assert session.get(Medicine, "ov_m").sell_price != 4
+
+
+def test_stock_decrement_invalidates_client_version():
+    session.expire_all()
+    seen = session.get(Medicine, "ov_m").version
+    decrement_stock(session, "ov_b", ItemType.medicine, "ov_m", 1)
+    session.commit()
+    with pytest.raises(HTTPException) as exc:
+        put_medicine(f'"{seen}"', name="Цитрамон П")
+    assert exc.value.status_code == 409
+    session.rollback()
+
+
+def test_body_version_and_concurrent_writer():
+    session.expire_all()
+    version = session.get(Patient, "ov_p").version
+    with pytest.raises(HTTPException):
+        asyncio.run(update_patient("ov_p", PatientUpdate(phone="2", version=version + 5), db=session))
+    session.rollback()
+
+    # a second session commits between our read and our write
+    stale = session.get(Patient, "ov_p")
+    with SessionLocal() as other:
+        other.get(Patient, "ov_p").phone = "3"
+        other.commit()
+    stale.phone = "4"
+    with pytest.raises(StaleDataError):
+        session.commit()
+    session.rollback()
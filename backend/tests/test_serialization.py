@@ -0,0 +1,35 @@
+import os
+import tempfile
+import sys
+import asyncio
+import json
+import pathlib
+
+ROOT = pathlib.Path(__file__).resolve().parents[1]
+sys.path.append(str(ROOT))
+
+DB_PATH = os.path.join(tempfile.gettempdir(), "test_serialization.db")
+if os.path.exists(DB_PATH):
+    os.remove(DB_PATH)
+os.environ["DATABASE_URL"] = f"sqlite:///{DB_PATH}"
+
+from database import create_tables, SessionLocal, Transfer as DBTransfer
+from main import get_transfers
+from schemas import Transfer
+from datetime import datetime
+
+create_tables()
+session = SessionLocal()
+session.add(DBTransfer(id="ser_t1", medicine_id="m1", medicine_name="Тримол", quantity=3, from_branch_id="main", to_branch_id="ser_b", date=datetime(2024, 1, 10, 12, 0, 0, 123456)))
+session.commit()
+
+
+def test_fast_path_matches_response_model():
+    resp = asyncio.run(get_transfers(branch_id="ser_b", db=session))
+    assert resp.media_type == "application/json"
+    fast = json.loads(resp.body)
+
+    row = session.get(DBTransfer, "ser_t1")
+    expected = [json.loads(Transfer.model_validate(row).model_dump_json())]
+    assert fast == expected
+    assert list(fast[0]) == list(Transfer.model_fields)
@@ -0,0 +1,83 @@
+import os
+import tempfile
+import sys
+import asyncio
+import pathlib
+
+ROOT = pathlib.Path(__file__).resolve().parents[1]
+sys.path.append(str(ROOT))
+
+DB_PATH = os.path.join(tempfile.gettempdir(), "test_stock_alerts.db")
+if os.path.exists(DB_PATH):
+    os.remove(DB_PATH)
+os.environ["DATABASE_URL"] = f"sqlite:///{DB_PATH}"
+
+from database import (
+    create_tables,
+    SessionLocal,
+    Branch,
+    Category,
+    Medicine,
+    Notification,
+    StockThreshold,
+)
+from main import set_stock_thresholds, get_stock_thresholds
+from schemas import BatchStockThresholdSet
+from services.alerts import next_state
+from services.stock import decrement_stock, ItemType
+
+create_tables()
+session = SessionLocal()
+session.add(Category(id="sa_c", name="cat", description="", type="medicine"))
+session.add(Branch(id="sa_b", name="SA", login="sa_b", password="p"))
+session.add(Medicine(id="sa_m", name="Парацетамол", category_id="sa_c", purchase_price=0, sell_price=0, quantity=20, branch_id="sa_b"))
+session.commit()
+
+
+def alerts():
+    return session.query(Notification).filter(Notification.branch_id == "sa_b").count()
+
+
+def test_next_state_hysteresis():
+    assert next_state("ok", 10, 5, 15) == "ok"
+    assert next_state("ok", 5, 5, 15) == "low"
+    assert next_state("low", 8, 5, 15) == "low"
+    assert next_state("low", 15, 5, 15) == "ok"
+    assert next_state("low", 0, 5, 15) == "out"
+    assert next_state("out", 6, 5, None) == "ok"
+
+
+def test_alerts_fire_once_per_crossing():
+    asyncio.run(set_stock_thresholds(
+        BatchStockThresholdSet(thresholds=[{"item_type": "medicine", "item_id": "sa_m", "min_qty": 5, "max_qty": 15}]),
+        db=session,
+    ))
+    assert alerts() == 0
+
+    decrement_stock(session, "sa_b", ItemType.medicine, "sa_m", 15)
+    session.commit()
+    assert alerts() == 1
+
+    # still below the minimum: no duplicate notification
+    decrement_stock(session, "sa_b", ItemType.medicine, "sa_m", 1)
+    session.commit()
+    assert alerts() == 1
+
+    decrement_stock(session, "sa_b", ItemType.medicine, "sa_m", 4)
+    session.commit()
+    assert alerts() == 2
+    assert session.get(StockThreshold, ("medicine", "sa_m")).alert_state == "out"
+
+    data = asyncio.run(get_stock_thresholds(branch_id="sa_b", db=session))["data"]
+    assert data[0]["alert_state"] == "out" and data[0]["quantity"] == 0
+
+
+def test_rollback_discards_pending_checks():
+    session.query(Medicine).filter(Medicine.id == "sa_m").update({"quantity": 20})
+    session.get(StockThreshold, ("medicine", "sa_m")).alert_state = "ok"
+    session.commit()
+    before = alerts()
+    decrement_stock(session, "sa_b", ItemType.medicine, "sa_m", 18)
+    session.rollback()
+    session.commit()
+    assert alerts() == before
@@ -0,0 +1,60 @@
+import os
+import tempfile
+import sys
+import asyncio
+import pathlib
+
+ROOT = pathlib.Path(__file__).resolve().parents[1]
+sys.path.append(str(ROOT))
+
+DB_PATH = os.path.join(tempfile.gettempdir(), "test_stock_items.db")
+if os.path.exists(DB_PATH):
+    os.remove(DB_PATH)
+os.environ["DATABASE_URL"] = f"sqlite:///{DB_PATH}"
+
+import pytest
+
+from database import create_tables, SessionLocal, Branch, Category, MedicalDevice, Medicine, Shipment
+from main import _create_shipment, accept_shipment, build_wh_stock_json, generate_report
+from schemas import ReportRequest
+
+create_tables()
+session = SessionLocal()
+
+
+@pytest.fixture(scope="module", autouse=True)
+def seed():
+    session.add(Category(id="ui_c", name="cat", description="", type="medicine"))
+    session.add(Category(id="ui_cd", name="dev", description="", type="medical_device"))
+    session.add(Branch(id="ui_b", name="ui_b", login="ui_b", password="x"))
+    session.add(Medicine(id="ui_m", name="Парацетамол", category_id="ui_c", purchase_price=1, sell_price=2, quantity=30, branch_id=None))
+    session.add(MedicalDevice(id="ui_d", name="Шприц", category_id="ui_cd", purchase_price=1, sell_price=2, quantity=40, branch_id=None))
+    session.commit()
+
+
+def test_shipment_of_both_kinds_lands_in_one_stock_listing():
+    asyncio.run(
+        _create_shipment(
+            {
+                "to_branch_id": "ui_b",
+                "medicines": [{"medicine_id": "ui_m", "quantity": 5}],
+                "medical_devices": [{"device_id": "ui_d", "quantity": 7}],
+            },
+            session,
+        )
+    )
+    shipment = session.query(Shipment).filter_by(to_branch_id="ui_b").one()
+    with SessionLocal() as db:
+        asyncio.run(accept_shipment(shipment.id, db=db))
+
+    session.expire_all()
+    rows = build_wh_stock_json(session, "ui_b", None, None)["data"]
+    assert [(r["item_type"], r["name"], r["category"], r["quantity"]) for r in rows] == [
+        ("medical_device", "Шприц", "dev", 7),
+        ("medicine", "Парацетамол", "cat", 5),
+    ]
+
+    main = asyncio.run(generate_report(ReportRequest(type="stock"), db=session))["data"]
+    by_id = {r["id"]: (r["type"], r["quantity"]) for r in main}
+    assert by_id["ui_m"] == ("medicine", 25)
+    assert by_id["ui_d"] == ("medical_device", 33)
@@ -0,0 +1,114 @@
+import os
+import tempfile
+import sys
+import asyncio
+import json
+import pathlib
+
+ROOT = pathlib.Path(__file__).resolve().parents[1]
+sys.path.append(str(ROOT))
+
+DB_PATH = os.path.join(tempfile.gettempdir(), "test_sync.db")
+if os.path.exists(DB_PATH):
+    os.remove(DB_PATH)
+os.environ["DATABASE_URL"] = f"sqlite:///{DB_PATH}"
+
+import pytest
+from sqlalchemy import text
+
+from database import create_tables, SessionLocal, Category, Medicine
+from main import create_patient, update_patient, delete_patient, get_sync_changes
+from schemas import PatientCreate, PatientUpdate
+from services.stock import decrement_stock, ItemType
+from services.sync import changes_since, current_version, record_change
+
+create_tables()
+session = SessionLocal()
+
+
+def sync(since, branch_id="sy_b", cursor=None, limit=1000, entities=None):
+    response = asyncio.run(
+        get_sync_changes(since=since, branch_id=branch_id, entities=entities, limit=limit, cursor=cursor, db=session)
+    )
+    return json.loads(response.body)
+
+
+def patient(first_name, branch_id="sy_b"):
+    return PatientCreate(first_name=first_name, last_name="С", illness="-", phone="1", address="a", branch_id=branch_id)
+
+
+def test_delta_sync_with_tombstones():
+    start = current_version(session)
+    kept = asyncio.run(create_patient(patient("Первый"), db=session))
+    gone = asyncio.run(create_patient(patient("Второй"), db=session))
+    asyncio.run(create_patient(patient("Чужой", branch_id="sy_other"), db=session))
+
+    page = sync(start)
+    assert {p["first_name"] for p in page["data"]["patients"]["upserted"]} == {"Первый", "Второй"}
+    since = page["version"]
+
+    asyncio.run(update_patient(kept.id, PatientUpdate(illness="ОРВИ"), db=session))
+    asyncio.run(delete_patient(gone.id, db=session))
+    page = sync(since)
+    assert [p["illness"] for p in page["data"]["patients"]["upserted"]] == ["ОРВИ"]
+    assert page["data"]["patients"]["deleted"] == [gone.id]
+
+    # nothing new: empty delta at the same version
+    again = sync(page["version"])
+    assert again["data"]["patients"] == {"upserted": [], "deleted": []}
+    assert again["version"] == page["version"]
+
+
+def test_moving_a_row_leaves_a_tombstone_in_the_old_branch():
+    start = current_version(session)
+    moved = asyncio.run(create_patient(patient("Переезд"), db=session))
+    asyncio.run(update_patient(moved.id, PatientUpdate(branch_id="sy_new"), db=session))
+    assert moved.id in sync(start)["data"]["patients"]["deleted"]
+    assert [p["id"] for p in sync(start, branch_id="sy_new")["data"]["patients"]["upserted"]] == [moved.id]
+
+
+def test_raw_stock_updates_are_tracked_and_paginated():
+    session.add(Category(id="sy_c", name="cat", description="", type="medicine"))
+    for i in range(5):
+        session.add(Medicine(id=f"sy_m{i}", name=f"М{i}", category_id="sy_c", purchase_price=0, sell_price=0, quantity=10, branch_id="sy_p"))
+    session.commit()
+    since = current_version(session)
+
+    decrement_stock(session, "sy_p", ItemType.medicine, "sy_m3", 4)
+    session.commit()
+    page = sync(since, branch_id="sy_p")
+    assert [(m["id"], m["quantity"]) for m in page["data"]["medicines"]["upserted"]] == [("sy_m3", 6)]
+
+    seen, cursor = [], None
+    while True:
+        page = sync(0, branch_id="sy_p", cursor=cursor, limit=2, entities="medicines")
+        seen += [m["id"] for m in page["data"]["medicines"]["upserted"]]
+        if not page["has_more"]:
+            break
+        cursor = page["cursor"]
+    assert sorted(seen) == [f"sy_m{i}" for i in range(5)]
+
+
+@pytest.mark.skipif(not os.getenv("TEST_POSTGRES_URL"), reason="needs an empty Postgres database")
+def test_postgres_readers_wait_for_older_writers():
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+    from database import Base
+
+    pg = create_engine(os.environ["TEST_POSTGRES_URL"])
+    Base.metadata.create_all(bind=pg)
+    PgSession = sessionmaker(bind=pg)
+    with PgSession() as slow, PgSession() as fast, PgSession() as reader:
+        slow.execute(text("SELECT txid_current()"))  # starts writing first
+        record_change(slow, "patients", "pg_slow", "pg_b")
+        record_change(fast, "patients", "pg_fast", "pg_b")
+        fast.commit()
+
+        # fast committed, but under a higher id than the open slow writer
+        page = changes_since(reader, 0, "pg_b", ["patients"], 100)
+        assert page["upserted"]["patients"] == []
+        reader.commit()
+
+        slow.commit()
+        page = changes_since(reader, 0, "pg_b", ["patients"], 100)
+        assert sorted(page["upserted"]["patients"]) == ["pg_fast", "pg_slow"]
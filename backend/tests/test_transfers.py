@@ -0,0 +1,80 @@
+import os
+import tempfile
+import sys
+import asyncio
+import pathlib
+
+ROOT = pathlib.Path(__file__).resolve().parents[1]
+sys.path.append(str(ROOT))
+
+DB_PATH = os.path.join(tempfile.gettempdir(), "test_transfers.db")
+if os.path.exists(DB_PATH):
+    os.remove(DB_PATH)
+os.environ["DATABASE_URL"] = f"sqlite:///{DB_PATH}"
+
+import pytest
+from fastapi import HTTPException
+
+from database import create_tables, SessionLocal, Branch, Category, MedicalDevice, Medicine, Transfer
+from main import create_transfers
+from schemas import BatchTransferCreate
+from services.reconciliation import reconcile_branch
+
+create_tables()
+session = SessionLocal()
+
+
+@pytest.fixture(scope="module", autouse=True)
+def seed():
+    session.add(Category(id="tf_c", name="cat", description="", type="medicine"))
+    session.add(Category(id="tf_cd", name="dev", description="", type="medical_device"))
+    for b in ("tf_b1", "tf_b2"):
+        session.add(Branch(id=b, name=b, login=b, password="x"))
+    session.add(Medicine(id="tf_m", name="Но-шпа", category_id="tf_c", purchase_price=1, sell_price=2, quantity=100, branch_id=None))
+    session.add(Medicine(id="tf_m_b1", name="Но-шпа", category_id="tf_c", purchase_price=1, sell_price=2, quantity=0, branch_id="tf_b1"))
+    session.add(MedicalDevice(id="tf_d", name="Бинт", category_id="tf_cd", purchase_price=1, sell_price=2, quantity=50, branch_id=None))
+    session.commit()
+
+
+def transfer(*lines):
+    batch = BatchTransferCreate(transfers=[dict(medicine_name="-", **line) for line in lines])
+    return asyncio.run(create_transfers(batch, db=session))
+
+
+def quantity(model, **filters):
+    session.expire_all()
+    return session.query(model.quantity).filter_by(**filters).scalar()
+
+
+def test_batch_moves_medicines_and_devices():
+    transfer(
+        {"medicine_id": "tf_m", "quantity": 10, "to_branch_id": "tf_b1"},
+        {"medicine_id": "tf_m", "quantity": 5, "to_branch_id": "tf_b1"},
+        {"medicine_id": "tf_m", "quantity": 20, "to_branch_id": "tf_b2"},
+        {"item_type": "medical_device", "medicine_id": "tf_d", "quantity": 7, "to_branch_id": "tf_b2"},
+    )
+    assert quantity(Medicine, id="tf_m") == 65
+    assert quantity(Medicine, id="tf_m_b1") == 15
+    assert quantity(Medicine, name="Но-шпа", branch_id="tf_b2") == 20
+    assert quantity(MedicalDevice, id="tf_d") == 43
+    assert quantity(MedicalDevice, name="Бинт", branch_id="tf_b2") == 7
+    rows = session.query(Transfer).filter(Transfer.to_branch_id.like("tf_%")).all()
+    assert sorted((t.item_type, t.medicine_name, t.quantity) for t in rows) == [
+        ("medical_device", "Бинт", 7),
+        ("medicine", "Но-шпа", 5),
+        ("medicine", "Но-шпа", 10),
+        ("medicine", "Но-шпа", 20),
+    ]
+    # the ledger agrees with the new quantities
+    assert reconcile_branch("tf_b2", session_factory=SessionLocal)["drift"] == []
+
+
+def test_shortages_fail_the_whole_batch():
+    with pytest.raises(HTTPException) as e:
+        transfer(
+            {"medicine_id": "tf_m", "quantity": 1, "to_branch_id": "tf_b1"},
+            {"item_type": "medical_device", "medicine_id": "tf_d", "quantity": 1000, "to_branch_id": "tf_b1"},
+            {"medicine_id": "tf_missing", "quantity": 1, "to_branch_id": "tf_b1"},
+        )
+    assert "Бинт" in e.value.detail and "tf_missing" in e.value.detail
+    assert quantity(Medicine, id="tf_m") == 65